@@ -17,8 +17,9 @@
 
 Detailed usage: android_ndk_perf.py [options] perf_command [perf_arguments]
 
-perf_command can be any valid command for the Linux perf tool or
-"visualize" to display a visualization of the performance report.
+perf_command can be any valid command for the Linux perf tool,
+"visualize" to display a visualization of the performance report or
+"launch" to measure the time taken to launch an application.
 
 Caveats:
 * "stat" and "top" require root access to the target device.
@@ -27,18 +28,26 @@ Caveats:
 """
 
 import argparse
+import bisect
 import distutils.spawn
 import json
 import os
 import platform
+import Queue
 import re
+import shutil
 import signal
-import subprocess
 import sys
 import tempfile
 import threading
 import time
 import xml.dom.minidom as minidom
+import zlib
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.axml as axml
+import buildutil.common as common
+import buildutil.device_cache as device_cache
+import buildutil.runner as runner
 
 ## Directory containing this script.
 SCRIPT_DIRECTORY = os.path.abspath(os.path.dirname(__file__))
@@ -54,6 +63,11 @@ REMOTE_TEMP_DIRECTORY = '/data/local/tmp'
 ## Android manifest filename.
 MANIFEST_NAME = 'AndroidManifest.xml'
 
+## Default directory of the host-wide store of libraries pulled from devices,
+## indexed by build ID, the "symbols" subdirectory of
+## common.get_cache_directory().  See SymbolCache.
+SYMBOL_CACHE_DIRECTORY = common.get_cache_directory('symbols')
+
 ## Set of tested devices that are known to support perf.
 SUPPORTED_DEVICES = set([
     'mantaray',  # Nexus 10
@@ -159,9 +173,13 @@ WARNING: Unable to collect CPU frequency data.
 ## Unable to get process ID message.
 UNABLE_TO_GET_PROCESS_ID = 'Unable to get process ID of package %s'
 
-## Regular expression which matches the libraries referenced by
-## "perf buildid-list --with-hits -i ${input_file}".
-PERF_BUILDID_LIST_MATCH_OBJ_RE = re.compile(r'^[^ ]* ([^\[][^ ]*[^\]])')
+## Regular expression which matches the build ID and library referenced by
+## each line of "perf buildid-list --with-hits -i ${input_file}".
+PERF_BUILDID_LIST_MATCH_OBJ_RE = re.compile(
+    r'^(?P<build_id>[^ ]*) (?P<dso>[^\[][^ ]*[^\]])')
+
+## Regular expression which matches a valid (non-zero) build ID.
+PERF_BUILD_ID_RE = re.compile(r'^[0-9a-fA-F]*[1-9a-fA-F][0-9a-fA-F]*$')
 
 ## Regular expression which extracts the CPU number from a path in
 ## /sys/devices/system/cpu.
@@ -169,9 +187,10 @@ SYS_DEVICES_CPU_NUMBER_RE = re.compile(
     r'/sys/devices/system/cpu/cpu([0-9]+)/.*')
 
 ## Regular expression which parses a sample even header from a perf trace dump
-## e.g the output of "perf script -D".
+## e.g the output of "perf script -D".  The header is prefixed by the CPU (if
+## it was recorded) and time of the sample.
 PERF_DUMP_EVENT_SAMPLE_RE = re.compile(
-    r'^(?P<unknown>\d+)\s+'
+    r'^(?:\d+\s+)+'
     r'(?P<file_offset>0x[0-9a-fA-F]+)\s+'
     r'\[(?P<event_header_size>[^\]]+)\]:\s+'
     r'(?P<perf_event_type>PERF_RECORD_[^(]+)'
@@ -185,6 +204,7 @@ PERF_DUMP_EVENT_SAMPLE_RE = re.compile(
 PERF_DUMP_EVENT_SAMPLE_REPORT_RE = re.compile(
     r'(?P<comm>.*)\s+'
     r'(?P<tid>[0-9]+)\s+'
+    r'(?:\[(?P<cpu>[0-9]+)\]\s+)?'
     r'(?P<time>[0-9]+\.[0-9]+):\s+'
     r'(?P<event>.*):\s*$')
 
@@ -202,6 +222,85 @@ PERF_VIS_OUTPUT_FILE_RE = re.compile(r'.*output:\s+(.*\.html).*')
 ## Name of the file used to hold CPU frequency data.
 CPUFREQ_JSON = 'cpufreq.json'
 
+## Suffix of the directory used to store chunks of a trace recorded with
+## PerfChunkRecorder e.g "perf.data.chunks" for the trace "perf.data".
+PERF_CHUNK_DIRECTORY_SUFFIX = '.chunks'
+
+## Extension of each chunk of a trace recorded with PerfChunkRecorder.
+PERF_CHUNK_EXTENSION = '.data'
+
+## Extension of files used to cache the conversion of each chunk of a trace
+## for visualization.
+PERF_CHUNK_SCRIPT_EXTENSION = '.script'
+
+## Perf events whose sample period is measured in nanoseconds.
+PERF_CLOCK_EVENTS = ('cpu-clock', 'task-clock')
+
+## Number of sampling intervals between two samples of a thread after which
+## the thread is assumed to have not been running between the samples.
+PERF_MAX_SAMPLE_GAP = 4
+
+## Name of the file used to hold CPU frequencies sampled while recording.
+CPUFREQ_TIMELINE_JSON = 'cpufreq_timeline.json'
+
+## Regular expression which parses the fields of CPU frequency samples
+## written by CpuFreqSampler e.g "uptime 1234.56", "monotonic_ns 1234560000"
+## or "cur_freq 300000".
+CPUFREQ_SAMPLE_FIELD_RE = re.compile(
+    r'^(uptime|monotonic_ns|cur_freq)\s+([0-9.]+)\s*$')
+
+## Name of the file used to hold statistics of traces recorded over multiple
+## runs.
+AGGREGATE_JSON = 'aggregate.json'
+
+## Two-tailed 95% critical values of Student's t-distribution indexed by
+## degrees of freedom - 1.  Larger degrees of freedom use the normal
+## distribution's critical value.
+T_DISTRIBUTION_95 = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306,
+                     2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120,
+                     2.110, 2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064,
+                     2.060, 2.056, 2.052, 2.048, 2.045, 2.042)
+
+## Name of the file used to hold application launch times.
+LAUNCH_JSON = 'launch.json'
+
+## Parses a time in milliseconds from the output of "am start -W".
+AM_START_WAIT_TIME_RE = re.compile(
+    r'^\s*(?P<name>ThisTime|TotalTime|WaitTime):\s*(?P<value>\d+)',
+    re.MULTILINE)
+
+## Log tags of the "Displayed" message which reports the time taken to
+## display an activity.  The message is logged by ActivityTaskManager from
+## Android 10 and ActivityManager by earlier releases.
+LOGCAT_DISPLAYED_TAGS = ('ActivityManager', 'ActivityTaskManager')
+
+## Parses the time taken to display an activity from the ActivityManager or
+## ActivityTaskManager log e.g "Displayed com.example/.Main: +1s234ms".
+LOGCAT_DISPLAYED_RE = re.compile(
+    r'Displayed\s+(?P<component>[^:\s]+):\s+\+'
+    r'(?:(?P<seconds>\d+)s)?(?:(?P<milliseconds>\d+)ms)?')
+
+## Parses the time of a line of the log in the "time" format
+## e.g "01-02 03:04:05.678 I/ActivityManager(  500): ...".
+LOGCAT_TIME_RE = re.compile(r'^(?P<time>\d\d-\d\d \d\d:\d\d:\d\d\.\d+)\s')
+
+## Shell command which reports the device time in the format accepted by
+## "logcat -T".
+LOGCAT_DATE_COMMAND = 'date +"%m-%d %H:%M:%S.000"'
+
+## First API level where "logcat -T" accepts a time.
+LOGCAT_TIME_FILTER_MIN_API_LEVEL = 21
+
+## Parses the time a launch started from the output of measure_launch()'s
+## shell command.
+LAUNCH_START_TIME_RE = re.compile(r'^launch_start_time\s+(?P<time>.*?)\s*$',
+                                  re.MULTILINE)
+
+## Launch times reported by the "launch" command, mapping names of values
+## parsed by parse_launch_output() to names displayed in the report.
+LAUNCH_TIMES = (('total_time', 'TotalTime'), ('wait_time', 'WaitTime'),
+                ('displayed', 'Displayed'))
+
 ## Parses a string attribute from the manifest output of aapt list.
 AAPT_MANIFEST_ATTRIBUTE_RE = re.compile(
     r'\s*A:\s+(?P<attribute>[^(=]*)[^=]*=[^"(]*[^")]*[")@](?P<value>[^"]*)')
@@ -247,6 +346,8 @@ class Adb(object):
     adb_path: Path to the ADB executable.
     command_handler: Callable which executes subprocesses.  See
       execute_command().
+    compress_pull: Whether pull_package_file() should compress files on the
+      device before transferring them to the host.
 
   Class Attributes:
     _MATCH_DEVICES: Regular expression which matches connected devices.
@@ -298,6 +399,11 @@ class Adb(object):
   _MATCH_PROPERTY = re.compile(r'^\[([^\]]*)\]: *\[([^\]]*)\]$')
   _GET_PID = ' && '.join((r'fields=( $(ps | grep -F %s) )',
                           r'echo ${fields[1]}'))
+  # Size of each block read from the device by _pull_compressed_package_file().
+  # Interrupted transfers resume from the last complete block.
+  _PULL_BLOCK_SIZE = 65536
+  # Number of times _pull_compressed_package_file() resumes a transfer.
+  _PULL_RETRIES = 3
 
   def __init__(self, serial, command_handler, adb_path=None, verbose=False):
     """Initialize this instance.
@@ -317,6 +423,9 @@ class Adb(object):
         no devices are connected or ADB can't be found.
     """
     self.cached_properties = {}
+    self.property_cache = None
+    self.transport_id = ''
+    self.compress_pull = True
     self.verbose = verbose
     self.command_handler = command_handler
     self.adb_path = (adb_path if adb_path else
@@ -480,6 +589,34 @@ class Adb(object):
     # Set the serial number and clear the cached properties.
     self._serial = serial
     self.cached_properties = {}
+    self.property_cache = None
+    # Record the ID of the device's connection to the ADB server, which
+    # changes when the device reconnects or the ADB server restarts.
+    self.transport_id = ''
+    for device in devices:
+      tokens = device.split()
+      if tokens and (not serial or tokens[0] == serial):
+        for token in tokens[2:]:
+          if token.startswith('transport_id:'):
+            self.transport_id = token.split(':', 1)[1]
+        break
+
+  def enable_property_cache(self, ttl, directory=None):
+    """Cache properties of the device on the host between invocations.
+
+    Args:
+      ttl: Time in seconds to cache properties, 0 disables the cache.
+      directory: Directory used to store the cache, see
+        device_cache.DevicePropertyCache.
+    """
+    self.property_cache = None
+    if ttl <= 0:
+      return
+    # The transport ID is reused when the ADB server restarts so the boot
+    # identity of the device, read along with the properties, is used to
+    # detect reboots.
+    self.property_cache = device_cache.DevicePropertyCache(
+        self.serial, ttl, directory=directory)
 
   def get_prop(self, android_property_name, use_cached=True):
     """Gets a property (getprop) from the device.
@@ -496,14 +633,32 @@ class Adb(object):
     """
     if not use_cached:
       self.cached_properties = {}
+    elif not self.cached_properties and self.property_cache:
+      self.cached_properties = dict(
+          self.property_cache.get(device_cache.GETPROP_KEY) or {})
 
     if not self.cached_properties:
-      out, _, _ = self.shell_command('getprop', 'Unable to get properties')
+      if self.property_cache:
+        # Read the boot identity in the same shell as the properties so a
+        # cache miss costs a single round trip to the device.
+        out, _, _ = self.shell_command(
+            device_cache.BOOT_IDENTITY_GETPROP_COMMAND,
+            'Unable to get properties')
+      else:
+        out, _, _ = self.shell_command('getprop', 'Unable to get properties')
       for l in out.splitlines():
         m = Adb._MATCH_PROPERTY.match(l)
         if m:
           key, value = m.groups()
           self.cached_properties[key] = value
+      if self.property_cache:
+        boot_id, boot_time = device_cache.parse_boot_identity(out)
+        # Without a boot identity it's not possible to detect reboots so
+        # the properties aren't cached.
+        if boot_id or boot_time is not None:
+          self.property_cache.set_boot_identity(boot_id, boot_time)
+          self.property_cache.set(device_cache.GETPROP_KEY,
+                                  self.cached_properties)
     return self.cached_properties.get(android_property_name)
 
   def get_supported_abis(self):
@@ -566,6 +721,40 @@ class Adb(object):
         'devices', ['-l'], 'Unable to get the list of connected devices.')
     return Adb._MATCH_DEVICES.sub(r'', out).splitlines()
 
+  @staticmethod
+  def get_connected_serials(command_handler, adb_path=None, verbose=False):
+    """Get the serial numbers of the devices connected to the host.
+
+    Args:
+      command_handler: Callable which executes subprocesses.  See
+        execute_local_command().
+      adb_path: Path to the adb executable.  If this is None the PATH is
+        searched.
+      verbose: Whether to display all shell commands run by this method.
+
+    Returns:
+      List of serial number strings of devices that are ready to use.
+
+    Raises:
+      Adb.Error: If ADB can't be found or no devices are connected.
+      CommandFailedError: An error occured running the command.
+    """
+    adb_path = adb_path if adb_path else distutils.spawn.find_executable('adb')
+    if not adb_path:
+      raise Adb.Error('Unable to find adb executable, '
+                      'is the ADT platforms-tools directory in the PATH?')
+    out, _, _ = command_handler(
+        adb_path, ['devices'], 'Unable to get the list of connected devices.',
+        verbose=verbose)
+    serials = []
+    for line in Adb._MATCH_DEVICES.sub(r'', out).splitlines():
+      tokens = line.split()
+      if len(tokens) >= 2 and tokens[1] == 'device':
+        serials.append(tokens[0])
+    if not serials:
+      raise Adb.Error('No Android devices are connected to this host.')
+    return serials
+
   def start_activity(self, package, activity):
     """Start an activity on the device.
 
@@ -694,14 +883,98 @@ class Adb(object):
     """
     return '/'.join(Adb.get_package_data_directory(package_name), package_file)
 
+  def _pull_compressed_package_file(self, package_name, package_file,
+                                    output_file):
+    """Pull a compressed file from a package's directory.
+
+    The file is compressed with gzip on the device and streamed to the host
+    using "adb exec-out" where it's decompressed.  If the transfer is
+    interrupted it's resumed from the last complete block received.
+
+    Args:
+      package_name: Name of the package to pull the file from.
+      package_file: Use Adb.get_package_file() to form the path.
+      output_file: Local path to copy the remote file to.
+
+    Raises:
+      CommandFailedError: If the device does not support the commands
+        required to compress the file or the transfer fails.
+    """
+    error = 'Unable to copy %s from device to %s.' % (package_file,
+                                                      output_file)
+    out, _, _ = self.shell_command(
+        'run-as %s stat -c %%s %s' % (package_name, package_file), error)
+    try:
+      size = int(out.strip())
+    except ValueError:
+      raise CommandFailedError('%s Unable to determine size of %s (device=%s)'
+                               % (error, package_file, str(self)), 1)
+    partial_file = output_file + '.partial'
+    with open(partial_file, 'wb') as output:
+      for _ in range(Adb._PULL_RETRIES + 1):
+        # Restart from the last complete block.
+        block = output.tell() / Adb._PULL_BLOCK_SIZE
+        output.seek(block * Adb._PULL_BLOCK_SIZE)
+        output.truncate()
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        corrupt = []
+
+        def decompress(data):
+          """Decompress data read from the device to the output file."""
+          if corrupt:
+            return
+          try:
+            output.write(decompressor.decompress(data))
+          except zlib.error:
+            # A truncated or corrupt stream is resumed from the last block.
+            corrupt.append(True)
+
+        # The standard error stream is drained concurrently by the command
+        # handler so adb never blocks writing to it.
+        self.run_command(
+            'exec-out', ["run-as %s sh -c 'dd if=%s bs=%d skip=%d "
+                         "2>/dev/null | gzip -c'" % (
+                             package_name, package_file,
+                             Adb._PULL_BLOCK_SIZE, block)],
+            error, stdout_callback=decompress,
+            display_output_on_error=False, ignore_error=True)
+        if not corrupt:
+          try:
+            output.write(decompressor.flush())
+          except zlib.error:
+            pass
+        if output.tell() >= size:
+          break
+      received = output.tell()
+    if received != size:
+      os.remove(partial_file)
+      raise CommandFailedError('%s Received %d of %d bytes (device=%s)' % (
+          error, received, size, str(self)), 1)
+    if os.path.exists(output_file):
+      os.remove(output_file)
+    os.rename(partial_file, output_file)
+
   def pull_package_file(self, package_name, package_file, output_file):
     """Pull a file from a package's directory.
 
+    If compress_pull is True the file is compressed on the device and
+    decompressed on the host which substantially reduces the time taken to
+    pull large files (e.g traces).  If the device doesn't support
+    compression the file is pulled without compression.
+
     Args:
       package_name: Name of the package to pull the file from.
       package_file: Use Adb.get_package_file() to form the path.
       output_file: Local path to copy the remote file to.
     """
+    if self.compress_pull:
+      try:
+        self._pull_compressed_package_file(package_name, package_file,
+                                           output_file)
+        return
+      except CommandFailedError as e:
+        if self.verbose:
+          print >> sys.stderr, '%s, retrying without compression.' % str(e)
     self.shell_command('run-as %s chmod 666 %s' % (package_name, package_file),
                        'Unable to make %s readable.' % package_file)
     self.run_command('pull', [package_file, output_file],
@@ -881,7 +1154,8 @@ class PerfArgs(object):
       PerfArgsCommand('top', verbose=True),
       # Specific to this script.
       PerfArgsCommand('visualize', real_command=False,
-                      input_filename='perf.data')]
+                      input_filename='perf.data'),
+      PerfArgsCommand('launch', real_command=False, remote=True)]
 
   SUPPORTED_COMMANDS_DICT = dict([(cmd.name, cmd)
                                   for cmd in SUPPORTED_COMMANDS])
@@ -1108,54 +1382,12 @@ class PerfArgs(object):
     if call_graph_recording:
       self.args.append('-g')
     if timestamp_recording:
-      self.args.append('-T')
+      # -R also records the CPU of each sample so that samples can be matched
+      # with the frequency of the CPU they were taken on.
+      self.args.extend(('-T', '-R'))
     return self.get_output_filename(remote_output_filename)
 
 
-class ThreadedReader(threading.Thread):
-  """Reads a file like object into a string from a thread.
-
-  This also optionally writes data read to an output file.
-
-  Attributes:
-    read_file: File to read.
-    output_file: If this isn't None, data read from read_file will be written
-      to this file.
-    read_lines: List of line strings read from the file.
-  """
-
-  def __init__(self, read_file, output_file):
-    """Initialize this instance.
-
-    Args:
-      read_file: File to read.
-      output_file: If this isn't None, data read from read_file will be written
-        to this file.
-    """
-    super(ThreadedReader, self).__init__()
-    self.read_file = read_file
-    self.output_file = output_file
-    self.read_lines = []
-
-  def run(self):
-    """Capture output from read_file into read_string."""
-    while True:
-      line = self.read_file.readline()
-      if not line:
-        break
-      self.read_lines.append(line)
-      if self.output_file:
-        self.output_file.write(line)
-
-  def __str__(self):
-    """Get the string read from the file.
-
-    Returns:
-      String read from the file.
-    """
-    return ''.join(self.read_lines)
-
-
 class CommandThread(threading.Thread):
   """Runs a command in a separate thread.
 
@@ -1280,11 +1512,13 @@ class PerfRecordSample(object):
     command: Name of the executable sampled.
     time: Time sample was taken.
     event: Type of record event.
+    cpu: Index of the CPU the sample was taken on or None if it wasn't
+      recorded.
     stack: List of PerfIp instances which represent the stack of this sample.
   """
 
   def __init__(self, file_offset, event_type, pid, tid, ip, period,
-               command, sample_time, event):
+               command, sample_time, event, cpu=None):
     """Initialize the instance.
 
     Args:
@@ -1298,6 +1532,7 @@ class PerfRecordSample(object):
       command: Name of the executable sampled.
       sample_time: Time sample was taken.
       event: Type of record event.
+      cpu: Index of the CPU the sample was taken on.
     """
     self.file_offset = file_offset
     self.event_type = event_type
@@ -1308,9 +1543,133 @@ class PerfRecordSample(object):
     self.command = command
     self.time = sample_time
     self.event = event
+    self.cpu = cpu
     self.stack = []
 
 
+class SymbolCache(object):
+  """Host-wide store of libraries pulled from devices indexed by build ID.
+
+  Libraries are stored in directory/build_id/basename so libraries that are
+  identical across captures (e.g system libraries of a device's firmware) are
+  only pulled from a device once.
+
+  Attributes:
+    directory: Root directory of the store.
+  """
+
+  def __init__(self, directory):
+    """Initialize the instance.
+
+    Args:
+      directory: Root directory of the store.
+    """
+    self.directory = directory
+
+  @staticmethod
+  def is_valid_build_id(build_id):
+    """Determine whether a build ID can be used to index the store.
+
+    Args:
+      build_id: Hex string build ID reported by perf.
+
+    Returns:
+      True if the build ID is valid, False otherwise (e.g if the build ID is
+      all zeros because the library was built without a build ID).
+    """
+    return bool(PERF_BUILD_ID_RE.match(build_id))
+
+  def get_path(self, build_id, dso):
+    """Get the path of a library in the store.
+
+    Args:
+      build_id: Build ID of the library.
+      dso: Path of the library on the device.
+
+    Returns:
+      Path of the library in the store.
+    """
+    return os.path.join(self.directory, build_id.lower(),
+                        os.path.basename(dso))
+
+  def lookup(self, build_id, dso):
+    """Find a library in the store.
+
+    Args:
+      build_id: Build ID of the library.
+      dso: Path of the library on the device.
+
+    Returns:
+      Path of the library in the store or an empty string if it isn't present.
+    """
+    if not SymbolCache.is_valid_build_id(build_id):
+      return ''
+    cached_file = self.get_path(build_id, dso)
+    return cached_file if os.path.exists(cached_file) else ''
+
+  def add(self, build_id, dso, local_file):
+    """Add a library to the store.
+
+    Args:
+      build_id: Build ID of the library.
+      dso: Path of the library on the device.
+      local_file: Host copy of the library to add to the store.
+
+    Returns:
+      Path of the library in the store or an empty string if the library
+      can't be stored.
+    """
+    if not SymbolCache.is_valid_build_id(build_id):
+      return ''
+    cached_file = self.get_path(build_id, dso)
+    if os.path.exists(cached_file):
+      return cached_file
+    cached_directory = os.path.dirname(cached_file)
+    try:
+      os.makedirs(cached_directory)
+    except OSError:
+      if not os.path.isdir(cached_directory):
+        raise
+    # Copy to a temporary file and rename so that concurrent captures never
+    # observe a partially written library.
+    fd, temporary_file = tempfile.mkstemp(dir=cached_directory, suffix='.tmp')
+    os.close(fd)
+    try:
+      shutil.copy2(local_file, temporary_file)
+      if not os.path.exists(cached_file):
+        os.rename(temporary_file, cached_file)
+    finally:
+      if os.path.exists(temporary_file):
+        os.remove(temporary_file)
+    return cached_file
+
+  @staticmethod
+  def link(cached_file, local_file):
+    """Reference a library in the store from a capture's symbols directory.
+
+    A hard link is used if possible, falling back to a symbolic link then a
+    copy of the file.
+
+    Args:
+      cached_file: Path of the library in the store.
+      local_file: Path to create in the symbols directory.
+    """
+    local_directory = os.path.dirname(local_file)
+    if local_directory and not os.path.exists(local_directory):
+      os.makedirs(local_directory)
+    if os.path.lexists(local_file):
+      os.remove(local_file)
+    for link_function in (getattr(os, 'link', None),
+                          getattr(os, 'symlink', None)):
+      if link_function:
+        try:
+          link_function(os.path.abspath(cached_file), local_file)
+          return
+        except OSError:
+          pass
+    shutil.copy2(cached_file, local_file)
+
+
 def version_to_tuple(version):
   """Convert a version to a tuple of ints.
 
@@ -1516,7 +1875,7 @@ def execute_command(executable, executable_args, error,
                     display_output_on_error=True,
                     verbose=False, keyboard_interrupt_success=False,
                     catch_sigint=True, ignore_error=False,
-                    display_output=False):
+                    display_output=False, stdout_callback=None):
   """Execute a command and throw an exception on failure.
 
   Args:
@@ -1529,13 +1888,19 @@ def execute_command(executable, executable_args, error,
       a command failure.
     catch_sigint: Whether to catch sigint (keyboard interrupt).
     ignore_error: Ignore errors running this command.
-    display_output: Display the output stream.
+    display_output: Display the output stream.  The output streams are not
+      retained, only their most recent lines.
+    stdout_callback: Callable which is passed each line read from the
+      standard output stream.  If this is specified the output streams are
+      not retained, only their most recent lines.
 
   Returns:
     (stdout, stderr, kbdint) where stdout is a string containing the
     standard output stream and stderr is a string containing the
     standard error stream and kbdint is whether a keyboard interrupt
-    occurred.
+    occurred.  If the output streams are not retained stdout and stderr
+    contain the most recent lines of each stream (see
+    runner.DEFAULT_TAIL_LINES) for error reporting.
 
   Raises:
     CommandFailedError: An error occured running the command.
@@ -1546,43 +1911,45 @@ def execute_command(executable, executable_args, error,
 
   # TODO(smiles): This isn't going to work on Windows, fix it.
   interrupt_signal = signal.SIGINT
+  # Signals can only be caught from the main thread.
+  catch_sigint = (catch_sigint and
+                  threading.current_thread().name == 'MainThread')
   if catch_sigint:
     sigint = SignalHandler()
     sigint.acquire(interrupt_signal)
 
   try:
-    process = subprocess.Popen([executable] + executable_args,
-                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # Read output of the command and optionally mirror the captured stdout and
+    # stderr streams to stdout and stderr respectively.
+    result = runner.run(
+        [executable] + executable_args,
+        capture=not (stdout_callback or display_output),
+        stdout_callback=stdout_callback or (
+            sys.stdout.write if display_output else None),
+        stderr_callback=sys.stderr.write if display_output else None)
   except OSError, e:
+    if catch_sigint:
+      sigint.release()
     raise CommandFailedError(' '.join((str(e), error)), 1)
 
-  if display_output:
-    # Read output of the command and optionally mirror the captured stdout and
-    # stderr streams to stderr and stdout respectively.
-    stdout_reader = ThreadedReader(process.stdout, sys.stdout)
-    stdout_reader.start()
-    stderr_reader = ThreadedReader(process.stderr, sys.stderr)
-    stderr_reader.start()
-    stdout_reader.join()
-    stderr_reader.join()
-    process.wait()
-  else:
-    # Read output into strings.
-    stdout_reader, stderr_reader = process.communicate()
-
+  stdout = (result.stdout if result.stdout is not None else
+            ''.join(result.stdout_tail))
+  stderr = (result.stderr if result.stderr is not None else
+            ''.join(result.stderr_tail))
+  returncode = result.returncode
   kbdint = False
   if catch_sigint:
     kdbint = sigint.called
     if kdbint and keyboard_interrupt_success:
-      process.returncode = 0
+      returncode = 0
     sigint.release()
 
-  if process.returncode and not ignore_error:
+  if returncode and not ignore_error:
     if display_output_on_error and not display_output:
-      print str(stdout_reader)
-      print >> sys.stderr, str(stderr_reader)
-    raise CommandFailedError(error, process.returncode)
-  return (str(stdout_reader), str(stderr_reader), kbdint)
+      print stdout
+      print >> sys.stderr, stderr
+    raise CommandFailedError(error, returncode)
+  return (stdout, stderr, kbdint)
 
 
 def parse_cpufreq_stats_time_in_state(string_to_parse):
@@ -1690,9 +2057,12 @@ def find_aapt():
   # NOTE: This is far from perfect since this will pick up the first instance
   # of aapt installed and not necessarily the newest version.
   # Use the path to the "android" SDK tool to determine the SDK path.
+  android_path = distutils.spawn.find_executable('android')
+  if not android_path:
+    return ''
   build_tools_dir = os.path.realpath(
-      os.path.join(distutils.spawn.find_executable('android'),
-                   os.path.pardir, os.path.pardir, 'build-tools'))
+      os.path.join(android_path, os.path.pardir, os.path.pardir,
+                   'build-tools'))
   for dirpath, unused_dirnames, filenames in os.walk(build_tools_dir):
     for filename in filenames:
       if os.path.splitext(filename)[0] == 'aapt':
@@ -1786,6 +2156,9 @@ def aapt_manifest_output_to_xml(aapt_lines, stack_depth=0):
 def apk_get_packge_activity_name(local_package_path):
   """Parse the package and main activity name from an APK.
 
+  The binary manifest in the APK is decoded in-process, if this fails aapt
+  (Android Asset Packaging Tool) is used to parse the manifest.
+
   Args:
     local_package_path: Path to a local APK to parse.
 
@@ -1795,10 +2168,16 @@ def apk_get_packge_activity_name(local_package_path):
     the package.
 
   Raises:
-    CommandFailedError: If there is a problem running aapt
-      (Android Asset Packaging Tool).
-    Error: If aapt can't be found.
+    CommandFailedError: If there is a problem running aapt.
+    Error: If the manifest can't be decoded and aapt can't be found.
   """
+  try:
+    manifest = axml.ApkManifest.read(local_package_path)
+    if manifest.package_name and manifest.activity_name:
+      return (manifest.package_name, manifest.activity_name)
+  except common.ConfigurationError:
+    pass
+
   # Find the SDK directory from the android SDK manager path.
   aapt_path = find_aapt()
   if not aapt_path:
@@ -1876,168 +2255,843 @@ def get_package_activity_name(adb_device, local_package_path,
   return (package_name, activity_name)
 
 
-def run_perf_remotely(adb_device, package_name, activity_name, perf_args,
-                      call_graph_recording, timestamp_recording,
-                      start_application, kill_application_on_stop,
-                      record_time):
-  """Run perf remotely.
+def check_device(adb_device, perf_args):
+  """Display warnings if a device's configuration is not supported.
 
   Args:
-    adb_device: The device that perf is run on.
-    package_name: Name of the package to profile.
-    activity_name: Name of the activity to profile in the package.
+    adb_device: The device that perf will run on.
     perf_args: PerfArgs instance referencing the arguments used to run perf.
-    call_graph_recording: Whether to enable recording of call graphs.
-    timestamp_recording: Whether to enable recording of timestamps.
-    start_application: Whether to start / restart the application prior to
-      recording.
-    kill_application_on_stop: Whether to kill the application prior to stopping
-      recording.
-    record_time: Time to record the application, 0 records until an interrupt
-      signal (e.g Ctrl-C) is pressed.
 
   Raises:
-    CommandFailedError: If subprocess execution fails.
-    Error: If this method encounters an error.
+    CommandFailedError: If the device can't be queried.
   """
-  # Push perf and wrapper script to the device.
-  android_perf = find_target_binary('perf', adb_device)
-  android_perf_remote = os.path.join(REMOTE_TEMP_DIRECTORY,
-                                     os.path.basename(android_perf))
-  adb_device.push_files([(android_perf, android_perf_remote)])
+  android_version = adb_device.get_version()
+  if is_version_less_than(android_version, '4.1'):
+    print >> sys.stderr, PERF_BINARIES_NOT_SUPPORTED % {
+        'ver': android_version}
+  (model, name) = adb_device.get_model_and_name()
+  if name in BROKEN_DEVICES:
+    print >> sys.stderr, PERFORMANCE_COUNTERS_BROKEN % model
+  elif name not in SUPPORTED_DEVICES:
+    print >> sys.stderr, NOT_SUPPORTED_DEVICE % model
+  user, _, _ = adb_device.shell_command(r'echo ${USER}',
+                                        'Unable to get Android user name')
+  if perf_args.requires_root() and user != 'root':
+    print >> sys.stderr, DEVICE_NOT_ROOTED % perf_args.command.name
+
+
+def pull_symbols(adb_device, perf_data, output_directory, symbol_cache=None):
+  """Pull the libraries referenced by a perf trace from a device.
 
-  # Get the output filename and mangle the arguments to run perf remotely.
-  output_filename = perf_args.get_output_filename()
-  if package_name:
-    perf_data = '/'.join([Adb.get_package_data_directory(package_name),
-                          os.path.basename(output_filename)])
-  else:
-    perf_data = output_filename
-  perf_args.process_remote_args(perf_data, call_graph_recording,
-                                timestamp_recording)
+  Args:
+    adb_device: The device the trace was recorded on.
+    perf_data: Host copy of the perf trace.
+    output_directory: Directory to pull libraries into.  Libraries are written
+      to output_directory/path_on_device so that this directory can be used as
+      the symfs directory of the trace.
+    symbol_cache: SymbolCache instance used to avoid pulling libraries which
+      have been pulled by a previous capture.  If this is None all libraries
+      are pulled from the device.
 
-  perf_recording = (os.path.splitext(
-      perf_args.get_default_output_filename())[1] == '.data')
+  Raises:
+    CommandFailedError: If the dependencies of the trace can't be parsed.
+  """
+  # Parse dependencies from the trace.
+  out, _, _ = execute_command(
+      find_host_binary(PERFHOST_BINARY, adb_device),
+      ['buildid-list', '-i', perf_data, '--with-hits'],
+      'Unable to retrieve the set of dependencies for perf '
+      'trace %s' % perf_data, verbose=adb_device.verbose)
+  pulled = 0
+  cached = 0
+  for m in [PERF_BUILDID_LIST_MATCH_OBJ_RE.match(l) for l in out.splitlines()]:
+    if not m:
+      continue
+    build_id = m.group('build_id')
+    dep = m.group('dso')
+    local_file = os.path.join(output_directory, dep[1:])
+    try:
+      cached_file = symbol_cache.lookup(build_id, dep) if symbol_cache else ''
+      if cached_file:
+        SymbolCache.link(cached_file, local_file)
+        cached += 1
+        continue
+      # Never write through a link into the store from a previous capture.
+      if os.path.lexists(local_file):
+        os.remove(local_file)
+      adb_device.pull(dep, local_file)
+      pulled += 1
+      if symbol_cache:
+        symbol_cache.add(build_id, dep, local_file)
+    except CommandFailedError as e:
+      print >> sys.stderr, 'WARNING: ' + str(e)
+    except (IOError, OSError) as e:
+      print >> sys.stderr, 'WARNING: Unable to cache %s (%s)' % (dep, str(e))
+  if adb_device.verbose:
+    print >> sys.stderr, ('Pulled %d libraries from the device, %d found in '
+                          'the symbol cache.' % (pulled, cached))
 
-  if perf_recording and not package_name:
-    raise Error('perf record commands require the specification of a package '
-                'name to profile.')
 
-  try:
-    if perf_recording:
-      # If a package name isn't specified, quit.
-      if not package_name:
-        raise Error('No package name specified, unable to record.')
-      if not activity_name and start_application:
-        raise Error('No activity name specified, unable to start '
-                    'application %s.' % package_name)
+def parse_cpufreq_samples(string_to_parse):
+  """Parse CPU frequency samples read by CpuFreqSampler.
 
-      # If data will be pulled from the device, create the target directory.
-      output_directory = ''
-      if output_filename:
-        output_directory = os.path.dirname(output_filename)
-        if output_directory and not os.path.exists(output_directory):
-          os.makedirs(output_directory)
+  Args:
+    string_to_parse: Output of the script run by CpuFreqSampler which
+      consists of a sequence of samples, each containing a line with the
+      device uptime ("uptime SECONDS"), optionally the monotonic clock
+      ("monotonic_ns NANOSECONDS") followed by the path of each CPU's
+      time_in_state file, the contents of the file and optionally the
+      CPU's current frequency ("cur_freq FREQUENCY").
 
-      # It's not possible to directly access the current CPU frequency without
-      # root so derive it from the stats.
-      # Save the CPU frequency statistics before profiling.
-      time_in_cpufreq_state = None
+  Returns:
+    List of (time, time_in_state_by_cpu, cur_freq_by_cpu) tuples, one per
+    sample, where time is the monotonic clock in seconds if it was read
+    for every sample, otherwise the device uptime in seconds,
+    time_in_state_by_cpu is a dictionary in the form returned by
+    parse_cpufreq_stats_time_in_state() and cur_freq_by_cpu is a dictionary
+    of frequencies in kHz indexed by CPU index.
+  """
+  samples = []
+  monotonic_times = []
+  cpu = None
+  for line in string_to_parse.splitlines():
+    m = CPUFREQ_SAMPLE_FIELD_RE.match(line)
+    if m:
+      field, value = m.groups()
+      if field == 'uptime':
+        samples.append((float(value), {}, {}))
+        monotonic_times.append(None)
+        cpu = None
+      elif field == 'monotonic_ns':
+        if samples:
+          monotonic_times[-1] = int(value) / 1000000000.0
+      elif samples and cpu is not None:
+        samples[-1][2][cpu] = int(value)
+      continue
+    m = SYS_DEVICES_CPU_NUMBER_RE.match(line)
+    if m and samples:
+      cpu = int(m.groups()[0])
+      samples[-1][1][cpu] = {}
+      continue
+    fields = line.split()
+    if len(fields) == 2 and samples and cpu is not None:
       try:
-        if output_filename and perf_recording:
-          time_in_cpufreq_state = get_cpufreq_stats_time_in_state(
-              adb_device, package_name)
-      except CommandFailedError as e:
-        print >> sys.stderr, CPU_FREQ_NOT_AVAILABLE % str(e)
+        samples[-1][1][cpu][int(fields[0])] = int(fields[1])
+      except ValueError:
+        pass
+  # Uptime includes time the device was suspended whereas perf timestamps do
+  # not, so the monotonic clock is used when it's available.
+  if samples and None not in monotonic_times:
+    samples = [(monotonic_time, time_in_state_by_cpu, cur_freq_by_cpu)
+               for monotonic_time, (_, time_in_state_by_cpu, cur_freq_by_cpu)
+               in zip(monotonic_times, samples)]
+  return samples
 
-      # Start the application or retrieve the package's PID.
-      if start_application:
-        package_pid = adb_device.start_activity(package_name, activity_name)
-      else:
-        package_pid = adb_device.get_package_pid(package_name)
-      perf_args.insert_process_option(package_pid)
 
-      # Start perf in a seperate thread so that it's possible to relay signals
-      # to the remote process from the main thread.
-      perf_thread = CommandThread(
-          Adb.ShellCommand(adb_device), 'run-as',
-          [package_name, android_perf_remote, ' '.join(perf_args.args)], '',
-          display_output=True)
-      perf_thread.start()
+class CpuFreqTimeline(object):
+  """Time series of CPU frequencies.
 
-      keyboard_interrupt = False
-      try:
-        if record_time:
-          time.sleep(record_time)
-          raise KeyboardInterrupt()
-        else:
-          # Wait for the thread to complete or SIGINT (ctrl-c).
-          perf_thread.join()
-      except KeyboardInterrupt:
-        print >> sys.stderr, 'Finishing, please wait..'
-        keyboard_interrupt = True
-        adb_device.shell_command(
-            r'pkg_user=$(ps | grep %(pkg)s | while read l; do '
-            r'  t=( ${l} ); echo ${t[0]}; break; done); '
-            r'pid=( $(ps | grep "${pkg_user}.* %(perf)s") ); '
-            r'echo "kill -s SIGINT ${pid[1]}" | run-as %(pkg)s sh' % {
-                'pkg': package_name, 'perf': android_perf_remote},
-            'Unable to stop %s' % android_perf_remote)
-        if kill_application_on_stop:
-          adb_device.shell_command(r'am force-stop %s' % package_name,
-                                   'Unable to stop %s' % package_name)
+  Frequencies are recorded for the interval between consecutive sample
+  times, such that frequencies[i] is the frequency of each CPU from times[i]
+  until times[i + 1].  Times are in seconds read from the device's
+  monotonic clock, which like perf sample timestamps doesn't advance while
+  the device is suspended, or the device uptime if the monotonic clock
+  isn't readable.
 
-      # If a keyboard interrupt occurred, ignore the status code.
-      if keyboard_interrupt:
-        perf_thread.join()
-        perf_thread.stdout = 0
+  Attributes:
+    cpus: List of CPU indices.
+    times: List of sample times in seconds.
+    frequencies: List of lists of frequencies in kHz, one per sample time
+      where each list contains the frequency of each CPU in cpus.  A
+      frequency of 0 indicates the frequency of the CPU is unknown.
+  """
 
-      # Grab the CPU frequency stats again, take the weighted average of
-      # of the time in each CPU state as the overall CPU frequency for
-      # visualization purposes.
-      if output_filename and perf_recording and time_in_cpufreq_state:
-        try:
-          weighted_time_in_cpufreq_state, weighted_average_cpufreq = (
-              calculate_cpufreq_weighted_time_in_state(
-                  get_cpufreq_stats_time_in_state(adb_device, package_name),
-                  time_in_cpufreq_state))
-          # Write the results to the output directory.
-          with open(os.path.join(output_directory, CPUFREQ_JSON), 'w') as f:
-            json.dump({
-                'weighted_time_in_cpufreq_state_by_cpu':
-                weighted_time_in_cpufreq_state,
-                'weighted_average_cpufreq_by_cpu':
-                weighted_average_cpufreq}, f, indent=2, sort_keys=True)
-        except CommandFailedError as e:
-          print >> sys.stderr, CPU_FREQ_NOT_AVAILABLE % str(e)
+  def __init__(self, cpus=None, times=None, frequencies=None):
+    """Initialize the instance.
 
-      # Copy the output file back to the host.
-      if output_filename:
-        adb_device.pull_package_file(package_name, perf_data, output_filename)
-
-      # If a trace was collected, pull dependencies from the device to the
-      # host directory.
-      if perf_recording and output_filename:
-        # Parse dependencies from the trace.
-        out, _, _ = execute_command(
-            find_host_binary(PERFHOST_BINARY, adb_device),
-            ['buildid-list', '-i', output_filename, '--with-hits'],
-            'Unable to retrieve the set of dependencies for perf '
-            'trace %s' % output_filename, verbose=adb_device.verbose)
-        # Pull all dependencies from the device.
-        for dep in [s.groups()[0] for s in [
-            PERF_BUILDID_LIST_MATCH_OBJ_RE.match(l)
-            for l in out.splitlines()] if s]:
-          try:
-            adb_device.pull(dep, os.path.join(output_directory, dep[1:]))
-          except CommandFailedError as e:
-            print >> sys.stderr, 'WARNING: ' + str(e)
+    Args:
+      cpus: List of CPU indices.
+      times: List of sample times in seconds.
+      frequencies: List of lists of frequencies, one per sample time.
+    """
+    self.cpus = list(cpus or [])
+    self.times = list(times or [])
+    self.frequencies = list(frequencies or [])
 
-    else:
-      adb_device.shell_command(
-          ' '.join((android_perf_remote, ' '.join(perf_args.args))),
-          'Unable to execute perf %s on device.' % perf_args.command.name,
-          display_output=True)
+  @staticmethod
+  def from_samples(samples):
+    """Create a timeline from samples read by CpuFreqSampler.
+
+    The frequency of each CPU during the interval between two samples is
+    derived from the time spent in each frequency state during the interval.
+    If a CPU did not spend any time in any state during the interval (e.g
+    stats are not available or the CPU was offline) the frequency read from
+    scaling_cur_freq at the start of the interval is used.
+
+    Args:
+      samples: List of samples returned by parse_cpufreq_samples().
+
+    Returns:
+      CpuFreqTimeline instance.
+    """
+    cpus = sorted(set([cpu for _, time_in_state, cur_freq in samples
+                       for cpu in time_in_state.keys() + cur_freq.keys()]))
+    timeline = CpuFreqTimeline(cpus)
+    for i, (sample_time, time_in_state_by_cpu, cur_freq_by_cpu) in enumerate(
+        samples):
+      if i + 1 < len(samples):
+        final_time_in_state_by_cpu = samples[i + 1][1]
+      else:
+        final_time_in_state_by_cpu = {}
+      frequencies = []
+      for cpu in cpus:
+        time_in_state = time_in_state_by_cpu.get(cpu, {})
+        final_time_in_state = final_time_in_state_by_cpu.get(cpu, {})
+        delta_time_in_state = dict([
+            (freq, final_time_in_state[freq] - cpu_time)
+            for freq, cpu_time in time_in_state.iteritems()
+            if freq in final_time_in_state])
+        total_time = sum(delta_time_in_state.values())
+        if total_time > 0:
+          frequencies.append(int(
+              sum([freq * cpu_time for freq, cpu_time in
+                   delta_time_in_state.iteritems()]) / total_time))
+        else:
+          frequencies.append(cur_freq_by_cpu.get(cpu, 0))
+      timeline.times.append(sample_time)
+      timeline.frequencies.append(frequencies)
+    return timeline
+
+  @staticmethod
+  def from_average(weighted_average_cpufreq_by_cpu):
+    """Create a timeline with a constant frequency for each CPU.
+
+    Args:
+      weighted_average_cpufreq_by_cpu: Dictionary of frequencies in kHz
+        indexed by CPU index as returned by
+        calculate_cpufreq_weighted_time_in_state().
+
+    Returns:
+      CpuFreqTimeline instance.
+    """
+    cpus = sorted([int(cpu) for cpu in weighted_average_cpufreq_by_cpu])
+    frequencies = dict([(int(cpu), int(frequency)) for cpu, frequency in
+                        weighted_average_cpufreq_by_cpu.iteritems()])
+    return CpuFreqTimeline(cpus, [0.0], [[frequencies[cpu] for cpu in cpus]])
+
+  @staticmethod
+  def load(trace_directory):
+    """Load the CPU frequencies recorded with a trace.
+
+    Args:
+      trace_directory: Directory containing the trace.
+
+    Returns:
+      CpuFreqTimeline read from CPUFREQ_TIMELINE_JSON if it's present,
+      otherwise a timeline of the average frequency of each CPU read from
+      CPUFREQ_JSON.  None is returned if neither file is present.
+    """
+    timeline_filename = os.path.join(trace_directory, CPUFREQ_TIMELINE_JSON)
+    if os.path.exists(timeline_filename):
+      return CpuFreqTimeline.read(timeline_filename)
+    cpufreq_filename = os.path.join(trace_directory, CPUFREQ_JSON)
+    if os.path.exists(cpufreq_filename):
+      with open(cpufreq_filename) as f:
+        return CpuFreqTimeline.from_average(json.load(f).get(
+            'weighted_average_cpufreq_by_cpu', {}))
+    return None
+
+  @staticmethod
+  def read(filename):
+    """Read a timeline from a JSON file written by write().
+
+    Args:
+      filename: File to read.
+
+    Returns:
+      CpuFreqTimeline instance.
+    """
+    with open(filename) as f:
+      data = json.load(f)
+    return CpuFreqTimeline(data.get('cpus'), data.get('times'),
+                           data.get('frequencies'))
+
+  def write(self, filename):
+    """Write the timeline to a JSON file.
+
+    Args:
+      filename: File to write.
+    """
+    with open(filename, 'w') as f:
+      json.dump({'cpus': self.cpus, 'times': self.times,
+                 'frequencies': self.frequencies}, f, separators=(',', ':'))
+
+  def frequency_at(self, sample_time, cpu=None):
+    """Get the frequency of a CPU at the specified time.
+
+    Args:
+      sample_time: Time in seconds e.g the timestamp of a perf sample.
+      cpu: Index of the CPU to query.  If this is None the mean frequency of
+        all CPUs with a known frequency is returned.  This is useful for
+        perf traces that do not record the CPU each sample was taken on.
+
+    Returns:
+      Frequency in kHz or 0 if the frequency is not known.  Times before the
+      first sample use the frequency of the first sample.
+    """
+    if not self.times:
+      return 0
+    index = max(0, bisect.bisect_right(self.times, sample_time) - 1)
+    frequencies = self.frequencies[index]
+    if cpu is not None:
+      return (frequencies[self.cpus.index(cpu)] if cpu in self.cpus else 0)
+    known = [f for f in frequencies if f]
+    return sum(known) / len(known) if known else 0
+
+
+class CpuFreqSampler(object):
+  """Samples CPU frequencies on a device in the background.
+
+  A single shell command, which loops until a stop file is created, reads
+  the device uptime, the monotonic clock from /proc/timer_list, per-CPU
+  time_in_state and scaling_cur_freq (where readable) at a fixed interval.
+  Using a persistent shell avoids the overhead of running an adb command for
+  each sample.
+
+  Attributes:
+    adb_device: Device to sample.
+    package_name: Name of the package used to run-as the sampling script.
+    interval: Time between samples in seconds.
+    stop_filename: File on the device which stops sampling when created.
+    thread: CommandThread running the sampling script or None if sampling
+      hasn't started.
+  """
+
+  def __init__(self, adb_device, package_name, interval):
+    """Initialize the instance.
+
+    Args:
+      adb_device: Device to sample.
+      package_name: Name of the package used to run-as the sampling script.
+      interval: Time between samples in seconds.
+    """
+    self.adb_device = adb_device
+    self.package_name = package_name
+    self.interval = interval
+    self.stop_filename = '/'.join((
+        Adb.get_package_data_directory(package_name), 'cpufreq_sampler.stop'))
+    self.thread = None
+
+  def get_script(self):
+    """Get the shell script which samples CPU frequencies.
+
+    Returns:
+      Shell script string which does not contain single quotes.
+    """
+    return ' '.join((
+        'rm -f %(stop)s;',
+        'while [[ ! -e %(stop)s ]]; do',
+        '  read uptime idle < /proc/uptime;',
+        '  echo "uptime ${uptime}";',
+        '  (while read now at ns units; do',
+        '    if [[ "${now} ${at}" == "now at" ]]; then',
+        '      echo "monotonic_ns ${ns}";',
+        '      break;',
+        '    fi;',
+        '  done < /proc/timer_list) 2>/dev/null;',
+        '  for cpu in /sys/devices/system/cpu/cpu[0-9]*; do',
+        '    time_in_state_file="${cpu}/cpufreq/stats/time_in_state";',
+        '    echo "${time_in_state_file}";',
+        '    if [[ -e ${time_in_state_file} ]]; then',
+        '      cat ${time_in_state_file};',
+        '    fi;',
+        '    if [[ -r ${cpu}/cpufreq/scaling_cur_freq ]]; then',
+        '      echo "cur_freq $(cat ${cpu}/cpufreq/scaling_cur_freq)";',
+        '    fi;',
+        '  done;',
+        '  usleep %(usec)d 2>/dev/null || sleep %(sec)s;',
+        'done')) % {'stop': self.stop_filename,
+                    'usec': int(self.interval * 1000000),
+                    'sec': str(self.interval)}
+
+  def start(self):
+    """Start sampling."""
+    self.thread = CommandThread(
+        Adb.ShellCommand(self.adb_device), 'run-as',
+        [self.package_name, 'sh', '-c', "'%s'" % self.get_script()],
+        'Unable to sample CPU frequency')
+    self.thread.start()
+
+  def stop(self):
+    """Stop sampling.
+
+    Returns:
+      CpuFreqTimeline containing the samples read from the device.
+
+    Raises:
+      CommandFailedError: If sampling fails.
+    """
+    if not self.thread:
+      return CpuFreqTimeline()
+    try:
+      self.adb_device.shell_command(
+          'run-as %s touch %s' % (self.package_name, self.stop_filename),
+          'Unable to stop CPU frequency sampling')
+      self.thread.join()
+    finally:
+      self.adb_device.shell_command(
+          'run-as %s rm -f %s' % (self.package_name, self.stop_filename),
+          'Unable to remove %s' % self.stop_filename)
+    if self.thread.returncode:
+      raise CommandFailedError('Unable to sample CPU frequency (device=%s)' %
+                               str(self.adb_device), self.thread.returncode)
+    return CpuFreqTimeline.from_samples(
+        parse_cpufreq_samples(self.thread.stdout))
+
+
+def stop_remote_perf(adb_device, package_name, android_perf_remote):
+  """Send SIGINT to perf running on a device so that it finishes recording.
+
+  Args:
+    adb_device: The device that perf is running on.
+    package_name: Name of the package perf is running as.
+    android_perf_remote: Path of the perf binary on the device.
+
+  Raises:
+    CommandFailedError: If the shell command used to stop perf fails.
+  """
+  adb_device.shell_command(
+      r'pkg_user=$(ps | grep %(pkg)s | while read l; do '
+      r'  t=( ${l} ); echo ${t[0]}; break; done); '
+      r'pid=( $(ps | grep "${pkg_user}.* %(perf)s") ); '
+      r'echo "kill -s SIGINT ${pid[1]}" | run-as %(pkg)s sh' % {
+          'pkg': package_name, 'perf': android_perf_remote},
+      'Unable to stop %s' % android_perf_remote)
+
+
+def get_perf_chunk_directory(output_filename):
+  """Get the directory used to store chunks of a trace.
+
+  Args:
+    output_filename: Host filename of the trace.
+
+  Returns:
+    Directory which contains chunks of the trace.
+  """
+  return output_filename + PERF_CHUNK_DIRECTORY_SUFFIX
+
+
+def get_perf_chunks(chunk_directory):
+  """Get the completed chunks of a trace.
+
+  Args:
+    chunk_directory: Directory containing chunks of a trace.
+
+  Returns:
+    List of chunk filenames in the order they were recorded.
+  """
+  return [os.path.join(chunk_directory, f) for f in sorted(
+      os.listdir(chunk_directory)) if f.endswith(PERF_CHUNK_EXTENSION)]
+
+
+class PerfChunkPuller(threading.Thread):
+  """Pulls chunks of a trace from a device in the background.
+
+  Each chunk is removed from the device after it has been copied to the host
+  and objects referenced by the chunk are copied to the host.
+
+  Attributes:
+    adb_device: The device to pull chunks from.
+    package_name: Name of the package which owns the chunks.
+    chunk_directory: Host directory chunks are written to.
+    symbols_directory: Host directory objects referenced by each chunk are
+      written to.
+    max_chunks: Maximum number of chunks retained on the host, the oldest
+      chunk is deleted when this is exceeded.  0 retains all chunks.
+    symbol_cache: SymbolCache instance passed to pull_symbols().
+    queue: Queue of (remote_filename, local_filename) tuples to pull, None
+      stops the thread.
+    error: Exception raised while pulling chunks, None if no error occurred.
+  """
+
+  def __init__(self, adb_device, package_name, chunk_directory,
+               symbols_directory, max_chunks=0, symbol_cache=None):
+    """Initialize the instance.
+
+    Args:
+      adb_device: The device to pull chunks from.
+      package_name: Name of the package which owns the chunks.
+      chunk_directory: Host directory chunks are written to.
+      symbols_directory: Host directory objects referenced by each chunk are
+        written to.
+      max_chunks: Maximum number of chunks retained on the host.
+      symbol_cache: SymbolCache instance passed to pull_symbols().
+    """
+    super(PerfChunkPuller, self).__init__()
+    self.adb_device = adb_device
+    self.package_name = package_name
+    self.chunk_directory = chunk_directory
+    self.symbols_directory = symbols_directory
+    self.max_chunks = max_chunks
+    self.symbol_cache = symbol_cache
+    self.queue = Queue.Queue()
+    self.error = None
+
+  def run(self):
+    """Pull chunks until None is read from the queue.
+
+    After an error chunks are no longer pulled, however they're still removed
+    from the device so that they don't exhaust the device's storage.
+    """
+    while True:
+      item = self.queue.get()
+      if item is None:
+        break
+      remote_filename, local_filename = item
+      # Pull to a temporary file so that only complete chunks are visible
+      # to readers of the chunk directory.
+      temporary_filename = local_filename + '.tmp'
+      pulled = False
+      if not self.error:
+        try:
+          try:
+            self.adb_device.pull_package_file(
+                self.package_name, remote_filename, temporary_filename)
+          except CommandFailedError:
+            # Retry once as the pull may have been interrupted when recording
+            # was stopped using SIGINT.
+            self.adb_device.pull_package_file(
+                self.package_name, remote_filename, temporary_filename)
+          pulled = True
+        except (Error, CommandFailedError, OSError) as e:
+          self.error = e
+      try:
+        self.adb_device.shell_command(
+            'run-as %s rm -f %s' % (self.package_name, remote_filename),
+            'Unable to remove %s' % remote_filename)
+      except CommandFailedError as e:
+        self.error = self.error or e
+      if not pulled:
+        continue
+      try:
+        pull_symbols(self.adb_device, temporary_filename,
+                     self.symbols_directory, self.symbol_cache)
+        os.rename(temporary_filename, local_filename)
+        print >> sys.stderr, 'Wrote %s' % local_filename
+        chunks = get_perf_chunks(self.chunk_directory)
+        if self.max_chunks > 0:
+          for chunk in chunks[:-self.max_chunks]:
+            for filename in (chunk, chunk + PERF_CHUNK_SCRIPT_EXTENSION):
+              if os.path.exists(filename):
+                os.remove(filename)
+      except (Error, CommandFailedError, OSError) as e:
+        self.error = self.error or e
+
+
+class PerfChunkRecorder(threading.Thread):
+  """Records a trace on a device as a sequence of fixed length chunks.
+
+  perf is restarted for each chunk, completed chunks are pulled from the
+  device and deleted from the device in the background by a PerfChunkPuller
+  so that long captures don't exhaust the device's storage.  Recording stops
+  if the PerfChunkPuller fails to pull a chunk.
+
+  Attributes:
+    adb_device: The device to record.
+    package_name: Name of the package to record.
+    android_perf_remote: Path of the perf binary on the device.
+    perf_args: PerfArgs instance referencing the arguments used to run perf.
+    remote_filename: Filename of the trace on the device, chunks are written
+      to this filename with the chunk index appended.
+    chunk_time: Time in seconds to record each chunk.
+    puller: PerfChunkPuller instance used to copy chunks to the host.
+    stop_event: threading.Event which is set to stop recording.
+  """
+
+  def __init__(self, adb_device, package_name, android_perf_remote, perf_args,
+               remote_filename, output_filename, chunk_time, max_chunks=0,
+               symbol_cache=None):
+    """Initialize the instance.
+
+    Args:
+      adb_device: The device to record.
+      package_name: Name of the package to record.
+      android_perf_remote: Path of the perf binary on the device.
+      perf_args: PerfArgs instance referencing the arguments used to run perf.
+      remote_filename: Filename of the trace on the device.
+      output_filename: Host filename of the trace, chunks are written to the
+        directory returned by get_perf_chunk_directory().
+      chunk_time: Time in seconds to record each chunk.
+      max_chunks: Maximum number of chunks retained on the host.
+      symbol_cache: SymbolCache instance passed to pull_symbols().
+    """
+    super(PerfChunkRecorder, self).__init__()
+    self.adb_device = adb_device
+    self.package_name = package_name
+    self.android_perf_remote = android_perf_remote
+    self.perf_args = perf_args
+    self.remote_filename = remote_filename
+    self.chunk_time = chunk_time
+    chunk_directory = get_perf_chunk_directory(output_filename)
+    if not os.path.exists(chunk_directory):
+      os.makedirs(chunk_directory)
+    self.puller = PerfChunkPuller(
+        adb_device, package_name, chunk_directory,
+        os.path.dirname(output_filename), max_chunks=max_chunks,
+        symbol_cache=symbol_cache)
+    self.stop_event = threading.Event()
+
+  @property
+  def error(self):
+    """Exception raised while pulling chunks or None."""
+    return self.puller.error
+
+  def run(self):
+    """Record chunks until stop() is called, perf exits or a pull fails."""
+    self.puller.start()
+    try:
+      index = 0
+      while not self.stop_event.is_set() and not self.puller.error:
+        remote_chunk = '%s.%05d' % (self.remote_filename, index)
+        self.perf_args.get_output_filename(remote_chunk)
+        perf_thread = CommandThread(
+            Adb.ShellCommand(self.adb_device), 'run-as',
+            [self.package_name, self.android_perf_remote,
+             ' '.join(self.perf_args.args)], '', display_output=True)
+        perf_thread.start()
+        # Stop recording the chunk early if pulling a previous chunk failed.
+        chunk_end_time = time.time() + self.chunk_time
+        while (not self.stop_event.is_set() and not self.puller.error and
+               time.time() < chunk_end_time):
+          self.stop_event.wait(min(0.1, chunk_end_time - time.time()))
+        perf_exited = not perf_thread.is_alive()
+        if not perf_exited:
+          stop_remote_perf(self.adb_device, self.package_name,
+                           self.android_perf_remote)
+        perf_thread.join()
+        self.puller.queue.put((remote_chunk, os.path.join(
+            self.puller.chunk_directory,
+            '%05d%s' % (index, PERF_CHUNK_EXTENSION))))
+        index += 1
+        if perf_exited:
+          break
+    except CommandFailedError as e:
+      self.puller.error = self.puller.error or e
+    finally:
+      self.puller.queue.put(None)
+      self.puller.join()
+
+  def stop(self):
+    """Stop recording and wait for all chunks to be copied to the host."""
+    self.stop_event.set()
+    self.join()
+
+
+def run_perf_remotely(adb_device, package_name, activity_name, perf_args,
+                      call_graph_recording, timestamp_recording,
+                      start_application, kill_application_on_stop,
+                      record_time, symbol_cache=None, ready_event=None,
+                      start_event=None, stop_event=None,
+                      cpufreq_sample_interval=0, chunk_time=0, max_chunks=0):
+  """Run perf remotely.
+
+  Args:
+    adb_device: The device that perf is run on.
+    package_name: Name of the package to profile.
+    activity_name: Name of the activity to profile in the package.
+    perf_args: PerfArgs instance referencing the arguments used to run perf.
+    call_graph_recording: Whether to enable recording of call graphs.
+    timestamp_recording: Whether to enable recording of timestamps.
+    start_application: Whether to start / restart the application prior to
+      recording.
+    kill_application_on_stop: Whether to kill the application prior to stopping
+      recording.
+    record_time: Time to record the application, 0 records until an interrupt
+      signal (e.g Ctrl-C) is pressed.
+    symbol_cache: SymbolCache instance used to avoid pulling libraries
+      from the device that were pulled by previous captures.
+    ready_event: threading.Event which is set when the application is
+      running and perf is about to start recording.
+    start_event: threading.Event which is waited upon before perf starts
+      recording.  Used to synchronize recording across multiple devices.
+    stop_event: threading.Event which stops recording when set.  If this is
+      specified record_time is ignored.
+    cpufreq_sample_interval: Interval in seconds between samples of each
+      CPU's frequency taken while recording which are written to
+      CPUFREQ_TIMELINE_JSON in the output directory.  If this is 0 CPU
+      frequencies are not sampled.
+    chunk_time: If this is non-zero the trace is recorded as a sequence of
+      chunks of the specified length in seconds, see PerfChunkRecorder.
+    max_chunks: Maximum number of chunks retained on the host when recording
+      chunks, 0 retains all chunks.
+
+  Raises:
+    CommandFailedError: If subprocess execution fails.
+    Error: If this method encounters an error.
+  """
+  # Push perf and wrapper script to the device.
+  android_perf = find_target_binary('perf', adb_device)
+  android_perf_remote = os.path.join(REMOTE_TEMP_DIRECTORY,
+                                     os.path.basename(android_perf))
+  adb_device.push_files([(android_perf, android_perf_remote)])
+
+  # Get the output filename and mangle the arguments to run perf remotely.
+  output_filename = perf_args.get_output_filename()
+  if package_name:
+    perf_data = '/'.join([Adb.get_package_data_directory(package_name),
+                          os.path.basename(output_filename)])
+  else:
+    perf_data = output_filename
+  perf_args.process_remote_args(perf_data, call_graph_recording,
+                                timestamp_recording)
+
+  perf_recording = (os.path.splitext(
+      perf_args.get_default_output_filename())[1] == '.data')
+
+  if perf_recording and not package_name:
+    raise Error('perf record commands require the specification of a package '
+                'name to profile.')
+
+  try:
+    if perf_recording:
+      # If a package name isn't specified, quit.
+      if not package_name:
+        raise Error('No package name specified, unable to record.')
+      if not activity_name and start_application:
+        raise Error('No activity name specified, unable to start '
+                    'application %s.' % package_name)
+
+      # If data will be pulled from the device, create the target directory.
+      output_directory = ''
+      if output_filename:
+        output_directory = os.path.dirname(output_filename)
+        if output_directory and not os.path.exists(output_directory):
+          os.makedirs(output_directory)
+
+      # It's not possible to directly access the current CPU frequency without
+      # root so derive it from the stats.
+      # Save the CPU frequency statistics before profiling.
+      time_in_cpufreq_state = None
+      try:
+        if output_filename and perf_recording:
+          time_in_cpufreq_state = get_cpufreq_stats_time_in_state(
+              adb_device, package_name)
+      except CommandFailedError as e:
+        print >> sys.stderr, CPU_FREQ_NOT_AVAILABLE % str(e)
+
+      # Start the application or retrieve the package's PID.
+      if start_application:
+        package_pid = adb_device.start_activity(package_name, activity_name)
+      else:
+        package_pid = adb_device.get_package_pid(package_name)
+      perf_args.insert_process_option(package_pid)
+
+      if ready_event:
+        ready_event.set()
+      if start_event:
+        while not start_event.is_set():
+          start_event.wait(0.1)
+          if stop_event and stop_event.is_set():
+            break
+
+      # Sample CPU frequencies while recording.
+      cpufreq_sampler = None
+      if output_filename and cpufreq_sample_interval > 0:
+        cpufreq_sampler = CpuFreqSampler(adb_device, package_name,
+                                         cpufreq_sample_interval)
+        cpufreq_sampler.start()
+
+      # Start perf in a seperate thread so that it's possible to relay signals
+      # to the remote process from the main thread.
+      if output_filename and chunk_time > 0:
+        perf_thread = PerfChunkRecorder(
+            adb_device, package_name, android_perf_remote, perf_args,
+            perf_data, output_filename, chunk_time, max_chunks=max_chunks,
+            symbol_cache=symbol_cache)
+      else:
+        perf_thread = CommandThread(
+            Adb.ShellCommand(adb_device), 'run-as',
+            [package_name, android_perf_remote, ' '.join(perf_args.args)], '',
+            display_output=True)
+      perf_thread.start()
+
+      keyboard_interrupt = False
+      try:
+        if stop_event:
+          # Wait for the thread to complete or the caller to stop recording.
+          while perf_thread.is_alive() and not stop_event.is_set():
+            stop_event.wait(0.1)
+          if stop_event.is_set():
+            raise KeyboardInterrupt()
+        elif record_time:
+          time.sleep(record_time)
+          raise KeyboardInterrupt()
+        else:
+          # Wait for the thread to complete or SIGINT (ctrl-c).
+          perf_thread.join()
+      except KeyboardInterrupt:
+        print >> sys.stderr, 'Finishing, please wait..'
+        keyboard_interrupt = True
+        if isinstance(perf_thread, PerfChunkRecorder):
+          perf_thread.stop()
+        else:
+          stop_remote_perf(adb_device, package_name, android_perf_remote)
+        if kill_application_on_stop:
+          adb_device.shell_command(r'am force-stop %s' % package_name,
+                                   'Unable to stop %s' % package_name)
+
+      # If a keyboard interrupt occurred, ignore the status code.
+      if keyboard_interrupt:
+        perf_thread.join()
+        perf_thread.stdout = 0
+
+      if cpufreq_sampler:
+        try:
+          cpufreq_sampler.stop().write(
+              os.path.join(output_directory, CPUFREQ_TIMELINE_JSON))
+        except CommandFailedError as e:
+          print >> sys.stderr, CPU_FREQ_NOT_AVAILABLE % str(e)
+
+      # Grab the CPU frequency stats again, take the weighted average of
+      # of the time in each CPU state as the overall CPU frequency for
+      # visualization purposes.
+      if output_filename and perf_recording and time_in_cpufreq_state:
+        try:
+          weighted_time_in_cpufreq_state, weighted_average_cpufreq = (
+              calculate_cpufreq_weighted_time_in_state(
+                  get_cpufreq_stats_time_in_state(adb_device, package_name),
+                  time_in_cpufreq_state))
+          # Write the results to the output directory.
+          with open(os.path.join(output_directory, CPUFREQ_JSON), 'w') as f:
+            json.dump({
+                'weighted_time_in_cpufreq_state_by_cpu':
+                weighted_time_in_cpufreq_state,
+                'weighted_average_cpufreq_by_cpu':
+                weighted_average_cpufreq}, f, indent=2, sort_keys=True)
+        except CommandFailedError as e:
+          print >> sys.stderr, CPU_FREQ_NOT_AVAILABLE % str(e)
+
+      if isinstance(perf_thread, PerfChunkRecorder):
+        # Chunks and their dependencies have already been copied to the host.
+        if perf_thread.error:
+          raise perf_thread.error
+      else:
+        # Copy the output file back to the host.
+        if output_filename:
+          adb_device.pull_package_file(package_name, perf_data,
+                                       output_filename)
+
+        # If a trace was collected, pull dependencies from the device to the
+        # host directory.
+        if perf_recording and output_filename:
+          pull_symbols(adb_device, output_filename, output_directory,
+                       symbol_cache)
+
+    else:
+      adb_device.shell_command(
+          ' '.join((android_perf_remote, ' '.join(perf_args.args))),
+          'Unable to execute perf %s on device.' % perf_args.command.name,
+          display_output=True)
 
   finally:
     # Remove temporary files from the device.
@@ -2050,62 +3104,770 @@ def run_perf_remotely(adb_device, package_name, activity_name, perf_args,
             temporary_files), display_output=True)
 
 
-def process_perf_script_dump(dump_output, progress_display_max_value):
-  """Parse perf script -D output and generate a data structure with the output.
+class DeviceProfileThread(threading.Thread):
+  """Runs perf on a device from a separate thread.
+
+  Attributes:
+    adb_device: Adb instance of the device to profile.
+    package_name: Name of the package to profile.
+    activity_name: Name of the activity to profile in the package.
+    perf_args: PerfArgs instance referencing the arguments used to run perf
+      on the device.
+    output_filename: Host filename of the trace recorded from the device or
+      an empty string if the perf command doesn't write a trace.
+    kwargs: Additional keyword arguments passed to run_perf_remotely().
+    ready_event: threading.Event which is set when the device is ready to
+      record or profiling fails.
+    error: Exception raised while profiling the device, None if no error
+      occurred.
+  """
+
+  def __init__(self, adb_device, package_name, activity_name, perf_args,
+               **kwargs):
+    """Initialize the instance.
+
+    Args:
+      adb_device: Adb instance of the device to profile.
+      package_name: Name of the package to profile.
+      activity_name: Name of the activity to profile in the package.
+      perf_args: PerfArgs instance referencing the arguments used to run perf
+        on the device.
+      **kwargs: Additional keyword arguments passed to run_perf_remotely().
+    """
+    super(DeviceProfileThread, self).__init__()
+    self.adb_device = adb_device
+    self.package_name = package_name
+    self.activity_name = activity_name
+    self.perf_args = perf_args
+    self.output_filename = perf_args.get_output_filename()
+    self.kwargs = kwargs
+    self.ready_event = threading.Event()
+    self.error = None
+
+  def run(self):
+    """Profile the device."""
+    try:
+      run_perf_remotely(self.adb_device, self.package_name,
+                        self.activity_name, self.perf_args,
+                        ready_event=self.ready_event, **self.kwargs)
+    except (Error, CommandFailedError) as e:
+      self.error = e
+    finally:
+      self.ready_event.set()
+
+
+def get_device_output_filename(output_filename, serial):
+  """Get the name of a file written for one of multiple profiled devices.
 
   Args:
-    dump_output: Output of the perf script -D command to parse.
-    progress_display_max_value: Maximum value to display in the
-      progress display.
+    output_filename: Output filename specified on the command line.
+    serial: Serial number of the device.
 
   Returns:
-    List of PerfRecordSample instances, one per recorded sample.  If samples
-    were recorded at a fixed frequency PerfRecordSample.period is fixed up
-    for each sample with the time delta between each sample in the trace.
+    output_filename moved into a subdirectory named after the serial number
+    of the device.
   """
-  samples = []
-  sample_data = None
-  sample = None
-  progress_display = ProgressDisplay()
-  lines = dump_output.splitlines()
-  num_lines = len(lines)
-  # Parse lines
-  for line_number, line in enumerate(lines):
-    # This could take a while, so display the progress.
-    progress_display.update((float(line_number + 1) / num_lines) *
-                            progress_display_max_value)
+  return os.path.join(os.path.dirname(output_filename), serial,
+                      os.path.basename(output_filename))
+
+
+def profile_devices(device_threads, record_time):
+  """Profile multiple devices concurrently.
+
+  Recording starts on all devices when all devices are ready to record and
+  stops on all devices after record_time or when an interrupt signal
+  (e.g Ctrl-C) is received.
+
+  Args:
+    device_threads: List of DeviceProfileThread instances.
+    record_time: Time to record, 0 records until an interrupt signal is
+      received or perf exits on all devices.
+  """
+  start_event = threading.Event()
+  stop_event = threading.Event()
+  for thread in device_threads:
+    thread.kwargs['start_event'] = start_event
+    thread.kwargs['stop_event'] = stop_event
+    thread.start()
+
+  # Events and threads are waited upon with a timeout so that the main thread
+  # can receive keyboard interrupts.
+  try:
+    for thread in device_threads:
+      while not thread.ready_event.is_set():
+        thread.ready_event.wait(0.1)
+    start_event.set()
+    end_time = time.time() + record_time if record_time else 0
+    while [t for t in device_threads if t.is_alive()]:
+      if end_time and time.time() >= end_time:
+        break
+      time.sleep(0.1)
+  except KeyboardInterrupt:
+    print >> sys.stderr, 'Finishing, please wait..'
+  stop_event.set()
+  start_event.set()
+  for thread in device_threads:
+    while thread.is_alive():
+      thread.join(0.1)
+
+
+def write_device_summary(device_threads, summary_filename):
+  """Write and display a summary of the traces recorded from devices.
+
+  Args:
+    device_threads: List of DeviceProfileThread instances that have
+      completed.
+    summary_filename: JSON file to write the summary to.
+  """
+  summary = []
+  for thread in device_threads:
+    adb_device = thread.adb_device
+    entry = {'serial': adb_device.serial,
+             'output_filename': thread.output_filename,
+             'error': str(thread.error) if thread.error else ''}
+    try:
+      entry['model'], entry['name'] = adb_device.get_model_and_name()
+      entry['version'] = adb_device.get_version()
+    except CommandFailedError:
+      pass
+    if thread.output_filename and os.path.exists(thread.output_filename):
+      entry['output_size'] = os.path.getsize(thread.output_filename)
+    cpufreq_filename = os.path.join(os.path.dirname(thread.output_filename),
+                                    CPUFREQ_JSON)
+    if thread.output_filename and os.path.exists(cpufreq_filename):
+      with open(cpufreq_filename) as f:
+        entry['weighted_average_cpufreq_by_cpu'] = json.load(f).get(
+            'weighted_average_cpufreq_by_cpu', {})
+    summary.append(entry)
+
+  summary_directory = os.path.dirname(summary_filename)
+  if summary_directory and not os.path.exists(summary_directory):
+    os.makedirs(summary_directory)
+  with open(summary_filename, 'w') as f:
+    json.dump(summary, f, indent=2, sort_keys=True)
+
+  row_format = '%-20s %-16s %-8s %10s %10s  %s'
+  lines = ['', row_format % ('Serial', 'Model', 'Android', 'Trace (KB)',
+                             'Avg. MHz', 'Status')]
+  for entry in summary:
+    average_cpufreq = [float(v) for v in entry.get(
+        'weighted_average_cpufreq_by_cpu', {}).values() if v]
+    lines.append(row_format % (
+        entry['serial'], entry.get('model', ''), entry.get('version', ''),
+        '%d' % (entry['output_size'] / 1024) if 'output_size' in entry else '',
+        '%d' % (sum(average_cpufreq) / len(average_cpufreq) / 1000)
+        if average_cpufreq else '',
+        entry['error'] if entry['error'] else 'OK'))
+  lines.append('Summary written to %s' % summary_filename)
+  print os.linesep.join(lines)
+
+
+def parse_launch_output(output, component, start_time=None):
+  """Parse launch times from "am start -W" and the "Displayed" log message.
+
+  Args:
+    output: Output of "am start -W" followed by the device log.
+    component: package/activity string of the launched activity.
+    start_time: Time the launch started in the format of the log's "time"
+      format ("MM-DD hh:mm:ss.mmm").  If this is specified "Displayed"
+      messages logged before this time are ignored.
+
+  Returns:
+    Dictionary containing 'this_time', 'total_time', 'wait_time' and
+    'displayed' times in milliseconds.  Times that are not reported are
+    None.
+  """
+  times = dict([(name, None) for name in ('this_time', 'total_time',
+                                          'wait_time', 'displayed')])
+  for m in AM_START_WAIT_TIME_RE.finditer(output):
+    name = re.sub(r'([a-z])([A-Z])', r'\1_\2', m.group('name')).lower()
+    times[name] = int(m.group('value'))
+  package_name, activity_name = component.split('/', 1)
+  for line in output.splitlines():
+    m = LOGCAT_DISPLAYED_RE.search(line)
+    if not m:
+      continue
+    line_time = LOGCAT_TIME_RE.match(line)
+    if start_time and line_time and line_time.group('time') < start_time:
+      continue
+    displayed_component = m.group('component')
+    if displayed_component not in (
+        component, package_name + '/' + package_name + activity_name):
+      continue
+    if m.group('seconds') or m.group('milliseconds'):
+      times['displayed'] = (int(m.group('seconds') or 0) * 1000 +
+                            int(m.group('milliseconds') or 0))
+  return times
+
+
+def calculate_statistics(values):
+  """Calculate summary statistics of a set of values.
+
+  Args:
+    values: List of numbers.
+
+  Returns:
+    Dictionary containing the 'count', 'min', 'max', 'mean', 'median',
+    'p90' (90th percentile), 'variance' and 'stddev' (sample standard
+    deviation) of the values or an empty dictionary if values is empty.
+  """
+  if not values:
+    return {}
+  ordered = sorted(values)
+  count = len(ordered)
+
+  def percentile(fraction):
+    """Linearly interpolate a percentile of the ordered values."""
+    position = (count - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, count - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (
+        position - lower)
+
+  mean = float(sum(ordered)) / count
+  variance = (sum([(v - mean) ** 2 for v in ordered]) / (count - 1)
+              if count > 1 else 0.0)
+  return {'count': count, 'min': ordered[0], 'max': ordered[-1],
+          'mean': mean, 'median': percentile(0.5), 'p90': percentile(0.9),
+          'variance': variance, 'stddev': variance ** 0.5}
+
+
+def measure_launch(adb_device, package_name, activity_name, cold):
+  """Launch an activity and measure the time taken to display it.
+
+  Args:
+    adb_device: The device to launch the activity on.
+    package_name: Name of the package containing the activity.
+    activity_name: Name of the activity to launch.
+    cold: Whether to stop the application before launching it (cold start).
+      If this is False the application is moved to the background and
+      brought to the foreground again (warm start).
+
+  Returns:
+    Dictionary of launch times, see parse_launch_output().
+
+  Raises:
+    CommandFailedError: If the activity can't be launched.
+  """
+  component = '%s/%s' % (package_name, activity_name)
+  # The log belongs to the user so rather than clearing it, only messages
+  # logged after the launch starts are read.  Devices which don't support
+  # "logcat -T TIME" report the whole log which is filtered on the host.
+  time_filter = (' -T "${start_time}"' if adb_device.get_api_level() >=
+                 LOGCAT_TIME_FILTER_MIN_API_LEVEL else '')
+  # Perform all operations in a single shell command to minimize the time
+  # spent communicating with the device between launches.
+  out, _, _ = adb_device.shell_command(
+      '; '.join(('am force-stop %s' % package_name if cold else
+                 'input keyevent KEYCODE_HOME',
+                 'start_time=$(%s)' % LOGCAT_DATE_COMMAND,
+                 'echo "launch_start_time ${start_time}"',
+                 'am start -W -n %s' % component,
+                 'logcat -d -v time%s -s %s' % (time_filter, ' '.join(
+                     ['%s:I' % tag for tag in LOGCAT_DISPLAYED_TAGS])))),
+      'Unable to launch %s' % component)
+  if 'Error:' in out:
+    raise CommandFailedError(
+        'Unable to launch %s (device=%s)%s%s' % (component, str(adb_device),
+                                                 os.linesep, out), 1)
+  m = LAUNCH_START_TIME_RE.search(out)
+  return parse_launch_output(out, component,
+                             start_time=m.group('time') if m else None)
+
+
+def run_launch_benchmark(adb_device, package_name, activity_name, iterations,
+                         modes, delay):
+  """Repeatedly launch an activity measuring the launch time.
+
+  Args:
+    adb_device: The device to launch the activity on.
+    package_name: Name of the package containing the activity.
+    activity_name: Name of the activity to launch.
+    iterations: Number of times to launch the activity in each mode.
+    modes: List of launch modes, 'cold' and / or 'warm'.
+    delay: Time in seconds to wait after each launch.
+
+  Returns:
+    Dictionary of lists of launch times (see parse_launch_output()) indexed
+    by launch mode.
+
+  Raises:
+    CommandFailedError: If the activity can't be launched.
+  """
+  results = {}
+  for mode in modes:
+    cold = mode == 'cold'
+    if not cold:
+      # Make sure the application is running before measuring warm starts.
+      measure_launch(adb_device, package_name, activity_name, False)
+      time.sleep(delay)
+    results[mode] = []
+    for iteration in range(iterations):
+      times = measure_launch(adb_device, package_name, activity_name, cold)
+      results[mode].append(times)
+      print >> sys.stderr, '%s %s launch %d/%d: %s' % (
+          str(adb_device), mode, iteration + 1, iterations,
+          ', '.join(['%s %sms' % (label, str(times[name]))
+                     for name, label in LAUNCH_TIMES
+                     if times[name] is not None]))
+      time.sleep(delay)
+  return results
+
+
+def get_launch_time(times):
+  """Get the time used to rank launches.
+
+  Args:
+    times: Dictionary of launch times, see parse_launch_output().
+
+  Returns:
+    The most complete launch time reported by the device in milliseconds.
+  """
+  for name in ('total_time', 'displayed', 'this_time', 'wait_time'):
+    if times.get(name) is not None:
+      return times[name]
+  return 0
+
+
+def profile_warm_launches(adb_device, package_name, activity_name,
+                          iterations, delay, output_directory, symbol_cache,
+                          verbose):
+  """Record perf traces of warm launches keeping the slowest trace.
+
+  The profiled launches are in addition to the launches measured by
+  run_launch_benchmark() since profiling increases the launch time.  perf
+  can only attach to a running process so each profiled launch is a warm
+  launch.  The slowest profiled launch is likely, but not guaranteed, to
+  exhibit the same behavior as the slowest benchmarked launch.
+
+  Args:
+    adb_device: The device to launch the activity on.
+    package_name: Name of the package containing the activity.
+    activity_name: Name of the activity to launch.
+    iterations: Number of launches to profile.
+    delay: Time in seconds to wait after each launch.
+    output_directory: Directory to write the trace of the slowest profiled
+      launch to.
+    symbol_cache: SymbolCache instance passed to run_perf_remotely().
+    verbose: Whether verbose output is enabled.
+
+  Returns:
+    (times, output_filename) tuple where times is the dictionary of
+    launch times (see parse_launch_output()) of the slowest profiled launch
+    and output_filename is the trace of the launch.
+
+  Raises:
+    CommandFailedError: If the activity can't be launched.
+    Error: If profiling fails.
+  """
+  slowest_times = None
+  slowest_directory = os.path.join(output_directory, 'slowest')
+  check_device(adb_device, PerfArgs(['record'], verbose))
+  measure_launch(adb_device, package_name, activity_name, False)
+  time.sleep(delay)
+  for iteration in range(iterations):
+    launch_directory = os.path.join(output_directory, 'launch%d' % iteration)
+    thread = DeviceProfileThread(
+        adb_device, package_name, activity_name,
+        PerfArgs(['record', '-o', os.path.join(launch_directory,
+                                               'perf.data')], verbose),
+        call_graph_recording=True, timestamp_recording=True,
+        start_application=False, kill_application_on_stop=False,
+        record_time=0, symbol_cache=symbol_cache,
+        start_event=threading.Event(), stop_event=threading.Event())
+    adb_device.shell_command('input keyevent KEYCODE_HOME',
+                             'Unable to move %s to the background' % (
+                                 package_name))
+    thread.start()
+    while not thread.ready_event.is_set():
+      thread.ready_event.wait(0.1)
+    thread.kwargs['start_event'].set()
+    # Wait for perf to attach to the process.
+    time.sleep(1)
+    try:
+      times = measure_launch(adb_device, package_name, activity_name, False)
+    finally:
+      thread.kwargs['stop_event'].set()
+      while thread.is_alive():
+        thread.join(0.1)
+    if thread.error:
+      raise thread.error
+    print >> sys.stderr, 'Profiled warm launch %d/%d: %dms' % (
+        iteration + 1, iterations, get_launch_time(times))
+    if (slowest_times is None or
+        get_launch_time(times) > get_launch_time(slowest_times)):
+      slowest_times = times
+      if os.path.exists(slowest_directory):
+        shutil.rmtree(slowest_directory)
+      os.rename(launch_directory, slowest_directory)
+    else:
+      shutil.rmtree(launch_directory)
+    time.sleep(delay)
+  return (slowest_times, os.path.join(slowest_directory, 'perf.data'))
+
+
+def report_launch_benchmark(results, output_filename):
+  """Display and write statistics of launch times.
+
+  Args:
+    results: Dictionary of launch results indexed by device serial number
+      where each launch result is a dictionary returned by
+      run_launch_benchmark().
+    output_filename: JSON file to write launch times and statistics to.
+  """
+  row_format = '%-16s %-5s %-10s %8s %8s %8s %8s %8s'
+  lines = [row_format % ('Device', 'Mode', 'Time (ms)', 'Min', 'Median',
+                         'P90', 'Mean', 'StdDev')]
+  report = {}
+  for serial, device_results in sorted(results.items()):
+    report[serial] = {}
+    for mode, launches in sorted(device_results.items()):
+      statistics = {}
+      for name, label in LAUNCH_TIMES:
+        values = [t[name] for t in launches if t[name] is not None]
+        if not values:
+          continue
+        statistics[name] = calculate_statistics(values)
+        lines.append(row_format % (
+            serial, mode, label, '%d' % statistics[name]['min'],
+            '%.1f' % statistics[name]['median'],
+            '%.1f' % statistics[name]['p90'],
+            '%.1f' % statistics[name]['mean'],
+            '%.1f' % statistics[name]['stddev']))
+      report[serial][mode] = {'launches': launches,
+                              'statistics': statistics}
+  output_directory = os.path.dirname(output_filename)
+  if output_directory and not os.path.exists(output_directory):
+    os.makedirs(output_directory)
+  with open(output_filename, 'w') as f:
+    json.dump(report, f, indent=2, sort_keys=True)
+  lines.append('Launch times written to %s' % output_filename)
+  print os.linesep.join(lines)
+
+
+def calculate_confidence_interval(statistics):
+  """Calculate the 95% confidence interval of the mean of a set of values.
+
+  Args:
+    statistics: Dictionary returned by calculate_statistics().
+
+  Returns:
+    Half-width of the confidence interval of the mean, 0.0 if there are
+    less than two values.
+  """
+  count = statistics.get('count', 0)
+  if count < 2:
+    return 0.0
+  degrees_of_freedom = count - 1
+  critical_value = (T_DISTRIBUTION_95[degrees_of_freedom - 1]
+                    if degrees_of_freedom <= len(T_DISTRIBUTION_95) else 1.96)
+  return critical_value * statistics['stddev'] / (count ** 0.5)
+
+
+def calculate_function_costs(samples):
+  """Calculate the cost of each function in a set of samples.
+
+  Args:
+    samples: List of PerfRecordSample instances.
+
+  Returns:
+    Dictionary of (self, inclusive) tuples indexed by function name (symbol
+    and object) where self is the percentage of the total sample period
+    where the function was at the top of the stack and inclusive is the
+    percentage of the total sample period where the function was on the
+    stack.
+  """
+  self_periods = {}
+  inclusive_periods = {}
+  total_period = 0.0
+  for sample in samples:
+    total_period += sample.period
+    names = ['%s %s' % (entry.symbol, entry.dso) for entry in sample.stack]
+    if names:
+      self_periods[names[0]] = self_periods.get(names[0], 0) + sample.period
+    # Recursive functions only contribute to their inclusive cost once.
+    for name in set(names):
+      inclusive_periods[name] = (inclusive_periods.get(name, 0) +
+                                 sample.period)
+  if not total_period:
+    return {}
+  return dict([(name, (self_periods.get(name, 0) * 100.0 / total_period,
+                       inclusive_period * 100.0 / total_period))
+               for name, inclusive_period in inclusive_periods.iteritems()])
+
+
+def aggregate_function_costs(costs_by_run):
+  """Calculate statistics of function costs across multiple runs.
+
+  Args:
+    costs_by_run: List of dictionaries returned by calculate_function_costs(),
+      one for each run.  A function which isn't sampled in a run has a cost
+      of 0 for the run.
+
+  Returns:
+    Dictionary indexed by function name where each value is a dictionary
+    containing 'self' and 'inclusive' dictionaries returned by
+    calculate_statistics() extended with 'ci95' the half-width of the 95%
+    confidence interval of the mean.
+  """
+  names = set()
+  for costs in costs_by_run:
+    names.update(costs.keys())
+  aggregate = {}
+  for name in names:
+    aggregate[name] = {}
+    for index, cost_type in enumerate(('self', 'inclusive')):
+      statistics = calculate_statistics(
+          [costs.get(name, (0.0, 0.0))[index] for costs in costs_by_run])
+      statistics['ci95'] = calculate_confidence_interval(statistics)
+      aggregate[name][cost_type] = statistics
+  return aggregate
+
+
+def calculate_sample_time_weights(samples):
+  """Calculate the time represented by each sample.
+
+  Samples of clock events (see PERF_CLOCK_EVENTS) record the nanoseconds of
+  CPU time they represent in their period.  Otherwise the time represented
+  by a sample is the delta to the next sample of the same thread, since
+  samples of other threads (possibly on other CPUs) are interleaved in the
+  trace.  The last sample of each thread uses the thread's previous delta.
+  Deltas which exceed PERF_MAX_SAMPLE_GAP sampling intervals (the median
+  delta) are assumed to span time the thread wasn't running so they're
+  clamped to the sampling interval.
+
+  Args:
+    samples: List of PerfRecordSample instances in the order they were
+      recorded.
+
+  Returns:
+    List of times in seconds, one for each sample.
+  """
+  if samples and all([s.event.split(':')[0].strip() in PERF_CLOCK_EVENTS and
+                      isinstance(s.period, (int, long)) and s.period > 1
+                      for s in samples]):
+    return [s.period / 1000000000.0 for s in samples]
+
+  delta_times = [None] * len(samples)
+  previous_index_by_thread = {}
+  for index, sample in enumerate(samples):
+    previous_index = previous_index_by_thread.get(sample.tid)
+    if previous_index is not None:
+      delta_times[previous_index] = max(
+          0.0, sample.time - samples[previous_index].time)
+    previous_index_by_thread[sample.tid] = index
+  measured = [d for d in delta_times if d is not None]
+  interval = calculate_statistics(measured)['median'] if measured else 0.0
+  max_delta = interval * PERF_MAX_SAMPLE_GAP
+  last_delta_by_thread = {}
+  for index, sample in enumerate(samples):
+    delta_time = delta_times[index]
+    if delta_time is None:
+      delta_time = last_delta_by_thread.get(sample.tid, interval)
+    elif delta_time > max_delta:
+      delta_time = interval
+    delta_times[index] = delta_time
+    last_delta_by_thread[sample.tid] = delta_time
+  return delta_times
+
+
+def calculate_function_time_cycles(samples, timeline):
+  """Calculate the wall time and estimated cycles spent in each function.
+
+  The cycles of each sample are estimated from the time the sample
+  represents and the frequency of the CPU at the time the sample was taken.
+  If the trace doesn't identify the CPU that was sampled, the mean frequency
+  of all CPUs is used.
+
+  Args:
+    samples: List of PerfRecordSample instances in the order they were
+      recorded.
+    timeline: CpuFreqTimeline used to determine the CPU frequency of each
+      sample or None if frequencies are not available.
+
+  Returns:
+    Dictionary indexed by function name (symbol and object) where each value
+    is a dictionary containing 'self_time' and 'inclusive_time' in seconds
+    and 'self_cycles' and 'inclusive_cycles', the estimated number of CPU
+    cycles where the function was at the top of the stack and anywhere on
+    the stack respectively.  Cycles are 0 if the frequency is unknown.
+  """
+  costs = {}
+  for sample, time_weight in zip(samples,
+                                 calculate_sample_time_weights(samples)):
+    frequency = (timeline.frequency_at(sample.time, cpu=sample.cpu)
+                 if timeline else 0)
+    cycles = time_weight * frequency * 1000
+    names = ['%s %s' % (entry.symbol, entry.dso) for entry in sample.stack]
+    for index, name in enumerate(names):
+      cost = costs.setdefault(name, {'self_time': 0.0, 'inclusive_time': 0.0,
+                                     'self_cycles': 0.0,
+                                     'inclusive_cycles': 0.0})
+      if index == 0:
+        cost['self_time'] += time_weight
+        cost['self_cycles'] += cycles
+      # Recursive functions only contribute to their inclusive cost once.
+      if name not in names[:index]:
+        cost['inclusive_time'] += time_weight
+        cost['inclusive_cycles'] += cycles
+  return costs
+
+
+def report_function_time_cycles(costs, report_filename, max_functions=20):
+  """Display and write the wall time and estimated cycles of each function.
+
+  Args:
+    costs: Dictionary returned by calculate_function_time_cycles().
+    report_filename: JSON file to write the costs to.
+    max_functions: Maximum number of functions to display, ordered by
+      inclusive time.
+  """
+  with open(report_filename, 'w') as f:
+    json.dump(costs, f, indent=2, sort_keys=True)
+  row_format = '%12s %12s %12s %12s  %s'
+  lines = ['', row_format % ('Self (ms)', 'Incl. (ms)', 'Self (Mcyc)',
+                             'Incl. (Mcyc)', 'Function')]
+  for name, cost in sorted(costs.items(),
+                           key=lambda item: item[1]['inclusive_time'],
+                           reverse=True)[:max_functions]:
+    lines.append(row_format % (
+        '%.2f' % (cost['self_time'] * 1000),
+        '%.2f' % (cost['inclusive_time'] * 1000),
+        '%.2f' % (cost['self_cycles'] / 1000000),
+        '%.2f' % (cost['inclusive_cycles'] / 1000000), name))
+  lines.append('Function costs written to %s' % report_filename)
+  print os.linesep.join(lines)
+
+
+def get_run_output_filename(output_filename, run):
+  """Get the name of a file written by one of multiple runs.
+
+  Args:
+    output_filename: Output filename specified on the command line.
+    run: Index of the run.
+
+  Returns:
+    output_filename moved into a subdirectory named after the run.
+  """
+  return os.path.join(os.path.dirname(output_filename), 'run_%d' % run,
+                      os.path.basename(output_filename))
+
+
+def report_aggregate_runs(perf_host, run_filenames, aggregate_filename,
+                          verbose, max_functions=20):
+  """Display and write statistics of function costs across multiple traces.
+
+  Args:
+    perf_host: Path of the host perf binary.
+    run_filenames: Traces recorded by each run.
+    aggregate_filename: JSON file to write the statistics to.
+    verbose: Whether to display all shell commands executed by this function.
+    max_functions: Maximum number of functions to display, ordered by mean
+      inclusive cost.
+
+  Raises:
+    CommandFailedError: If a trace can't be read.
+  """
+  costs_by_run = []
+  cycles_by_run = []
+  for run_filename in run_filenames:
+    samples = read_perf_script_dump(
+        perf_host, run_filename, os.path.dirname(run_filename),
+        'Unable to read %s' % run_filename, verbose)
+    costs_by_run.append(calculate_function_costs(samples))
+    cycles_by_run.append(calculate_function_time_cycles(
+        samples, CpuFreqTimeline.load(os.path.dirname(run_filename))))
+  aggregate = aggregate_function_costs(costs_by_run)
+  # Estimated cycles are comparable across runs where the CPU frequency
+  # differs (e.g due to thermal throttling).
+  for name, statistics in aggregate.iteritems():
+    for cost_type in ('inclusive_time', 'inclusive_cycles'):
+      statistics[cost_type] = calculate_statistics(
+          [cycles.get(name, {}).get(cost_type, 0.0)
+           for cycles in cycles_by_run])
+      statistics[cost_type]['ci95'] = calculate_confidence_interval(
+          statistics[cost_type])
+  with open(aggregate_filename, 'w') as f:
+    json.dump({'runs': run_filenames, 'functions': aggregate}, f, indent=2,
+              sort_keys=True)
+
+  row_format = '%16s %16s %8s %10s %12s  %s'
+  lines = ['', 'Function cost (%% of samples) across %d runs, mean +/- 95%% '
+           'confidence interval' % len(run_filenames),
+           row_format % ('Self', 'Inclusive', 'StdDev', 'Incl. (ms)',
+                         'Incl. (Mcyc)', 'Function')]
+  for name, statistics in sorted(
+      aggregate.items(), key=lambda item: item[1]['inclusive']['mean'],
+      reverse=True)[:max_functions]:
+    lines.append(row_format % (
+        '%.2f +/- %.2f' % (statistics['self']['mean'],
+                           statistics['self']['ci95']),
+        '%.2f +/- %.2f' % (statistics['inclusive']['mean'],
+                           statistics['inclusive']['ci95']),
+        '%.2f' % statistics['inclusive']['stddev'],
+        '%.2f' % (statistics['inclusive_time']['mean'] * 1000),
+        '%.2f' % (statistics['inclusive_cycles']['mean'] / 1000000), name))
+  lines.append('Statistics written to %s' % aggregate_filename)
+  print os.linesep.join(lines)
+
+
+class PerfScriptDumpParser(object):
+  """Parses the output of "perf script -D" a line at a time.
+
+  The dump of a trace is many times larger than the samples parsed from it
+  so lines can be passed to parse_line() as they're read from perf rather
+  than retaining the whole dump in memory.
+
+  Attributes:
+    samples: List of PerfRecordSample instances parsed so far.
+  """
+
+  def __init__(self):
+    """Initialize the instance."""
+    self.samples = []
+    self._sample_data = None
+    self._sample = None
+
+  def parse_line(self, line):
+    """Parse a line of the dump.
+
+    Args:
+      line: Line to parse, with or without a trailing newline.
+    """
+    line = line.rstrip('\r\n')
     # End of the stack trace?
     if not line:
-      if sample:
-        if not sample.stack:
+      if self._sample:
+        if not self._sample.stack:
           # PERF_TO_TRACING requires a stack trace for each event so
           # mark all events without a stack trace as "idle" at the end of
           # 32-bit address space, since it's likely the sample simply
           # captured the perf interrupt handler.
-          sample.stack.append(PerfIp(0xffffffff, '[idle]', '([idle])'))
-        samples.append(sample)
-        sample = None
-        sample_data = None
+          self._sample.stack.append(PerfIp(0xffffffff, '[idle]', '([idle])'))
+        self.samples.append(self._sample)
+        self._sample = None
+        self._sample_data = None
 
     # Aggregating stack for sample.
-    elif sample:
+    elif self._sample:
       # This is a stack trace.
       m = PERF_REPORT_STACK_RE.match(line)
       if m:
         groups = m.groupdict()
         symbol = groups['symbol']
         dso = groups['dso']
-        sample.stack.append(PerfIp(
+        self._sample.stack.append(PerfIp(
             int(groups['ip'], 16),
             symbol if symbol.strip() else '[unknown]',
             '([unknown])' if dso == '()' else dso))
 
     # If a sample is being parsed, merge the report line and create a sample.
-    elif sample_data:
+    elif self._sample_data:
       m = PERF_DUMP_EVENT_SAMPLE_REPORT_RE.match(line)
       if m:
+        sample_data = self._sample_data
         sample_data.update(m.groupdict())
-        sample = PerfRecordSample(
+        self._sample = PerfRecordSample(
             int(sample_data['file_offset'][2:], 16),
             sample_data['perf_event_type'],
             int(sample_data['pid']),
@@ -2114,37 +3876,103 @@ def process_perf_script_dump(dump_output, progress_display_max_value):
             int(sample_data['period']),
             sample_data['comm'],
             float(sample_data['time']),
-            sample_data['event'])
+            sample_data['event'],
+            (int(sample_data['cpu']) if sample_data['cpu'] is not None
+             else None))
 
     # Searching the start of a new sample.
     else:
       m = PERF_DUMP_EVENT_SAMPLE_RE.match(line)
       if m:
-        sample_data = m.groupdict()
-
-  # If period is 1 across all samples, derive the sample period from the time
-  # delta between samples.
-  if samples and sum([s.period for s in samples]) == len(samples):
-    delta_times = [samples[i].time - samples[i - 1].time
-                   for i in range(1, len(samples))]
-    # There is no delta for the last sample so duplicate the previous sample
-    # period, assuming a fixed sampling frequency.
-    delta_times.append(delta_times[-1])
-    # Fix up sampling periods.
-    for sample, delta_time in zip(samples, delta_times):
-      sample.period = delta_time
-  return samples
+        self._sample_data = m.groupdict()
 
+  def finish(self):
+    """Complete parsing the dump.
 
-def process_perf_script_dump_for_json_generator(dump_output):
-  """Parse perf script -D output and generate report for PERF_TO_TRACING.
+    Returns:
+      List of PerfRecordSample instances, one per recorded sample.  If
+      samples were recorded at a fixed frequency PerfRecordSample.period is
+      fixed up for each sample with the time delta between each sample in
+      the trace.
+    """
+    # Complete the sample being parsed if the dump isn't terminated by an
+    # empty line.
+    self.parse_line('')
+    samples = self.samples
+    # If period is 1 across all samples, derive the sample period from the
+    # time delta between samples.
+    if len(samples) > 1 and sum([s.period for s in samples]) == len(samples):
+      delta_times = [samples[i].time - samples[i - 1].time
+                     for i in range(1, len(samples))]
+      # There is no delta for the last sample so duplicate the previous
+      # sample period, assuming a fixed sampling frequency.
+      delta_times.append(delta_times[-1])
+      # Fix up sampling periods.
+      for sample, delta_time in zip(samples, delta_times):
+        sample.period = delta_time
+    return samples
+
+
+def process_perf_script_dump(dump_output, progress_display_max_value):
+  """Parse perf script -D output and generate a data structure with the output.
+
+  Args:
+    dump_output: Output of the perf script -D command to parse.
+    progress_display_max_value: Maximum value to display in the
+      progress display.
+
+  Returns:
+    List of PerfRecordSample instances, see PerfScriptDumpParser.finish().
+  """
+  parser = PerfScriptDumpParser()
+  progress_display = ProgressDisplay()
+  lines = dump_output.splitlines()
+  num_lines = len(lines)
+  for line_number, line in enumerate(lines):
+    # This could take a while, so display the progress.
+    progress_display.update((float(line_number + 1) / num_lines) *
+                            progress_display_max_value)
+    parser.parse_line(line)
+  return parser.finish()
+
+
+def read_perf_script_dump(perf_host, trace, symfs, error, verbose):
+  """Read the samples of a trace using perf script -D.
+
+  The output of perf is parsed as it's read rather than retained in memory.
 
-  This script add fields required by PERF_TO_TRACING that are not supported by
+  Args:
+    perf_host: Path of the host perf binary.
+    trace: Trace to read.
+    symfs: Directory containing objects referenced by the trace.
+    error: The message to print if perf fails.
+    verbose: Whether to display all shell commands executed by this function.
+
+  Returns:
+    List of PerfRecordSample instances, see PerfScriptDumpParser.finish().
+
+  Raises:
+    CommandFailedError: If perf fails to read the trace.
+  """
+  parser = PerfScriptDumpParser()
+  execute_command(
+      perf_host, PerfArgs(['script', '-D', '-i', trace, '--symfs', symfs],
+                          verbose).args,
+      error, verbose=verbose, stdout_callback=parser.parse_line)
+  return parser.finish()
+
+
+def format_samples_for_json_generator(samples, progress_display_min_value=0.0):
+  """Generate a report for PERF_TO_TRACING from perf samples.
+
+  This adds fields required by PERF_TO_TRACING that are not supported by
   the Android version of perf (API level 16-19) in addition to delimiting
   fields with tabs.
 
   Args:
-    dump_output: Output of the perf script -D command to parse.
+    samples: List of PerfRecordSample instances.
+    progress_display_min_value: Minimum value to display in the progress
+      display.
 
   Returns:
     A string containg a report similar to
@@ -2152,11 +3980,13 @@ def process_perf_script_dump_for_json_generator(dump_output):
     in a form that can be parsed by PERF_TO_TRACING.
   """
   output_lines = []
-  progress_display = ProgressDisplay()
-  samples = process_perf_script_dump(dump_output, 0.5)
+  progress_display = ProgressDisplay(
+      previous_progress=progress_display_min_value)
   num_samples = len(samples)
+  progress_range = 1.0 - progress_display_min_value
   for i, sample in enumerate(samples):
-    progress_display.update(((float(i + 1) / num_samples) * 0.5) + 0.5)
+    progress_display.update(((float(i + 1) / num_samples) * progress_range) +
+                            progress_display_min_value)
     output_lines.append(
         '\t'.join([sample.command, str(sample.tid),
                    '[000]',  # cpu requires root on Android.
@@ -2173,8 +4003,82 @@ def process_perf_script_dump_for_json_generator(dump_output):
   return os.linesep.join(output_lines)
 
 
+def process_perf_script_dump_for_json_generator(dump_output):
+  """Parse perf script -D output and generate report for PERF_TO_TRACING.
+
+  Args:
+    dump_output: Output of the perf script -D command to parse.
+
+  Returns:
+    String in the form returned by format_samples_for_json_generator().
+  """
+  return format_samples_for_json_generator(
+      process_perf_script_dump(dump_output, 0.5), 0.5)
+
+
+def convert_perf_trace(perf_host, input_filename, symfs, verbose):
+  """Convert a trace to the format read by PERF_TO_TRACING.
+
+  Args:
+    perf_host: Path of the host perf binary.
+    input_filename: Trace to convert.
+    symfs: Directory containing objects referenced by the trace.
+    verbose: Whether to display all shell commands executed by this function.
+
+  Returns:
+    String in the form returned by format_samples_for_json_generator().
+
+  Raises:
+    CommandFailedError: If perf fails to read the trace.
+  """
+  # Dump the entire trace as ASCII so that we can accesss the period field.
+  return format_samples_for_json_generator(read_perf_script_dump(
+      perf_host, input_filename, symfs,
+      'Cannot visualize perf data.  Try specifying input data using -i.',
+      verbose))
+
+
+def convert_perf_chunks(perf_host, chunk_directory, symfs, verbose):
+  """Convert chunks of a trace to the format read by PERF_TO_TRACING.
+
+  The conversion of each chunk is cached alongside the chunk so that
+  chunks of a trace which is still being recorded are only converted once.
+
+  Args:
+    perf_host: Path of the host perf binary.
+    chunk_directory: Directory containing chunks of a trace, see
+      get_perf_chunk_directory().
+    symfs: Directory containing objects referenced by the trace.
+    verbose: Whether to display all shell commands executed by this function.
+
+  Returns:
+    String in the form returned by format_samples_for_json_generator()
+    containing samples from all chunks in the order they were recorded.
+
+  Raises:
+    CommandFailedError: If perf fails to read a chunk.
+    Error: If the directory does not contain any chunks.
+  """
+  chunks = get_perf_chunks(chunk_directory)
+  if not chunks:
+    raise Error('No trace chunks found in %s' % chunk_directory)
+  converted_chunks = []
+  for chunk in chunks:
+    script_filename = chunk + PERF_CHUNK_SCRIPT_EXTENSION
+    if (os.path.exists(script_filename) and
+        os.path.getmtime(script_filename) >= os.path.getmtime(chunk)):
+      with open(script_filename) as f:
+        converted_chunks.append(f.read())
+    else:
+      converted_chunks.append(convert_perf_trace(perf_host, chunk, symfs,
+                                                 verbose))
+      with open(script_filename, 'w') as f:
+        f.write(converted_chunks[-1])
+  return os.linesep.join(converted_chunks)
+
+
 def run_perf_visualizer(browser, perf_args, adb_device, output_filename,
-                        frames, verbose):
+                        frames, verbose, function_report=''):
   """Generate the visualized html.
 
   Args:
@@ -2186,6 +4090,8 @@ def run_perf_visualizer(browser, perf_args, adb_device, output_filename,
     output_filename: Name of the report file to write to.
     frames: Number of application specific "frames" in the perf trace.
     verbose: Whether to display all shell commands executed by this function.
+    function_report: If this is a non-zero length string, the wall time and
+      estimated CPU cycles of each function are written to this JSON file.
 
   Raises:
     Error: If an error occurs.
@@ -2195,27 +4101,35 @@ def run_perf_visualizer(browser, perf_args, adb_device, output_filename,
   perf_to_tracing = find_host_binary(PERF_TO_TRACING)
   perf_vis = find_host_binary(PERF_VIS)
 
-  # Dump the entire trace as ASCII so that we can accesss the period field.
+  input_filename = perf_args.get_input_filename()
   symfs_index = perf_args.parse_value_option(['--symfs'])
-  perf_script_args_list = [
-      'script', '-D', '-i', perf_args.get_input_filename(),
-      '--symfs', (perf_args.args[symfs_index] if symfs_index >= 0 else
-                  os.path.dirname(perf_args.get_input_filename()))]
-  perf_script_args = PerfArgs(perf_script_args_list, verbose)
-  out, _, _ = execute_command(perf_host, perf_script_args.args,
-                              'Cannot visualize perf data.  '
-                              'Try specifying input data using -i.',
-                              verbose=verbose)
+  symfs = (perf_args.args[symfs_index] if symfs_index >= 0 else
+           os.path.dirname(input_filename))
   script_output = tempfile.NamedTemporaryFile()
-  script_output.write(process_perf_script_dump_for_json_generator(out))
+  if os.path.isdir(input_filename):
+    script_output.write(convert_perf_chunks(perf_host, input_filename, symfs,
+                                            verbose))
+  else:
+    script_output.write(convert_perf_trace(perf_host, input_filename, symfs,
+                                           verbose))
   script_output.flush()
 
+  if function_report:
+    samples = []
+    for trace in (get_perf_chunks(input_filename)
+                  if os.path.isdir(input_filename) else [input_filename]):
+      samples.extend(read_perf_script_dump(
+          perf_host, trace, symfs, 'Unable to read %s' % trace, verbose))
+    report_function_time_cycles(
+        calculate_function_time_cycles(samples, CpuFreqTimeline.load(
+            os.path.dirname(os.path.normpath(input_filename)))),
+        function_report)
+
   # Generate a common json format from the outputted sample data.
-  out, _, _ = execute_command(perf_to_tracing, [script_output.name],
-                              'Unable to convert perf script output to JSON.',
-                              verbose=verbose)
   json_output = tempfile.NamedTemporaryFile()
-  json_output.write(out)
+  execute_command(perf_to_tracing, [script_output.name],
+                  'Unable to convert perf script output to JSON.',
+                  verbose=verbose, stdout_callback=json_output.write)
   json_output.flush()
 
   # Generate the html file from the json data.
@@ -2313,10 +4227,19 @@ def main():
   parser = argparse.ArgumentParser(
       description=re.sub(r'^@file [^ ]* ', '', __doc__),
       formatter_class=argparse.RawDescriptionHelpFormatter, add_help=False)
-  parser.add_argument('--adb-device',
+  parser.add_argument('--adb-device', action='append',
                       help=('The serial_number of the device to profile if '
                             'multiple Android devices are connected to the '
-                            'host.'))
+                            'host.  This option can be specified multiple '
+                            'times (or with a comma separated list of '
+                            'serial numbers) to profile multiple devices '
+                            'concurrently, in which case the output of each '
+                            'device is written to a subdirectory named '
+                            'after the device\'s serial number.'))
+  parser.add_argument('--all-devices',
+                      help=('Profile all devices connected to the host '
+                            'concurrently.  See --adb-device.'),
+                      action='store_true', default=False)
   parser.add_argument('--manifest-directory',
                       help=('Directory containing the manifest of the '
                             'application to profile.'))
@@ -2343,8 +4266,8 @@ def main():
                             'for each recorded event so the trace can be '
                             'visualized with timing information.  Use this '
                             'option to disable timestamp recording '
-                            '(effectively removing -T from the "perf record"'
-                            ' command line.'),
+                            '(effectively removing -T and -R from the "perf '
+                            'record" command line.'),
                       action='store_true', default=False)
   parser.add_argument('--no-launch-on-start',
                       help=('By default the application being profiled will '
@@ -2360,6 +4283,59 @@ def main():
                       help=('Amount of time (in seconds) to profile an '
                             'application when using a record command.'),
                       default=0)
+  parser.add_argument('--cpufreq-sample-interval',
+                      help=('Interval (in seconds) between samples of each '
+                            'CPU\'s frequency taken while recording.  '
+                            'Samples are written to %s alongside the trace '
+                            'so that perf samples can be weighted by the '
+                            'CPU frequency at the time they were taken.  '
+                            'If this is 0 CPU frequencies are not sampled.' %
+                            CPUFREQ_TIMELINE_JSON),
+                      default=0)
+  parser.add_argument('--runs',
+                      help=('Number of times to record the application.  '
+                            'Each run writes its trace to a run_N '
+                            'subdirectory of the output directory and '
+                            'statistics of the cost of each function across '
+                            'runs are written to %s in the output '
+                            'directory.' % AGGREGATE_JSON),
+                      default=1)
+  parser.add_argument('--chunk-time',
+                      help=('Record the trace as a sequence of chunks of the '
+                            'specified length (in seconds).  Each chunk is '
+                            'copied from the device to the directory '
+                            'OUTPUT%s and removed from the device while '
+                            'recording continues.  The visualize command '
+                            'accepts the directory of chunks as input.' %
+                            PERF_CHUNK_DIRECTORY_SUFFIX),
+                      default=0)
+  parser.add_argument('--max-chunks',
+                      help=('Maximum number of chunks to retain on the host '
+                            'when using --chunk-time, the oldest chunks are '
+                            'deleted when this is exceeded.  0 retains all '
+                            'chunks.'),
+                      default=0)
+  parser.add_argument('--no-compress-pull',
+                      help=('By default traces are compressed on the device '
+                            'before they\'re copied to the host.  This '
+                            'option disables compression.'),
+                      action='store_true', default=False)
+  parser.add_argument('--symbol-cache-directory',
+                      help=('Directory used to store libraries pulled from '
+                            'devices indexed by build ID so that they are '
+                            'not pulled again by subsequent captures.  '
+                            'Defaults to %s' % SYMBOL_CACHE_DIRECTORY),
+                      default=SYMBOL_CACHE_DIRECTORY)
+  parser.add_argument('--adb-property-cache-ttl',
+                      help=('Time in seconds to cache device properties on '
+                            'the host between invocations of this script.  '
+                            'Cached properties are discarded when a device '
+                            'reboots.  0 (the default) disables the cache.'),
+                      type=float, default=0)
+  parser.add_argument('--no-symbol-cache',
+                      help=('Disable the symbol cache, pulling all libraries '
+                            'referenced by a trace from the device.'),
+                      action='store_true', default=False)
 
   visualizer_parser = argparse.ArgumentParser(
       description=('visualize converts a perf trace to a HTML visualization '
@@ -2386,6 +4362,40 @@ def main():
   visualizer_parser.add_argument(
       '--no-browser', action='store_true', default=False,
       help=('Specify to disable opening the generated report in a browser.'))
+  visualizer_parser.add_argument(
+      '--function-report', default='',
+      help=('Write the wall time and estimated CPU cycles of each function to '
+            'the specified JSON file.  Cycles are estimated using the CPU '
+            'frequencies recorded with the trace (%s or %s).' % (
+                CPUFREQ_TIMELINE_JSON, CPUFREQ_JSON)))
+
+  launch_parser = argparse.ArgumentParser(
+      description=('launch measures the time taken to launch an application '
+                   'by repeatedly starting the application\'s activity.  '
+                   'Cold launches stop the application before each launch '
+                   'and warm launches move the running application to the '
+                   'background before each launch.'), add_help=False)
+  launch_parser.add_argument(
+      '-n', '--iterations', type=int, default=10,
+      help='Number of times to launch the application in each mode.')
+  launch_parser.add_argument(
+      '--mode', choices=('cold', 'warm', 'both'), default='both',
+      help='Type of launch to measure.')
+  launch_parser.add_argument(
+      '--delay', type=float, default=2.0,
+      help='Time in seconds to wait after each launch.')
+  launch_parser.add_argument(
+      '-o', '--output-directory', default='launch',
+      help=('Directory to write launch times (%s) and traces to.' %
+            LAUNCH_JSON))
+  launch_parser.add_argument(
+      '--profile-warm-launches', type=int, default=0, metavar='ITERATIONS',
+      help=('After measuring launch times, record a perf trace of '
+            'ITERATIONS additional warm launches and keep the trace of the '
+            'slowest of these launches.  The benchmarked launches are not '
+            'profiled and launch times measured while profiling are not '
+            'included in the statistics.'))
+
   args, perf_arg_list = parser.parse_known_args()
   verbose = args.verbose
 
@@ -2406,10 +4416,21 @@ def main():
   else:
     visualizer_args = []
 
+  serials = []
+  for serial_list in args.adb_device or []:
+    serials.extend([serial for serial in serial_list.split(',') if serial])
+
   try:
-    # Construct a class to communicate with the ADB device.
-    adb_device = Adb(args.adb_device, execute_command, verbose=verbose)
-  except Adb.Error, error:
+    if args.all_devices:
+      serials = Adb.get_connected_serials(execute_command, verbose=verbose)
+    # Construct a class to communicate with each ADB device.
+    adb_devices = [Adb(serial, execute_command, verbose=verbose)
+                   for serial in serials or [None]]
+    for adb_device in adb_devices:
+      adb_device.enable_property_cache(args.adb_property_cache_ttl)
+      adb_device.compress_pull = not args.no_compress_pull
+    adb_device = adb_devices[0]
+  except (Adb.Error, CommandFailedError), error:
     # If the perf command needs to be run on the device, report the error and
     # exit.
     if not perf_args.get_help_enabled() and perf_args.requires_remote():
@@ -2421,7 +4442,8 @@ def main():
 
   # If requested, display the help text and exit.
   if perf_args.get_help_enabled():
-    display_help(parser, {'visualize': visualizer_parser}, perf_args,
+    display_help(parser, {'visualize': visualizer_parser,
+                          'launch': launch_parser}, perf_args,
                  adb_device, verbose)
     return 1
 
@@ -2439,45 +4461,138 @@ def main():
     try:
       run_perf_visualizer('' if visualizer_args.no_browser else browser,
                           perf_args, adb_device, visualizer_args.output_file,
-                          visualizer_args.frames, verbose)
+                          visualizer_args.frames, verbose,
+                          function_report=visualizer_args.function_report)
     except CommandFailedError as error:
       print >> sys.stderr, str(error)
       return getattr(error, 'returncode', 1)
     return 0
 
+  # Run the launch benchmark.
+  if perf_args.command.name == 'launch':
+    launch_args, _ = launch_parser.parse_known_args(args=perf_args.args[1:])
+    modes = (('cold', 'warm') if launch_args.mode == 'both' else
+             (launch_args.mode,))
+    manifest = (os.path.join(args.manifest_directory, MANIFEST_NAME)
+                if args.manifest_directory else '')
+    results = {}
+    activities = {}
+    try:
+      for device in adb_devices:
+        activities[device] = get_package_activity_name(
+            device, args.apk, args.package_name, args.activity_name,
+            manifest)
+        package_name, activity_name = activities[device]
+        results[device.serial or str(device)] = run_launch_benchmark(
+            device, package_name, activity_name, launch_args.iterations,
+            modes, launch_args.delay)
+      report_launch_benchmark(results, os.path.join(
+          launch_args.output_directory, LAUNCH_JSON))
+      # Profile after measuring so that profiling doesn't skew launch times.
+      if launch_args.profile_warm_launches:
+        for device in adb_devices:
+          package_name, activity_name = activities[device]
+          _, trace = profile_warm_launches(
+              device, package_name, activity_name,
+              launch_args.profile_warm_launches, launch_args.delay,
+              os.path.join(launch_args.output_directory,
+                           device.serial or ''),
+              None if args.no_symbol_cache else
+              SymbolCache(args.symbol_cache_directory), verbose)
+          print >> sys.stderr, (
+              'Trace of the slowest profiled launch written to %s' % trace)
+    except (Error, CommandFailedError) as error:
+      print >> sys.stderr, str(error)
+      return getattr(error, 'returncode', 1)
+    return 0
+
   try:
     # Run perf remotely
     if perf_args.requires_remote():
-      # Check the device configuration.
-      android_version = adb_device.get_version()
-      if is_version_less_than(android_version, '4.1'):
-        print >> sys.stderr, PERF_BINARIES_NOT_SUPPORTED % {
-            'ver': android_version}
-      (model, name) = adb_device.get_model_and_name()
-      if name in BROKEN_DEVICES:
-        print >> sys.stderr, PERFORMANCE_COUNTERS_BROKEN % model
-      elif name not in SUPPORTED_DEVICES:
-        print >> sys.stderr, NOT_SUPPORTED_DEVICE % model
-      user, _, _ = adb_device.shell_command(r'echo ${USER}',
-                                            'Unable to get Android user name')
-      if perf_args.requires_root() and user != 'root':
-        print >> sys.stderr, DEVICE_NOT_ROOTED % perf_args.command.name
-
-      # Parse the package and activity name.
       if args.manifest_directory:
         manifest = os.path.join(args.manifest_directory, MANIFEST_NAME)
       else:
         manifest = ''
-      package_name, activity_name = get_package_activity_name(
-          adb_device, args.apk, args.package_name, args.activity_name,
-          manifest)
-
-      run_perf_remotely(adb_device, package_name, activity_name, perf_args,
-                        not args.no_record_call_graph,
-                        not args.no_record_timestamp,
-                        not args.no_launch_on_start,
-                        not args.no_kill_on_stop,
-                        float(args.record_time))
+      symbol_cache = (None if args.no_symbol_cache else
+                      SymbolCache(args.symbol_cache_directory))
+
+      if len(adb_devices) == 1:
+        # Check the device configuration.
+        check_device(adb_device, perf_args)
+        # Parse the package and activity name.
+        package_name, activity_name = get_package_activity_name(
+            adb_device, args.apk, args.package_name, args.activity_name,
+            manifest)
+
+        runs = int(args.runs)
+        output_filename = perf_args.get_output_filename()
+        run_filenames = []
+        for run in range(runs):
+          run_perf_args = perf_args
+          if runs > 1:
+            # Each run writes to its own output directory.
+            run_perf_args = PerfArgs(perf_arg_list, verbose)
+            if output_filename:
+              run_filenames.append(get_run_output_filename(output_filename,
+                                                           run))
+              run_perf_args.get_output_filename(run_filenames[-1])
+            print >> sys.stderr, 'Run %d/%d' % (run + 1, runs)
+          run_perf_remotely(adb_device, package_name, activity_name,
+                            run_perf_args,
+                            not args.no_record_call_graph,
+                            not args.no_record_timestamp,
+                            not args.no_launch_on_start,
+                            not args.no_kill_on_stop,
+                            float(args.record_time),
+                            symbol_cache=symbol_cache,
+                            cpufreq_sample_interval=float(
+                                args.cpufreq_sample_interval),
+                            chunk_time=float(args.chunk_time),
+                            max_chunks=int(args.max_chunks))
+        if (len(run_filenames) > 1 and
+            os.path.splitext(output_filename)[1] == '.data' and
+            not float(args.chunk_time)):
+          report_aggregate_runs(
+              find_host_binary(PERFHOST_BINARY, adb_device), run_filenames,
+              os.path.join(os.path.dirname(output_filename), AGGREGATE_JSON),
+              verbose)
+      elif int(args.runs) > 1:
+        print >> sys.stderr, '--runs is not supported with multiple devices.'
+        return 1
+      else:
+        device_threads = []
+        for device in adb_devices:
+          check_device(device, perf_args)
+          package_name, activity_name = get_package_activity_name(
+              device, args.apk, args.package_name, args.activity_name,
+              manifest)
+          # Each device writes to its own output directory.
+          device_perf_args = PerfArgs(perf_arg_list, verbose)
+          output_filename = device_perf_args.get_output_filename()
+          if output_filename:
+            device_perf_args.get_output_filename(get_device_output_filename(
+                output_filename, device.serial))
+          device_threads.append(DeviceProfileThread(
+              device, package_name, activity_name, device_perf_args,
+              call_graph_recording=not args.no_record_call_graph,
+              timestamp_recording=not args.no_record_timestamp,
+              start_application=not args.no_launch_on_start,
+              kill_application_on_stop=not args.no_kill_on_stop,
+              record_time=0, symbol_cache=symbol_cache,
+              cpufreq_sample_interval=float(args.cpufreq_sample_interval),
+              chunk_time=float(args.chunk_time),
+              max_chunks=int(args.max_chunks)))
+        profile_devices(device_threads, float(args.record_time))
+        output_filename = perf_args.get_output_filename()
+        if output_filename:
+          write_device_summary(device_threads, os.path.join(
+              os.path.dirname(output_filename), 'summary.json'))
+        errors = [t for t in device_threads if t.error]
+        for thread in errors:
+          print >> sys.stderr, '%s: %s' % (thread.adb_device.serial,
+                                           str(thread.error))
+        if errors:
+          return getattr(errors[0].error, 'returncode', 1) or 1
 
     # Run perf locally
     else:
@@ -0,0 +1,498 @@
+#!/usr/bin/python
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+import android_ndk_perf
+import buildutil.fake_adb as fake_adb
+import buildutil.runner as runner
+
+## @cond FPLUTIL_INTERNAL
+# Package installed on the simulated devices.
+_PACKAGE = 'com.example.app'
+# Activity of _PACKAGE.
+_ACTIVITY = '.Main'
+## @endcond FPLUTIL_INTERNAL
+
+
+class AndroidNdkPerfTest(unittest.TestCase):
+  """android_ndk_perf tests which run against simulated devices."""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.state = fake_adb.FakeAdbState(os.path.join(self.directory, 'adb'))
+    for serial in ('123456', '654321'):
+      self.state.add_device(serial, model='Nexus 7', name='razor')
+      self.state.add_package(serial, _PACKAGE, _ACTIVITY, launch_time_ms=100)
+    self.state.save()
+    self.adb_path = self.state.create_launcher()
+    self.pull_symbols = android_ndk_perf.pull_symbols
+    self.find_host_binary = android_ndk_perf.find_host_binary
+
+  def tearDown(self):
+    android_ndk_perf.pull_symbols = self.pull_symbols
+    android_ndk_perf.find_host_binary = self.find_host_binary
+    shutil.rmtree(self.directory)
+
+  def create_adb(self, serial='123456'):
+    """Create an Adb instance which uses the simulated adb.
+
+    Args:
+      serial: Serial number of the device to connect to.
+
+    Returns:
+      android_ndk_perf.Adb instance.
+    """
+    return android_ndk_perf.Adb(serial, android_ndk_perf.execute_command,
+                                adb_path=self.adb_path)
+
+  def get_commands(self, pattern):
+    """Get the commands issued to the simulated adb which contain a string.
+
+    Args:
+      pattern: String to search for in each command line.
+
+    Returns:
+      List of command lines.
+    """
+    return [c for c in [' '.join(c['args'])
+                        for c in self.state.get_command_log()]
+            if pattern in c]
+
+  def test_pull_chunks(self):
+    pulled_symbols = []
+    android_ndk_perf.pull_symbols = (
+        lambda unused_adb_device, perf_data, unused_output_directory,
+        unused_symbol_cache: pulled_symbols.append(os.path.basename(
+            perf_data)))
+    chunk_directory = os.path.join(self.directory, 'perf.data.chunks')
+    os.makedirs(chunk_directory)
+    puller = android_ndk_perf.PerfChunkPuller(
+        self.create_adb(), _PACKAGE, chunk_directory, self.directory,
+        max_chunks=1)
+    for index in range(2):
+      remote_chunk = '/data/data/%s/perf.data.%05d' % (_PACKAGE, index)
+      self.state.write_file('123456', remote_chunk, 'chunk%d' % index * 1000)
+      puller.queue.put((remote_chunk, os.path.join(
+          chunk_directory, '%05d.data' % index)))
+    puller.queue.put(None)
+    puller.run()
+    self.assertIsNone(puller.error)
+    self.assertEqual(['00000.data.tmp', '00001.data.tmp'], pulled_symbols)
+    # Only the most recent chunk is retained on the host.
+    self.assertEqual([os.path.join(chunk_directory, '00001.data')],
+                     android_ndk_perf.get_perf_chunks(chunk_directory))
+    with open(os.path.join(chunk_directory, '00001.data')) as f:
+      self.assertEqual('chunk1' * 1000, f.read())
+    # Chunks are compressed while they're pulled then removed from the
+    # device.
+    self.assertEqual(2, len(self.get_commands('gzip')))
+    self.assertEqual([], os.listdir(self.state.get_device_path(
+        '123456', '/data/data/%s' % _PACKAGE)))
+
+  def test_pull_chunks_error(self):
+    android_ndk_perf.pull_symbols = (
+        lambda unused_adb_device, unused_perf_data, unused_output_directory,
+        unused_symbol_cache: None)
+    chunk_directory = os.path.join(self.directory, 'perf.data.chunks')
+    os.makedirs(chunk_directory)
+    puller = android_ndk_perf.PerfChunkPuller(
+        self.create_adb(), _PACKAGE, chunk_directory, self.directory)
+    # The first chunk doesn't exist so it can't be pulled.
+    for index in range(3):
+      remote_chunk = '/data/data/%s/perf.data.%05d' % (_PACKAGE, index)
+      if index:
+        self.state.write_file('123456', remote_chunk, 'chunk')
+      puller.queue.put((remote_chunk, os.path.join(
+          chunk_directory, '%05d.data' % index)))
+    puller.queue.put(None)
+    puller.run()
+    self.assertIsInstance(puller.error, android_ndk_perf.CommandFailedError)
+    # Chunks after the error are not pulled but are removed from the device.
+    self.assertEqual([], os.listdir(chunk_directory))
+    self.assertEqual([], os.listdir(self.state.get_device_path(
+        '123456', '/data/data/%s' % _PACKAGE)))
+
+  def test_record_chunks_error(self):
+    adb_device = self.create_adb()
+    perf_remote = '/data/local/tmp/perf'
+    adb_device.push(android_ndk_perf.find_target_binary('perf', adb_device),
+                    perf_remote)
+    # Fail to pull all chunks.
+    self.state.add_response(r'^(exec-out|pull)', returncode=1)
+    self.state.save()
+    output_filename = os.path.join(self.directory, 'perf.data')
+    perf_args = android_ndk_perf.PerfArgs(['record', '-o', output_filename],
+                                          False)
+    recorder = android_ndk_perf.PerfChunkRecorder(
+        adb_device, _PACKAGE, perf_remote, perf_args,
+        '/data/data/%s/perf.data' % _PACKAGE, output_filename, 0.2)
+    recorder.start()
+    # Recording stops when a chunk can't be pulled.
+    recorder.join(30)
+    self.assertFalse(recorder.is_alive())
+    self.assertIsInstance(recorder.error, android_ndk_perf.CommandFailedError)
+    self.assertEqual([], os.listdir(self.state.get_device_path(
+        '123456', '/data/data/%s' % _PACKAGE)))
+
+  def test_pull_package_file(self):
+    remote_file = '/data/data/%s/perf.data' % _PACKAGE
+    contents = os.urandom(100000) + 'a' * 100000
+    self.state.write_file('123456', remote_file, contents)
+    # All commands are issued using the command handler.
+    commands = []
+
+    def command_handler(executable, executable_args, error, **kwargs):
+      commands.append(executable_args)
+      return android_ndk_perf.execute_command(executable, executable_args,
+                                              error, **kwargs)
+
+    adb_device = android_ndk_perf.Adb('123456', command_handler,
+                                      adb_path=self.adb_path)
+    local_file = os.path.join(self.directory, 'perf.data')
+    adb_device.pull_package_file(_PACKAGE, remote_file, local_file)
+    with open(local_file, 'rb') as f:
+      self.assertEqual(contents, f.read())
+    self.assertEqual(1, len([c for c in commands if 'exec-out' in c]))
+
+  def test_pull_package_file_stderr(self):
+    remote_file = '/data/data/%s/perf.data' % _PACKAGE
+    self.state.write_file('123456', remote_file, 'trace')
+    # Writing more than a pipe buffer to the standard error stream doesn't
+    # block the transfer, the file is pulled without compression when the
+    # compressed stream is empty.
+    self.state.add_response(r'^exec-out', stderr='error\n' * 100000)
+    self.state.save()
+    local_file = os.path.join(self.directory, 'perf.data')
+    self.create_adb().pull_package_file(_PACKAGE, remote_file, local_file)
+    with open(local_file) as f:
+      self.assertEqual('trace', f.read())
+    self.assertEqual(1, len(self.get_commands('pull')))
+
+  def test_execute_command_stdout_callback(self):
+    lines = []
+    out, _, _ = android_ndk_perf.execute_command(
+        sys.executable, ['-c', 'for i in range(1000): print i'], 'error',
+        stdout_callback=lines.append)
+    self.assertEqual(['%d\n' % i for i in range(1000)], lines)
+    # Only the most recent lines of streamed output are retained.
+    self.assertEqual(''.join(lines[-runner.DEFAULT_TAIL_LINES:]), out)
+
+  def test_measure_launch(self):
+    times = android_ndk_perf.measure_launch(self.create_adb(), _PACKAGE,
+                                            _ACTIVITY, True)
+    self.assertEqual({'this_time': 100, 'total_time': 100, 'wait_time': 105,
+                      'displayed': 100}, times)
+    self.assertRaises(android_ndk_perf.CommandFailedError,
+                      android_ndk_perf.measure_launch, self.create_adb(),
+                      'com.example.missing', _ACTIVITY, True)
+
+  def test_measure_launch_preserves_log(self):
+    # Messages logged before the launch are neither cleared nor parsed.
+    with open(os.path.join(self.state.get_device_directory('123456'),
+                           'logcat.txt'), 'w') as f:
+      f.write('01-01 00:00:00.000 I/ActivityManager(  500): Displayed '
+              '%s/%s: +9s999ms\n' % (_PACKAGE, _ACTIVITY))
+    times = android_ndk_perf.measure_launch(self.create_adb(), _PACKAGE,
+                                            _ACTIVITY, True)
+    self.assertEqual(100, times['displayed'])
+    self.assertIn('+9s999ms', self.state.get_logcat('123456'))
+
+  def test_parse_launch_output(self):
+    component = 'com.example.app/.Main'
+    output = '\n'.join((
+        'Status: ok',
+        'ThisTime: 1200',
+        'TotalTime: 1234',
+        'WaitTime: 1250',
+        'Complete',
+        '01-02 03:04:04.900 I/ActivityManager(  500): Displayed '
+        'com.example.app/.Main: +2s5ms',
+        '01-02 03:04:05.678 I/ActivityManager(  500): Displayed '
+        'com.example.other/.Main: +345ms',
+        '01-02 03:04:05.700 I/ActivityManager(  500): Displayed '
+        'com.example.app/.Main: +1s234ms'))
+    self.assertEqual({'this_time': 1200, 'total_time': 1234,
+                      'wait_time': 1250, 'displayed': 1234},
+                     android_ndk_perf.parse_launch_output(
+                         output, component, start_time='01-02 03:04:05.000'))
+    # The package name is expanded in the logged component.
+    self.assertEqual(345, android_ndk_perf.parse_launch_output(
+        'I/ActivityTaskManager(  500): Displayed '
+        'com.example.app/com.example.app.Main: +345ms\n',
+        component)['displayed'])
+    self.assertEqual(dict([(name, None) for name in (
+        'this_time', 'total_time', 'wait_time', 'displayed')]),
+                     android_ndk_perf.parse_launch_output('', component))
+
+  def test_calculate_statistics(self):
+    statistics = android_ndk_perf.calculate_statistics([4, 1, 3, 2, 10])
+    self.assertEqual(5, statistics['count'])
+    self.assertEqual(1, statistics['min'])
+    self.assertEqual(10, statistics['max'])
+    self.assertAlmostEqual(4.0, statistics['mean'])
+    self.assertAlmostEqual(3.0, statistics['median'])
+    # 90th percentile is interpolated between 4 and 10.
+    self.assertAlmostEqual(7.6, statistics['p90'])
+    self.assertAlmostEqual(12.5, statistics['variance'])
+    self.assertAlmostEqual(12.5 ** 0.5, statistics['stddev'])
+    statistics = android_ndk_perf.calculate_statistics([5])
+    self.assertEqual((5, 5, 5), (statistics['min'], statistics['median'],
+                                 statistics['p90']))
+    self.assertEqual(0, statistics['stddev'])
+    self.assertEqual({}, android_ndk_perf.calculate_statistics([]))
+
+  def test_calculate_confidence_interval(self):
+    statistics = android_ndk_perf.calculate_statistics([2, 4, 6])
+    self.assertAlmostEqual(4.0, statistics['mean'])
+    self.assertAlmostEqual(2.0, statistics['stddev'])
+    # 2 degrees of freedom.
+    self.assertAlmostEqual(4.303 * 2.0 / 3 ** 0.5,
+                           android_ndk_perf.calculate_confidence_interval(
+                               statistics))
+    # 1 degree of freedom, the standard deviation of sqrt(2) cancels the
+    # square root of the count.
+    statistics = android_ndk_perf.calculate_statistics([1, 3])
+    self.assertAlmostEqual(12.706,
+                           android_ndk_perf.calculate_confidence_interval(
+                               statistics))
+    # A single value has no confidence interval.
+    self.assertEqual(0.0, android_ndk_perf.calculate_confidence_interval(
+        android_ndk_perf.calculate_statistics([5])))
+    self.assertEqual(0.0, android_ndk_perf.calculate_confidence_interval({}))
+    # The last entry of the table is used for 30 degrees of freedom and the
+    # normal distribution beyond the table.
+    self.assertEqual(30, len(android_ndk_perf.T_DISTRIBUTION_95))
+    self.assertAlmostEqual(2.042 / 31 ** 0.5,
+                           android_ndk_perf.calculate_confidence_interval(
+                               {'count': 31, 'stddev': 1.0}))
+    self.assertAlmostEqual(1.96 / 100 ** 0.5,
+                           android_ndk_perf.calculate_confidence_interval(
+                               {'count': 100, 'stddev': 1.0}))
+
+  def test_aggregate_function_costs(self):
+    aggregate = android_ndk_perf.aggregate_function_costs([
+        {'f (a)': (10.0, 50.0), 'g (a)': (5.0, 5.0)},
+        {'f (a)': (20.0, 70.0)}])
+    self.assertEqual(['f (a)', 'g (a)'], sorted(aggregate.keys()))
+    self_cost = aggregate['f (a)']['self']
+    self.assertAlmostEqual(15.0, self_cost['mean'])
+    self.assertAlmostEqual(50 ** 0.5, self_cost['stddev'])
+    self.assertAlmostEqual(12.706 * 50 ** 0.5 / 2 ** 0.5, self_cost['ci95'])
+    self.assertAlmostEqual(60.0, aggregate['f (a)']['inclusive']['mean'])
+    # Functions which aren't sampled in a run have a cost of 0 for the run.
+    self.assertEqual(2, aggregate['g (a)']['self']['count'])
+    self.assertAlmostEqual(2.5, aggregate['g (a)']['self']['mean'])
+    self.assertEqual({}, android_ndk_perf.aggregate_function_costs([]))
+
+  def test_measure_launch_activity_task_manager(self):
+    # From Android 10 the "Displayed" message is logged by
+    # ActivityTaskManager.
+    self.state.add_device('123456', properties={
+        'ro.build.version.sdk': '29', 'ro.build.version.release': '10'})
+    self.state.save()
+    times = android_ndk_perf.measure_launch(self.create_adb(), _PACKAGE,
+                                            _ACTIVITY, False)
+    self.assertEqual(100, times['displayed'])
+
+  def test_profile_devices(self):
+    self.assertEqual(['123456', '654321'],
+                     android_ndk_perf.Adb.get_connected_serials(
+                         android_ndk_perf.execute_command,
+                         adb_path=self.adb_path))
+    android_ndk_perf.pull_symbols = (
+        lambda unused_adb_device, unused_perf_data, unused_output_directory,
+        unused_symbol_cache: None)
+    output_filename = os.path.join(self.directory, 'output', 'perf.data')
+    device_threads = []
+    for serial in ('123456', '654321'):
+      perf_args = android_ndk_perf.PerfArgs(
+          ['record', '-o', output_filename], False)
+      perf_args.get_output_filename(android_ndk_perf.get_device_output_filename(
+          output_filename, serial))
+      device_threads.append(android_ndk_perf.DeviceProfileThread(
+          self.create_adb(serial), _PACKAGE, _ACTIVITY, perf_args,
+          call_graph_recording=False, timestamp_recording=False,
+          start_application=True, kill_application_on_stop=True,
+          record_time=0))
+    android_ndk_perf.profile_devices(device_threads, 0.5)
+    for thread in device_threads:
+      self.assertIsNone(thread.error)
+      with open(thread.output_filename) as f:
+        self.assertEqual('PERFILE2', f.read())
+    self.assertEqual(
+        [os.path.join(self.directory, 'output', serial, 'perf.data')
+         for serial in ('123456', '654321')],
+        [t.output_filename for t in device_threads])
+
+  def test_pull_symbols_cached(self):
+    libraries = ('/system/lib/libc.so', '/system/lib/libm.so')
+    build_ids = ('%040x' % 1, '%040x' % 2)
+    for library in libraries:
+      self.state.write_file('123456', library, library)
+    perfhost = os.path.join(self.directory, 'perfhost')
+    with open(perfhost, 'w') as f:
+      f.write('#!/bin/sh\n' + ''.join(
+          ['echo "%s %s"\n' % (b, l) for b, l in zip(build_ids, libraries)]))
+    os.chmod(perfhost, 0755)
+    android_ndk_perf.find_host_binary = lambda unused_name, unused_adb: (
+        perfhost)
+    symbol_cache = android_ndk_perf.SymbolCache(
+        os.path.join(self.directory, 'symbols'))
+    for capture in ('capture1', 'capture2'):
+      android_ndk_perf.pull_symbols(
+          self.create_adb(), 'perf.data',
+          os.path.join(self.directory, capture), symbol_cache)
+      for library in libraries:
+        with open(os.path.join(self.directory, capture,
+                               library.lstrip('/'))) as f:
+          self.assertEqual(library, f.read())
+    # Libraries are only pulled from the device by the first capture.
+    self.assertEqual(len(libraries), len(self.get_commands('pull')))
+    self.assertEqual(symbol_cache.get_path(build_ids[0], libraries[0]),
+                     symbol_cache.lookup(build_ids[0], libraries[0]))
+
+
+  def test_sample_time_weights(self):
+
+    def create_sample(tid, sample_time, period=1, event='cycles:'):
+      return android_ndk_perf.PerfRecordSample(0, 'PERF_RECORD_SAMPLE', 1, tid,
+                                               0, period, 'app', sample_time,
+                                               event)
+
+    # Two threads sampled concurrently every 10ms, thread 3 stops running
+    # for 1s and thread 4 is sampled once.
+    samples = [create_sample(2, 1.0), create_sample(3, 1.001),
+               create_sample(2, 1.01), create_sample(3, 1.011),
+               create_sample(2, 1.02), create_sample(4, 1.021),
+               create_sample(3, 2.011)]
+    weights = android_ndk_perf.calculate_sample_time_weights(samples)
+    self.assertEqual([0.01] * len(samples), [round(w, 6) for w in weights])
+    # Clock events record the time of each sample in nanoseconds.
+    samples = [create_sample(2, 1.0, period=250000, event='cpu-clock:'),
+               create_sample(3, 1.5, period=500000, event='cpu-clock:')]
+    self.assertEqual([0.00025, 0.0005],
+                     android_ndk_perf.calculate_sample_time_weights(samples))
+    self.assertEqual([], android_ndk_perf.calculate_sample_time_weights([]))
+
+  def test_process_perf_script_dump_cpu(self):
+    dump = '\n'.join((
+        '1 1000000000 0x1a0 [0x30]: PERF_RECORD_SAMPLE(IP, 2): 10/11: '
+        '0x400 period: 1 addr: 0',
+        ' ... thread: app:11',
+        'app 11 [001] 1.000000000: cycles:',
+        '\t            400 main (/data/app.so)',
+        '',
+        '1000000000 0x1d0 [0x30]: PERF_RECORD_SAMPLE(IP, 2): 10/11: '
+        '0x404 period: 1 addr: 0',
+        ' ... thread: app:11',
+        'app 11 1.010000000: cycles:',
+        '\t            404 main (/data/app.so)',
+        '', ''))
+    samples = android_ndk_perf.process_perf_script_dump(dump, 1.0)
+    self.assertEqual([1, None], [sample.cpu for sample in samples])
+    self.assertEqual([1.0, 1.01], [sample.time for sample in samples])
+    # Lines streamed to the parser yield the same samples.
+    parser = android_ndk_perf.PerfScriptDumpParser()
+    for line in dump.splitlines(True)[:-1]:
+      parser.parse_line(line)
+    self.assertEqual([(1.0, 0.01), (1.01, 0.01)],
+                     [(sample.time, round(sample.period, 6))
+                      for sample in parser.finish()])
+
+  def test_parse_cpufreq_samples(self):
+    sample_output = '\n'.join((
+        'uptime 100.50',
+        '/sys/devices/system/cpu/cpu0/cpufreq/stats/time_in_state',
+        '300000 10',
+        '600000 20',
+        'cur_freq 600000',
+        '/sys/devices/system/cpu/cpu1/cpufreq/stats/time_in_state',
+        'uptime 100.60',
+        '/sys/devices/system/cpu/cpu0/cpufreq/stats/time_in_state',
+        '300000 12',
+        '600000 28',
+        '/sys/devices/system/cpu/cpu1/cpufreq/stats/time_in_state',
+        'cur_freq 300000'))
+    self.assertEqual(
+        [(100.5, {0: {300000: 10, 600000: 20}, 1: {}}, {0: 600000}),
+         (100.6, {0: {300000: 12, 600000: 28}, 1: {}}, {1: 300000})],
+        android_ndk_perf.parse_cpufreq_samples(sample_output))
+    # The monotonic clock is used when it was read for every sample.
+    self.assertEqual(
+        [1.5, 1.6], [sample[0] for sample in
+                     android_ndk_perf.parse_cpufreq_samples(
+                         'uptime 100.50\nmonotonic_ns 1500000000\n'
+                         'uptime 100.60\nmonotonic_ns 1600000000\n')])
+    self.assertEqual(
+        [100.5, 100.6], [sample[0] for sample in
+                         android_ndk_perf.parse_cpufreq_samples(
+                             'uptime 100.50\nmonotonic_ns 1500000000\n'
+                             'uptime 100.60\n')])
+    self.assertEqual([], android_ndk_perf.parse_cpufreq_samples(''))
+
+  def test_cpufreq_timeline_from_samples(self):
+    timeline = android_ndk_perf.CpuFreqTimeline.from_samples([
+        (1.0, {0: {300000: 10, 600000: 20}, 1: {}}, {0: 600000, 1: 900000}),
+        (1.1, {0: {300000: 12, 600000: 28}, 1: {}}, {0: 600000}),
+        (1.2, {0: {300000: 12, 600000: 28}}, {0: 300000})])
+    self.assertEqual([0, 1], timeline.cpus)
+    self.assertEqual([1.0, 1.1, 1.2], timeline.times)
+    # CPU 0 spent 2 ticks at 300MHz and 8 ticks at 600MHz during the first
+    # interval and no time in any state during the second, so the current
+    # frequency is used.  CPU 1 has no stats.
+    self.assertEqual([[540000, 900000], [600000, 0], [300000, 0]],
+                     timeline.frequencies)
+
+  def test_cpufreq_timeline_frequency_at(self):
+    timeline = android_ndk_perf.CpuFreqTimeline(
+        [0, 1], [1.0, 2.0], [[300000, 0], [600000, 1000000]])
+    # Times before the first sample use the first sample.
+    self.assertEqual(300000, timeline.frequency_at(0.5, cpu=0))
+    self.assertEqual(300000, timeline.frequency_at(1.5, cpu=0))
+    self.assertEqual(600000, timeline.frequency_at(2.0, cpu=0))
+    self.assertEqual(1000000, timeline.frequency_at(5.0, cpu=1))
+    self.assertEqual(0, timeline.frequency_at(1.5, cpu=1))
+    self.assertEqual(0, timeline.frequency_at(1.5, cpu=2))
+    # The mean only includes CPUs with a known frequency.
+    self.assertEqual(300000, timeline.frequency_at(1.5))
+    self.assertEqual(800000, timeline.frequency_at(2.5))
+    self.assertEqual(0, android_ndk_perf.CpuFreqTimeline().frequency_at(1.0))
+
+  def test_function_time_cycles_per_cpu(self):
+    timeline = android_ndk_perf.CpuFreqTimeline([0, 1], [0.0],
+                                                [[1000000, 2000000]])
+    samples = []
+    for cpu, sample_time in ((0, 1.0), (1, 1.01), (None, 1.02)):
+      sample = android_ndk_perf.PerfRecordSample(
+          0, 'PERF_RECORD_SAMPLE', 1, 2, 0, 1, 'app', sample_time, 'cycles:',
+          cpu=cpu)
+      sample.stack.append(android_ndk_perf.PerfIp(0, 'func%s' % cpu, '(a)'))
+      samples.append(sample)
+    costs = android_ndk_perf.calculate_function_time_cycles(samples, timeline)
+    # Samples without a CPU use the mean frequency of all CPUs.
+    self.assertEqual([1e7, 2e7, 1.5e7],
+                     [round(costs['func%s (a)' % cpu]['self_cycles'])
+                      for cpu in (0, 1, None)])
+
+if __name__ == '__main__':
+  unittest.main()
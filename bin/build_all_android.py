@@ -157,7 +157,22 @@ def main():
   args = parser.parse_args()
 
   env = BuildAllEnvironment(args)
+  try:
+    return build_install_and_run(env, args)
+  finally:
+    env.write_trace()
 
+
+def build_install_and_run(env, args):
+  """Build, install and run all packages.
+
+  Args:
+    env: BuildAllEnvironment instance.
+    args: Parsed command line arguments.
+
+  Returns:
+    0 if successful, non-zero if an error occurs.
+  """
   (rc, errmsg) = env.build_all(
       path=args.search_path, apk_output=args.apk_output_dir,
       lib_output=args.lib_output_dir, exclude_dirs=args.exclude_dirs)
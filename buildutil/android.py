@@ -27,8 +27,13 @@ command line.
 @package fplutil.buildutil.android Android-specific BuildEnvironment.
 """
 
+import contextlib
 import datetime
 import errno
+import glob
+import hashlib
+import json
+import multiprocessing
 import os
 import platform
 import random
@@ -39,11 +44,18 @@ import stat
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import uuid
 import xml.etree.ElementTree
 sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.android_mk as android_mk
+import buildutil.artifact_cache as artifact_cache
 import buildutil.common as common
+import buildutil.device_cache as device_cache
+import buildutil.jobs as jobs
+import buildutil.project_index as project_index
+import buildutil.trace as trace
 
 _SDK_HOME_ENV_VAR = 'ANDROID_SDK_HOME'
 _NDK_HOME_ENV_VAR = 'NDK_HOME'
@@ -65,6 +77,10 @@ _ALWAYS_MAKE = 'always_make'
 _ADB_LOGCAT_ARGS = 'adb_logcat_args'
 _ADB_LOGCAT_MONITOR = 'adb_logcat_monitor'
 _IGNORE_SDK_VERSION_MISSING = 'ignore_sdk_version_missing'
+_ADB_PROPERTY_CACHE_TTL = 'adb_property_cache_ttl'
+_LIBRARY_JOBS = 'library_jobs'
+_APK_JOBS = 'apk_jobs'
+_PROJECT_INDEX = 'project_index'
 
 _MATCH_DEVICES = re.compile(r'^List of devices attached\s*')
 _MATCH_PACKAGE = re.compile(r'^package:(.*)')
@@ -81,6 +97,52 @@ _LOCAL_PROPERTIES_SDK_LOCATION = re.compile(r'^\s*sdk.dir=(.*)')
 # NDK location storage file.
 _NDK_LOCATION = '.ndk_install_path'
 
+# Regular expressions used to extract the API level and codename of an SDK
+# platform from its source.properties file.
+_SOURCE_PROPERTIES_API_LEVEL = re.compile(
+    r'^\s*AndroidVersion.ApiLevel\s*=\s*(\S+)', re.MULTILINE)
+_SOURCE_PROPERTIES_CODENAME = re.compile(
+    r'^\s*AndroidVersion.CodeName\s*=\s*(\S+)', re.MULTILINE)
+
+# File in an APK project's bin directory which stores the fingerprint of the
+# inputs of the last successful build.
+_APK_FINGERPRINT_FILE = '.fplutil_build_fingerprint'
+
+# Files and directories of an APK project which are inputs of the ant build.
+_APK_INPUTS = ('AndroidManifest.xml', 'build.xml', 'project.properties',
+               'ant.properties', 'local.properties', 'custom_rules.xml',
+               'proguard-project.txt', 'src', 'res', 'assets', 'libs', 'jni')
+
+# Files and directories of a library project referenced by an APK project
+# which are inputs of the APK project's ant build.
+_APK_LIBRARY_INPUTS = ('AndroidManifest.xml', 'project.properties', 'src',
+                       'res', 'assets', 'libs')
+
+# Regular expression used to extract the paths of library projects referenced
+# by a project.properties file.
+_PROJECT_PROPERTIES_LIBRARY_REFERENCE = re.compile(
+    r'^\s*android\.library\.reference\.\d+\s*=\s*(.*?)\s*$', re.MULTILINE)
+
+# Top level directories of a library project written by ndk-build and, for
+# library projects which are also APK projects, ant.
+_LIBRARY_OUTPUT_DIRECTORIES = ('libs', 'obj', 'bin', 'gen')
+
+# Extensions of C/C++ sources and headers.  The contents of these files only
+# contribute to the artifact cache key of a library project if the dependency
+# files written by ndk-build list them as inputs of the build.
+_NDK_SOURCE_EXTENSIONS = ('.c', '.cc', '.cp', '.cpp', '.cxx', '.c++', '.h',
+                          '.hh', '.hpp', '.hxx', '.inl', '.ipp', '.s', '.asm')
+
+# Files in the NDK directory which identify the version of the NDK.
+_NDK_VERSION_FILES = ('source.properties', 'RELEASE.TXT')
+
+# Subdirectory of the cache directory which stores the SDK targets installed
+# in each SDK.
+_SDK_TARGETS_CACHE_SUBDIR = 'sdk_targets'
+
+# Installed SDK targets indexed by (platforms_directory, mtime).
+_SDK_TARGETS_CACHE = {}
+
 class XMLFile(object):
   """XML file base class factored for testability.
 
@@ -433,6 +495,13 @@ class BuildEnvironment(common.BuildEnvironment):
     adb_logcat_monitor: Whether to continue to monitor the application's
       output after it has launched or has been destroyed.
     always_make: Whether to build when the project is already up to date.
+    adb_property_cache_ttl: Time (in seconds) device properties are cached
+      on the host between invocations, 0 disables the cache.
+    library_jobs: Maximum number of library projects to build concurrently.
+    apk_jobs: Maximum number of APK projects build_all() builds concurrently,
+      0 selects the number of processor cores on the host.
+    project_index: Whether to cache the projects found by find_projects()
+      on the host between invocations.
   """
 
   ADB = 'adb'
@@ -481,6 +550,16 @@ class BuildEnvironment(common.BuildEnvironment):
     self.adb_logcat_args = args[_ADB_LOGCAT_ARGS]
     self.adb_logcat_monitor = args[_ADB_LOGCAT_MONITOR]
     self.ignore_sdk_version_missing = args[_IGNORE_SDK_VERSION_MISSING]
+    self.adb_property_cache_ttl = args[_ADB_PROPERTY_CACHE_TTL]
+    self.library_jobs = args[_LIBRARY_JOBS]
+    self.apk_jobs = args[_APK_JOBS]
+    self.project_index = args[_PROJECT_INDEX]
+    self._found_projects = {}
+    self._xml_files = {}
+    self._signing_lock = threading.Lock()
+    self._signing_session_depth = 0
+    self._signing_key = None
+    self._device_property_caches = {}
 
   @staticmethod
   def build_defaults():
@@ -513,6 +592,10 @@ class BuildEnvironment(common.BuildEnvironment):
     args[_ADB_LOGCAT_MONITOR] = False
     # We expect an SDK version check by default.
     args[_IGNORE_SDK_VERSION_MISSING] = False
+    args[_ADB_PROPERTY_CACHE_TTL] = 0
+    args[_LIBRARY_JOBS] = 1
+    args[_APK_JOBS] = 1
+    args[_PROJECT_INDEX] = False
 
     return args
 
@@ -592,6 +675,37 @@ class BuildEnvironment(common.BuildEnvironment):
                               'gradle project files instead of the manifest.'),
                         action='store_true',
                         default=defaults[_IGNORE_SDK_VERSION_MISSING])
+    parser.add_argument('--' + _ADB_PROPERTY_CACHE_TTL,
+                        help=('Time in seconds to cache device properties on '
+                              'the host between invocations.  Cached '
+                              'properties are discarded when a device '
+                              'reboots.  0 disables the cache.'),
+                        dest=_ADB_PROPERTY_CACHE_TTL, type=float,
+                        default=defaults[_ADB_PROPERTY_CACHE_TTL])
+    parser.add_argument('--' + _LIBRARY_JOBS,
+                        help=('Maximum number of library projects to build '
+                              'concurrently.  The processor cores specified '
+                              'by --%s are split between the projects being '
+                              'built and the output of each project is '
+                              'written to a log file.' % common._CPU_COUNT),
+                        dest=_LIBRARY_JOBS, type=int,
+                        default=defaults[_LIBRARY_JOBS])
+    parser.add_argument('--' + _APK_JOBS,
+                        help=('Maximum number of APK projects to build '
+                              'concurrently, 0 selects the number of '
+                              'processor cores on the host.  The output of '
+                              'each concurrently built project is written to '
+                              'a log file in the logs directory of the APK '
+                              'output directory.'),
+                        dest=_APK_JOBS, type=int,
+                        default=defaults[_APK_JOBS])
+    parser.add_argument('--' + _PROJECT_INDEX,
+                        help=('Cache the projects found in the project '
+                              'directory on the host between invocations.  '
+                              'The cache is discarded when a directory that '
+                              'was searched is modified.'),
+                        dest=_PROJECT_INDEX, action='store_true',
+                        default=defaults[_PROJECT_INDEX])
 
     parser.set_defaults(
         **{_ALWAYS_MAKE: defaults[_ALWAYS_MAKE]})  # pylint: disable=star-args
@@ -695,12 +809,22 @@ class BuildEnvironment(common.BuildEnvironment):
     with open(ndk_location_filename, 'w') as f:
       f.write(current_ndk_path)
 
+  @trace.traced()
   def build_android_libraries(self, subprojects, output=None,
-                              check_ndk_install_path=True):
+                              check_ndk_install_path=True, dependencies=None):
     """Build list of Android library projects.
 
-    This function iteratively runs ndk-build over a list of paths relative
-    to the current project directory.
+    This function runs ndk-build over a list of paths relative to the current
+    project directory.  If library_jobs is greater than 1, projects are built
+    concurrently splitting cpu_count between the projects being built.  The
+    output of each concurrently built project is written to
+    ndk-build-PROJECT.log in the project's object directory.
+
+    If the artifact cache is enabled, the libs and obj directories of each
+    project are restored from the cache when the project's sources, the
+    sources of the projects it depends upon, the make flags and the NDK are
+    unchanged.  The obj directory is not cached when output is specified
+    since it may be shared between projects.
 
     Args:
       subprojects: A list pf paths relative to the project directory to build.
@@ -708,21 +832,24 @@ class BuildEnvironment(common.BuildEnvironment):
           receive the build output.
       check_ndk_install_path: Whether to track the NDK install location and
           rebuild if it changes.
+      dependencies: Optional dictionary which maps each subproject to the list
+          of subprojects that must be built before it.
 
     Raises:
       SubCommandError: ndk-build invocation failed or returned an error.
       ToolPathError: Android NDK location not found in configured build
           environment or $PATH.
+      DependencyError: If subprojects have cyclic dependencies.
     """
     ndk_build = self._find_binary(BuildEnvironment.NDK_BUILD)
 
-    for p in subprojects:
-      # Disable parallel clean on OSX.
-      cpu_count = self.cpu_count
-      if self.clean and platform.mac_ver()[0]:
-        cpu_count = 1
+    # Disable parallel clean on OSX.
+    cpu_count = self.cpu_count
+    if self.clean and platform.mac_ver()[0]:
+      cpu_count = 1
 
-      if check_ndk_install_path:
+    if check_ndk_install_path:
+      for p in subprojects:
         project_output_dir = (self.get_project_directory(path=output)
                               if output else p)
         if BuildEnvironment.ndk_location_changed(project_output_dir,
@@ -738,25 +865,263 @@ class BuildEnvironment(common.BuildEnvironment):
               shutil.rmtree(output_dir)
           BuildEnvironment.write_ndk_location(project_output_dir, ndk_build)
 
-      args = [ndk_build, '-j' + str(cpu_count)]
-      if self.always_make:
-        args.append('-B')
-      args += ['-C', self.get_project_directory(path=p)]
+    if self.library_jobs <= 1 or len(subprojects) <= 1:
+      for p in subprojects:
+        self._build_android_library(
+            ndk_build, p, output, cpu_count,
+            dependencies=BuildEnvironment._get_transitive_dependencies(
+                p, dependencies))
+      return
 
-      if self.clean:
-        args.append('clean')
+    project_cpu_count = jobs.split_cpu_count(cpu_count, self.library_jobs,
+                                             len(subprojects))
+    results = jobs.run_jobs(
+        subprojects,
+        self.bind_trace(lambda p: self._build_android_library(
+            ndk_build, p, output, project_cpu_count,
+            log_filename=self._get_ndk_build_log(p, output),
+            dependencies=BuildEnvironment._get_transitive_dependencies(
+                p, dependencies))),
+        self.library_jobs, dependencies=dependencies)
+    if self.verbose or not results.succeeded:
+      print os.linesep.join(results.summary())
+    if results.failures:
+      raise results.failures[0][1]
 
-      if self.verbose:
-        args.append('V=1')
+  @staticmethod
+  def _get_transitive_dependencies(subproject, dependencies):
+    """Get the projects a project depends upon directly or indirectly.
+
+    Args:
+      subproject: Project to get the dependencies of.
+      dependencies: Dictionary which maps each project to the list of
+        projects it directly depends upon or None.
+
+    Returns:
+      Sorted list of projects.
+    """
+    found = set()
+    pending = list((dependencies or {}).get(subproject, []))
+    while pending:
+      project = pending.pop()
+      if project not in found and project != subproject:
+        found.add(project)
+        pending.extend(dependencies.get(project, []))
+    return sorted(found)
+
+  def _get_library_input_key(self, ndk_build, subproject, output,
+                             dependencies):
+    """Derive a key from the inputs of a library project known before a build.
+
+    The key covers the NDK, the make flags, the names of the files in the
+    project and the projects it depends upon and the contents of those files
+    which aren't C/C++ sources or headers, such as makefiles and prebuilt
+    libraries.  The project's own output directories are skipped.
+
+    Args:
+      ndk_build: Path to ndk-build.
+      subproject: Path of the project relative to the project directory.
+      output: Optional directory relative to the project directory which
+        receives the build output.
+      dependencies: List of the projects the project depends upon.
+
+    Returns:
+      Key string or None if the inputs of the project can't be read.
+    """
+    key = self.get_artifact_key_builder()
+    try:
+      key.add_value(os.path.abspath(ndk_build))
+      ndk_directory = os.path.dirname(os.path.abspath(ndk_build))
+      for name in _NDK_VERSION_FILES:
+        version_file = os.path.join(ndk_directory, name)
+        if os.path.exists(version_file):
+          key.add_value(artifact_cache.hash_file(version_file))
+      for project in [subproject] + list(dependencies):
+        project_directory = self.get_project_directory(path=project)
+        exclude_paths = list(_LIBRARY_OUTPUT_DIRECTORIES)
+        if output:
+          exclude_paths.append(os.path.relpath(
+              self.get_project_directory(path=output), project_directory))
+        for filename in artifact_cache.list_tree(project_directory,
+                                                 exclude_paths=exclude_paths):
+          if os.path.splitext(filename)[1].lower() in _NDK_SOURCE_EXTENSIONS:
+            key.add_name(filename)
+          else:
+            key.add_file(filename)
+    except (IOError, OSError):
+      return None
+    return key.hexdigest()
+
+  def _get_library_artifact_key(self, input_key, inputs):
+    """Derive the artifact cache key of a library project.
+
+    Args:
+      input_key: Key returned by _get_library_input_key().
+      inputs: List of the sources and headers compiled by the project,
+        relative to the project directory, see _get_library_inputs().
+
+    Returns:
+      Key string or None if an input can't be read.
+    """
+    key = artifact_cache.KeyBuilder(self.project_directory)
+    key.add_value(input_key)
+    try:
+      for filename in inputs:
+        key.add_file(os.path.join(self.project_directory, filename))
+    except (IOError, OSError):
+      return None
+    return key.hexdigest()
+
+  def _get_library_inputs(self, ndk_build, subproject, output):
+    """Get the sources and headers compiled by a library project.
+
+    The inputs are read from the dependency files written by ndk-build, so
+    they include headers outside of the project such as those found via
+    LOCAL_C_INCLUDES or imported modules.  Files in the NDK are omitted since
+    the version of the NDK contributes to the key of the project.
+
+    Args:
+      ndk_build: Path to ndk-build.
+      subproject: Path of the project relative to the project directory.
+      output: Optional directory relative to the project directory which
+        receives the build output.
+
+    Returns:
+      Sorted list of paths relative to the project directory.
+    """
+    project_directory = self.get_project_directory(path=subproject)
+    obj_directory = (self.get_project_directory(path=output) if output else
+                     os.path.join(project_directory, 'obj'))
+    ndk_directory = os.path.dirname(os.path.abspath(ndk_build))
+    local_directory = os.path.join(obj_directory, 'local')
+    # The output directory can be shared between projects so only the
+    # objects of the modules defined by this project, written to
+    # local/ABI/objs*/MODULE, are read.  If the modules can't be determined
+    # all objects in the output directory are read.
+    makefile = android_mk.get_project_makefile(project_directory)
+    modules = (android_mk.parse_makefile(makefile,
+                                         project=project_directory)[0]
+               if makefile else [])
+    if modules:
+      module_directories = [
+          directory for module in modules
+          for directory in glob.glob(os.path.join(
+              local_directory, '*', 'objs*', module.name))]
+    else:
+      module_directories = [local_directory]
+    inputs = set()
+    for root, _, files in [entry for directory in module_directories
+                           for entry in os.walk(directory)]:
+      for dependency_file in [f for f in files if f.endswith('.d')]:
+        try:
+          prerequisites = artifact_cache.parse_dependency_file(
+              os.path.join(root, dependency_file))
+        except IOError:
+          continue
+        for prerequisite in prerequisites:
+          filename = os.path.normpath(os.path.join(project_directory,
+                                                   prerequisite))
+          # Dependency files of sources which are no longer built are left
+          # in the output directory so missing files are ignored.
+          if (not filename.startswith(ndk_directory + os.sep) and
+              os.path.isfile(filename)):
+            inputs.add(os.path.relpath(filename, self.project_directory))
+    return sorted(inputs)
+
+  def _get_ndk_build_log(self, subproject, output=None):
+    """Get the log file used when building a library project concurrently.
+
+    Args:
+      subproject: Path of the project relative to the project directory.
+      output: Optional directory relative to the project directory which
+        receives the build output.
+
+    Returns:
+      Path of the log file.  The directory containing the file is created if
+      it doesn't exist.
+    """
+    project_directory = self.get_project_directory(path=subproject)
+    obj_directory = (self.get_project_directory(path=output) if output else
+                     os.path.join(project_directory, 'obj'))
+    if not os.path.exists(obj_directory):
+      os.makedirs(obj_directory)
+    name = os.path.relpath(project_directory, self.project_directory)
+    return os.path.join(obj_directory, 'ndk-build-%s.log' % (
+        re.sub(r'[^\w.-]', '_', name)))
+
+  @trace.traced()
+  def _build_android_library(self, ndk_build, subproject, output, cpu_count,
+                             log_filename=None, dependencies=()):
+    """Build an Android library project using ndk-build.
+
+    Args:
+      ndk_build: Path to ndk-build.
+      subproject: Path of the project relative to the project directory.
+      output: An optional directory relative to the project directory to
+          receive the build output.
+      cpu_count: Number of processor cores ndk-build should use.
+      log_filename: Optional file to write the output of ndk-build to.
+      dependencies: Projects the project depends upon, used to derive the
+          project's artifact cache key.
+
+    Raises:
+      SubCommandError: ndk-build invocation failed or returned an error.
+    """
+    args = [ndk_build, '-j' + str(cpu_count)]
+    if self.always_make:
+      args.append('-B')
+    args += ['-C', self.get_project_directory(path=subproject)]
+
+    if self.clean:
+      args.append('clean')
+
+    if self.verbose:
+      args.append('V=1')
 
-      if output:
-        args.append(
-            'NDK_OUT=%s' % self.get_project_directory(path=output))
+    if output:
+      args.append(
+          'NDK_OUT=%s' % self.get_project_directory(path=output))
 
-      if self.make_flags:
-        args += shlex.split(self.make_flags, posix=self._posix)
+    ccache = self.get_ccache()
+    if ccache:
+      args.append('NDK_CCACHE=%s' % ccache)
 
-      self.run_subprocess(args)
+    if self.make_flags:
+      args += shlex.split(self.make_flags, posix=self._posix)
+
+    def build():
+      """Run ndk-build."""
+      self.run_subprocess(args, log_filename=log_filename)
+
+    if not self.artifact_cache or self.clean or self.always_make:
+      build()
+      return
+    project_directory = self.get_project_directory(path=subproject)
+    output_directories = [os.path.join(project_directory, 'libs')]
+    if not output:
+      output_directories.append(os.path.join(project_directory, 'obj'))
+    # The sources and headers compiled by the project are recorded in a
+    # manifest after each build and hashed to derive the key of the next.
+    input_key = self._get_library_input_key(ndk_build, subproject, output,
+                                            dependencies)
+    key = None
+    if input_key:
+      inputs = self.artifact_cache.get_manifest(input_key)
+      if inputs is not None:
+        key = self._get_library_artifact_key(input_key, inputs)
+
+    def get_output_key():
+      """Record the inputs of the build and derive the key of its outputs."""
+      if not input_key:
+        return None
+      inputs = self._get_library_inputs(ndk_build, subproject, output)
+      self.artifact_cache.store_manifest(input_key, inputs)
+      return self._get_library_artifact_key(input_key, inputs)
+
+    self.run_cached(
+        build, key, [os.path.relpath(d, self.project_directory)
+                     for d in output_directories],
+        get_output_key=get_output_key)
 
   def _find_best_android_sdk(self, android, minsdk, target):
     """Finds the best installed Android SDK for a project.
@@ -784,25 +1149,11 @@ class BuildEnvironment(common.BuildEnvironment):
       ConfigurationError: Required build configuration file missing or broken
           in an unrecoverable way.
     """
-    acmd = [android, 'list', 'target', '--compact']
-    (stdout, unused_stderr) = self.run_subprocess(acmd, capture=True)
-
-    if self.verbose:
-      print 'android list target returned: {%s}' % (stdout)
     # Find the highest installed SDK <= targetSdkVersion, if possible.
-    #
-    # 'android list target --compact' will output lines like:
-    #
-    # android-1
-    # android-2
-    #
-    # for installed SDK targets, along with other info not starting with
-    # android-.
     installed = 0
-    for line in stdout.splitlines():
-      l = line.strip()
-      if l.startswith('android-'):
-        nstr = l.split('-')[1]
+    for target_name in self.get_installed_sdk_targets(android):
+      if target_name.startswith('android-'):
+        nstr = target_name.split('-')[1]
         # Ignore preview SDK revisions (e.g "L").
         if not nstr.isdigit():
           continue
@@ -823,6 +1174,121 @@ class BuildEnvironment(common.BuildEnvironment):
     apitarget = 'android-%d' % (installed)
     return apitarget
 
+  def get_installed_sdk_targets(self, android):
+    """Get the targets installed in the Android SDK.
+
+    Targets are read from the source.properties file of each platform in
+    the SDK, falling back to 'android list target' if the platforms can't be
+    read.  Targets are cached in this process and on the host until the
+    SDK's platforms directory is modified.
+
+    Args:
+      android: Path to android tool binary.
+
+    Returns:
+      List of target names (e.g "android-19").
+
+    Raises:
+      SubCommandError: android tool invocation failed or returned an error.
+    """
+    platforms = (os.path.join(self.sdk_home, 'platforms') if self.sdk_home
+                 else None)
+    key = None
+    if platforms and os.path.isdir(platforms):
+      key = (os.path.abspath(platforms), os.path.getmtime(platforms))
+    if not key:
+      return self._list_sdk_targets(android)
+
+    targets = _SDK_TARGETS_CACHE.get(key)
+    if targets is not None:
+      return targets
+
+    cache_path = os.path.join(
+        common.get_cache_directory(_SDK_TARGETS_CACHE_SUBDIR),
+        hashlib.sha1(key[0]).hexdigest() + '.json')
+    try:
+      with open(cache_path) as f:
+        data = json.load(f)
+      if data.get('platforms') == key[0] and data.get('mtime') == key[1]:
+        targets = data.get('targets')
+    except (IOError, OSError, ValueError, AttributeError):
+      pass
+
+    if targets is None:
+      targets = BuildEnvironment.read_sdk_platform_targets(platforms)
+      if targets is None:
+        targets = self._list_sdk_targets(android)
+      try:
+        common.write_json_atomically(
+            cache_path, {'platforms': key[0], 'mtime': key[1],
+                         'targets': targets})
+      except (IOError, OSError):
+        # Failing to write the cache is not fatal.
+        pass
+
+    if self.verbose:
+      print 'Installed SDK targets: %s' % ', '.join(targets)
+    _SDK_TARGETS_CACHE[key] = targets
+    return targets
+
+  @staticmethod
+  def read_sdk_platform_targets(platforms):
+    """Read the targets of the platforms installed in an SDK.
+
+    Args:
+      platforms: Path of the SDK's platforms directory.
+
+    Returns:
+      List of target names (e.g "android-19") sorted by API level or None if
+      the source.properties file of a platform can't be read.
+    """
+    targets = []
+    try:
+      for platform_directory in os.listdir(platforms):
+        platform_path = os.path.join(platforms, platform_directory)
+        if not os.path.isdir(platform_path):
+          continue
+        with open(os.path.join(platform_path, 'source.properties')) as f:
+          properties = f.read()
+        api_level = _SOURCE_PROPERTIES_API_LEVEL.search(properties)
+        if not api_level:
+          return None
+        codename = _SOURCE_PROPERTIES_CODENAME.search(properties)
+        targets.append((int(api_level.group(1)) if api_level.group(1).isdigit()
+                        else 0,
+                        codename.group(1) if codename else api_level.group(1)))
+    except (IOError, OSError):
+      return None
+    return ['android-%s' % name for _, name in sorted(targets)]
+
+  def _list_sdk_targets(self, android):
+    """List the targets installed in the SDK using the android tool.
+
+    Args:
+      android: Path to android tool binary.
+
+    Returns:
+      List of target names (e.g "android-19") in the order they're listed by
+      the android tool.
+
+    Raises:
+      SubCommandError: android tool invocation failed or returned an error.
+    """
+    acmd = [android, 'list', 'target', '--compact']
+    (stdout, unused_stderr) = self.run_subprocess(acmd, capture=True)
+
+    if self.verbose:
+      print 'android list target returned: {%s}' % (stdout)
+    # 'android list target --compact' will output lines like:
+    #
+    # android-1
+    # android-2
+    #
+    # for installed SDK targets, along with other info not starting with
+    # android-.
+    return [l.strip() for l in stdout.splitlines()
+            if l.strip().startswith('android-')]
+
   def get_manifest_path(self, path='.'):
     """Get the path of the manifest file.
 
@@ -847,11 +1313,47 @@ class BuildEnvironment(common.BuildEnvironment):
       ConfigurationError: Required elements were missing or incorrect.
       MissingActivityError: If a main activity element isn't present.
     """
-    manifest = AndroidManifest(self.get_manifest_path(path=path),
-                               ignore_sdk_version_missing=
-                               self.ignore_sdk_version_missing)
-    manifest.parse()
-    return manifest
+    return self._parse_xml_file(
+        AndroidManifest, self.get_manifest_path(path=path),
+        ignore_sdk_version_missing=self.ignore_sdk_version_missing)
+
+  def _parse_xml_file(self, xml_file_class, path, **kwargs):
+    """Parse an XML file reusing the result while the file is unmodified.
+
+    Args:
+      xml_file_class: XMLFile subclass used to parse the file.
+      path: Path of the file to parse.
+      **kwargs: Additional arguments for the xml_file_class constructor.
+
+    Returns:
+      Parsed xml_file_class instance.
+
+    Raises:
+      ConfigurationError: Required elements were missing or incorrect.
+      MissingActivityError: If a main activity element isn't present.
+    """
+    try:
+      file_stat = os.stat(path)
+      version = (file_stat.st_mtime, file_stat.st_size)
+    except (OSError, TypeError):
+      version = None
+    key = (xml_file_class, path, tuple(sorted(kwargs.items())))
+    cached = self._xml_files.get(key)
+    if version is not None and cached and cached[0] == version:
+      xml_file, error = cached[1:]
+    else:
+      xml_file = xml_file_class(path, **kwargs)
+      error = None
+      try:
+        xml_file.parse()
+      except AndroidManifest.MissingActivityError as e:
+        # The manifest is fully parsed when this is raised so it's cached.
+        error = e
+      if version is not None:
+        self._xml_files[key] = (version, xml_file, error)
+    if error:
+      raise error
+    return xml_file
 
   @staticmethod
   def parse_delete_local_properties(project_path, build_xml_path,
@@ -910,9 +1412,7 @@ class BuildEnvironment(common.BuildEnvironment):
       self.run_subprocess([android, 'update', 'project', '--path', project,
                            '--target', apitarget, '--name', app_name])
 
-    buildxml = BuildXml(buildxml_path)
-    buildxml.parse()
-    return buildxml
+    return self._parse_xml_file(BuildXml, buildxml_path)
 
   def get_apk_filenames(self, app_name, path='.'):
     """Get the set of output APK names for the project.
@@ -940,6 +1440,7 @@ class BuildEnvironment(common.BuildEnvironment):
       signed_apkpath = os.path.join(apk_directory, '%s.apk' % app_name)
     return (signed_apkpath, unsigned_apkpath)
 
+  @trace.traced()
   def build_android_apk(self, path='.', output=None, manifest=None):
     """Build an Android APK.
 
@@ -987,15 +1488,33 @@ class BuildEnvironment(common.BuildEnvironment):
     if self.ant_flags:
       acmd += shlex.split(self.ant_flags, posix=self._posix)
 
-    self.run_subprocess(acmd, cwd=path)
-
-    if not build_apk:
-      return
-
     signed_apkpath, unsigned_apkpath = self.get_apk_filenames(
         buildxml.project_name, path=path)
     source_apkpath = unsigned_apkpath
 
+    # Skip the build if the inputs are unchanged since the last build.
+    fingerprint = None
+    fingerprint_path = os.path.join(self.get_project_directory(path=path),
+                                    'bin', _APK_FINGERPRINT_FILE)
+    if build_apk and not self.clean:
+      fingerprint = self.get_apk_input_fingerprint(path=path)
+    if (fingerprint and os.path.exists(unsigned_apkpath) and
+        BuildEnvironment._read_file(fingerprint_path) == fingerprint):
+      if self.verbose:
+        print 'Skipping build of unmodified project %s' % path
+    else:
+      self.run_subprocess(acmd, cwd=path)
+      if fingerprint:
+        try:
+          with open(fingerprint_path, 'w') as f:
+            f.write(fingerprint)
+        except IOError:
+          # Failing to write the fingerprint only results in a rebuild.
+          pass
+
+    if not build_apk:
+      return
+
     if self.sign_apk and not self.clean:
       if self.ant_target != 'debug':
         source_apkpath = signed_apkpath
@@ -1012,6 +1531,96 @@ class BuildEnvironment(common.BuildEnvironment):
         print 'Copying apk %s to: %s' % (source_apkpath, out_abs)
       shutil.copy2(source_apkpath, out_abs)
 
+  def get_apk_input_fingerprint(self, path='.'):
+    """Calculate a fingerprint of the inputs of an APK build.
+
+    The fingerprint covers the name, size and modification time of each of
+    the project's build files, sources, resources, assets and libraries,
+    the manifests, sources, resources, assets and libraries of the library
+    projects it references (see get_library_references()) along with the ant
+    flags, ant target and SDK used to build the project.
+
+    Args:
+      path: Optional relative path from project directory to project to build.
+
+    Returns:
+      Hexadecimal fingerprint string or None if the inputs can't be read.
+    """
+    project = self.get_project_directory(path=path)
+    fingerprint = hashlib.sha1()
+    for value in (self.ant_target, self.ant_flags, self.sdk_home):
+      fingerprint.update('%s\0' % value)
+    inputs = [(project, _APK_INPUTS)] + [
+        (library, _APK_LIBRARY_INPUTS)
+        for library in BuildEnvironment.get_library_references(project)]
+    try:
+      for directory, names in inputs:
+        for name in names:
+          input_path = os.path.join(directory, name)
+          if not os.path.isdir(input_path):
+            filenames = [input_path] if os.path.exists(input_path) else []
+          else:
+            filenames = []
+            for root, dirs, files in os.walk(input_path):
+              dirs.sort()
+              filenames.extend([os.path.join(root, f) for f in sorted(files)])
+          for filename in filenames:
+            file_stat = os.stat(filename)
+            fingerprint.update('%s\0%d\0%r\0' % (
+                os.path.relpath(filename, project), file_stat.st_size,
+                file_stat.st_mtime))
+    except OSError:
+      return None
+    return fingerprint.hexdigest()
+
+  @staticmethod
+  def get_library_references(project):
+    """Get the library projects referenced by a project.
+
+    Library projects are read from the android.library.reference.N entries
+    of the project's project.properties file, including the libraries
+    referenced by each library project.
+
+    Args:
+      project: Absolute path of the project.
+
+    Returns:
+      List of absolute paths of library projects in the order they're
+      referenced, each library is only listed once.
+    """
+    libraries = []
+    pending = [project]
+    while pending:
+      directory = pending.pop(0)
+      properties = BuildEnvironment._read_file(
+          os.path.join(directory, 'project.properties'))
+      if not properties:
+        continue
+      for reference in _PROJECT_PROPERTIES_LIBRARY_REFERENCE.findall(
+          properties):
+        library = os.path.normpath(os.path.join(
+            directory, reference.replace('\\', '/')))
+        if library != project and library not in libraries:
+          libraries.append(library)
+          pending.append(library)
+    return libraries
+
+  @staticmethod
+  def _read_file(filename):
+    """Read the contents of a file.
+
+    Args:
+      filename: Name of the file to read.
+
+    Returns:
+      Contents of the file or None if it can't be read.
+    """
+    try:
+      with open(filename) as f:
+        return f.read()
+    except IOError:
+      return None
+
   @staticmethod
   def generate_password():
     """Generate a psuedo random password.
@@ -1021,12 +1630,153 @@ class BuildEnvironment(common.BuildEnvironment):
     """
     return '%08x' % (random.random() * 16 ** 8)
 
+  @contextlib.contextmanager
+  def signing_session(self):
+    """Share the key used to sign APKs within a with statement.
+
+    The key used to sign APKs (a keystore converted from apk_keycertpair or
+    an ephemeral keystore) is generated when the first APK is signed and
+    removed when the outermost with statement exits.  This is safe to use
+    while APKs are signed concurrently.
+    """
+    with self._signing_lock:
+      self._signing_session_depth += 1
+    try:
+      yield
+    finally:
+      with self._signing_lock:
+        self._signing_session_depth -= 1
+        if not self._signing_session_depth and self._signing_key:
+          temp_directory = self._signing_key[3]
+          self._signing_key = None
+          if temp_directory and os.path.exists(temp_directory):
+            if self.verbose:
+              print 'Removing temporary keystore %s' % temp_directory
+            shutil.rmtree(temp_directory)
+
+  def _get_signing_key(self):
+    """Get the key used to sign APKs in the current signing session.
+
+    Returns:
+      (keystore, passfile, alias) tuple where keystore is the path of the
+      keystore, passfile is the path of a file containing the keystore
+      password and alias is the alias of the key in the keystore.
+
+    Raises:
+      SubCommandError: openssl or keytool invocation failed.
+      ToolPathError: keytool location not found in $PATH.
+      ConfigurationError: User specified some but not all signing parameters.
+    """
+    with self._signing_lock:
+      if not self._signing_key:
+        self._signing_key = self._create_signing_key()
+      return self._signing_key[:3]
+
+  def _create_signing_key(self):
+    """Create or select the key used to sign APKs.
+
+    If a key / cert pair is specified, a temporary keystore is generated from
+    the pair.  If any of keystore, password file or alias are not specified a
+    temporary keystore with a random password and alias is created.  This
+    facilitates testing release builds when the release keystore is not
+    available (such as in a continuous testing environment).
+
+    Returns:
+      (keystore, passfile, alias, temp_directory) tuple where temp_directory
+      is a directory which should be removed when the key is no longer
+      required or None.
+
+    Raises:
+      SubCommandError: openssl or keytool invocation failed.
+      ToolPathError: keytool location not found in $PATH.
+      ConfigurationError: User specified some but not all signing parameters.
+    """
+    if self.apk_keycertpair:
+      temp_directory = tempfile.mkdtemp()
+      try:
+        key = os.path.join(temp_directory, 'key.pem')
+        self.run_subprocess(('openssl', 'pkcs8', '-inform', 'DER',
+                             '-nocrypt', '-in', self.apk_keycertpair[0],
+                             '-out', key))
+
+        p12 = os.path.join(temp_directory, 'key.p12')
+        passfile = os.path.join(temp_directory, 'password')
+        password = BuildEnvironment.generate_password()
+        with open(passfile, 'w') as pf:
+          if self._posix:
+            os.fchmod(pf.fileno(), stat.S_IRUSR | stat.S_IWUSR)
+          pf.write(password)
+
+        alias = BuildEnvironment.generate_password()
+        self.run_subprocess(('openssl', 'pkcs12', '-export', '-in',
+                             self.apk_keycertpair[1], '-inkey', key,
+                             '-out', p12, '-password', 'pass:' + password,
+                             '-name', alias))
+        os.unlink(key)
+
+        keystore = os.path.join(temp_directory, 'temp.keystore')
+        self.run_subprocess(('keytool', '-importkeystore', '-deststorepass',
+                             password, '-destkeystore', keystore,
+                             '-srckeystore', p12, '-srcstoretype', 'PKCS12',
+                             '-srcstorepass', password))
+        os.unlink(p12)
+      except:
+        shutil.rmtree(temp_directory)
+        raise
+      return (keystore, passfile, alias, temp_directory)
+
+    keystore = self.apk_keystore
+    passfile = self.apk_passfile
+    alias = self.apk_keyalias
+    if keystore and passfile and alias:
+      return (keystore, passfile, alias, None)
+
+    # If the user specifies any of these, they need to specify them all,
+    # otherwise we may overwrite one of them.
+    for specified in (keystore, passfile, alias):
+      if specified:
+        raise common.ConfigurationError(specified,
+                                        ('Must specify all of keystore, '
+                                         'password file, and alias'))
+
+    temp_directory = tempfile.mkdtemp()
+    try:
+      keystore = os.path.join(temp_directory, 'ephemeral.keystore')
+      passfile = os.path.join(temp_directory, 'ephemeral.password')
+      if self.verbose:
+        print ('Creating ephemeral keystore file %s and password file %s' %
+               (keystore, passfile))
+
+      password = BuildEnvironment.generate_password()
+      with open(passfile, 'w') as pf:
+        if self._posix:
+          os.fchmod(pf.fileno(), stat.S_IRUSR | stat.S_IWUSR)
+        pf.write(password)
+
+      alias = 'ephemeral'
+
+      # NOTE: The password is passed via the command line for compatibility
+      # with JDK 6.  Move to use -storepass:file and -keypass:file when
+      # JDK 7 is a requirement for Android development.
+      acmd = [self._find_binary(BuildEnvironment.KEYTOOL), '-genkeypair',
+              '-v', '-dname', 'cn=, ou=%s, o=fpl' % alias, '-storepass',
+              password, '-keypass', password, '-keystore', keystore,
+              '-alias', alias, '-keyalg', 'RSA', '-keysize', '2048',
+              '-validity', '60']
+      self.run_subprocess(acmd)
+    except:
+      shutil.rmtree(temp_directory)
+      raise
+    return (keystore, passfile, alias, temp_directory)
+
+  @trace.traced()
   def _sign_apk(self, source, target):
     """This function signs an Android APK, optionally generating a key.
 
     This function signs an APK using a keystore and password as configured
     in the build configuration. If none are configured, it generates an
-    ephemeral key good for 60 days.
+    ephemeral key good for 60 days.  The key is shared by all APKs signed
+    within a signing_session().
 
     Args:
       source: Absolute path to source APK to sign.
@@ -1042,91 +1792,13 @@ class BuildEnvironment(common.BuildEnvironment):
     if self.ant_target is 'debug':
       return
 
-    keystore = self.apk_keystore
-    passfile = self.apk_passfile
-    alias = self.apk_keyalias
-
-    # If any of keystore, passwdfile, or alias are None we will create a
-    # temporary keystore with a random password and alias and remove it after
-    # signing. This facilitates testing release builds when the release
-    # keystore is not available (such as in a continuous testing environment).
-    ephemeral = False
-
     # Exit and don't sign if the source file is older than the target.
     if os.path.exists(target):
       if os.path.getmtime(source) < os.path.getmtime(target):
         return
 
-    # If a key / cert pair is specified, generate a temporary key store to sign
-    # the APK.
-    temp_directory = ''
-    if self.apk_keycertpair:
-      key = tempfile.NamedTemporaryFile()
-      self.run_subprocess(('openssl', 'pkcs8', '-inform', 'DER', '-nocrypt',
-                           '-in', self.apk_keycertpair[0], '-out', key.name))
-
-      p12 = tempfile.NamedTemporaryFile()
-      password_file = tempfile.NamedTemporaryFile()
-      password = BuildEnvironment.generate_password()
-      passfile = password_file.name
-      password_file.write(password)
-      password_file.flush()
-
-      alias = BuildEnvironment.generate_password()
-      self.run_subprocess(('openssl', 'pkcs12', '-export', '-in',
-                           self.apk_keycertpair[1], '-inkey', key.name,
-                           '-out', p12.name, '-password', 'pass:' + password,
-                           '-name', alias))
-      key.close()
-
-      temp_directory = tempfile.mkdtemp()
-      keystore = os.path.join(temp_directory, 'temp.keystore')
-      self.run_subprocess(('keytool', '-importkeystore', '-deststorepass',
-                           password, '-destkeystore', keystore,
-                           '-srckeystore', p12.name, '-srcstoretype', 'PKCS12',
-                           '-srcstorepass', password))
-      p12.close()
-
-    try:
-      if not keystore or not passfile or not alias:
-        # If the user specifies any of these, they need to specify them all,
-        # otherwise we may overwrite one of them.
-        if keystore:
-          raise common.ConfigurationError(keystore,
-                                          ('Must specify all of keystore, '
-                                           'password file, and alias'))
-        if passfile:
-          raise common.ConfigurationError(passfile,
-                                          ('Must specify all of keystore, '
-                                           'password file, and alias'))
-        if alias:
-          raise common.ConfigurationError(alias,
-                                          ('Must specify all of keystore, '
-                                           'password file, and alias'))
-        ephemeral = True
-        keystore = source + '.keystore'
-        passfile = source + '.password'
-        if self.verbose:
-          print ('Creating ephemeral keystore file %s and password file %s' %
-                 (keystore, passfile))
-
-        password = BuildEnvironment.generate_password()
-        with open(passfile, 'w') as pf:
-          if self._posix:
-            os.fchmod(pf.fileno(), stat.S_IRUSR | stat.S_IWUSR)
-          pf.write(password)
-
-        alias = os.path.basename(source).split('.')[0]
-
-        # NOTE: The password is passed via the command line for compatibility
-        # with JDK 6.  Move to use -storepass:file and -keypass:file when
-        # JDK 7 is a requirement for Android development.
-        acmd = [self._find_binary(BuildEnvironment.KEYTOOL), '-genkeypair',
-                '-v', '-dname', 'cn=, ou=%s, o=fpl' % alias, '-storepass',
-                password, '-keypass', password, '-keystore', keystore,
-                '-alias', alias, '-keyalg', 'RSA', '-keysize', '2048',
-                '-validity', '60']
-        self.run_subprocess(acmd)
+    with self.signing_session():
+      keystore, passfile, alias = self._get_signing_key()
 
       tmpapk = target + '.tmp'
 
@@ -1161,17 +1833,6 @@ class BuildEnvironment(common.BuildEnvironment):
       acmd += ['4', tmpapk, target]  # alignment == 4
       self.run_subprocess(acmd)
 
-    finally:
-      if temp_directory and os.path.exists(temp_directory):
-        shutil.rmtree(temp_directory)
-      if ephemeral:
-        if self.verbose:
-          print 'Removing ephemeral keystore and password files'
-        if os.path.exists(keystore):
-          os.unlink(keystore)
-        if os.path.exists(passfile):
-          os.unlink(passfile)
-
   def find_projects(self, path='.', exclude_dirs=None):
     """Find all Android projects under the specified path.
 
@@ -1188,16 +1849,44 @@ class BuildEnvironment(common.BuildEnvironment):
     """
     project = self.get_project_directory(path=path)
 
-    apk_dir_set = set()
-    module_dir_set = set()
-
     # Exclude paths where buildutil or ndk-build may generate or copy files.
     exclude = (exclude_dirs if exclude_dirs else []) + ['bin', 'obj', 'res']
 
     if type(exclude_dirs) is list:
       exclude += exclude_dirs
 
+    # Projects are found once per environment, so that the build, install and
+    # run steps share the result, and optionally once per change to the tree.
+    key = (project, tuple(sorted(set(exclude))))
+    found = self._found_projects.get(key)
+    if found is None:
+      index = None
+      if self.project_index:
+        index = project_index.ProjectIndex(project, exclude)
+        found = index.load()
+      if found is None:
+        found = self._search_projects(project, exclude, index)
+      self._found_projects[key] = found
+    return (list(found[0]), list(found[1]))
+
+  def _search_projects(self, project, exclude, index=None):
+    """Search a directory tree for Android projects.
+
+    Args:
+      project: Directory to search.
+      exclude: List of directory names to exclude from the search.
+      index: Optional project_index.ProjectIndex which is updated with the
+        projects that are found.
+
+    Returns:
+      (apk_dirs, lib_dirs) tuple, see find_projects().
+    """
+    apk_dir_set = set()
+    module_dir_set = set()
+    searched_directories = []
+
     for root, dirs, files in os.walk(project, followlinks=True):
+      searched_directories.append(root)
       for ex in exclude:
         if ex in dirs:
           dirs.remove(ex)
@@ -1210,7 +1899,13 @@ class BuildEnvironment(common.BuildEnvironment):
           p = os.path.dirname(p)
         module_dir_set.add(p)
 
-    return (list(apk_dir_set), list(module_dir_set))
+    found = (list(apk_dir_set), list(module_dir_set))
+    if index:
+      directory_mtimes = project_index.get_directory_mtimes(
+          searched_directories)
+      if directory_mtimes is not None:
+        index.save(found[0], found[1], directory_mtimes)
+    return found
 
   def build_all(self, path='.', apk_output='apks', lib_output='libs',
                 exclude_dirs=None):
@@ -1247,9 +1942,24 @@ class BuildEnvironment(common.BuildEnvironment):
       print 'Found library projects in: %s' % str(lib_dirs)
 
     try:
-      self.build_android_libraries(lib_dirs, output=lib_output)
-      for apk in apk_dirs:
-        self.build_android_apk(path=apk, output=apk_output)
+      with self.ccache_report():
+        dependencies = None
+        if self.library_jobs > 1 or self.artifact_cache:
+          # Build libraries after the libraries they depend upon.
+          lib_dirs, dependencies = self._get_library_build_order(lib_dirs)
+        if dependencies is not None:
+          self.build_android_libraries(lib_dirs, output=lib_output,
+                                       dependencies=dependencies)
+        else:
+          self.build_android_libraries(lib_dirs, output=lib_output)
+        apk_jobs = self.apk_jobs or multiprocessing.cpu_count()
+        # Generate key material once for all APKs.
+        with self.signing_session():
+          if apk_jobs <= 1 or len(apk_dirs) <= 1:
+            for apk in apk_dirs:
+              self.build_android_apk(path=apk, output=apk_output)
+          else:
+            self.build_android_apks(apk_dirs, apk_output, apk_jobs)
       retval = 0
 
     except common.Error as e:
@@ -1262,6 +1972,74 @@ class BuildEnvironment(common.BuildEnvironment):
 
     return (retval, errmsg)
 
+  @staticmethod
+  def _get_library_build_order(lib_dirs):
+    """Order library projects so that each follows the projects it depends on.
+
+    The dependencies between projects are derived from their makefiles, which
+    can report false dependencies (e.g if projects define modules with the
+    same name) so a warning is displayed rather than failing the build if
+    they can't be satisfied.
+
+    Args:
+      lib_dirs: List of library project directories in discovery order.
+
+    Returns:
+      (lib_dirs, dependencies) tuple where lib_dirs is the list of projects
+      in build order and dependencies is a dictionary which maps each project
+      to the set of projects it depends upon.  If the projects can't be
+      ordered lib_dirs is returned unmodified and dependencies is None.
+    """
+    try:
+      graph = android_mk.ModuleGraph(lib_dirs)
+      return (graph.topological_order(), graph.dependencies)
+    except jobs.DependencyError as e:
+      print >> sys.stderr, (
+          'Warning: %s, building library projects in the order they were '
+          'found.' % e.error_message)
+      return (lib_dirs, None)
+
+  def build_android_apks(self, apk_dirs, output, apk_jobs):
+    """Build a set of APK projects concurrently.
+
+    The output of each project's build is written to
+    output/logs/PROJECT.log and a summary of the projects that succeeded
+    and failed is displayed when all projects have been built.  Projects
+    which reference the same library project are built one at a time, since
+    each build writes to the library's bin and gen directories.
+
+    Args:
+      apk_dirs: List of paths of APK projects relative to the project
+        directory.
+      output: Path relative to the project directory of the APK output
+        directory.
+      apk_jobs: Maximum number of projects to build concurrently.
+
+    Raises:
+      common.Error: The first error raised when building an APK.
+      IOError: An error occurred writing or copying an APK.
+    """
+    log_directory = os.path.join(self.get_project_directory(path=output),
+                                 'logs')
+
+    def build_apk(apk):
+      """Build an APK logging the output of the build."""
+      name = os.path.relpath(self.get_project_directory(path=apk),
+                             self.project_directory)
+      log_filename = os.path.join(log_directory, '%s.log' % (
+          re.sub(r'[^\w.-]', '_', name)))
+      with self.subprocess_log(log_filename):
+        self.build_android_apk(path=apk, output=output)
+
+    libraries = dict([
+        (apk, BuildEnvironment.get_library_references(
+            self.get_project_directory(path=apk))) for apk in apk_dirs])
+    results = jobs.run_jobs(apk_dirs, self.bind_trace(build_apk), apk_jobs,
+                            fail_fast=False, resources=libraries)
+    print os.linesep.join(results.summary())
+    if results.failures:
+      raise results.failures[0][1]
+
   def get_adb_devices(self):
     """Get the set of attached devices.
 
@@ -1375,6 +2153,7 @@ class BuildEnvironment(common.BuildEnvironment):
     """
     return str(device) if self.verbose else device.serial
 
+  @trace.traced()
   def install_android_apk(self, path='.', adb_device=None, force_install=True):
     """Install an android apk on the given device.
 
@@ -1502,15 +2281,71 @@ class BuildEnvironment(common.BuildEnvironment):
     Returns:
       int of the device's pixel density.
     """
+    return int(self.get_device_property('ro.sf.lcd_density',
+                                        adb_device=adb_device))
+
+  def get_device_property_cache(self, device):
+    """Get the on-disk property cache of a device.
+
+    Args:
+      device: AdbDevice instance.
+
+    Returns:
+      device_cache.DevicePropertyCache instance for the device.
+    """
+    # The ADB server assigns a new transport_id each time a device connects
+    # so the cache, along with the boot identity it has verified, is reused
+    # for the lifetime of the connection.  transport_ids are reused when the
+    # ADB server restarts so the boot identity stored in the cache is used to
+    # detect reboots between invocations.
+    transport_id = getattr(device, 'transport_id', '')
+    cache = self._device_property_caches.get((device.serial, transport_id))
+    if not cache:
+      cache = device_cache.DevicePropertyCache(
+          device.serial, self.adb_property_cache_ttl)
+      if transport_id:
+        self._device_property_caches[(device.serial, transport_id)] = cache
+    return cache
+
+  def get_device_property(self, name, adb_device=None):
+    """Get a property (getprop) of a device connected to adb.
+
+    If adb_property_cache_ttl is non-zero, all properties of the device are
+    retrieved and cached on the host.
+
+    Args:
+      name: Name of the property to retrieve.
+      adb_device: Serial of the device to query. If none specified,
+        the only device connected will be used.
+
+    Returns:
+      String value of the property, an empty string if the property isn't set.
+    """
     adb_path = self._find_binary(BuildEnvironment.ADB)
     device = self.check_adb_devices(adb_device=adb_device)
     adb_device_arg = self.get_adb_device_argument(adb_device=device.serial)
-    density, _ = self.run_subprocess(('%s %s shell getprop ro.sf.lcd_density' %
-                                      (adb_path, adb_device_arg)
-                                     ),
-                                     shell=True,
+    if self.adb_property_cache_ttl > 0:
+      cache = self.get_device_property_cache(device)
+      properties = cache.get(device_cache.GETPROP_KEY)
+      if properties is None:
+        # Read the boot identity in the same shell as the properties so a
+        # cache miss costs a single round trip to the device.
+        out, _ = self.run_subprocess('%s %s shell "%s"' % (
+            adb_path, adb_device_arg,
+            device_cache.BOOT_IDENTITY_GETPROP_COMMAND), shell=True,
                                      capture=True)
-    return int(density)
+        properties = device_cache.parse_getprop_output(out)
+        boot_id, boot_time = device_cache.parse_boot_identity(out)
+        # Reboots can't be detected without a boot identity so the
+        # properties are only cached if it's available.
+        if boot_id or boot_time is not None:
+          cache.set_boot_identity(boot_id, boot_time)
+          cache.set(device_cache.GETPROP_KEY, properties)
+      return properties.get(name, '')
+    value, _ = self.run_subprocess(('%s %s shell getprop %s' %
+                                    (adb_path, adb_device_arg, name)),
+                                   shell=True, capture=True)
+    return value.strip()
 
 
   def take_screencap(self, destination, adb_device=None):
@@ -1543,6 +2378,7 @@ class BuildEnvironment(common.BuildEnvironment):
                          (adb_path, adb_device_arg, temp_filename)),
                         shell=True)
 
+  @trace.traced()
   def run_android_apk(self, path='.', adb_device=None, wait=True,
                       end_match=None, echo_log=True, apk_missing_allowed=True):
     """Run an android apk on the given device.
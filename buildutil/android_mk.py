@@ -0,0 +1,333 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""@file buildutil/android_mk.py Android.mk dependency graph.
+
+This module scans the Android.mk files of NDK projects for the modules they
+define (LOCAL_MODULE), the modules they link against
+(LOCAL_STATIC_LIBRARIES, LOCAL_WHOLE_STATIC_LIBRARIES and
+LOCAL_SHARED_LIBRARIES) and the modules they import
+($(call import-module,...)).  ModuleGraph combines this information to
+derive the dependencies between projects.
+
+The scanner does not evaluate makefiles so references to variables and
+functions other than those listed above are ignored.
+
+@package fplutil.buildutil.android_mk Android.mk dependency graph.
+"""
+
+import os
+import re
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.jobs as jobs
+
+## Name of the makefile which describes the modules of an NDK project.
+ANDROID_MK = 'Android.mk'
+
+## @cond FPLUTIL_INTERNAL
+# Matches variable assignments.
+_ASSIGNMENT_RE = re.compile(r'^\s*(LOCAL_[A-Z_]+)\s*(:=|\+=|\?=|=)\s*(.*)$')
+# Matches includes of build system makefiles e.g $(BUILD_SHARED_LIBRARY).
+_INCLUDE_RE = re.compile(r'^\s*-?include\s+(.*)$')
+# Matches module imports.
+_IMPORT_MODULE_RE = re.compile(r'\$\(call\s+import-module\s*,\s*([^)\s]+)\s*\)')
+# Variables which reference modules linked by a module.
+_LIBRARY_VARIABLES = ('LOCAL_STATIC_LIBRARIES', 'LOCAL_WHOLE_STATIC_LIBRARIES',
+                      'LOCAL_SHARED_LIBRARIES')
+## @endcond FPLUTIL_INTERNAL
+
+
+class Module(object):
+
+  """A module defined in an Android.mk file.
+
+  Attributes:
+    name: Name of the module.
+    project: Directory of the project which defines the module.
+    makefile: Makefile which defines the module.
+    libraries: List of the names of modules this module links against.
+  """
+
+  def __init__(self, name, project, makefile, libraries):
+    """Initialize the instance.
+
+    Args:
+      name: Name of the module.
+      project: Directory of the project which defines the module.
+      makefile: Makefile which defines the module.
+      libraries: List of the names of modules this module links against.
+    """
+    self.name = name
+    self.project = project
+    self.makefile = makefile
+    self.libraries = libraries
+
+
+def _read_logical_lines(makefile):
+  """Read a makefile joining continued lines and removing comments.
+
+  Args:
+    makefile: Path of the makefile to read.
+
+  Returns:
+    List of lines.
+  """
+  with open(makefile) as f:
+    text = f.read()
+  lines = []
+  for line in re.sub(r'\\\r?\n', ' ', text).splitlines():
+    line = line.split('#', 1)[0].rstrip()
+    if line:
+      lines.append(line)
+  return lines
+
+
+def parse_makefile(makefile, project=None):
+  """Scan an Android.mk file for modules and imports.
+
+  Makefiles included relative to $(LOCAL_PATH) are scanned as well.
+
+  Args:
+    makefile: Path of the makefile to scan.
+    project: Directory of the project which contains the makefile, defaults
+      to the directory containing the makefile.
+
+  Returns:
+    (modules, imports) tuple where modules is a list of Module instances and
+    imports is a list of module paths passed to import-module.
+  """
+  makefile_directory = os.path.dirname(os.path.abspath(makefile))
+  project = project or makefile_directory
+  modules = []
+  imports = []
+  variables = {}
+  pending_makefiles = [makefile]
+  scanned = set()
+  while pending_makefiles:
+    current = pending_makefiles.pop(0)
+    if current in scanned or not os.path.exists(current):
+      continue
+    scanned.add(current)
+    for line in _read_logical_lines(current):
+      imports.extend(_IMPORT_MODULE_RE.findall(line))
+      assignment = _ASSIGNMENT_RE.match(line)
+      if assignment:
+        name, operator, value = assignment.groups()
+        words = [w for w in value.split() if not w.startswith('$')]
+        if operator == '+=':
+          variables[name] = variables.get(name, []) + words
+        elif operator != '?=' or name not in variables:
+          variables[name] = words
+        continue
+      include = _INCLUDE_RE.match(line)
+      if not include:
+        continue
+      included = include.group(1).strip()
+      if included == '$(CLEAR_VARS)':
+        variables = {}
+      elif included.startswith('$(BUILD_') or included.startswith(
+          '$(PREBUILT_'):
+        module_name = variables.get('LOCAL_MODULE')
+        if module_name:
+          libraries = []
+          for library_variable in _LIBRARY_VARIABLES:
+            libraries.extend(variables.get(library_variable, []))
+          modules.append(Module(module_name[0], project, current, libraries))
+      elif included.startswith('$(LOCAL_PATH)/'):
+        pending_makefiles.append(os.path.join(
+            makefile_directory, included[len('$(LOCAL_PATH)/'):]))
+  return (modules, imports)
+
+
+def get_project_makefile(project):
+  """Get the Android.mk file of an NDK project.
+
+  Args:
+    project: Directory of the project.
+
+  Returns:
+    Path of the project's Android.mk file or None if it isn't found.
+  """
+  for makefile in (os.path.join(project, 'jni', ANDROID_MK),
+                   os.path.join(project, ANDROID_MK)):
+    if os.path.exists(makefile):
+      return makefile
+  return None
+
+
+class ModuleGraph(object):
+
+  """Graph of the dependencies between NDK projects.
+
+  Attributes:
+    projects: List of project directories in the graph.
+    modules: Dictionary of Module instances indexed by module name.
+    dependencies: Dictionary which maps each project to the set of projects
+      it depends upon.
+  """
+
+  def __init__(self, projects):
+    """Scan the makefiles of a set of projects and build the graph.
+
+    Args:
+      projects: List of project directories.  Each directory contains either
+        an Android.mk file or a jni directory which contains an Android.mk
+        file.  Projects without a makefile have no dependencies.
+    """
+    self.projects = list(projects)
+    self.modules = {}
+    self.dependencies = dict([(p, set()) for p in self.projects])
+    project_imports = {}
+    for project in self.projects:
+      makefile = get_project_makefile(project)
+      if not makefile:
+        continue
+      modules, imports = parse_makefile(makefile, project=project)
+      for module in modules:
+        self.modules.setdefault(module.name, module)
+      project_imports[project] = imports
+
+    for project in self.projects:
+      for name in project_imports.get(project, []):
+        imported_project = self._find_imported_project(name)
+        if imported_project and imported_project != project:
+          self.dependencies[project].add(imported_project)
+    for module in self.modules.itervalues():
+      for library in module.libraries:
+        dependency = self.modules.get(library)
+        if dependency and dependency.project != module.project:
+          self.dependencies[module.project].add(dependency.project)
+
+  def _find_imported_project(self, module_path):
+    """Find the project imported via $(call import-module,module_path).
+
+    The NDK searches NDK_MODULE_PATH for module_path, since the search path
+    isn't known the project whose path ends with module_path is selected.
+
+    Args:
+      module_path: Path passed to import-module.
+
+    Returns:
+      Project directory or None if the imported module isn't in the graph.
+    """
+    suffix = os.path.normpath(module_path).split(os.sep)
+    for project in self.projects:
+      for directory in (project, os.path.join(project, 'jni')):
+        components = os.path.normpath(directory).split(os.sep)
+        if components[-len(suffix):] == suffix:
+          return project
+    return None
+
+  def get_dependents(self):
+    """Get the projects that depend upon each project.
+
+    Returns:
+      Dictionary which maps each project to the set of projects that directly
+      depend upon it.
+    """
+    dependents = dict([(p, set()) for p in self.projects])
+    for project, dependencies in self.dependencies.iteritems():
+      for dependency in dependencies:
+        dependents[dependency].add(project)
+    return dependents
+
+  def topological_order(self):
+    """Order projects so that each project follows its dependencies.
+
+    Projects which don't depend upon each other retain their order in the
+    projects list.
+
+    Returns:
+      List of project directories.
+
+    Raises:
+      jobs.DependencyError: If projects have cyclic dependencies.
+    """
+    order = []
+    ordered = set()
+    remaining = list(self.projects)
+    while remaining:
+      ready = [p for p in remaining if self.dependencies[p] <= ordered]
+      if not ready:
+        raise jobs.DependencyError(remaining)
+      for project in ready:
+        remaining.remove(project)
+        ordered.add(project)
+      order.extend(ready)
+    return order
+
+  def critical_path(self, costs=None):
+    """Find the most expensive chain of dependent projects.
+
+    Args:
+      costs: Optional dictionary of the cost (e.g build time) of each
+        project.  Projects which are not in the dictionary have a cost of 1.
+
+    Returns:
+      (path, cost) tuple where path is a list of project directories starting
+      with the project that has no dependencies and cost is the total cost
+      of the path.
+
+    Raises:
+      jobs.DependencyError: If projects have cyclic dependencies.
+    """
+    costs = costs or {}
+    path_costs = {}
+    predecessors = {}
+    for project in self.topological_order():
+      predecessor = None
+      cost = 0
+      for dependency in self.dependencies[project]:
+        if predecessor is None or path_costs[dependency] > cost:
+          predecessor = dependency
+          cost = path_costs[dependency]
+      path_costs[project] = cost + costs.get(project, 1)
+      predecessors[project] = predecessor
+    if not path_costs:
+      return ([], 0)
+    project = max(self.projects, key=lambda p: path_costs[p])
+    cost = path_costs[project]
+    path = []
+    while project is not None:
+      path.insert(0, project)
+      project = predecessors[project]
+    return (path, cost)
+
+  def affected_projects(self, changed_files):
+    """Find the projects which need to be rebuilt when files change.
+
+    Args:
+      changed_files: List of paths of modified files.
+
+    Returns:
+      Set of project directories which contain a changed file or depend,
+      directly or indirectly, upon a project which contains a changed file.
+    """
+    affected = set()
+    for filename in changed_files:
+      filename = os.path.abspath(filename)
+      for project in self.projects:
+        project_directory = os.path.join(os.path.abspath(project), '')
+        if filename.startswith(project_directory):
+          affected.add(project)
+    dependents = self.get_dependents()
+    pending = list(affected)
+    while pending:
+      for dependent in dependents[pending.pop()]:
+        if dependent not in affected:
+          affected.add(dependent)
+          pending.append(dependent)
+    return affected
@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.android_mk as android_mk
+import buildutil.jobs as jobs
+
+CORE_MK = """LOCAL_PATH := $(call my-dir)
+
+include $(CLEAR_VARS)
+LOCAL_MODULE := core
+LOCAL_SRC_FILES := core.c
+include $(BUILD_STATIC_LIBRARY)
+"""
+
+RENDER_MK = """LOCAL_PATH := $(call my-dir)
+
+include $(CLEAR_VARS)
+LOCAL_MODULE := render
+# LOCAL_STATIC_LIBRARIES := ignored
+LOCAL_STATIC_LIBRARIES := \\
+  core \\
+  $(MISSING)
+LOCAL_SHARED_LIBRARIES += log
+include $(BUILD_SHARED_LIBRARY)
+include $(LOCAL_PATH)/extra.mk
+"""
+
+EXTRA_MK = """include $(CLEAR_VARS)
+LOCAL_MODULE := render_extra
+include $(BUILD_STATIC_LIBRARY)
+"""
+
+GAME_MK = """LOCAL_PATH := $(call my-dir)
+
+include $(CLEAR_VARS)
+LOCAL_MODULE := game
+LOCAL_WHOLE_STATIC_LIBRARIES := render_extra
+include $(BUILD_SHARED_LIBRARY)
+$(call import-module,libs/audio)
+"""
+
+AUDIO_MK = """include $(CLEAR_VARS)
+LOCAL_MODULE := audio
+include $(BUILD_STATIC_LIBRARY)
+"""
+
+
+class AndroidMkTest(unittest.TestCase):
+  """Android.mk dependency graph unit tests."""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.core = self.write_makefile('core', CORE_MK)
+    self.render = self.write_makefile(os.path.join('render', 'jni'),
+                                      RENDER_MK)
+    self.write_makefile(os.path.join('render', 'jni'), EXTRA_MK, 'extra.mk')
+    self.game = self.write_makefile(os.path.join('game', 'jni'), GAME_MK)
+    self.audio = self.write_makefile(os.path.join('libs', 'audio'), AUDIO_MK)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def write_makefile(self, path, contents, name=android_mk.ANDROID_MK):
+    """Write a makefile returning the project directory that contains it."""
+    directory = os.path.join(self.directory, path)
+    if not os.path.exists(directory):
+      os.makedirs(directory)
+    with open(os.path.join(directory, name), 'w') as f:
+      f.write(contents)
+    if os.path.basename(directory) == 'jni':
+      directory = os.path.dirname(directory)
+    return directory
+
+  def test_parse_makefile(self):
+    modules, imports = android_mk.parse_makefile(
+        android_mk.get_project_makefile(self.render))
+    self.assertEqual(['render', 'render_extra'], [m.name for m in modules])
+    self.assertEqual(['core', 'log'], modules[0].libraries)
+    self.assertEqual([], modules[1].libraries)
+    self.assertEqual([], imports)
+    _, imports = android_mk.parse_makefile(
+        android_mk.get_project_makefile(self.game))
+    self.assertEqual(['libs/audio'], imports)
+
+  def test_dependencies(self):
+    graph = android_mk.ModuleGraph([self.game, self.render, self.core,
+                                    self.audio])
+    self.assertEqual(set([self.render, self.audio]),
+                     graph.dependencies[self.game])
+    self.assertEqual(set([self.core]), graph.dependencies[self.render])
+    self.assertEqual([self.core, self.audio, self.render, self.game],
+                     graph.topological_order())
+
+  def test_critical_path(self):
+    graph = android_mk.ModuleGraph([self.game, self.render, self.core,
+                                    self.audio])
+    self.assertEqual(([self.core, self.render, self.game], 3),
+                     graph.critical_path())
+    self.assertEqual(([self.audio, self.game], 11),
+                     graph.critical_path({self.audio: 10}))
+
+  def test_affected_projects(self):
+    graph = android_mk.ModuleGraph([self.game, self.render, self.core,
+                                    self.audio])
+    self.assertEqual(set([self.core, self.render, self.game]),
+                     graph.affected_projects([os.path.join(self.core,
+                                                           'core.c')]))
+    self.assertEqual(set(), graph.affected_projects(['/elsewhere.c']))
+
+  def test_cycle(self):
+    self.write_makefile('core', CORE_MK.replace(
+        'LOCAL_SRC_FILES', 'LOCAL_SHARED_LIBRARIES := render\nLOCAL_SRC'))
+    with self.assertRaises(jobs.DependencyError):
+      android_mk.ModuleGraph([self.render, self.core]).topological_order()
+
+
+if __name__ == '__main__':
+  unittest.main()
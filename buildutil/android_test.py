@@ -19,15 +19,21 @@ import argparse
 import os
 import platform
 import re
+import shutil
 import StringIO
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 import unittest
 import uuid
 sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
 import buildutil.android as android
+import buildutil.artifact_cache as artifact_cache
 import buildutil.common as common
 import buildutil.common_test as common_test
+import buildutil.device_cache as device_cache
 import buildutil.linux as linux
 
 
@@ -563,6 +569,44 @@ class AndroidBuildUtilTest(unittest.TestCase):
     self.assertRaises(android.AndroidManifest.MissingActivityError,
                       android.BuildEnvironment(defaults).parse_manifest)
 
+  def test_parse_manifest_cached(self):
+    manifest_xml = (
+        '<manifest '
+        '  xmlns:android="http://schemas.android.com/apk/res/android"\n'
+        '  package="%s">\n'
+        '  <uses-sdk android:minSdkVersion="1"/>\n'
+        '  <application>\n'
+        '    <activity android:name="android.app.NativeActivity">\n'
+        '      <meta-data android:name="android.app.lib_name"\n'
+        '                 android:value="test"/>\n'
+        '      <intent-filter>\n'
+        '       <action android:name="android.intent.action.MAIN"/>\n'
+        '       %s\n'
+        '      </intent-filter>\n'
+        '    </activity>\n'
+        '  </application>\n'
+        '</manifest>')
+    launcher = '<category android:name="android.intent.category.LAUNCHER"/>'
+    d = android.BuildEnvironment.build_defaults()
+    d['project_dir'] = tempfile.mkdtemp()
+    b = android.BuildEnvironment(d)
+    manifest_path = b.get_manifest_path()
+    try:
+      with open(manifest_path, 'w') as f:
+        f.write(manifest_xml % ('com.example.a', launcher))
+      manifest = b.parse_manifest()
+      self.assertIs(manifest, b.parse_manifest())
+      with open(manifest_path, 'w') as f:
+        f.write(manifest_xml % ('com.example.ab', launcher))
+      self.assertEqual('com.example.ab', b.parse_manifest().package_name)
+      with open(manifest_path, 'w') as f:
+        f.write(manifest_xml % ('com.example.a', ''))
+      for _ in range(2):
+        with self.assertRaises(android.AndroidManifest.MissingActivityError):
+          b.parse_manifest()
+    finally:
+      shutil.rmtree(d['project_dir'])
+
   def test_manifest_parse_error(self):
     f = FileMock('<manifest ')
     m = android.AndroidManifest(None)
@@ -661,6 +705,258 @@ class AndroidBuildUtilTest(unittest.TestCase):
     with self.assertRaises(common.ToolPathError):
       b.build_android_libraries([l], output=l, check_ndk_install_path=False)
 
+  def test_build_libraries_concurrently(self):
+    d = android.BuildEnvironment.build_defaults()
+    b = android.BuildEnvironment(d)
+    b.project_directory = tempfile.mkdtemp()
+    b.cpu_count = '4'
+    b.library_jobs = 2
+    commands = []
+
+    def run_subprocess(args, log_filename=None):
+      commands.append((args, log_filename))
+      if args[3].endswith('bad'):
+        raise common.SubCommandError(args, 1)
+
+    b.run_subprocess = run_subprocess
+    try:
+      b.build_android_libraries(['a', 'b', os.path.join('c', 'd')],
+                                check_ndk_install_path=False,
+                                dependencies={os.path.join('c', 'd'): ['a',
+                                                                       'b']})
+      self.assertEqual(3, len(commands))
+      self.assertEqual(['-j2'] * 3, [c[0][1] for c in commands])
+      self.assertTrue(commands[-1][0][3].endswith(os.path.join('c', 'd')))
+      self.assertEqual(
+          os.path.join(b.project_directory, 'c', 'd', 'obj',
+                       'ndk-build-c_d.log'), commands[-1][1])
+
+      del commands[:]
+      with self.assertRaises(common.SubCommandError):
+        b.build_android_libraries(['bad', 'b', 'c'],
+                                  check_ndk_install_path=False,
+                                  dependencies={'c': ['bad']})
+      self.assertNotIn('c', [os.path.basename(c[0][3]) for c in commands])
+    finally:
+      shutil.rmtree(b.project_directory)
+
+  def test_build_libraries_artifact_cache(self):
+    d = android.BuildEnvironment.build_defaults()
+    b = android.BuildEnvironment(d)
+    directory = tempfile.mkdtemp()
+    b.project_directory = os.path.join(directory, 'project')
+    b.artifact_cache = artifact_cache.ArtifactCache(
+        os.path.join(directory, 'cache'), 1024 * 1024)
+    commands = []
+
+    def run_subprocess(args, log_filename=None):
+      commands.append(args)
+      libs = os.path.join(args[3], 'libs')
+      if not os.path.exists(libs):
+        os.makedirs(libs)
+      with open(os.path.join(libs, 'liba.so'), 'w') as f:
+        f.write('lib')
+      # Each project compiles a source and a header shared between projects.
+      objs = os.path.join(args[3], 'obj', 'local', 'armeabi', 'objs', 'a')
+      if not os.path.exists(objs):
+        os.makedirs(objs)
+      with open(os.path.join(objs, 'a.o.d'), 'w') as f:
+        f.write('obj/local/armeabi/objs/a/a.o: jni/a.cc ../include/shared.h')
+
+    def write_file(filename, contents):
+      filename = os.path.join(b.project_directory, filename)
+      if not os.path.exists(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+      with open(filename, 'w') as f:
+        f.write(contents)
+
+    b.run_subprocess = run_subprocess
+    try:
+      write_file(os.path.join('include', 'shared.h'), 'shared')
+      for project in ('a', 'b'):
+        write_file(os.path.join(project, 'jni', 'Android.mk'), project)
+        write_file(os.path.join(project, 'jni', 'a.cc'), project)
+        write_file(os.path.join(project, 'jni', 'unused.cc'), project)
+      dependencies = {'b': ['a']}
+      b.build_android_libraries(['a', 'b'], check_ndk_install_path=False,
+                                dependencies=dependencies)
+      self.assertEqual(2, len(commands))
+
+      # Outputs of unmodified projects are restored from the cache.
+      shutil.rmtree(os.path.join(b.project_directory, 'a', 'libs'))
+      b.build_android_libraries(['a', 'b'], check_ndk_install_path=False,
+                                dependencies=dependencies)
+      self.assertEqual(2, len(commands))
+      self.assertTrue(os.path.exists(os.path.join(
+          b.project_directory, 'a', 'libs', 'liba.so')))
+
+      # Modifying a source which isn't compiled doesn't rebuild the project.
+      write_file(os.path.join('a', 'jni', 'unused.cc'), 'modified')
+      b.build_android_libraries(['a', 'b'], check_ndk_install_path=False,
+                                dependencies=dependencies)
+      self.assertEqual(2, len(commands))
+
+      # Modifying a project rebuilds the project and its dependents.
+      write_file(os.path.join('a', 'jni', 'Android.mk'), 'modified')
+      b.build_android_libraries(['a', 'b'], check_ndk_install_path=False,
+                                dependencies=dependencies)
+      self.assertEqual(4, len(commands))
+
+      # Modifying a header outside of the projects which is compiled by them
+      # rebuilds them.
+      write_file(os.path.join('include', 'shared.h'), 'modified')
+      b.build_android_libraries(['a', 'b'], check_ndk_install_path=False,
+                                dependencies=dependencies)
+      self.assertEqual(6, len(commands))
+
+      # Adding a source rebuilds the project as it may be compiled.
+      write_file(os.path.join('b', 'jni', 'b.cc'), 'b')
+      b.build_android_libraries(['a', 'b'], check_ndk_install_path=False,
+                                dependencies=dependencies)
+      self.assertEqual(7, len(commands))
+    finally:
+      shutil.rmtree(directory)
+
+  def test_get_library_inputs_shared_output(self):
+    d = android.BuildEnvironment.build_defaults()
+    b = android.BuildEnvironment(d)
+    b.project_directory = tempfile.mkdtemp()
+
+    def write_file(filename, contents):
+      filename = os.path.join(b.project_directory, filename)
+      if not os.path.exists(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+      with open(filename, 'w') as f:
+        f.write(contents)
+
+    try:
+      for project in ('a', 'b'):
+        write_file(os.path.join(project, 'jni', 'Android.mk'),
+                   'include $(CLEAR_VARS)\n'
+                   'LOCAL_MODULE := %s\n'
+                   'include $(BUILD_SHARED_LIBRARY)\n' % project)
+        write_file(os.path.join(project, 'jni', '%s.cc' % project), project)
+        write_file(os.path.join('out', 'local', 'armeabi', 'objs', project,
+                                '%s.o.d' % project),
+                   'objs/%s/%s.o: ../%s/jni/%s.cc' % (project, project,
+                                                     project, project))
+      # Only the objects of modules defined by the project are read from the
+      # shared output directory.
+      self.assertEqual([os.path.join('a', 'jni', 'a.cc')],
+                       b._get_library_inputs(
+                           os.path.join('ndk', 'ndk-build'), 'a', 'out'))
+    finally:
+      shutil.rmtree(b.project_directory)
+
+  def test_build_apks_concurrently(self):
+    d = android.BuildEnvironment.build_defaults()
+    b = android.BuildEnvironment(d)
+    b.project_directory = tempfile.mkdtemp()
+    built = []
+
+    def build_android_apk(path='.', output=None):
+      built.append((path, output))
+      b.run_subprocess([sys.executable, '-c', 'print "building %s"' % path])
+      if path == 'bad':
+        raise common.SubCommandError(['ant'], 1)
+
+    b.build_android_apk = build_android_apk
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+      with self.assertRaises(common.SubCommandError):
+        b.build_android_apks(['a', 'bad', os.path.join('c', 'd')], 'apks', 2)
+      summary = sys.stdout.getvalue()
+      self.assertEqual([('a', 'apks'), ('bad', 'apks'),
+                        (os.path.join('c', 'd'), 'apks')], sorted(built))
+      self.assertIn('2 succeeded, 1 failed, 0 skipped', summary)
+      self.assertIn('FAILED bad', summary)
+      with open(os.path.join(b.project_directory, 'apks', 'logs',
+                             'c_d.log')) as f:
+        self.assertEqual('building %s\n' % os.path.join('c', 'd'), f.read())
+    finally:
+      sys.stdout = stdout
+      shutil.rmtree(b.project_directory)
+
+  def test_build_apks_sharing_library(self):
+    d = android.BuildEnvironment.build_defaults()
+    b = android.BuildEnvironment(d)
+    b.project_directory = tempfile.mkdtemp()
+    lock = threading.Lock()
+    running = []
+    concurrent = []
+
+    def build_android_apk(path='.', output=None):
+      with lock:
+        running.append(path)
+        concurrent.append(sorted(running))
+      time.sleep(0.05)
+      with lock:
+        running.remove(path)
+
+    b.build_android_apk = build_android_apk
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+      for project, properties in (
+          ('a', 'android.library.reference.1=../lib\n'),
+          ('b', 'android.library.reference.1=../lib\n'),
+          ('c', '')):
+        os.makedirs(os.path.join(b.project_directory, project))
+        with open(os.path.join(b.project_directory, project,
+                               'project.properties'), 'w') as f:
+          f.write(properties)
+      b.build_android_apks(['a', 'b', 'c'], 'apks', 3)
+      # a and b reference the same library so they're not built concurrently.
+      self.assertNotIn(['a', 'b'], concurrent)
+      self.assertNotIn(['a', 'b', 'c'], concurrent)
+      self.assertIn(['a', 'c'], concurrent)
+    finally:
+      sys.stdout = stdout
+      shutil.rmtree(b.project_directory)
+
+  def test_signing_session(self):
+    d = android.BuildEnvironment.build_defaults()
+    b = android.BuildEnvironment(d)
+    b._find_binary = lambda binary, additional_paths=None: binary
+    directory = tempfile.mkdtemp()
+    commands = []
+
+    def run_subprocess(args, stdin=None):
+      commands.append(args)
+      if args[0] == 'keytool':
+        keystore = args[args.index('-keystore') + 1]
+        self.assertTrue(os.path.exists(os.path.dirname(keystore)))
+        open(keystore, 'w').close()
+
+    b.run_subprocess = run_subprocess
+    try:
+      apks = []
+      for name in ('a', 'b'):
+        apk = os.path.join(directory, name + '-unsigned.apk')
+        open(apk, 'w').close()
+        apks.append((apk, os.path.join(directory, name + '.apk')))
+      with b.signing_session():
+        for source, target in apks:
+          b._sign_apk(source, target)
+        keystore = b._get_signing_key()[0]
+        self.assertTrue(os.path.exists(keystore))
+      self.assertFalse(os.path.exists(keystore))
+      self.assertEqual(['keytool', 'jarsigner', 'zipalign', 'jarsigner',
+                        'zipalign'], [c[0] for c in commands])
+
+      # Without a session the key is generated for each APK.
+      del commands[:]
+      b._sign_apk(*apks[0])
+      self.assertEqual(['keytool', 'jarsigner', 'zipalign'],
+                       [c[0] for c in commands])
+
+      b.apk_keystore = 'release.keystore'
+      with self.assertRaises(common.ConfigurationError):
+        b._sign_apk(*apks[0])
+    finally:
+      shutil.rmtree(directory)
+
   def test_clean_libraries(self):
     d = android.BuildEnvironment.build_defaults()
     b = android.BuildEnvironment(d)
@@ -718,6 +1014,50 @@ class AndroidBuildUtilTest(unittest.TestCase):
     got = b._find_best_android_sdk('android', 5, 15)
     self.assertEqual(got, 'android-15')
 
+  def test_get_installed_sdk_targets(self):
+    directory = tempfile.mkdtemp()
+    cache_directory = os.getenv('FPLUTIL_CACHE_DIR')
+    os.environ['FPLUTIL_CACHE_DIR'] = os.path.join(directory, 'cache')
+    try:
+      d = android.BuildEnvironment.build_defaults()
+      d['sdk_home'] = directory
+      b = android.BuildEnvironment(d)
+      b.run_subprocess = common_test.RunCommandMock(self)
+      platforms = os.path.join(directory, 'platforms')
+      for name, properties in (('android-10', 'AndroidVersion.ApiLevel=10'),
+                               ('android-L', 'AndroidVersion.ApiLevel=20\n'
+                                'AndroidVersion.CodeName=L'),
+                               ('android-19', 'AndroidVersion.ApiLevel=19')):
+        os.makedirs(os.path.join(platforms, name))
+        with open(os.path.join(platforms, name, 'source.properties'),
+                  'w') as f:
+          f.write('Pkg.Desc=Android SDK Platform\n' + properties + '\n')
+      expected = ['android-10', 'android-19', 'android-L']
+      self.assertEqual(expected, b.get_installed_sdk_targets('android'))
+      self.assertEqual('android-19', b._find_best_android_sdk('android', 1,
+                                                              19))
+
+      # Targets are cached on disk until the platforms directory changes.
+      os.remove(os.path.join(platforms, 'android-10', 'source.properties'))
+      android._SDK_TARGETS_CACHE.clear()
+      self.assertEqual(expected, b.get_installed_sdk_targets('android'))
+
+      # Fall back to the android tool if a platform can't be read.
+      os.makedirs(os.path.join(platforms, 'android-21'))
+      m = common_test.RunCommandMock(self)
+      m.expect(['android', 'list', 'target', '--compact'])
+      m.returns('android-10\nandroid-19\nGoogle Inc.:Google APIs:19\n')
+      b.run_subprocess = m
+      self.assertEqual(['android-10', 'android-19'],
+                       b.get_installed_sdk_targets('android'))
+    finally:
+      android._SDK_TARGETS_CACHE.clear()
+      if cache_directory is None:
+        del os.environ['FPLUTIL_CACHE_DIR']
+      else:
+        os.environ['FPLUTIL_CACHE_DIR'] = cache_directory
+      shutil.rmtree(directory)
+
   def _find_projects_test_setup(self):
     build_environment = android.BuildEnvironment(
         android.BuildEnvironment.build_defaults())
@@ -769,6 +1109,45 @@ class AndroidBuildUtilTest(unittest.TestCase):
     walk_mock.set_root(tree)
     b.find_projects()
 
+  def test_find_projects_index(self):
+    directory = tempfile.mkdtemp()
+    cache_directory = os.getenv('FPLUTIL_CACHE_DIR')
+    os.environ['FPLUTIL_CACHE_DIR'] = os.path.join(directory, 'cache')
+    try:
+      project = os.path.join(directory, 'project')
+      os.makedirs(os.path.join(project, 'app', 'jni'))
+      for filename in (os.path.join('app', 'AndroidManifest.xml'),
+                       os.path.join('app', 'jni', 'Android.mk')):
+        open(os.path.join(project, filename), 'w').close()
+      d = android.BuildEnvironment.build_defaults()
+      d['project_dir'] = project
+      d['project_index'] = True
+      b = android.BuildEnvironment(d)
+      expected = ([os.path.join(project, 'app')],
+                  [os.path.join(project, 'app')])
+      self.assertEqual(expected, b.find_projects())
+
+      # The index is shared by subsequent searches and environments.
+      def fail_walk(*unused_args, **unused_kwargs):
+        self.fail('os.walk() called')
+      os.walk = fail_walk
+      self.assertEqual(expected, b.find_projects())
+      self.assertEqual(expected, android.BuildEnvironment(d).find_projects())
+
+      # Adding a directory invalidates the index.
+      os.walk = self.os_walk
+      os.makedirs(os.path.join(project, 'lib', 'jni'))
+      open(os.path.join(project, 'lib', 'jni', 'Android.mk'), 'w').close()
+      self.assertEqual(
+          sorted(expected[1] + [os.path.join(project, 'lib')]),
+          sorted(android.BuildEnvironment(d).find_projects()[1]))
+    finally:
+      if cache_directory is None:
+        del os.environ['FPLUTIL_CACHE_DIR']
+      else:
+        os.environ['FPLUTIL_CACHE_DIR'] = cache_directory
+      shutil.rmtree(directory)
+
   def _create_update_build_xml_setup(self):
     build_environment = android.BuildEnvironment(
         android.BuildEnvironment.build_defaults())
@@ -941,6 +1320,69 @@ class AndroidBuildUtilTest(unittest.TestCase):
     build_environment.sdk_home = 'sdk_path'
     build_environment.build_android_apk(manifest=manifest)
 
+  def test_get_apk_input_fingerprint(self):
+    directory = tempfile.mkdtemp()
+    try:
+      os.makedirs(os.path.join(directory, 'res', 'values'))
+      for filename in ('AndroidManifest.xml',
+                       os.path.join('res', 'values', 'strings.xml')):
+        with open(os.path.join(directory, filename), 'w') as f:
+          f.write('x')
+      d = android.BuildEnvironment.build_defaults()
+      d['project_dir'] = directory
+      b = android.BuildEnvironment(d)
+      fingerprint = b.get_apk_input_fingerprint()
+      self.assertTrue(fingerprint)
+      self.assertEqual(fingerprint, b.get_apk_input_fingerprint())
+
+      # Modifying a resource changes the fingerprint.
+      with open(os.path.join(directory, 'res', 'values', 'strings.xml'),
+                'w') as f:
+        f.write('xy')
+      modified_fingerprint = b.get_apk_input_fingerprint()
+      self.assertNotEqual(fingerprint, modified_fingerprint)
+
+      # Changing the build flags changes the fingerprint.
+      b.ant_flags = '-verbose'
+      self.assertNotEqual(modified_fingerprint, b.get_apk_input_fingerprint())
+    finally:
+      shutil.rmtree(directory)
+
+  def test_get_apk_input_fingerprint_library_references(self):
+    directory = tempfile.mkdtemp()
+    try:
+      project = os.path.join(directory, 'app')
+      for filename, contents in (
+          (os.path.join('app', 'project.properties'),
+           'android.library.reference.1=../lib\n'),
+          (os.path.join('lib', 'project.properties'),
+           'android.library.library=true\n'
+           'android.library.reference.1=../base\n'
+           'android.library.reference.2=../app\n'),
+          (os.path.join('base', 'res', 'values', 'strings.xml'), 'x')):
+        filename = os.path.join(directory, filename)
+        if not os.path.exists(os.path.dirname(filename)):
+          os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+          f.write(contents)
+      self.assertEqual([os.path.join(directory, 'lib'),
+                        os.path.join(directory, 'base')],
+                       android.BuildEnvironment.get_library_references(
+                           project))
+      d = android.BuildEnvironment.build_defaults()
+      d['project_dir'] = project
+      b = android.BuildEnvironment(d)
+      fingerprint = b.get_apk_input_fingerprint()
+
+      # Modifying a resource of a library referenced by a library changes the
+      # fingerprint.
+      with open(os.path.join(directory, 'base', 'res', 'values',
+                             'strings.xml'), 'w') as f:
+        f.write('xy')
+      self.assertNotEqual(fingerprint, b.get_apk_input_fingerprint())
+    finally:
+      shutil.rmtree(directory)
+
   def _build_all_test_setup(self):
     b, walk_mock = self._find_projects_test_setup()
     apk_mock = BuildAndroidAPKMock(self)
@@ -990,6 +1432,30 @@ class AndroidBuildUtilTest(unittest.TestCase):
     apk_mock.expect(app.name)
     b.build_all()
 
+  def test_get_library_build_order_cycle(self):
+    directory = tempfile.mkdtemp()
+    stderr = sys.stderr
+    sys.stderr = StringIO.StringIO()
+    try:
+      projects = []
+      for name, library in (('a', 'b'), ('b', 'a')):
+        project = os.path.join(directory, name)
+        os.makedirs(os.path.join(project, 'jni'))
+        with open(os.path.join(project, 'jni', 'Android.mk'), 'w') as f:
+          f.write('include $(CLEAR_VARS)\n'
+                  'LOCAL_MODULE := %s\n'
+                  'LOCAL_STATIC_LIBRARIES := %s\n'
+                  'include $(BUILD_STATIC_LIBRARY)\n' % (name, library))
+        projects.append(project)
+      # Projects with cyclic dependencies are built in discovery order.
+      self.assertEqual(
+          (projects, None),
+          android.BuildEnvironment._get_library_build_order(projects))
+      self.assertIn('Warning: Cyclic dependencies', sys.stderr.getvalue())
+    finally:
+      sys.stderr = stderr
+      shutil.rmtree(directory)
+
   def test_check_adb_devices_no_devices(self):
     build_environment = android.BuildEnvironment(
         android.BuildEnvironment.build_defaults())
@@ -1334,6 +1800,45 @@ class AndroidBuildUtilTest(unittest.TestCase):
     dpi = build_environment.get_device_dpi(adb_device='123456')
     self.assertEqual(dpi, 240)
 
+  def test_get_device_property_cached(self):
+    cache_directory = tempfile.mkdtemp()
+    build_environment = android.BuildEnvironment(
+        android.BuildEnvironment.build_defaults())
+    build_environment.adb_property_cache_ttl = 60
+    adb_path = build_environment._find_binary(android.BuildEnvironment.ADB)
+    devices = common_test.RunCommandMock(
+        self, args='%s devices -l' % adb_path,
+        stdout=('List of devices attached\n'
+                '123456\tdevice\tusb:2-3.4\tproduct:razor\tmodel:Nexus_7\t'
+                'device:flo\ttransport_id:3\n'))
+    run_command_mock = common_test.RunCommandMockList(
+        [devices,
+         common_test.RunCommandMock(
+             self, args='%s -s 123456 shell "%s"' % (
+                 adb_path, device_cache.BOOT_IDENTITY_GETPROP_COMMAND),
+             stdout=('0f3b4c2e-8a1d-4e5f-9a6b-7c8d9e0f1a2b\n'
+                     '1234.56 789.01\n'
+                     '[ro.sf.lcd_density]: [240]\n'
+                     '[ro.product.model]: [Nexus 7]\n')),
+         devices])
+    build_environment.run_subprocess = run_command_mock
+    cache_dir = os.getenv('FPLUTIL_CACHE_DIR')
+    os.environ['FPLUTIL_CACHE_DIR'] = cache_directory
+    try:
+      self.assertEqual(240, build_environment.get_device_dpi(
+          adb_device='123456'))
+      # The second query should be read from the cache without contacting
+      # the device.
+      build_environment._device_property_caches = {}
+      self.assertEqual('Nexus 7', build_environment.get_device_property(
+          'ro.product.model', adb_device='123456'))
+    finally:
+      if cache_dir is None:
+        del os.environ['FPLUTIL_CACHE_DIR']
+      else:
+        os.environ['FPLUTIL_CACHE_DIR'] = cache_dir
+      shutil.rmtree(cache_directory)
+
 
 if __name__ == '__main__':
   unittest.main()
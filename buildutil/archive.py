@@ -0,0 +1,497 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""@file buildutil/archive.py Parallel zip archive writer.
+
+write_archive() compresses the files added to a zip archive in a pool of
+processes then appends the compressed entries to the archive in order.
+Files are read and compressed in blocks, large files are compressed to
+temporary files so that memory usage doesn't depend upon the size of the
+files being archived.  Archives larger than 4GB and files larger than 4GB
+are supported using the zip64 extensions.
+
+Deterministic archives sort their entries by name and record a fixed
+timestamp and normalized permissions for each entry so that archives of
+identical files are byte-for-byte identical.  When an archive is written
+incrementally the compressed data of files whose size, modification time and
+contents are unchanged since the previous archive was written is copied from
+the previous archive rather than compressing the files again.  This requires
+an index, written alongside the archive, which records the size, modification
+time and hash of each file.
+
+@package fplutil.buildutil.archive Parallel zip archive writer.
+"""
+
+import collections
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import zipfile
+import zlib
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+
+## Default zlib compression level of archive entries.
+DEFAULT_COMPRESSION_LEVEL = 6
+
+## Timestamp of the entries of deterministic archives, the earliest time
+## that can be represented in a zip archive.
+DETERMINISTIC_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+## @cond FPLUTIL_INTERNAL
+# Environment variable which overrides the timestamp of the entries of
+# deterministic archives, see https://reproducible-builds.org/specs/
+_SOURCE_DATE_EPOCH_ENV_VAR = 'SOURCE_DATE_EPOCH'
+# Unix file mode of entries in deterministic archives.
+_DETERMINISTIC_MODE = 0100644
+# Unix file mode of executable entries in deterministic archives.
+_DETERMINISTIC_EXECUTABLE_MODE = 0100755
+# Value of ZipInfo.create_system for archives created on Unix.
+_CREATE_SYSTEM_UNIX = 3
+# Format of a zip archive's local file header.
+_LOCAL_FILE_HEADER = struct.Struct('<4s2B4HL2L2H')
+# Indices of the filename and extra field lengths in the local file header.
+_LOCAL_FILE_HEADER_FILENAME_LENGTH = 10
+_LOCAL_FILE_HEADER_EXTRA_LENGTH = 11
+# Version of the format of archive indices.
+_INDEX_VERSION = 1
+# Size of the blocks files are read and compressed in.
+_BLOCK_SIZE = 1024 * 1024
+# Files larger than this are compressed to temporary files rather than
+# memory.
+_IN_MEMORY_LIMIT = 4 * 1024 * 1024
+# Maximum number of files compressed ahead of the file being written to the
+# archive for each compression process.
+_PENDING_FILES_PER_JOB = 4
+## @endcond FPLUTIL_INTERNAL
+
+
+class CompressedFile(object):
+
+  """A file compressed for inclusion in a zip archive.
+
+  Attributes:
+    filename: Name of the file that was compressed.
+    mode: Mode of the file.
+    mtime: Modification time of the file.
+    file_size: Size of the file in bytes.
+    crc: CRC-32 of the file's contents.
+    sha1: Hexadecimal SHA-1 of the file's contents.
+    compress_type: zipfile.ZIP_DEFLATED if the file was compressed or
+      zipfile.ZIP_STORED if compression did not reduce its size.
+    compress_size: Size in bytes of the data stored in the archive.
+    data: Data stored in the archive or None if the data is in
+      data_filename.
+    data_filename: File containing the data stored in the archive or None if
+      the data is in data or the file itself.
+    data_offset: Offset of the data stored in the archive in data_filename.
+    reused: Whether the data was copied from a previous archive.
+  """
+
+  def __init__(self, filename, mode, mtime):
+    """Initialize the instance.
+
+    Args:
+      filename: Name of the file that was compressed.
+      mode: Mode of the file.
+      mtime: Modification time of the file.
+    """
+    self.filename = filename
+    self.mode = mode
+    self.mtime = mtime
+    self.file_size = 0
+    self.crc = 0
+    self.sha1 = None
+    self.compress_type = zipfile.ZIP_STORED
+    self.compress_size = 0
+    self.data = None
+    self.data_filename = None
+    self.data_offset = 0
+    self.reused = False
+
+  def write_data(self, output):
+    """Write the data stored in the archive to a file.
+
+    Args:
+      output: File object to write to.
+    """
+    if self.data is not None:
+      output.write(self.data)
+      return
+    with open(self.data_filename or self.filename, 'rb') as f:
+      f.seek(self.data_offset)
+      remaining = self.compress_size
+      while remaining:
+        block = f.read(min(remaining, _BLOCK_SIZE))
+        if not block:
+          raise IOError('%s is truncated' % f.name)
+        output.write(block)
+        remaining -= len(block)
+
+  def discard(self):
+    """Delete the temporary file containing the compressed data."""
+    if self.data_filename and not self.reused:
+      os.remove(self.data_filename)
+    self.data_filename = None
+
+
+def hash_file(filename):
+  """Calculate the SHA-1 of a file's contents.
+
+  Args:
+    filename: Name of the file to hash.
+
+  Returns:
+    Hexadecimal SHA-1 string.
+  """
+  sha1 = hashlib.sha1()
+  with open(filename, 'rb') as f:
+    for block in iter(lambda: f.read(_BLOCK_SIZE), ''):
+      sha1.update(block)
+  return sha1.hexdigest()
+
+
+def _reuse_entry(filename, file_stat, previous):
+  """Reuse the compressed data of an unchanged file from a previous archive.
+
+  Args:
+    filename: File being archived.
+    file_stat: Result of os.stat() for the file.
+    previous: Dictionary which describes the file's entry in the previous
+      archive, see _load_previous_entries().
+
+  Returns:
+    CompressedFile which references the data in the previous archive or None
+    if the file changed.
+  """
+  if (previous['size'] != file_stat.st_size or
+      previous['mtime'] != file_stat.st_mtime):
+    return None
+  sha1 = hash_file(filename)
+  if sha1 != previous['sha1']:
+    return None
+  compressed = CompressedFile(filename, file_stat.st_mode, file_stat.st_mtime)
+  compressed.file_size = previous['size']
+  compressed.crc = previous['crc']
+  compressed.sha1 = sha1
+  compressed.compress_type = previous['compress_type']
+  compressed.compress_size = previous['compress_size']
+  compressed.data_filename = previous['archive']
+  compressed.data_offset = previous['offset']
+  compressed.reused = True
+  return compressed
+
+
+def compress_file(filename, compression_level, temporary_directory,
+                  previous=None):
+  """Compress a file with the raw deflate format used by zip archives.
+
+  Args:
+    filename: File to compress.
+    compression_level: zlib compression level, 0 stores the file.
+    temporary_directory: Directory used to store the compressed data of
+      files larger than _IN_MEMORY_LIMIT.
+    previous: Optional dictionary which describes the file's entry in a
+      previous archive.  If the file is unchanged the entry's compressed data
+      is reused.
+
+  Returns:
+    CompressedFile instance.
+  """
+  file_stat = os.stat(filename)
+  if previous:
+    compressed = _reuse_entry(filename, file_stat, previous)
+    if compressed:
+      return compressed
+  sha1 = hashlib.sha1()
+  compressed = CompressedFile(filename, file_stat.st_mode, file_stat.st_mtime)
+  compressor = (zlib.compressobj(compression_level, zlib.DEFLATED, -15)
+                if compression_level else None)
+  output = None
+  blocks = []
+  try:
+    if compressor and file_stat.st_size > _IN_MEMORY_LIMIT:
+      fd, compressed.data_filename = tempfile.mkstemp(
+          dir=temporary_directory)
+      output = os.fdopen(fd, 'wb')
+    with open(filename, 'rb') as f:
+      for block in iter(lambda: f.read(_BLOCK_SIZE), ''):
+        compressed.file_size += len(block)
+        compressed.crc = zlib.crc32(block, compressed.crc)
+        sha1.update(block)
+        if not compressor:
+          continue
+        block = compressor.compress(block)
+        compressed.compress_size += len(block)
+        if output:
+          output.write(block)
+        else:
+          blocks.append(block)
+      if compressor:
+        block = compressor.flush()
+        compressed.compress_size += len(block)
+        if output:
+          output.write(block)
+        else:
+          blocks.append(block)
+  finally:
+    if output:
+      output.close()
+  compressed.crc &= 0xffffffff
+  compressed.sha1 = sha1.hexdigest()
+  if compressor and compressed.compress_size < compressed.file_size:
+    compressed.compress_type = zipfile.ZIP_DEFLATED
+    if not output:
+      compressed.data = ''.join(blocks)
+  else:
+    # Store files which don't compress, the data is read from the file when
+    # it's added to the archive.
+    compressed.discard()
+    compressed.compress_size = compressed.file_size
+  return compressed
+
+
+def _compress_files(pool, job_args, max_pending):
+  """Compress files in a pool of processes.
+
+  Args:
+    pool: multiprocessing.Pool used to compress files.
+    job_args: Iterable of tuples of arguments for compress_file().
+    max_pending: Maximum number of files compressed ahead of the file
+      being consumed, this bounds the memory and temporary disk space used.
+
+  Yields:
+    CompressedFile instances in the order of job_args.
+  """
+  pending = collections.deque()
+  job_args = iter(job_args)
+  while True:
+    while len(pending) < max_pending:
+      args = next(job_args, None)
+      if not args:
+        break
+      pending.append(pool.apply_async(compress_file, args))
+    if not pending:
+      break
+    yield pending.popleft().get()
+
+
+def get_deterministic_date_time():
+  """Get the timestamp of the entries of deterministic archives.
+
+  Returns:
+    (year, month, day, hour, minute, second) tuple derived from the
+    SOURCE_DATE_EPOCH environment variable if it's set, otherwise
+    DETERMINISTIC_DATE_TIME.
+  """
+  source_date_epoch = os.getenv(_SOURCE_DATE_EPOCH_ENV_VAR)
+  if source_date_epoch:
+    date_time = time.gmtime(int(source_date_epoch))[0:6]
+    if date_time >= DETERMINISTIC_DATE_TIME:
+      return date_time
+  return DETERMINISTIC_DATE_TIME
+
+
+def add_compressed_file(zip_file, compressed, arcname, date_time=None):
+  """Append a compressed file to a zip archive.
+
+  Args:
+    zip_file: zipfile.ZipFile opened for writing with allowZip64 enabled.
+    compressed: CompressedFile to add.
+    arcname: Name of the file in the archive.
+    date_time: Optional timestamp of the entry, if this is specified the
+      permissions of the entry are also normalized so that the entry doesn't
+      depend upon the file system the file was read from.
+  """
+  if date_time:
+    zinfo = zipfile.ZipInfo(arcname, date_time)
+    zinfo.create_system = _CREATE_SYSTEM_UNIX
+    mode = (_DETERMINISTIC_EXECUTABLE_MODE if compressed.mode & 0111 else
+            _DETERMINISTIC_MODE)
+  else:
+    zinfo = zipfile.ZipInfo(arcname, time.localtime(compressed.mtime)[0:6])
+    mode = compressed.mode
+  zinfo.external_attr = (mode & 0xFFFF) << 16L
+  zinfo.compress_type = compressed.compress_type
+  zinfo.file_size = compressed.file_size
+  zinfo.compress_size = compressed.compress_size
+  zinfo.CRC = compressed.crc
+  zinfo.flag_bits = 0x00
+  zinfo.header_offset = zip_file.fp.tell()
+  # zipfile.ZipFile.write() compresses files in the calling thread, so the
+  # header and the already compressed data are written directly.
+  zip_file._writecheck(zinfo)  # pylint: disable=protected-access
+  zip_file._didModify = True  # pylint: disable=protected-access
+  zip_file.fp.write(zinfo.FileHeader())
+  compressed.write_data(zip_file.fp)
+  zip_file.filelist.append(zinfo)
+  zip_file.NameToInfo[zinfo.filename] = zinfo
+
+
+def _load_previous_entries(previous_archive, index_path, compression_level):
+  """Find the entries of a previous archive that may be reused.
+
+  Args:
+    previous_archive: Archive written by a previous call to write_archive().
+    index_path: Index written with the previous archive.
+    compression_level: Compression level of the archive being written.
+
+  Returns:
+    Dictionary indexed by entry name of dictionaries which describe each
+    entry, empty if the index doesn't match the archive or the archive was
+    written with a different compression level.
+  """
+  try:
+    with open(index_path) as f:
+      index = json.load(f)
+    archive_stat = os.stat(previous_archive)
+    if (index.get('version') != _INDEX_VERSION or
+        index.get('compression_level') != compression_level or
+        index.get('archive_size') != archive_stat.st_size or
+        index.get('archive_mtime') != archive_stat.st_mtime):
+      return {}
+    entries = {}
+    files = index.get('files', {})
+    with open(previous_archive, 'rb') as f:
+      for zinfo in zipfile.ZipFile(f).infolist():
+        file_info = files.get(zinfo.filename)
+        if not file_info:
+          continue
+        f.seek(zinfo.header_offset)
+        header = _LOCAL_FILE_HEADER.unpack(f.read(_LOCAL_FILE_HEADER.size))
+        entries[zinfo.filename] = {
+            'archive': os.path.abspath(previous_archive),
+            'offset': (zinfo.header_offset + _LOCAL_FILE_HEADER.size +
+                       header[_LOCAL_FILE_HEADER_FILENAME_LENGTH] +
+                       header[_LOCAL_FILE_HEADER_EXTRA_LENGTH]),
+            'compress_type': zinfo.compress_type,
+            'compress_size': zinfo.compress_size,
+            'crc': zinfo.CRC,
+            'size': file_info['size'],
+            'mtime': file_info['mtime'],
+            'sha1': file_info['sha1']}
+    return entries
+  except (IOError, OSError, ValueError, KeyError, struct.error,
+          zipfile.BadZipfile):
+    return {}
+
+
+def _write_index(index_path, archive_path, compression_level, files):
+  """Write the index used to update an archive incrementally.
+
+  Args:
+    index_path: File to write the index to.
+    archive_path: Archive described by the index.
+    compression_level: Compression level of the archive.
+    files: Dictionary of dictionaries containing the size, mtime and sha1 of
+      each file indexed by entry name.
+  """
+  # buildutil.common imports this module so it's imported on use.
+  import buildutil.common as common
+  try:
+    archive_stat = os.stat(archive_path)
+    common.write_json_atomically(
+        index_path, {'version': _INDEX_VERSION,
+                     'compression_level': compression_level,
+                     'archive_size': archive_stat.st_size,
+                     'archive_mtime': archive_stat.st_mtime,
+                     'files': files})
+  except (IOError, OSError):
+    # Failing to write the index is not fatal, the next archive will be
+    # written from scratch.
+    pass
+
+
+def write_archive(path, entries, compression_level=DEFAULT_COMPRESSION_LEVEL,
+                  jobs=None, callback=None, deterministic=False,
+                  previous_archive=None, index_path=None):
+  """Write a zip archive compressing files in a pool of processes.
+
+  Args:
+    path: Zip archive to create.
+    entries: List of (filename, arcname) tuples of the files to add to the
+      archive.
+    compression_level: zlib compression level from 0 (store files) to 9.
+    jobs: Number of processes used to compress files, defaults to the number
+      of CPUs.
+    callback: Optional function called with (filename, arcname) as each file
+      is added to the archive.
+    deterministic: Whether to sort entries by name and write a fixed
+      timestamp and normalized permissions for each entry.  Otherwise entries
+      are written in order with the modification time and permissions of
+      each file.
+    previous_archive: Optional archive previously written by this function
+      with index_path.  Compressed data of files which are unchanged is copied
+      from this archive.  This must not be the same file as path.
+    index_path: Optional file used to store the index of the archive, this
+      is required to reuse entries of the archive when the next archive is
+      written.
+
+  Raises:
+    IOError: An error occurred reading a file or writing the archive.
+    OSError: An error occurred reading a file or writing the archive.
+  """
+  jobs = jobs or multiprocessing.cpu_count()
+  date_time = None
+  if deterministic:
+    entries = sorted(entries, key=lambda e: zipfile.ZipInfo(e[1]).filename)
+    date_time = get_deterministic_date_time()
+  previous_entries = {}
+  if previous_archive and index_path and os.path.exists(previous_archive):
+    previous_entries = _load_previous_entries(previous_archive, index_path,
+                                              compression_level)
+  temporary_directory = tempfile.mkdtemp(
+      dir=os.path.dirname(os.path.abspath(path)))
+  pool = None
+  files = {}
+  try:
+    job_args = ((filename, compression_level, temporary_directory,
+                 previous_entries.get(zipfile.ZipInfo(arcname).filename))
+                for filename, arcname in entries)
+    if jobs > 1 and (compression_level or previous_entries) and (
+        len(entries) > 1):
+      pool = multiprocessing.Pool(jobs)
+      compressed_files = _compress_files(pool, job_args,
+                                         jobs * _PENDING_FILES_PER_JOB)
+    else:
+      compressed_files = (compress_file(*args) for args in job_args)
+    with zipfile.ZipFile(path, 'w', allowZip64=True) as zip_file:
+      for (filename, arcname), compressed in itertools.izip(
+          entries, compressed_files):
+        if callback:
+          callback(filename, arcname)
+        try:
+          add_compressed_file(zip_file, compressed, arcname,
+                              date_time=date_time)
+        finally:
+          compressed.discard()
+        files[zip_file.filelist[-1].filename] = {
+            'size': compressed.file_size, 'mtime': compressed.mtime,
+            'sha1': compressed.sha1}
+    if pool:
+      pool.close()
+      pool.join()
+  finally:
+    if pool:
+      pool.terminate()
+    shutil.rmtree(temporary_directory, ignore_errors=True)
+  if index_path:
+    _write_index(index_path, path, compression_level, files)
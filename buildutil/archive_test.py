@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.archive as archive
+
+
+class ArchiveTest(unittest.TestCase):
+  """Parallel zip archive writer unit tests."""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.in_memory_limit = archive._IN_MEMORY_LIMIT
+    self.zip64_limit = zipfile.ZIP64_LIMIT
+    self.contents = {'empty': '', 'text': 'hello world ' * 1000,
+                     'random': os.urandom(4096),
+                     'large': 'large file ' * 10000}
+    self.entries = []
+    for name in sorted(self.contents):
+      filename = os.path.join(self.directory, name)
+      with open(filename, 'wb') as f:
+        f.write(self.contents[name])
+      self.entries.append((filename, os.path.join('files', name)))
+    self.archive_path = os.path.join(self.directory, 'archive.zip')
+
+  def tearDown(self):
+    archive._IN_MEMORY_LIMIT = self.in_memory_limit
+    zipfile.ZIP64_LIMIT = self.zip64_limit
+    shutil.rmtree(self.directory)
+
+  def verify_archive(self):
+    """Verify the archive contains the test files in order."""
+    with zipfile.ZipFile(self.archive_path) as zip_file:
+      self.assertIsNone(zip_file.testzip())
+      self.assertEqual([a.replace(os.sep, '/') for _, a in self.entries],
+                       zip_file.namelist())
+      for name, contents in self.contents.iteritems():
+        self.assertEqual(contents, zip_file.read('files/' + name))
+      return dict([(os.path.basename(i.filename), i)
+                   for i in zip_file.infolist()])
+
+  def test_compressed(self):
+    archive._IN_MEMORY_LIMIT = 1024
+    archived = []
+    archive.write_archive(self.archive_path, self.entries, jobs=2,
+                          callback=lambda f, a: archived.append(a))
+    self.assertEqual([a for _, a in self.entries], archived)
+    infos = self.verify_archive()
+    self.assertEqual(zipfile.ZIP_DEFLATED, infos['text'].compress_type)
+    self.assertEqual(zipfile.ZIP_DEFLATED, infos['large'].compress_type)
+    # Files which don't compress are stored.
+    self.assertEqual(zipfile.ZIP_STORED, infos['random'].compress_type)
+    self.assertEqual(len(self.contents['random']),
+                     infos['random'].compress_size)
+    self.assertEqual([], [f for f in os.listdir(self.directory)
+                          if f not in self.contents and f != 'archive.zip'])
+
+  def test_stored(self):
+    archive.write_archive(self.archive_path, self.entries,
+                          compression_level=0, jobs=1)
+    infos = self.verify_archive()
+    self.assertEqual([zipfile.ZIP_STORED] * len(infos),
+                     [i.compress_type for i in infos.itervalues()])
+
+  def test_zip64(self):
+    zipfile.ZIP64_LIMIT = 1024
+    archive.write_archive(self.archive_path, self.entries, jobs=1)
+    zipfile.ZIP64_LIMIT = self.zip64_limit
+    self.verify_archive()
+
+  def test_deterministic(self):
+    archive.write_archive(self.archive_path, self.entries, jobs=1,
+                          deterministic=True)
+    with open(self.archive_path, 'rb') as f:
+      contents = f.read()
+    # Reversing the order of the entries and changing the modification time
+    # and permissions of a file doesn't change the archive.
+    filename = self.entries[0][0]
+    os.utime(filename, (1000000000, 1000000000))
+    os.chmod(filename, 0600)
+    archive.write_archive(self.archive_path, list(reversed(self.entries)),
+                          jobs=2, deterministic=True)
+    with open(self.archive_path, 'rb') as f:
+      self.assertEqual(contents, f.read())
+    with zipfile.ZipFile(self.archive_path) as zip_file:
+      self.assertEqual(sorted(zip_file.namelist()), zip_file.namelist())
+      self.assertEqual([archive.DETERMINISTIC_DATE_TIME],
+                       list(set([i.date_time for i in zip_file.infolist()])))
+
+  def test_incremental(self):
+    hash_file = archive.hash_file
+    hashed = []
+
+    def hash_file_mock(filename):
+      hashed.append(os.path.basename(filename))
+      return hash_file(filename)
+
+    archive.hash_file = hash_file_mock
+    index_path = os.path.join(self.directory, 'index', 'archive.json')
+    previous_path = os.path.join(self.directory, 'previous.zip')
+    try:
+      archive.write_archive(previous_path, self.entries, jobs=1,
+                            deterministic=True, index_path=index_path)
+      self.assertEqual([], hashed)
+      self.contents['text'] = 'modified'
+      with open(os.path.join(self.directory, 'text'), 'w') as f:
+        f.write(self.contents['text'])
+      archive.write_archive(self.archive_path, self.entries, jobs=1,
+                            deterministic=True, previous_archive=previous_path,
+                            index_path=index_path)
+      # Only files whose size and modification time are unchanged are hashed
+      # and reused.
+      self.assertEqual(['empty', 'large', 'random'], sorted(hashed))
+      self.verify_archive()
+
+      # Archiving unchanged files produces an identical archive.
+      shutil.move(self.archive_path, previous_path)
+      archive.write_archive(self.archive_path, self.entries, jobs=1,
+                            deterministic=True, previous_archive=previous_path,
+                            index_path=index_path)
+      with open(self.archive_path, 'rb') as f:
+        contents = f.read()
+      with open(previous_path, 'rb') as f:
+        self.assertEqual(f.read(), contents)
+    finally:
+      archive.hash_file = hash_file
+
+
+if __name__ == '__main__':
+  unittest.main()
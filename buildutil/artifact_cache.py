@@ -0,0 +1,443 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""@file buildutil/artifact_cache.py Content addressed build artifact cache.
+
+ArtifactCache stores the output directories of a build step under a key
+derived from the contents of the step's inputs (see KeyBuilder) so that the
+outputs can be restored rather than rebuilt when the same inputs are built
+again, for example in another checkout or branch of a project.  The total
+size of the cache is bounded by evicting the least recently used entries.
+
+Build steps whose inputs are only known once they've run, such as the headers
+included by compiled sources, can record the inputs in a manifest (see
+ArtifactCache.store_manifest() and parse_dependency_file()) which is read to
+derive the key the next time the step is built.
+
+@package fplutil.buildutil.artifact_cache Content addressed artifact cache.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+## Names of directories which are not hashed when found in input trees.
+DEFAULT_EXCLUDE = ('.git', '.svn', '.hg')
+
+## @cond FPLUTIL_INTERNAL
+# File in each cache entry which describes the entry.
+_ENTRY_FILE = 'entry.json'
+# Subdirectory of each cache entry which contains the outputs.
+_OUTPUTS_DIR = 'outputs'
+# Suffix of directories which contain entries that are being written.
+_TEMPORARY_SUFFIX = '.tmp'
+# Subdirectory of the cache which contains manifests.
+_MANIFESTS_DIR = 'manifests'
+# Splits the prerequisites of a rule in a dependency file on whitespace which
+# isn't escaped.
+_DEPENDENCY_SEPARATOR_RE = re.compile(r'(?<!\\)\s+')
+# Hashes of file contents indexed by (path, size, mtime).
+_FILE_HASHES = {}
+# Guards _FILE_HASHES.
+_FILE_HASHES_LOCK = threading.Lock()
+## @endcond FPLUTIL_INTERNAL
+
+
+def hash_file(filename):
+  """Calculate the hash of a file's contents.
+
+  Hashes are memoized by path, size and modification time so that files
+  shared between build steps are only read once.
+
+  Args:
+    filename: Name of the file to hash.
+
+  Returns:
+    Hexadecimal SHA-1 of the file's contents.
+
+  Raises:
+    IOError: If the file can't be read.
+    OSError: If the file can't be read.
+  """
+  file_stat = os.stat(filename)
+  memo_key = (os.path.abspath(filename), file_stat.st_size,
+              file_stat.st_mtime)
+  with _FILE_HASHES_LOCK:
+    file_hash = _FILE_HASHES.get(memo_key)
+  if file_hash:
+    return file_hash
+  sha1 = hashlib.sha1()
+  with open(filename, 'rb') as f:
+    for block in iter(lambda: f.read(1024 * 1024), ''):
+      sha1.update(block)
+  file_hash = sha1.hexdigest()
+  with _FILE_HASHES_LOCK:
+    _FILE_HASHES[memo_key] = file_hash
+  return file_hash
+
+
+def list_tree(directory, exclude=DEFAULT_EXCLUDE, exclude_paths=()):
+  """List the files in a directory tree.
+
+  Args:
+    directory: Directory to list.
+    exclude: Names of files and subdirectories which are skipped wherever
+      they're found in the tree.
+    exclude_paths: Paths of files and subdirectories, relative to directory,
+      which are skipped.
+
+  Returns:
+    Sorted list of file paths.
+  """
+  excluded = set([os.path.normpath(os.path.join(directory, p))
+                  for p in exclude_paths])
+  filenames = []
+  for root, dirs, files in os.walk(directory):
+    dirs[:] = sorted([d for d in dirs if d not in exclude and
+                      os.path.join(root, d) not in excluded])
+    filenames.extend([os.path.join(root, f) for f in sorted(files)
+                      if f not in exclude and
+                      os.path.join(root, f) not in excluded])
+  return filenames
+
+
+def parse_dependency_file(filename):
+  """Read the prerequisites from a dependency file written by a compiler.
+
+  Dependency files (e.g those written by gcc -MMD) are makefiles which list
+  the sources and headers read to compile each object.
+
+  Args:
+    filename: Dependency file to read.
+
+  Returns:
+    List of prerequisite paths in the order they're listed.  Relative paths
+    are relative to the directory the compiler was run in.
+
+  Raises:
+    IOError: If the file can't be read.
+  """
+  with open(filename) as f:
+    text = re.sub(r'\\\r?\n', ' ', f.read())
+  prerequisites = []
+  listed = set()
+  for line in text.splitlines():
+    # Split the targets from the prerequisites, colons in drive letters
+    # (e.g "C:/") are not followed by whitespace.
+    rule = re.split(r':(?:\s|$)', line, 1)
+    if len(rule) != 2:
+      continue
+    for prerequisite in _DEPENDENCY_SEPARATOR_RE.split(rule[1].strip()):
+      prerequisite = prerequisite.replace('\\ ', ' ')
+      if prerequisite and prerequisite not in listed:
+        listed.add(prerequisite)
+        prerequisites.append(prerequisite)
+  return prerequisites
+
+
+class KeyBuilder(object):
+
+  """Derives a cache key from the inputs of a build step.
+
+  Files are identified by their path relative to a base directory so that
+  the same inputs produce the same key wherever they're checked out.
+  """
+
+  def __init__(self, base_directory):
+    """Initialize the instance.
+
+    Args:
+      base_directory: Directory file paths are made relative to.
+    """
+    self._base_directory = os.path.abspath(base_directory)
+    self._sha1 = hashlib.sha1()
+
+  def add_value(self, value):
+    """Add a value, such as a flag or tool version, to the key.
+
+    Args:
+      value: Value to add, converted to a string.
+    """
+    self._sha1.update('v\0%s\0' % value)
+
+  def add_file(self, filename):
+    """Add the path and contents of a file to the key.
+
+    Args:
+      filename: File to add.
+
+    Raises:
+      IOError: If the file can't be read.
+      OSError: If the file can't be read.
+    """
+    self._sha1.update('f\0%s\0%s\0' % (
+        os.path.relpath(os.path.abspath(filename), self._base_directory),
+        hash_file(filename)))
+
+  def add_name(self, filename):
+    """Add the path of a file, but not its contents, to the key.
+
+    Args:
+      filename: File to add.
+    """
+    self._sha1.update('n\0%s\0' % os.path.relpath(os.path.abspath(filename),
+                                                  self._base_directory))
+
+  def add_tree(self, directory, exclude=DEFAULT_EXCLUDE, exclude_paths=()):
+    """Add all files in a directory tree to the key.
+
+    Args:
+      directory: Directory to add.
+      exclude: Names of files and subdirectories which are skipped wherever
+        they're found in the tree.
+      exclude_paths: Paths of files and subdirectories, relative to
+        directory, which are skipped.
+
+    Raises:
+      IOError: If a file can't be read.
+      OSError: If a file can't be read.
+    """
+    for filename in list_tree(directory, exclude=exclude,
+                              exclude_paths=exclude_paths):
+      self.add_file(filename)
+
+  def hexdigest(self):
+    """Get the key.
+
+    Returns:
+      Hexadecimal key string.
+    """
+    return self._sha1.hexdigest()
+
+
+def get_tree_size(directory):
+  """Get the total size of the files in a directory tree.
+
+  Args:
+    directory: Directory to measure.
+
+  Returns:
+    Size in bytes.
+  """
+  size = 0
+  for root, _, files in os.walk(directory):
+    for f in files:
+      try:
+        size += os.lstat(os.path.join(root, f)).st_size
+      except OSError:
+        pass
+  return size
+
+
+class ArtifactCache(object):
+
+  """Directory of build outputs indexed by key.
+
+  Each entry is a directory named after its key which contains the output
+  directories of a build step along with a file which describes the entry.
+  The modification time of an entry's directory records when it was last
+  used.
+
+  Attributes:
+    directory: Directory containing the cache entries.
+    max_size: Maximum total size in bytes of the entries in the cache.
+  """
+
+  def __init__(self, directory, max_size):
+    """Initialize the instance.
+
+    Args:
+      directory: Directory containing the cache entries.
+      max_size: Maximum total size in bytes of the entries in the cache.
+    """
+    self.directory = directory
+    self.max_size = max_size
+
+  def _get_entry_directory(self, key):
+    """Get the directory of a cache entry.
+
+    Args:
+      key: Key of the entry.
+
+    Returns:
+      Path of the entry's directory.
+    """
+    return os.path.join(self.directory, key)
+
+  def _get_manifest_file(self, key):
+    """Get the file which stores a manifest.
+
+    Args:
+      key: Key of the manifest.
+
+    Returns:
+      Path of the manifest file.
+    """
+    return os.path.join(self.directory, _MANIFESTS_DIR, key + '.json')
+
+  def get_manifest(self, key):
+    """Read the inputs recorded by store_manifest().
+
+    Args:
+      key: Key of the manifest.
+
+    Returns:
+      List of input paths or None if the manifest isn't in the cache.
+    """
+    try:
+      with open(self._get_manifest_file(key)) as f:
+        return json.load(f)['inputs']
+    except (IOError, ValueError, KeyError):
+      return None
+
+  def store_manifest(self, key, inputs):
+    """Record the inputs of a build step.
+
+    Args:
+      key: Key derived from the inputs known before the step is built.
+      inputs: List of input paths read by the build step.
+    """
+    # buildutil.common imports this module so it's imported on use.
+    import buildutil.common as common
+    try:
+      common.write_json_atomically(self._get_manifest_file(key),
+                                   {'inputs': inputs})
+    except (IOError, OSError):
+      # Without a manifest the step is built again next time.
+      pass
+
+  def restore(self, key, base_directory, outputs):
+    """Restore outputs from the cache.
+
+    Existing output directories are replaced by those in the cache.
+
+    Args:
+      key: Key of the entry to restore.
+      base_directory: Directory the outputs are relative to.
+      outputs: List of output directories relative to base_directory.
+
+    Returns:
+      True if the entry was found and restored, False otherwise.
+    """
+    entry_directory = self._get_entry_directory(key)
+    try:
+      with open(os.path.join(entry_directory, _ENTRY_FILE)) as f:
+        entry = json.load(f)
+      if sorted(entry['outputs']) != sorted(outputs):
+        return False
+      # Mark the entry as used before copying so that it isn't evicted.
+      os.utime(entry_directory, None)
+      for output in entry['stored']:
+        destination = os.path.join(base_directory, output)
+        if os.path.exists(destination):
+          shutil.rmtree(destination)
+        shutil.copytree(os.path.join(entry_directory, _OUTPUTS_DIR, output),
+                        destination, symlinks=True)
+    except (IOError, OSError, ValueError, KeyError):
+      return False
+    return True
+
+  def store(self, key, base_directory, outputs):
+    """Add outputs to the cache then evict entries if the cache is too big.
+
+    Args:
+      key: Key of the entry to add.
+      base_directory: Directory the outputs are relative to.
+      outputs: List of output directories relative to base_directory.
+        Outputs which don't exist are not stored.
+    """
+    entry_directory = self._get_entry_directory(key)
+    temporary_directory = None
+    try:
+      if not os.path.exists(self.directory):
+        os.makedirs(self.directory)
+      # Write the entry to a temporary directory then move it into place so
+      # that concurrent builds never restore a partially written entry.
+      temporary_directory = tempfile.mkdtemp(dir=self.directory,
+                                             suffix=_TEMPORARY_SUFFIX)
+      stored = []
+      for output in outputs:
+        source = os.path.join(base_directory, output)
+        if os.path.isdir(source):
+          shutil.copytree(source, os.path.join(temporary_directory,
+                                               _OUTPUTS_DIR, output),
+                          symlinks=True)
+          stored.append(output)
+      with open(os.path.join(temporary_directory, _ENTRY_FILE), 'w') as f:
+        json.dump({'outputs': outputs, 'stored': stored,
+                   'size': get_tree_size(temporary_directory),
+                   'created': time.time()}, f)
+      if os.path.exists(entry_directory):
+        shutil.rmtree(entry_directory)
+      os.rename(temporary_directory, entry_directory)
+      temporary_directory = None
+    except (IOError, OSError):
+      # Failing to populate the cache is not fatal, the outputs will be built
+      # again next time.
+      pass
+    finally:
+      if temporary_directory:
+        shutil.rmtree(temporary_directory, ignore_errors=True)
+    self.evict()
+
+  def get_entries(self):
+    """Get the entries in the cache.
+
+    Returns:
+      List of (last_used, size, key) tuples, least recently used first.
+    """
+    entries = []
+    try:
+      keys = os.listdir(self.directory)
+    except OSError:
+      return entries
+    for key in keys:
+      if key.endswith(_TEMPORARY_SUFFIX) or key == _MANIFESTS_DIR:
+        continue
+      entry_directory = self._get_entry_directory(key)
+      try:
+        with open(os.path.join(entry_directory, _ENTRY_FILE)) as f:
+          size = json.load(f)['size']
+        entries.append((os.stat(entry_directory).st_mtime, size, key))
+      except (IOError, OSError, ValueError, KeyError):
+        continue
+    return sorted(entries)
+
+  def evict(self):
+    """Remove least recently used entries until the cache fits max_size.
+
+    Returns:
+      List of the keys of the entries that were removed.
+    """
+    entries = self.get_entries()
+    total_size = sum([size for _, size, _ in entries])
+    evicted = []
+    for _, size, key in entries:
+      if total_size <= self.max_size:
+        break
+      shutil.rmtree(self._get_entry_directory(key), ignore_errors=True)
+      total_size -= size
+      evicted.append(key)
+    return evicted
+
+  def clear(self):
+    """Remove all entries from the cache."""
+    if os.path.exists(self.directory):
+      shutil.rmtree(self.directory)
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.artifact_cache as artifact_cache
+
+
+class ArtifactCacheTest(unittest.TestCase):
+  """Content addressed artifact cache unit tests."""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.project = os.path.join(self.directory, 'project')
+    self.cache = artifact_cache.ArtifactCache(
+        os.path.join(self.directory, 'cache'), 1024 * 1024)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def write_file(self, filename, contents):
+    """Write a file relative to the project directory."""
+    filename = os.path.join(self.project, filename)
+    if not os.path.exists(os.path.dirname(filename)):
+      os.makedirs(os.path.dirname(filename))
+    with open(filename, 'w') as f:
+      f.write(contents)
+
+  def get_key(self, project=None):
+    """Derive a key from the contents of a project."""
+    project = project or self.project
+    key = artifact_cache.KeyBuilder(project)
+    key.add_value('flags')
+    key.add_tree(project, exclude_paths=['obj'])
+    return key.hexdigest()
+
+  def test_key(self):
+    self.write_file(os.path.join('jni', 'a.cc'), 'a')
+    key = self.get_key()
+    # Outputs and checkout location don't affect the key.
+    self.write_file(os.path.join('obj', 'a.o'), 'o')
+    self.write_file(os.path.join('.git', 'HEAD'), 'ref')
+    copy = os.path.join(self.directory, 'copy')
+    shutil.copytree(self.project, copy)
+    self.assertEqual(key, self.get_key())
+    self.assertEqual(key, self.get_key(project=copy))
+    self.write_file(os.path.join('jni', 'a.cc'), 'b')
+    self.assertNotEqual(key, self.get_key())
+
+  def test_key_nested_output_names(self):
+    self.write_file(os.path.join('jni', 'a.cc'), 'a')
+    key = self.get_key()
+    # Only the excluded paths are skipped, not every directory with the same
+    # name.
+    self.write_file(os.path.join('jni', 'obj', 'b.cc'), 'b')
+    self.assertNotEqual(key, self.get_key())
+    self.assertEqual([os.path.join(self.project, 'jni', 'a.cc')],
+                     artifact_cache.list_tree(self.project,
+                                              exclude_paths=['jni/obj']))
+
+  def test_add_name(self):
+    key = artifact_cache.KeyBuilder(self.project)
+    key.add_name(os.path.join(self.project, 'a.h'))
+    name_key = key.hexdigest()
+    # Only the path contributes to the key so the file needn't exist.
+    self.write_file('a.h', 'a')
+    key = artifact_cache.KeyBuilder(self.project)
+    key.add_name(os.path.join(self.project, 'a.h'))
+    self.assertEqual(name_key, key.hexdigest())
+    key = artifact_cache.KeyBuilder(self.project)
+    key.add_file(os.path.join(self.project, 'a.h'))
+    self.assertNotEqual(name_key, key.hexdigest())
+
+  def test_parse_dependency_file(self):
+    self.write_file('a.o.d', 'obj/a.o: jni/a.cc jni/a.h \\\n'
+                    '  /ndk/include/stdio.h jni/with\\ space.h jni/a.h\n'
+                    '\n'
+                    'jni/a.h:\n')
+    self.assertEqual(['jni/a.cc', 'jni/a.h', '/ndk/include/stdio.h',
+                      'jni/with space.h'],
+                     artifact_cache.parse_dependency_file(
+                         os.path.join(self.project, 'a.o.d')))
+
+  def test_manifest(self):
+    self.assertIsNone(self.cache.get_manifest('key'))
+    self.cache.store_manifest('key', ['jni/a.cc', '../include/b.h'])
+    self.assertEqual(['jni/a.cc', '../include/b.h'],
+                     self.cache.get_manifest('key'))
+    self.cache.store_manifest('key', [])
+    self.assertEqual([], self.cache.get_manifest('key'))
+    # Manifests are not cache entries.
+    self.assertEqual([], self.cache.get_entries())
+
+  def test_store_restore(self):
+    self.write_file(os.path.join('libs', 'armeabi', 'liba.so'), 'lib')
+    self.assertFalse(self.cache.restore('key', self.project, ['libs', 'obj']))
+    self.cache.store('key', self.project, ['libs', 'obj'])
+    shutil.rmtree(os.path.join(self.project, 'libs'))
+    self.write_file(os.path.join('obj', 'stale.o'), 'o')
+    self.assertTrue(self.cache.restore('key', self.project, ['libs', 'obj']))
+    with open(os.path.join(self.project, 'libs', 'armeabi', 'liba.so')) as f:
+      self.assertEqual('lib', f.read())
+    self.assertFalse(self.cache.restore('key', self.project, ['libs']))
+
+  def test_evict(self):
+    self.cache.max_size = 10
+    for key in ('a', 'b', 'c'):
+      self.write_file(os.path.join('libs', 'lib.so'), '1234')
+      self.cache.store(key, self.project, ['libs'])
+      os.utime(os.path.join(self.cache.directory, key),
+               (0, {'a': 1, 'b': 3, 'c': 2}[key]))
+    self.assertEqual(['c', 'b'], [k for _, _, k in self.cache.get_entries()])
+    self.cache.max_size = 4
+    self.assertEqual(['c'], self.cache.evict())
+    self.assertTrue(self.cache.restore('b', self.project, ['libs']))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,358 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""@file buildutil/axml.py Reader for Android binary XML files.
+
+The AndroidManifest.xml file in an APK is compiled to Android's binary XML
+(AXML) format.  This module decodes AXML to text XML without depending upon
+the Android Asset Packaging Tool (aapt) so that tools can read the package
+name, launchable activity and SDK versions of an APK in-process.
+
+@package fplutil.buildutil.axml Reader for Android binary XML files.
+"""
+
+import os
+import struct
+import sys
+import xml.dom.minidom
+import xml.sax.saxutils
+import zipfile
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.common as common
+
+## Name of the manifest in an APK.
+MANIFEST_NAME = 'AndroidManifest.xml'
+
+## Android XML schema URI.
+ANDROID_SCHEMA = 'http://schemas.android.com/apk/res/android'
+
+## @cond FPLUTIL_INTERNAL
+# Chunk types, see frameworks/base/include/androidfw/ResourceTypes.h.
+_RES_STRING_POOL_TYPE = 0x0001
+_RES_XML_TYPE = 0x0003
+_RES_XML_START_NAMESPACE_TYPE = 0x0100
+_RES_XML_END_NAMESPACE_TYPE = 0x0101
+_RES_XML_START_ELEMENT_TYPE = 0x0102
+_RES_XML_END_ELEMENT_TYPE = 0x0103
+_RES_XML_RESOURCE_MAP_TYPE = 0x0180
+# Flag set in a string pool header when strings are encoded as UTF-8.
+_UTF8_FLAG = 0x100
+# Index used to reference no string.
+_NO_INDEX = 0xffffffff
+# Res_value data types.
+_TYPE_REFERENCE = 0x01
+_TYPE_ATTRIBUTE = 0x02
+_TYPE_STRING = 0x03
+_TYPE_FLOAT = 0x04
+_TYPE_DIMENSION = 0x05
+_TYPE_FRACTION = 0x06
+_TYPE_INT_HEX = 0x11
+_TYPE_INT_BOOLEAN = 0x12
+_TYPE_INT_COLOR_FIRST = 0x1c
+_TYPE_INT_COLOR_LAST = 0x1f
+# Units of dimension and fraction values.
+_DIMENSION_UNITS = ('px', 'dip', 'sp', 'pt', 'in', 'mm')
+_FRACTION_UNITS = ('%', '%p')
+# Radix multipliers of complex (dimension and fraction) values.
+_COMPLEX_RADIX = (1.0 / (1 << 8), 1.0 / (1 << 15), 1.0 / (1 << 23),
+                  1.0 / (1 << 31))
+# Names of framework attributes used in manifests indexed by resource ID.
+# These are used when attribute names have been stripped from the string
+# pool (e.g by obfuscation tools).
+_ANDROID_ATTRIBUTES = {
+    0x01010003: 'name',
+    0x0101020c: 'minSdkVersion',
+    0x0101021b: 'versionCode',
+    0x0101021c: 'versionName',
+    0x01010270: 'targetSdkVersion',
+    0x01010271: 'maxSdkVersion',
+}
+## @endcond FPLUTIL_INTERNAL
+
+
+def _read_string_pool(data, offset, path):
+  """Read the strings from a string pool chunk.
+
+  Args:
+    data: Binary XML string.
+    offset: Offset of the string pool chunk in data.
+    path: Path of the file being read, used to report errors.
+
+  Returns:
+    List of strings in the pool.
+
+  Raises:
+    common.ConfigurationError: If the string pool is malformed.
+  """
+  (_, header_size, _, string_count, _, flags, strings_start,
+   _) = struct.unpack_from('<HHIIIIII', data, offset)
+  utf8 = flags & _UTF8_FLAG
+  strings = []
+  try:
+    for index in range(string_count):
+      (string_offset,) = struct.unpack_from(
+          '<I', data, offset + header_size + index * 4)
+      position = offset + strings_start + string_offset
+      if utf8:
+        # UTF-16 length followed by UTF-8 length, each 1 or 2 bytes.
+        for _ in range(2):
+          length = ord(data[position])
+          position += 1
+          if length & 0x80:
+            length = ((length & 0x7f) << 8) | ord(data[position])
+            position += 1
+        strings.append(data[position:position + length].decode('utf-8'))
+      else:
+        (length,) = struct.unpack_from('<H', data, position)
+        position += 2
+        if length & 0x8000:
+          (low,) = struct.unpack_from('<H', data, position)
+          length = ((length & 0x7fff) << 16) | low
+          position += 2
+        strings.append(
+            data[position:position + length * 2].decode('utf-16-le'))
+  except (struct.error, IndexError, UnicodeDecodeError) as e:
+    raise common.ConfigurationError(path, 'Malformed string pool: %s' % e)
+  return strings
+
+
+def _format_value(strings, raw_value, data_type, value):
+  """Convert an attribute value to a string.
+
+  Args:
+    strings: String pool.
+    raw_value: Index of the attribute's raw string value in the pool.
+    data_type: Type of the typed value.
+    value: Typed value data.
+
+  Returns:
+    String representation of the attribute value.
+  """
+  if raw_value != _NO_INDEX and raw_value < len(strings):
+    return strings[raw_value]
+  if data_type == _TYPE_STRING:
+    return strings[value] if value < len(strings) else ''
+  if data_type == _TYPE_REFERENCE:
+    return '@%08x' % value
+  if data_type == _TYPE_ATTRIBUTE:
+    return '?%08x' % value
+  if data_type == _TYPE_FLOAT:
+    return '%g' % struct.unpack('<f', struct.pack('<I', value))[0]
+  if data_type in (_TYPE_DIMENSION, _TYPE_FRACTION):
+    mantissa = struct.unpack('<i', struct.pack('<I', value & 0xffffff00))[0]
+    number = mantissa * _COMPLEX_RADIX[(value >> 4) & 0x3]
+    if data_type == _TYPE_DIMENSION:
+      units = _DIMENSION_UNITS
+    else:
+      units = _FRACTION_UNITS
+      number *= 100
+    unit = value & 0xf
+    return '%g%s' % (number, units[unit] if unit < len(units) else '')
+  if data_type == _TYPE_INT_HEX:
+    return '0x%08x' % value
+  if data_type == _TYPE_INT_BOOLEAN:
+    return 'true' if value else 'false'
+  if _TYPE_INT_COLOR_FIRST <= data_type <= _TYPE_INT_COLOR_LAST:
+    return '#%08x' % value
+  return str(struct.unpack('<i', struct.pack('<I', value))[0])
+
+
+def decode(data, path=''):
+  """Decode binary XML to text XML.
+
+  Args:
+    data: Binary XML string.
+    path: Path of the file being decoded, used to report errors.
+
+  Returns:
+    Unicode string containing the XML document.
+
+  Raises:
+    common.ConfigurationError: If the data isn't valid binary XML.
+  """
+  try:
+    (chunk_type, header_size, size) = struct.unpack_from('<HHI', data, 0)
+  except struct.error:
+    chunk_type = None
+  if chunk_type != _RES_XML_TYPE:
+    raise common.ConfigurationError(path, 'Not a binary XML file')
+  size = min(size, len(data))
+
+  strings = []
+  resource_ids = []
+  # Namespaces declared on the next element as (prefix, uri) tuples.
+  pending_namespaces = []
+  # Prefixes indexed by namespace URI.
+  prefixes = {}
+  lines = ['<?xml version="1.0" encoding="utf-8"?>']
+  depth = 0
+
+  def string(index):
+    """Get a string from the pool or an empty string for no index."""
+    return strings[index] if index < len(strings) else ''
+
+  offset = header_size
+  while offset + 8 <= size:
+    (chunk_type, chunk_header_size, chunk_size) = struct.unpack_from(
+        '<HHI', data, offset)
+    if chunk_size < 8 or offset + chunk_size > size:
+      raise common.ConfigurationError(
+          path, 'Malformed chunk at offset %d' % offset)
+    body = offset + chunk_header_size
+    if chunk_type == _RES_STRING_POOL_TYPE:
+      strings = _read_string_pool(data, offset, path)
+    elif chunk_type == _RES_XML_RESOURCE_MAP_TYPE:
+      resource_ids = list(struct.unpack_from(
+          '<%dI' % ((chunk_size - chunk_header_size) / 4), data, body))
+    elif chunk_type == _RES_XML_START_NAMESPACE_TYPE:
+      prefix, uri = struct.unpack_from('<II', data, body)
+      prefixes[string(uri)] = string(prefix)
+      pending_namespaces.append((string(prefix), string(uri)))
+    elif chunk_type == _RES_XML_START_ELEMENT_TYPE:
+      (namespace, name, attribute_start, attribute_size,
+       attribute_count) = struct.unpack_from('<IIHHH', data, body)
+      attributes = ['xmlns:%s=%s' % (prefix, xml.sax.saxutils.quoteattr(uri))
+                    for prefix, uri in pending_namespaces]
+      pending_namespaces = []
+      for index in range(attribute_count):
+        (attribute_namespace, attribute_name, raw_value, _, _, data_type,
+         value) = struct.unpack_from(
+             '<IIIHBBI', data, body + attribute_start + index * attribute_size)
+        attribute = string(attribute_name)
+        if not attribute and attribute_name < len(resource_ids):
+          attribute = _ANDROID_ATTRIBUTES.get(resource_ids[attribute_name],
+                                              '')
+        prefix = prefixes.get(string(attribute_namespace))
+        if prefix:
+          attribute = '%s:%s' % (prefix, attribute)
+        attributes.append('%s=%s' % (attribute, xml.sax.saxutils.quoteattr(
+            _format_value(strings, raw_value, data_type, value))))
+      tag = string(name)
+      prefix = prefixes.get(string(namespace))
+      if prefix:
+        tag = '%s:%s' % (prefix, tag)
+      lines.append('%s<%s>' % ('  ' * depth, ' '.join([tag] + attributes)))
+      depth += 1
+    elif chunk_type == _RES_XML_END_ELEMENT_TYPE:
+      namespace, name = struct.unpack_from('<II', data, body)
+      depth -= 1
+      tag = string(name)
+      prefix = prefixes.get(string(namespace))
+      if prefix:
+        tag = '%s:%s' % (prefix, tag)
+      lines.append('%s</%s>' % ('  ' * depth, tag))
+    elif chunk_type == _RES_XML_END_NAMESPACE_TYPE:
+      pass
+    offset += chunk_size
+  return u'\n'.join(lines)
+
+
+def read_apk_manifest(apk_path):
+  """Read and decode the manifest from an APK.
+
+  Args:
+    apk_path: Path to the APK.
+
+  Returns:
+    Unicode string containing the manifest XML document.
+
+  Raises:
+    common.ConfigurationError: If the APK or manifest can't be read.
+  """
+  try:
+    with zipfile.ZipFile(apk_path) as apk:
+      data = apk.read(MANIFEST_NAME)
+  except (IOError, KeyError, zipfile.BadZipfile) as e:
+    raise common.ConfigurationError(apk_path, str(e))
+  return decode(data, '%s:%s' % (apk_path, MANIFEST_NAME))
+
+
+class ApkManifest(object):
+
+  """Summary of the manifest of an APK.
+
+  Attributes:
+    package_name: Name of the package.
+    activity_name: Name of the activity which handles the
+      android.intent.action.MAIN intent, preferring activities in the
+      android.intent.category.LAUNCHER category.  Empty string if no
+      activity is found.
+    min_sdk_version: Value of the minSdkVersion attribute of the uses-sdk
+      element, empty string if it isn't specified.
+    target_sdk_version: Value of the targetSdkVersion attribute of the
+      uses-sdk element, empty string if it isn't specified.
+    version_code: Value of the versionCode attribute of the manifest.
+    version_name: Value of the versionName attribute of the manifest.
+  """
+
+  def __init__(self, manifest_xml, path=''):
+    """Parse the manifest.
+
+    Args:
+      manifest_xml: String containing the manifest XML document.
+      path: Path of the manifest, used to report errors.
+
+    Raises:
+      common.ConfigurationError: If the manifest can't be parsed.
+    """
+    try:
+      if isinstance(manifest_xml, unicode):
+        manifest_xml = manifest_xml.encode('utf-8')
+      document = xml.dom.minidom.parseString(manifest_xml)
+    except Exception as e:  # pylint: disable=broad-except
+      raise common.ConfigurationError(path, str(e))
+    manifest_elements = document.getElementsByTagName('manifest')
+    if not manifest_elements:
+      raise common.ConfigurationError(path, 'No manifest element')
+    manifest = manifest_elements[0]
+    self.package_name = manifest.getAttribute('package')
+    self.version_code = manifest.getAttribute('android:versionCode')
+    self.version_name = manifest.getAttribute('android:versionName')
+    self.min_sdk_version = ''
+    self.target_sdk_version = ''
+    for uses_sdk in manifest.getElementsByTagName('uses-sdk'):
+      self.min_sdk_version = uses_sdk.getAttribute('android:minSdkVersion')
+      self.target_sdk_version = uses_sdk.getAttribute(
+          'android:targetSdkVersion')
+    self.activity_name = ''
+    launcher_found = False
+    for activity in (manifest.getElementsByTagName('activity') +
+                     manifest.getElementsByTagName('activity-alias')):
+      for intent_filter in activity.getElementsByTagName('intent-filter'):
+        actions = [a.getAttribute('android:name') for a in
+                   intent_filter.getElementsByTagName('action')]
+        categories = [c.getAttribute('android:name') for c in
+                      intent_filter.getElementsByTagName('category')]
+        if 'android.intent.action.MAIN' not in actions:
+          continue
+        launcher = 'android.intent.category.LAUNCHER' in categories
+        if not self.activity_name or (launcher and not launcher_found):
+          self.activity_name = activity.getAttribute('android:name')
+          launcher_found = launcher
+
+  @staticmethod
+  def read(apk_path):
+    """Read the manifest of an APK.
+
+    Args:
+      apk_path: Path to the APK.
+
+    Returns:
+      ApkManifest instance.
+
+    Raises:
+      common.ConfigurationError: If the APK or manifest can't be read.
+    """
+    return ApkManifest(read_apk_manifest(apk_path), apk_path)
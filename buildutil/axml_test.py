@@ -0,0 +1,192 @@
+#!/usr/bin/python
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+import zipfile
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.axml as axml
+import buildutil.common as common
+
+
+class AxmlEncoder(object):
+  """Encodes a tree of elements as Android binary XML.
+
+  Attributes:
+    strings: List of strings in the string pool.
+    utf8: Whether to encode the string pool as UTF-8.
+  """
+
+  def __init__(self, utf8=False):
+    """Initialize the instance.
+
+    Args:
+      utf8: Whether to encode the string pool as UTF-8.
+    """
+    self.strings = []
+    self.utf8 = utf8
+
+  def index(self, string):
+    """Get the index of a string in the pool, adding it if required."""
+    if string is None:
+      return 0xffffffff
+    if string not in self.strings:
+      self.strings.append(string)
+    return self.strings.index(string)
+
+  @staticmethod
+  def chunk(chunk_type, header, body):
+    """Build a chunk from a header (excluding the chunk header) and body."""
+    return struct.pack('<HHI', chunk_type, 8 + len(header),
+                       8 + len(header) + len(body)) + header + body
+
+  def string_pool(self):
+    """Encode the string pool."""
+    offsets = []
+    data = ''
+    for string in self.strings:
+      offsets.append(len(data))
+      if self.utf8:
+        encoded = string.encode('utf-8')
+        data += struct.pack('<BB', len(string), len(encoded)) + encoded + '\0'
+      else:
+        data += (struct.pack('<H', len(string)) + string.encode('utf-16-le') +
+                 '\0\0')
+    data += '\0' * (-len(data) % 4)
+    header_size = 28
+    header = struct.pack('<IIIII', len(self.strings), 0,
+                         0x100 if self.utf8 else 0,
+                         header_size + 4 * len(offsets), 0)
+    return self.chunk(0x0001, header,
+                      struct.pack('<%dI' % len(offsets), *offsets) + data)
+
+  def element(self, name, attributes, children):
+    """Encode an element and its children.
+
+    Args:
+      name: Name of the element.
+      attributes: List of (namespace, name, raw_value, data_type, value)
+        tuples.
+      children: List of (name, attributes, children) tuples.
+
+    Returns:
+      Binary string.
+    """
+    attribute_data = ''.join([
+        struct.pack('<IIIHBBI', self.index(ns), self.index(attribute),
+                    self.index(raw), 8, 0, data_type, value)
+        for ns, attribute, raw, data_type, value in attributes])
+    start = self.chunk(0x0102, struct.pack('<II', 1, 0xffffffff),
+                       struct.pack('<IIHHHHHH', 0xffffffff, self.index(name),
+                                   20, 20, len(attributes), 0, 0, 0) +
+                       attribute_data)
+    end = self.chunk(0x0103, struct.pack('<II', 1, 0xffffffff),
+                     struct.pack('<II', 0xffffffff, self.index(name)))
+    return start + ''.join([self.element(*c) for c in children]) + end
+
+  def encode(self, root):
+    """Encode a document.
+
+    Args:
+      root: (name, attributes, children) tuple of the root element.
+
+    Returns:
+      Binary XML string.
+    """
+    namespace = struct.pack('<II', self.index('android'),
+                            self.index(axml.ANDROID_SCHEMA))
+    node_header = struct.pack('<II', 1, 0xffffffff)
+    body = (self.chunk(0x0100, node_header, namespace) +
+            self.element(*root) +
+            self.chunk(0x0101, node_header, namespace))
+    return self.chunk(0x0003, '', self.string_pool() + body)
+
+
+def android_name(value):
+  """Build an android:name string attribute."""
+  return (axml.ANDROID_SCHEMA, 'name', value, 0x03, 0)
+
+
+MANIFEST = (
+    'manifest',
+    [(None, 'package', 'com.example.app', 0x03, 0),
+     (axml.ANDROID_SCHEMA, 'versionCode', None, 0x10, 42),
+     (axml.ANDROID_SCHEMA, 'versionName', '1.0 & more', 0x03, 0)],
+    [('uses-sdk', [(axml.ANDROID_SCHEMA, 'minSdkVersion', None, 0x10, 9),
+                   (axml.ANDROID_SCHEMA, 'targetSdkVersion', None, 0x10,
+                    19)], []),
+     ('application',
+      [(axml.ANDROID_SCHEMA, 'debuggable', None, 0x12, 0xffffffff)],
+      [('activity', [android_name('.Settings')],
+        [('intent-filter', [],
+          [('action', [android_name('android.intent.action.MAIN')], [])])]),
+       ('activity', [android_name('android.app.NativeActivity')],
+        [('intent-filter', [],
+          [('action', [android_name('android.intent.action.MAIN')], []),
+           ('category', [android_name('android.intent.category.LAUNCHER')],
+            [])])])])])
+
+
+class AxmlTest(unittest.TestCase):
+  """Binary XML reader unit tests."""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_decode(self):
+    document = axml.decode(AxmlEncoder().encode(MANIFEST))
+    self.assertIn('xmlns:android="%s"' % axml.ANDROID_SCHEMA, document)
+    self.assertIn('package="com.example.app"', document)
+    self.assertIn('android:versionCode="42"', document)
+    self.assertIn('android:versionName="1.0 &amp; more"', document)
+    self.assertIn('android:debuggable="true"', document)
+
+  def test_decode_utf8(self):
+    self.assertEqual(axml.decode(AxmlEncoder().encode(MANIFEST)),
+                     axml.decode(AxmlEncoder(utf8=True).encode(MANIFEST)))
+
+  def test_decode_invalid(self):
+    with self.assertRaises(common.ConfigurationError):
+      axml.decode('<manifest/>')
+
+  def test_apk_manifest(self):
+    apk_path = os.path.join(self.directory, 'test.apk')
+    with zipfile.ZipFile(apk_path, 'w') as apk:
+      apk.writestr(axml.MANIFEST_NAME, AxmlEncoder().encode(MANIFEST))
+    manifest = axml.ApkManifest.read(apk_path)
+    self.assertEqual('com.example.app', manifest.package_name)
+    self.assertEqual('android.app.NativeActivity', manifest.activity_name)
+    self.assertEqual('9', manifest.min_sdk_version)
+    self.assertEqual('19', manifest.target_sdk_version)
+    self.assertEqual('42', manifest.version_code)
+
+  def test_apk_without_manifest(self):
+    apk_path = os.path.join(self.directory, 'test.apk')
+    with zipfile.ZipFile(apk_path, 'w') as apk:
+      apk.writestr('classes.dex', '')
+    with self.assertRaises(common.ConfigurationError):
+      axml.ApkManifest.read(apk_path)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -24,19 +24,31 @@ Optional environment variables:
 @li MAKE_PATH = Path to make binary. Required if make is not in $PATH,
 or not passed on command line.
 @li MAKE_FLAGS = String to override the default make flags with.
+@li FPLUTIL_CACHE_DIR = Directory used to store data cached between
+invocations of fplutil tools, defaults to ~/.cache/fplutil.
 
 @package fplutil.buildutil.common Common BuildEnvironment.
 """
 
+import contextlib
 import datetime
 import distutils.spawn
+import hashlib
+import json
 import multiprocessing
 import os
 import platform
 import shlex
 import shutil
-import subprocess
-import zipfile
+import sys
+import tempfile
+import threading
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.archive as archive
+import buildutil.artifact_cache as artifact_cache
+import buildutil.compiler_cache as compiler_cache
+import buildutil.runner as runner
+import buildutil.trace as trace
 
 ## @cond FPLUTIL_INTERNAL
 # Flag which specifies directory of the project to build.
@@ -47,6 +59,8 @@ _MAKE_PATH_ENV_VAR = 'MAKE_PATH'
 _GIT_PATH_ENV_VAR = 'GIT_PATH'
 # Environment variable which specifies flags for `make`.
 _MAKE_FLAGS_ENV_VAR = 'MAKE_FLAGS'
+# Environment variable which specifies the path to `ccache`.
+_CCACHE_PATH_ENV_VAR = 'CCACHE_PATH'
 # Flag which specifies the number of CPUs to use during the build process.
 _CPU_COUNT = 'cpu_count'
 # Flag which specifies the path to `make`.
@@ -63,6 +77,36 @@ _VERBOSE = 'verbose'
 _OUTPUT_DIR = 'output_dir'
 # Flag which controls whether the project should be cleaned.
 _CLEAN = 'clean'
+# Flag which specifies the zlib compression level of archives.
+_ARCHIVE_COMPRESSION = 'archive_compression'
+# Flag which enables deterministic archives.
+_ARCHIVE_DETERMINISTIC = 'archive_deterministic'
+# Flag which enables reuse of compressed files from previous archives.
+_ARCHIVE_INCREMENTAL = 'archive_incremental'
+# Subdirectory of the cache directory which contains archive indices.
+_ARCHIVE_INDEX_SUBDIR = 'archives'
+# Flag which specifies the file to write a trace of the build to.
+_TRACE_OUT = 'trace_out'
+# Flag which enables the cache of build outputs.
+_ARTIFACT_CACHE = 'artifact_cache'
+# Flag which specifies the maximum size of the cache of build outputs in MB.
+_ARTIFACT_CACHE_SIZE = 'artifact_cache_size'
+# Subdirectory of the cache directory which contains build outputs.
+_ARTIFACT_CACHE_SUBDIR = 'artifacts'
+# Flag which enables compilation via ccache.
+_CCACHE = 'ccache'
+# Flag which specifies the path to `ccache`.
+_CCACHE_PATH = 'ccache_path'
+# Flag which specifies the directory used by ccache to store its cache.
+_CCACHE_DIR = 'ccache_dir'
+# Flag which specifies the maximum size of ccache's cache.
+_CCACHE_SIZE = 'ccache_size'
+# Number of lines of a subprocess' output logged to a file that are reported
+# when the subprocess fails.
+_ERROR_TAIL_LINES = 20
+# Environment variable which specifies the directory used to cache data
+# between invocations of fplutil tools.
+_CACHE_DIR_ENV_VAR = 'FPLUTIL_CACHE_DIR'
 ## @endcond FPLUTIL_INTERNAL
 
 class Error(Exception):
@@ -210,12 +254,34 @@ class BuildEnvironment(object):
     verbose: Boolean to enable verbose message output.
     host_os_name: Lowercased name of host operating system.
     host_architecture: Lowercased name of host machine architecture.
+    archive_compression: zlib compression level (0-9) of the files in
+      archives written by make_archive(), 0 stores files uncompressed.
+    archive_deterministic: Boolean value which specifies whether archives
+      written by make_archive() are sorted and use fixed timestamps and
+      permissions so that identical files produce identical archives.
+    archive_incremental: Boolean value which specifies whether make_archive()
+      reuses the compressed data of unchanged files from the existing
+      archive.
+    trace_out: Name of the file to write a Chrome trace of the build to or
+      None if tracing is disabled.
+    tracer: buildutil.trace.Tracer which records the steps of the build if
+      trace_out is set, None otherwise.
+    artifact_cache: buildutil.artifact_cache.ArtifactCache used to reuse the
+      outputs of build steps or None if the cache is disabled.
+    ccache: Boolean value which specifies whether to compile using ccache.
+    ccache_path: Path to the ccache binary.
+    ccache_dir: Directory used by ccache to store its cache or None to use
+      ccache's default.
+    ccache_size: Maximum size of ccache's cache (e.g 5G) or None to use the
+      size configured for the cache.
 
   Class Attributes:
+    CCACHE: Name of the ccache binary.
     GIT: Name of the git binary.
     MAKE: Name of the make binary.
   """
 
+  CCACHE = 'ccache'
   GIT = 'git'
   MAKE = 'make'
 
@@ -250,6 +316,23 @@ class BuildEnvironment(object):
     self.cpu_count = args[_CPU_COUNT]
     self.verbose = args[_VERBOSE]
     self.clean = args[_CLEAN]
+    self.archive_compression = args[_ARCHIVE_COMPRESSION]
+    self.archive_deterministic = args[_ARCHIVE_DETERMINISTIC]
+    self.archive_incremental = args[_ARCHIVE_INCREMENTAL]
+    self.trace_out = args[_TRACE_OUT]
+    self.tracer = trace.Tracer() if self.trace_out else None
+    self._thread_state = threading.local()
+    self.artifact_cache = (
+        artifact_cache.ArtifactCache(
+            get_cache_directory(_ARTIFACT_CACHE_SUBDIR),
+            int(args[_ARTIFACT_CACHE_SIZE]) * 1024 * 1024)
+        if args[_ARTIFACT_CACHE] else None)
+    self.ccache = args[_CCACHE]
+    self.ccache_path = args[_CCACHE_PATH]
+    self.ccache_dir = args[_CCACHE_DIR]
+    self.ccache_size = args[_CCACHE_SIZE]
+    self._ccache_configured = False
+    self._ccache_lock = threading.Lock()
 
     platform_info = platform.uname()
     self.host_os_name = platform_info[0].lower()
@@ -315,6 +398,17 @@ class BuildEnvironment(object):
     args[_VERBOSE] = False
     args[_OUTPUT_DIR] = args[_PROJECT_DIR]
     args[_CLEAN] = False
+    args[_ARCHIVE_COMPRESSION] = archive.DEFAULT_COMPRESSION_LEVEL
+    args[_ARCHIVE_DETERMINISTIC] = False
+    args[_ARCHIVE_INCREMENTAL] = False
+    args[_TRACE_OUT] = None
+    args[_ARTIFACT_CACHE] = False
+    args[_ARTIFACT_CACHE_SIZE] = 4096
+    args[_CCACHE] = False
+    args[_CCACHE_PATH] = (os.getenv(_CCACHE_PATH_ENV_VAR) or
+                          _find_executable('ccache'))
+    args[_CCACHE_DIR] = None
+    args[_CCACHE_SIZE] = None
 
     return args
 
@@ -359,6 +453,54 @@ class BuildEnvironment(object):
     parser.add_argument('-c', '--' + _CLEAN, action='store_true',
                         help='Clean all build artifacts.',
                         default=False)
+    parser.add_argument('--' + _ARCHIVE_COMPRESSION,
+                        help=('Compression level of build archives from 0 '
+                              '(no compression) to 9 (best compression).'),
+                        dest=_ARCHIVE_COMPRESSION, type=int,
+                        choices=range(10),
+                        default=defaults[_ARCHIVE_COMPRESSION])
+    parser.add_argument('--' + _ARCHIVE_DETERMINISTIC,
+                        help=('Write build archives with sorted entries, '
+                              'fixed timestamps and normalized permissions '
+                              'so that identical files produce identical '
+                              'archives.'),
+                        dest=_ARCHIVE_DETERMINISTIC, action='store_true',
+                        default=defaults[_ARCHIVE_DETERMINISTIC])
+    parser.add_argument('--' + _ARCHIVE_INCREMENTAL,
+                        help=('Reuse the compressed data of unchanged files '
+                              'from the existing build archive.'),
+                        dest=_ARCHIVE_INCREMENTAL, action='store_true',
+                        default=defaults[_ARCHIVE_INCREMENTAL])
+    parser.add_argument('--' + _TRACE_OUT,
+                        help=('Write a trace of the time spent in each step '
+                              'of the build to the specified file in the '
+                              'Chrome trace event format.'),
+                        dest=_TRACE_OUT, default=defaults[_TRACE_OUT])
+    parser.add_argument('--' + _ARTIFACT_CACHE,
+                        help=('Restore the outputs of build steps whose '
+                              'inputs are unchanged from a cache shared '
+                              'between checkouts.'),
+                        dest=_ARTIFACT_CACHE, action='store_true',
+                        default=defaults[_ARTIFACT_CACHE])
+    parser.add_argument('--' + _ARTIFACT_CACHE_SIZE,
+                        help=('Maximum size in MB of the build output cache. '
+                              'Least recently used outputs are removed '
+                              'when the cache exceeds this size.'),
+                        dest=_ARTIFACT_CACHE_SIZE, type=int,
+                        default=defaults[_ARTIFACT_CACHE_SIZE])
+    parser.add_argument('--' + _CCACHE,
+                        help='Compile C and C++ source files using ccache.',
+                        dest=_CCACHE, action='store_true',
+                        default=defaults[_CCACHE])
+    parser.add_argument('--' + _CCACHE_PATH, help='Path to ccache binary',
+                        dest=_CCACHE_PATH, default=defaults[_CCACHE_PATH])
+    parser.add_argument('--' + _CCACHE_DIR,
+                        help='Directory used by ccache to store its cache.',
+                        dest=_CCACHE_DIR, default=defaults[_CCACHE_DIR])
+    parser.add_argument('--' + _CCACHE_SIZE,
+                        help=('Maximum size of the ccache cache, for example '
+                              '5G.'),
+                        dest=_CCACHE_SIZE, default=defaults[_CCACHE_SIZE])
 
   @staticmethod
   def _check_binary(name, paths):
@@ -403,6 +545,7 @@ class BuildEnvironment(object):
     binary to avoid replication of code which searches for binaries.
 
     This class allows the lookup of...
+    * BuildEnvironment.CCACHE
     * BuildEnvironment.GIT
     * BuildEnvironment.MAKE
 
@@ -418,17 +561,18 @@ class BuildEnvironment(object):
     Raises:
       ToolPathError: Binary is not at the specified path.
     """
-    search_dict = {BuildEnvironment.GIT: [self.git_path],
+    search_dict = {BuildEnvironment.CCACHE: [self.ccache_path],
+                   BuildEnvironment.GIT: [self.git_path],
                    BuildEnvironment.MAKE: [self.make_path]}
     if additional_paths:
       search_dict.update(additional_paths)
     return BuildEnvironment._check_binary(binary, search_dict[binary])
 
   def run_subprocess(self, argv, capture=False, cwd=None, shell=False,
-                     stdin=None):
+                     stdin=None, log_filename=None):
     """Run a subprocess as specified by the given argument list.
 
-    Runs a process via popen().
+    Runs a process via runner.run().
 
     Args:
       argv: A list of process arguments starting with the binary name, in the
@@ -438,6 +582,9 @@ class BuildEnvironment(object):
         for commands that do not allow specifying this, such as ant.
       shell: Optional argument to tell subprocess to allow for shell features.
       stdin: String to send to the standard input of the process.
+      log_filename: Optional file to write the standard output and error
+        streams of the process to instead of displaying them.  Defaults to
+        the file selected for the calling thread by subprocess_log().
     Returns:
       A tuple of (stdout, stderr), or (None, None) if capture=False.
 
@@ -451,26 +598,202 @@ class BuildEnvironment(object):
     if cwd:
       cwd = os.path.abspath(os.path.join(self.project_directory, cwd))
 
-    stdout = None
-    stderr = None
-    stdin_pipe = subprocess.PIPE if stdin else None
-    if capture:
-      process = subprocess.Popen(args=argv, bufsize=-1, stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE, shell=shell, cwd=cwd,
-                                 stdin=stdin_pipe)
-    else:
-      process = subprocess.Popen(argv, shell=shell, cwd=cwd, stdin=stdin_pipe)
+    if not log_filename:
+      log_filename = getattr(getattr(self, '_thread_state', None),
+                             'log_filename', None)
+    # Captured streams are returned separately so they're only merged when
+    # the output is just written to the log.
+    merge_stderr = bool(log_filename) and not capture
+    result = runner.run(argv, cwd=cwd, shell=shell, stdin=stdin or None,
+                        capture=capture, log_filename=log_filename,
+                        merge_stderr=merge_stderr,
+                        tail_lines=_ERROR_TAIL_LINES)
+
+    if result.returncode or self.verbose:
+      print 'Subprocess returned %d' % result.returncode
+    if self.verbose:
+      print 'Subprocess took %.2fs' % result.wall_time
+
+    if result.returncode:
+      stderr = result.stderr
+      if log_filename:
+        stderr = '%s(see %s)' % (''.join(
+            result.stdout_tail if merge_stderr else result.stderr_tail),
+                                 log_filename)
+      raise SubCommandError(argv, result.returncode, stderr)
+
+    stdout = result.stdout
+    stderr = result.stderr
+    return (stdout, stderr)
 
-    (stdout, stderr) = process.communicate(stdin)
+  @contextlib.contextmanager
+  def subprocess_log(self, log_filename):
+    """Log the output of subprocesses run by the calling thread to a file.
 
-    if process.returncode or self.verbose:
-      print 'Subprocess returned %d' % process.returncode
+    This allows the output of steps run concurrently to be separated.
 
-    if process.returncode:
-      raise SubCommandError(argv, process.returncode, stderr)
+    Args:
+      log_filename: File which receives the output of each subprocess
+        started by run_subprocess() from the calling thread within the with
+        statement.  The file is truncated when the with statement is entered.
 
-    return (stdout, stderr)
+    Yields:
+      log_filename
+    """
+    directory = os.path.dirname(os.path.abspath(log_filename))
+    if not os.path.exists(directory):
+      try:
+        os.makedirs(directory)
+      except OSError:
+        # Another thread may have created the directory.
+        if not os.path.isdir(directory):
+          raise
+    open(log_filename, 'w').close()
+    previous_log_filename = getattr(self._thread_state, 'log_filename', None)
+    self._thread_state.log_filename = log_filename
+    try:
+      yield log_filename
+    finally:
+      self._thread_state.log_filename = previous_log_filename
+
+  def write_trace(self):
+    """Write the trace of the build to trace_out and stop tracing.
+
+    Does nothing if tracing is not enabled.
+    """
+    if self.tracer:
+      self.tracer.close()
+      self.tracer.write(self.trace_out)
+      self.tracer = None
+      if self.verbose:
+        print 'Wrote build trace to %s' % self.trace_out
+
+  def bind_trace(self, function):
+    """Attribute the work of a function run on a worker thread to the trace.
+
+    Args:
+      function: Function to wrap.
+
+    Returns:
+      Function which records its spans and subprocesses within the spans
+      open on the calling thread, see buildutil.trace.Tracer.bind().
+    """
+    return self.tracer.bind(function) if self.tracer else function
+
+  def get_artifact_key_builder(self):
+    """Create a KeyBuilder which identifies outputs of this environment.
+
+    Derived classes add the tools and flags that affect their outputs.
+
+    Returns:
+      buildutil.artifact_cache.KeyBuilder instance.
+    """
+    key = artifact_cache.KeyBuilder(self.project_directory)
+    key.add_value(self.host_os_name)
+    key.add_value(self.host_architecture)
+    key.add_value(self.make_flags)
+    return key
+
+  def run_cached(self, build, key, outputs, base_directory=None,
+                 get_output_key=None):
+    """Run a build step unless its outputs can be restored from the cache.
+
+    If the artifact cache is disabled, the project is being cleaned or there
+    is no key the build step is always run.
+
+    Args:
+      build: Function which runs the build step.
+      key: Key derived from the inputs of the build step or None.
+      outputs: List of directories, relative to base_directory, written by
+        the build step.
+      base_directory: Directory outputs are relative to, defaults to the
+        project directory.
+      get_output_key: Optional function called after the build step is run
+        which returns the key to store the outputs under, or None to not
+        store them.  Used when the inputs of the step are only known once
+        it has run.  Defaults to key.
+
+    Returns:
+      True if the outputs were restored from the cache, False if the build
+      step was run.
+    """
+    base_directory = base_directory or self.project_directory
+    if not self.artifact_cache or self.clean or not (key or get_output_key):
+      build()
+      return False
+    if key and self.artifact_cache.restore(key, base_directory, outputs):
+      if self.verbose:
+        print 'Restored %s from the artifact cache' % ', '.join(outputs)
+      return True
+    build()
+    output_key = get_output_key() if get_output_key else key
+    if output_key:
+      self.artifact_cache.store(output_key, base_directory, outputs)
+    return False
+
+  def get_ccache(self):
+    """Get the path of ccache configuring it on first use.
+
+    ccache is configured via environment variables inherited by the
+    subprocesses of this process.  CCACHE_BASEDIR is set to the project
+    directory, unless it's already set, so that compilations are shared
+    between checkouts in different directories.
 
+    Returns:
+      Path to ccache or None if ccache is disabled.
+
+    Raises:
+      SubCommandError: ccache invocation failed or returned an error.
+      ToolPathError: ccache not found in configured build environment or
+        $PATH.
+    """
+    if not self.ccache:
+      return None
+    ccache = self._find_binary(BuildEnvironment.CCACHE)
+    with self._ccache_lock:
+      if not self._ccache_configured:
+        if self.ccache_dir:
+          os.environ['CCACHE_DIR'] = os.path.abspath(self.ccache_dir)
+        if not os.getenv('CCACHE_BASEDIR'):
+          os.environ['CCACHE_BASEDIR'] = os.path.abspath(
+              self.project_directory)
+        if self.ccache_size:
+          self.run_subprocess([ccache, '-M', self.ccache_size], capture=True)
+        self._ccache_configured = True
+    return ccache
+
+  def get_ccache_stats(self):
+    """Read the statistics of ccache.
+
+    Returns:
+      buildutil.compiler_cache.Stats instance or None if ccache is disabled.
+    """
+    ccache = self.get_ccache()
+    if not ccache:
+      return None
+    out, _ = self.run_subprocess([ccache, '-s'], capture=True)
+    return compiler_cache.parse_stats(out)
+
+  @contextlib.contextmanager
+  def ccache_report(self):
+    """Display ccache's effectiveness for builds run in a with statement.
+
+    When the with statement exits the number of compilations served from and
+    added to the cache and the hit rate are displayed.  ccache's counters are
+    shared by every build using the cache directory so compilations of
+    builds running concurrently with this one are included.
+
+    Yields:
+      None
+    """
+    stats = self.get_ccache_stats()
+    try:
+      yield
+    finally:
+      if stats:
+        print (self.get_ccache_stats() - stats).summary()
+
+  @trace.traced()
   def run_make(self):
     """Run make based on the specified build environment.
 
@@ -492,12 +815,20 @@ class BuildEnvironment(object):
 
     self.run_subprocess(args)
 
+  @trace.traced()
   def make_archive(self, dirlist, archive_path, copyto=None, exclude=None):
     """Archive build artifacts at the specified directory paths.
 
     Creates a zip archive containing the contents of all the directories
     specified in dirlist. All dirlist paths are relative from the project
-    top directory.
+    top directory.  Files are compressed at archive_compression using
+    cpu_count processes.
+
+    If archive_incremental is set, the existing archive is replaced only
+    when the new archive is complete and the compressed data of files which
+    are unchanged since the existing archive was written is copied from it.
+    An index of the files in each archive is stored in the "archives"
+    subdirectory of get_cache_directory() to detect unchanged files.
 
     Args:
       dirlist: A list of directories to archive, relative to the value of the
@@ -514,7 +845,12 @@ class BuildEnvironment(object):
       IOError: An error occurred writing or copying the archive.
     """
     arcabs = os.path.join(self.output_directory, archive_path)
-    if os.path.exists(arcabs):
+    index_path = None
+    if self.archive_incremental:
+      index_path = os.path.join(
+          get_cache_directory(_ARCHIVE_INDEX_SUBDIR),
+          hashlib.sha1(os.path.abspath(arcabs)).hexdigest() + '.json')
+    elif os.path.exists(arcabs):
       os.remove(arcabs)
 
     if self.verbose:
@@ -524,8 +860,12 @@ class BuildEnvironment(object):
     now_string = now.strftime('%Y_%m_%d_%H%M.%S.%f')
     tmp = arcabs + str(os.getpid()) + now_string
 
-    self._write_archive(tmp, dirlist, exclude)
+    self._write_archive(tmp, dirlist, exclude,
+                        previous_archive=arcabs if index_path else None,
+                        index_path=index_path)
 
+    if os.path.exists(arcabs) and sys.platform == 'win32':
+      os.remove(arcabs)
     os.rename(tmp, arcabs)
     if self.verbose:
       print 'Archive complete at: %s' % arcabs
@@ -535,13 +875,17 @@ class BuildEnvironment(object):
         print 'Copying archive to: %s' % copyto
       shutil.copy2(arcabs, copyto)
 
-  def _write_archive(self, path, directory_list, exclude):
+  def _write_archive(self, path, directory_list, exclude,
+                     previous_archive=None, index_path=None):
     """Write a zip archive of a list of directories.
 
     Args:
       path: A path to the zipfile to create.
       directory_list: A list of directories to archive.
       exclude: Subtree directory names to exclude from the archive.
+      previous_archive: Optional archive to reuse unchanged entries from.
+      index_path: Optional file which stores the index of the archive used
+        to detect unchanged entries.
 
     Raises:
       IOError: An error occurred writing the archive.
@@ -555,23 +899,33 @@ class BuildEnvironment(object):
     # the project base dir. In this code, absolute paths are prefaced with
     # 'abs' to make that clear. The final filename in the archive is resolved
     # in the call to os.path.relpath.
-    with zipfile.ZipFile(path, 'w') as arczip:
-      for d in directory_list:
-        absd = os.path.join(self.project_directory, d)
-        if self.verbose:
-          print 'Archiving directory %s' % d
-        for root, dirs, files in os.walk(absd):
-          if exclude:
-            for ex in exclude:
-              if ex in dirs:
-                dirs.remove(ex)
-          for f in files:
-            absf = os.path.join(root, f)
-            absr = os.path.relpath(absf,
-                                   os.path.dirname(self.project_directory))
-            if self.verbose:
-              print '--> Archiving "%s" as "%s"' % (absf, absr)
-            arczip.write(absf, absr)
+    entries = []
+    for d in directory_list:
+      absd = os.path.join(self.project_directory, d)
+      if self.verbose:
+        print 'Archiving directory %s' % d
+      for root, dirs, files in os.walk(absd):
+        if exclude:
+          for ex in exclude:
+            if ex in dirs:
+              dirs.remove(ex)
+        for f in files:
+          absf = os.path.join(root, f)
+          absr = os.path.relpath(absf,
+                                 os.path.dirname(self.project_directory))
+          entries.append((absf, absr))
+
+    def archived(absf, absr):
+      """Display each file as it's added to the archive."""
+      print '--> Archiving "%s" as "%s"' % (absf, absr)
+
+    archive.write_archive(path, entries,
+                          compression_level=self.archive_compression,
+                          jobs=int(self.cpu_count),
+                          callback=archived if self.verbose else None,
+                          deterministic=self.archive_deterministic,
+                          previous_archive=previous_archive,
+                          index_path=index_path)
 
   def git_clean(self):
     """Cleans build directory back to last git commit.
@@ -643,3 +997,57 @@ def _find_executable(name, path=None):
         if os.path.exists(fname):
           return fname
   return filename
+
+
+def get_cache_directory(name=None):
+  """Get the directory used to cache data between invocations of tools.
+
+  The cache directory is read from the FPLUTIL_CACHE_DIR environment variable,
+  defaulting to ~/.cache/fplutil.  The directory is not created by this
+  function.
+
+  Args:
+    name: Optional name of a subdirectory of the cache directory.
+
+  Returns:
+    Absolute path of the cache directory or the named subdirectory.
+  """
+  directory = os.getenv(_CACHE_DIR_ENV_VAR) or os.path.join(
+      os.path.expanduser('~'), '.cache', 'fplutil')
+  if name:
+    directory = os.path.join(directory, name)
+  return os.path.abspath(directory)
+
+
+def write_json_atomically(path, data, **kwargs):
+  """Write an object to a JSON file.
+
+  The object is written to a temporary file in the same directory which then
+  replaces the file, so that concurrent tool invocations reading the file
+  see either its previous or its new contents, never a partially written
+  file.  The directory containing the file is created if it doesn't exist.
+
+  Args:
+    path: File to write.
+    data: Object to serialize.
+    **kwargs: Additional arguments for json.dump() e.g indent.
+
+  Raises:
+    IOError: If the file can't be written.
+    OSError: If the file can't be written.
+  """
+  directory = os.path.dirname(os.path.abspath(path))
+  if not os.path.exists(directory):
+    os.makedirs(directory)
+  fd, temporary_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+  try:
+    with os.fdopen(fd, 'w') as f:
+      json.dump(data, f, **kwargs)
+    # Windows can't rename over an existing file.
+    if os.path.exists(path) and sys.platform == 'win32':
+      os.remove(path)
+    os.rename(temporary_path, path)
+  except:
+    if os.path.exists(temporary_path):
+      os.remove(temporary_path)
+    raise
@@ -15,9 +15,13 @@
 #
 
 import argparse
+import json
 import os
+import shutil
 import sys
+import tempfile
 import unittest
+import zipfile
 sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
 import buildutil.common as common
 
@@ -128,7 +132,7 @@ class RunCommandMock(object):
       self.expected_shell = shell
 
   def __call__(self, argv, capture=False, cwd=os.getcwd(), shell=False,
-               stdin=None):
+               stdin=None, log_filename=None):
     """Mock of common.BuildEnvironment.run_subprocess().
 
     Args:
@@ -138,6 +142,7 @@ class RunCommandMock(object):
         for commands that do not allow specifying this, such as ant.
       shell: Compared against expected_shell.
       stdin: Unused.
+      log_filename: Unused.
 
     Returns:
       (self.stdout, self.stderr) if capture is True, None otherwise.
@@ -393,15 +398,101 @@ class CommonBuildUtilTest(unittest.TestCase):
     expected = os.path.join(os.getcwd(), directories[0])
     self.assertEquals(expected, b.get_project_directory(path='..'))
 
-  # TBD, these are highly dependent high level functions that may need refactor
-  # to unit-test well, as they are currently difficult to mock. At the moment
-  # the examples serve as functional tests for these.
+  def test_subprocess_log(self):
+    b = common.BuildEnvironment(common.BuildEnvironment.build_defaults())
+    directory = tempfile.mkdtemp()
+    try:
+      log_filename = os.path.join(directory, 'logs', 'build.log')
+      with b.subprocess_log(log_filename):
+        self.assertEqual(('out\n', 'err\n'), b.run_subprocess(
+            [sys.executable, '-c',
+             'import sys; print "out"; print >> sys.stderr, "err"'],
+            capture=True))
+        with self.assertRaises(common.SubCommandError) as context:
+          b.run_subprocess([sys.executable, '-c', 'print "failed"; exit(3)'])
+      self.assertIn('failed', str(context.exception))
+      self.assertIn(log_filename, str(context.exception))
+      with open(log_filename) as f:
+        self.assertEqual(['err', 'failed', 'out'],
+                         sorted(f.read().splitlines()))
+    finally:
+      shutil.rmtree(directory)
+
   def test_make_archive(self):
-    pass
+    directory = tempfile.mkdtemp()
+    cache_directory = os.getenv('FPLUTIL_CACHE_DIR')
+    os.environ['FPLUTIL_CACHE_DIR'] = os.path.join(directory, 'cache')
+    try:
+      d = common.BuildEnvironment.build_defaults()
+      d['project_dir'] = os.path.join(directory, 'project')
+      d['output_dir'] = directory
+      d['archive_deterministic'] = True
+      d['archive_incremental'] = True
+      b = common.BuildEnvironment(d)
+      os.makedirs(os.path.join(b.project_directory, 'bin', 'objs'))
+      for filename in ('a.so', 'b.so', os.path.join('objs', 'a.o')):
+        with open(os.path.join(b.project_directory, 'bin', filename),
+                  'w') as f:
+          f.write(filename * 100)
+      archive_path = os.path.join(directory, 'output.zip')
+      b.make_archive(['bin'], 'output.zip', exclude=['objs'])
+      with open(archive_path, 'rb') as f:
+        contents = f.read()
+      with zipfile.ZipFile(archive_path) as zip_file:
+        self.assertEqual(['project/bin/a.so', 'project/bin/b.so'],
+                         zip_file.namelist())
+      # Archiving the same files produces the same archive.
+      b.make_archive(['bin'], 'output.zip', exclude=['objs'])
+      with open(archive_path, 'rb') as f:
+        self.assertEqual(contents, f.read())
+    finally:
+      if cache_directory is None:
+        del os.environ['FPLUTIL_CACHE_DIR']
+      else:
+        os.environ['FPLUTIL_CACHE_DIR'] = cache_directory
+      shutil.rmtree(directory)
 
   def test_write_archive(self):
-    pass
-
+    directory = tempfile.mkdtemp()
+    try:
+      d = common.BuildEnvironment.build_defaults()
+      d['project_dir'] = os.path.join(directory, 'project')
+      d['archive_compression'] = 0
+      b = common.BuildEnvironment(d)
+      os.makedirs(os.path.join(b.project_directory, 'libs', 'obj'))
+      for filename in ('a.so', os.path.join('obj', 'a.o')):
+        with open(os.path.join(b.project_directory, 'libs', filename),
+                  'w') as f:
+          f.write(filename * 100)
+      archive_path = os.path.join(directory, 'output.zip')
+      b._write_archive(archive_path, ['libs'], ['obj'])
+      with zipfile.ZipFile(archive_path) as zip_file:
+        self.assertEqual(['project/libs/a.so'], zip_file.namelist())
+        self.assertEqual(zipfile.ZIP_STORED,
+                         zip_file.infolist()[0].compress_type)
+        self.assertEqual('a.so' * 100, zip_file.read('project/libs/a.so'))
+    finally:
+      shutil.rmtree(directory)
+
+
+  def test_write_json_atomically(self):
+    directory = tempfile.mkdtemp()
+    try:
+      path = os.path.join(directory, 'cache', 'data.json')
+      common.write_json_atomically(path, {'a': 1})
+      common.write_json_atomically(path, {'b': 2}, indent=2)
+      with open(path) as f:
+        self.assertEqual({'b': 2}, json.load(f))
+      # Objects which can't be serialized leave the file unchanged and
+      # don't leave temporary files behind.
+      self.assertRaises(TypeError, common.write_json_atomically, path,
+                        {'c': object()})
+      with open(path) as f:
+        self.assertEqual({'b': 2}, json.load(f))
+      self.assertEqual(['data.json'],
+                       os.listdir(os.path.dirname(path)))
+    finally:
+      shutil.rmtree(directory)
 
 if __name__ == '__main__':
   unittest.main()
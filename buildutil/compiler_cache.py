@@ -0,0 +1,107 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""@file buildutil/compiler_cache.py ccache statistics.
+
+This module parses the statistics reported by `ccache -s` so that the
+effectiveness of the compiler cache during a build can be summarized.
+Versions of ccache prior to 4.0 report the number of direct and
+preprocessed cache hits on separate lines, later versions report the total
+number of hits and misses.
+
+@package fplutil.buildutil.compiler_cache ccache statistics.
+"""
+
+import re
+
+## @cond FPLUTIL_INTERNAL
+# Matches hits reported by ccache 3.x e.g "cache hit (direct)   10".
+_HIT_RE = re.compile(r'^\s*cache hit \((?:direct|preprocessed)\)\s+(\d+)',
+                     re.MULTILINE)
+# Matches misses reported by ccache 3.x e.g "cache miss   10".
+_MISS_RE = re.compile(r'^\s*cache miss\s+(\d+)', re.MULTILINE)
+# Matches hits reported by ccache 4.x e.g "  Hits:   7 / 10 (70.00%)".
+_HITS_RE = re.compile(r'^\s*Hits:\s+(\d+)', re.MULTILINE)
+# Matches misses reported by ccache 4.x e.g "  Misses:   3 / 10 (30.00%)".
+_MISSES_RE = re.compile(r'^\s*Misses:\s+(\d+)', re.MULTILINE)
+## @endcond FPLUTIL_INTERNAL
+
+
+class Stats(object):
+
+  """Number of compilations served from and added to the cache.
+
+  Attributes:
+    hits: Number of compilations whose results were found in the cache.
+    misses: Number of compilations whose results were not in the cache.
+  """
+
+  def __init__(self, hits=0, misses=0):
+    """Initialize the instance.
+
+    Args:
+      hits: Number of compilations whose results were found in the cache.
+      misses: Number of compilations whose results were not in the cache.
+    """
+    self.hits = hits
+    self.misses = misses
+
+  def __sub__(self, other):
+    """Get the statistics accumulated since other was read.
+
+    Args:
+      other: Stats read before this instance.
+
+    Returns:
+      Stats instance.
+    """
+    return Stats(max(0, self.hits - other.hits),
+                 max(0, self.misses - other.misses))
+
+  @property
+  def hit_rate(self):
+    """Fraction of compilations which were cache hits."""
+    total = self.hits + self.misses
+    return float(self.hits) / total if total else 0.0
+
+  def summary(self):
+    """Get a human readable summary of the statistics.
+
+    Returns:
+      Summary string.
+    """
+    return 'ccache: %d hits, %d misses (%.0f%% hit rate)' % (
+        self.hits, self.misses, self.hit_rate * 100)
+
+
+def parse_stats(output):
+  """Parse the output of `ccache -s`.
+
+  Args:
+    output: Output of `ccache -s`.
+
+  Returns:
+    Stats instance.
+  """
+  hits = sum([int(h) for h in _HIT_RE.findall(output)])
+  misses = sum([int(m) for m in _MISS_RE.findall(output)])
+  if not hits and not misses:
+    # ccache 4.x repeats the totals for each storage backend so only the
+    # first occurrence is used.
+    hits_match = _HITS_RE.search(output)
+    misses_match = _MISSES_RE.search(output)
+    hits = int(hits_match.group(1)) if hits_match else 0
+    misses = int(misses_match.group(1)) if misses_match else 0
+  return Stats(hits, misses)
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import sys
+import unittest
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.compiler_cache as compiler_cache
+
+CCACHE3_STATS = """cache directory                     /home/user/.ccache
+primary config                      /home/user/.ccache/ccache.conf
+cache hit (direct)                     5
+cache hit (preprocessed)               2
+cache miss                             3
+called for link                        1
+files in cache                        12
+"""
+
+CCACHE4_STATS = """Cacheable calls:    10 / 11 (90.91%)
+  Hits:              7 / 10 (70.00%)
+    Direct:          5 /  7 (71.43%)
+    Preprocessed:    2 /  7 (28.57%)
+  Misses:            3 / 10 (30.00%)
+Uncacheable calls:   1 / 11 ( 9.09%)
+Local storage:
+  Cache size (GB): 0.1 / 5.0 ( 2.00%)
+  Hits:              7 / 10 (70.00%)
+  Misses:            3 / 10 (30.00%)
+"""
+
+
+class CompilerCacheTest(unittest.TestCase):
+  """ccache statistics unit tests."""
+
+  def test_parse_stats(self):
+    for output in (CCACHE3_STATS, CCACHE4_STATS):
+      stats = compiler_cache.parse_stats(output)
+      self.assertEqual((7, 3), (stats.hits, stats.misses))
+    stats = compiler_cache.parse_stats('')
+    self.assertEqual((0, 0), (stats.hits, stats.misses))
+    self.assertEqual(0.0, stats.hit_rate)
+
+  def test_difference(self):
+    stats = (compiler_cache.Stats(hits=10, misses=4) -
+             compiler_cache.Stats(hits=2, misses=2))
+    self.assertEqual((8, 2), (stats.hits, stats.misses))
+    self.assertEqual(0.8, stats.hit_rate)
+
+  def test_summary(self):
+    self.assertEqual('ccache: 6 hits, 2 misses (75% hit rate)',
+                     compiler_cache.Stats(hits=6, misses=2).summary())
+    self.assertEqual('ccache: 6 hits, 0 misses (100% hit rate)',
+                     compiler_cache.Stats(hits=6).summary())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,326 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""@file buildutil/device_cache.py Persistent cache of device properties.
+
+Querying an Android device's properties requires a round trip to the device
+so tools which are invoked repeatedly against the same devices can use
+DevicePropertyCache to store property values on the host between
+invocations.  Each device has a cache file (indexed by serial number) in
+the "devices" subdirectory of common.get_cache_directory().  Entries
+expire after a configurable time to live and all entries for a device are
+discarded when the device reboots.
+
+A reboot is detected by comparing the identity of the boot the entries were
+written during with the current boot of the device.  The boot identity is
+read from the device using BOOT_IDENTITY_COMMAND which reports the kernel's
+random boot ID, where available, and the device's uptime from which the time
+the device booted is derived.  The "transport_id" reported by
+"adb devices -l" is not used to detect reboots since it changes each time a
+device reconnects to the ADB server and restarts from 1 when the ADB server
+restarts.
+
+So that reading a cached value doesn't require a round trip to the device,
+the boot identity is trusted for BOOT_IDENTITY_TTL seconds after it's read
+from the device.  When a value isn't cached the boot identity is read in the
+same shell command as the value (e.g BOOT_IDENTITY_GETPROP_COMMAND).
+
+@package fplutil.buildutil.device_cache Persistent cache of device properties.
+"""
+
+import json
+import os
+import re
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.common as common
+
+## Cache key used to store the dictionary of all properties returned by the
+## "getprop" shell command.
+GETPROP_KEY = 'getprop'
+
+## Shell command which reports the boot identity of a device, parsed by
+## parse_boot_identity().  The boot ID file doesn't exist on old kernels so
+## errors reading it are ignored.
+BOOT_IDENTITY_COMMAND = ('cat /proc/sys/kernel/random/boot_id 2>/dev/null; '
+                         'cat /proc/uptime')
+
+## Shell command which reports the boot identity and all properties of a
+## device.  The output can be parsed by both parse_boot_identity() and
+## parse_getprop_output().
+BOOT_IDENTITY_GETPROP_COMMAND = BOOT_IDENTITY_COMMAND + '; getprop'
+
+## Time in seconds the boot identity read from a device is trusted without
+## reading it again.  A device can't reboot and reconnect in less time.
+BOOT_IDENTITY_TTL = 30.0
+
+## @cond FPLUTIL_INTERNAL
+# Subdirectory of the cache directory used to store device caches.
+_DEVICE_CACHE_SUBDIR = 'devices'
+# Maximum difference (in seconds) between boot times derived from a device's
+# uptime for the boot times to be considered the same boot.
+_BOOT_TIME_TOLERANCE = 10.0
+# Matches the kernel's boot ID e.g "0f3b4c2e-8a1d-4e5f-9a6b-7c8d9e0f1a2b".
+_MATCH_BOOT_ID = re.compile(r'^[0-9a-fA-F]{8}(-[0-9a-fA-F]{4}){3}-'
+                            r'[0-9a-fA-F]{12}$')
+# Matches the contents of /proc/uptime e.g "1234.56 789.01".
+_MATCH_UPTIME = re.compile(r'^[0-9.]+\s+[0-9.]+$')
+# Matches a property line in the output of "getprop".
+_MATCH_PROPERTY = re.compile(r'^\[([^\]]*)\]: *\[([^\]]*)\]$')
+# Characters that are not used in cache filenames.
+_MATCH_UNSAFE_FILENAME_CHARACTERS = re.compile(r'[^A-Za-z0-9_.-]')
+## @endcond FPLUTIL_INTERNAL
+
+
+def parse_getprop_output(output):
+  """Parse the output of the "getprop" shell command.
+
+  Args:
+    output: Output of "getprop".
+
+  Returns:
+    Dictionary of property values indexed by property name.
+  """
+  properties = {}
+  for line in output.splitlines():
+    m = _MATCH_PROPERTY.match(line.strip())
+    if m:
+      key, value = m.groups()
+      properties[key] = value
+  return properties
+
+
+def boot_time_from_uptime(uptime_output, now=None):
+  """Calculate the time a device booted from the contents of /proc/uptime.
+
+  Args:
+    uptime_output: Contents of /proc/uptime on the device.
+    now: Host time the uptime was read, defaults to the current time.
+
+  Returns:
+    Host time the device booted in seconds since the epoch or None if the
+    uptime can't be parsed.
+  """
+  try:
+    uptime = float(uptime_output.split()[0])
+  except (IndexError, ValueError):
+    return None
+  return (time.time() if now is None else now) - uptime
+
+
+def parse_boot_identity(output, now=None):
+  """Parse the output of BOOT_IDENTITY_COMMAND.
+
+  Args:
+    output: Output of BOOT_IDENTITY_COMMAND.
+    now: Host time the command was run, defaults to the current time.
+
+  Returns:
+    (boot_id, boot_time) tuple where boot_id is the kernel's boot ID or an
+    empty string if it isn't available and boot_time is the host time the
+    device booted or None if the uptime isn't available.
+  """
+  boot_id = ''
+  boot_time = None
+  for line in output.splitlines():
+    line = line.strip()
+    if _MATCH_BOOT_ID.match(line):
+      boot_id = line.lower()
+    elif _MATCH_UPTIME.match(line):
+      boot_time = boot_time_from_uptime(line, now=now)
+  return (boot_id, boot_time)
+
+
+class DevicePropertyCache(object):
+  """On-disk cache of values associated with a device.
+
+  Attributes:
+    serial: Serial number of the device.
+    ttl: Time to live of each entry in seconds.  If this is 0 or less
+      the cache is disabled.
+    path: Path of the file used to store the cache.
+    boot_id: Kernel boot ID of the current boot of the device or an empty
+      string if it isn't known.
+    boot_time: Host time the device booted or None if it isn't known.
+    boot_identity_ttl: Time in seconds the boot identity stored in the
+      cache file is trusted after it was read from the device.
+    verified_time: Host time the boot identity was read from the device or
+      None if it isn't known, see is_boot_verified().
+  """
+
+  def __init__(self, serial, ttl, boot_id='', boot_time=None, directory=None,
+               clock=time.time, boot_identity_ttl=BOOT_IDENTITY_TTL):
+    """Initialize the instance.
+
+    If neither boot_id nor boot_time are specified the boot identity is read
+    from the cache file if it was recently read from the device, otherwise
+    it must be set using set_boot_identity() before the cache is used.
+
+    Args:
+      serial: Serial number of the device.
+      ttl: Time to live of each entry in seconds.
+      boot_id: Kernel boot ID of the current boot of the device.
+      boot_time: Host time the device booted.
+      directory: Directory used to store the cache.  Defaults to the
+        "devices" subdirectory of common.get_cache_directory().
+      clock: Callable which returns the current time in seconds.
+      boot_identity_ttl: Time in seconds the boot identity stored in the
+        cache file is trusted.
+    """
+    self.serial = serial
+    self.ttl = ttl
+    self.boot_id = boot_id
+    self.boot_time = boot_time
+    self.boot_identity_ttl = boot_identity_ttl
+    self.verified_time = (clock() if boot_id or boot_time is not None
+                          else None)
+    self.path = os.path.join(
+        directory or common.get_cache_directory(_DEVICE_CACHE_SUBDIR),
+        _MATCH_UNSAFE_FILENAME_CHARACTERS.sub('_', serial or 'default') +
+        '.json')
+    self._clock = clock
+    self._entries = None
+
+  @property
+  def enabled(self):
+    """Whether the cache is enabled."""
+    return self.ttl > 0
+
+  def _same_boot(self, data):
+    """Determine whether cached data was written during the current boot.
+
+    Args:
+      data: Dictionary read from the cache file.
+
+    Returns:
+      True if the data was written during the current boot, False otherwise.
+    """
+    cached_boot_id = data.get('boot_id', '')
+    if self.boot_id and cached_boot_id:
+      return self.boot_id == cached_boot_id
+    cached_boot_time = data.get('boot_time')
+    if self.boot_time is not None and cached_boot_time is not None:
+      return abs(self.boot_time - cached_boot_time) <= _BOOT_TIME_TOLERANCE
+    # If neither boot identifier is available, rely upon the entry TTL.
+    return not self.boot_id and self.boot_time is None
+
+  def _load(self):
+    """Read cache entries for the current boot from disk.
+
+    Returns:
+      Dictionary of entries indexed by key.
+    """
+    if self._entries is None:
+      self._entries = {}
+      try:
+        with open(self.path) as f:
+          data = json.load(f)
+        if self.verified_time is None:
+          verified_time = data.get('verified_time')
+          if (verified_time is not None and
+              0 <= self._clock() - verified_time <= self.boot_identity_ttl):
+            self.boot_id = data.get('boot_id', '')
+            self.boot_time = data.get('boot_time')
+            self.verified_time = verified_time
+            self._entries = data.get('entries', {})
+        elif self._same_boot(data):
+          self._entries = data.get('entries', {})
+      except (IOError, OSError, ValueError, AttributeError):
+        pass
+    return self._entries
+
+  def _save(self):
+    """Write cache entries to disk."""
+    try:
+      common.write_json_atomically(
+          self.path, {'serial': self.serial, 'boot_id': self.boot_id,
+                      'boot_time': self.boot_time,
+                      'verified_time': self.verified_time,
+                      'entries': self._entries},
+          indent=2, sort_keys=True)
+    except (IOError, OSError):
+      # Failing to write the cache is not fatal, values will be queried
+      # from the device next time.
+      pass
+
+  def is_boot_verified(self):
+    """Determine whether the current boot of the device is known.
+
+    Returns:
+      True if the boot identity was passed to the constructor or
+      set_boot_identity() or was read from the device less than
+      boot_identity_ttl seconds ago, False if it needs to be read from the
+      device.
+    """
+    self._load()
+    return self.verified_time is not None
+
+  def set_boot_identity(self, boot_id, boot_time):
+    """Set the boot identity read from the device.
+
+    Entries written during a different boot are discarded.
+
+    Args:
+      boot_id: Kernel boot ID of the current boot of the device.
+      boot_time: Host time the device booted.
+    """
+    self.boot_id = boot_id
+    self.boot_time = boot_time
+    self.verified_time = self._clock()
+    self._entries = None
+    if self.enabled:
+      self._load()
+      self._save()
+
+  def get(self, key):
+    """Get a value from the cache.
+
+    Args:
+      key: Key of the value to retrieve.
+
+    Returns:
+      Cached value or None if the value isn't cached, has expired or the
+      boot identity of the device isn't known.
+    """
+    if not self.enabled:
+      return None
+    entry = self._load().get(key)
+    if not entry:
+      return None
+    now = self._clock()
+    if not 0 <= now - entry.get('time', 0) <= self.ttl:
+      return None
+    return entry.get('value')
+
+  def set(self, key, value):
+    """Store a value in the cache.
+
+    Values are not stored until the boot identity of the device is known.
+
+    Args:
+      key: Key of the value to store.
+      value: JSON serializable value to store.
+    """
+    if not self.enabled or not self.is_boot_verified():
+      return
+    self._load()[key] = {'time': self._clock(), 'value': value}
+    self._save()
+
+  def clear(self):
+    """Remove all entries for the device from the cache."""
+    self._entries = {}
+    if os.path.exists(self.path):
+      os.remove(self.path)
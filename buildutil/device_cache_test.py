@@ -0,0 +1,166 @@
+#!/usr/bin/python
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.common as common
+import buildutil.device_cache as device_cache
+
+
+class MockClock(object):
+  """Callable which returns a settable time.
+
+  Attributes:
+    now: Time returned by __call__().
+  """
+
+  def __init__(self, now):
+    """Initialize the instance.
+
+    Args:
+      now: Time returned by __call__().
+    """
+    self.now = now
+
+  def __call__(self):
+    """Get the current time.
+
+    Returns:
+      The value of the now attribute.
+    """
+    return self.now
+
+
+class DeviceCacheTest(unittest.TestCase):
+  """Device property cache unit tests."""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.clock = MockClock(1000.0)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def create_cache(self, ttl=60, boot_id='', boot_time=None):
+    return device_cache.DevicePropertyCache(
+        '123456', ttl, boot_id=boot_id, boot_time=boot_time,
+        directory=self.directory, clock=self.clock)
+
+  def test_parse_getprop_output(self):
+    properties = device_cache.parse_getprop_output(
+        '[ro.product.model]: [Nexus 7]\r\n'
+        '[ro.sf.lcd_density]: [320]\n'
+        'garbage\n')
+    self.assertEqual({'ro.product.model': 'Nexus 7',
+                      'ro.sf.lcd_density': '320'}, properties)
+
+  def test_boot_time_from_uptime(self):
+    self.assertEqual(900.0, device_cache.boot_time_from_uptime(
+        '100.00 50.00', now=1000.0))
+    self.assertIsNone(device_cache.boot_time_from_uptime('', now=1000.0))
+
+  def test_parse_boot_identity(self):
+    self.assertEqual(
+        ('0f3b4c2e-8a1d-4e5f-9a6b-7c8d9e0f1a2b', 900.0),
+        device_cache.parse_boot_identity(
+            '0F3B4C2E-8A1D-4E5F-9A6B-7C8D9E0F1A2B\r\n100.00 50.00\r\n',
+            now=1000.0))
+    self.assertEqual(('', 900.0), device_cache.parse_boot_identity(
+        '100.00 50.00\n', now=1000.0))
+    self.assertEqual(('', None), device_cache.parse_boot_identity(''))
+
+  def test_get_cache_directory(self):
+    cache_dir = os.getenv('FPLUTIL_CACHE_DIR')
+    os.environ['FPLUTIL_CACHE_DIR'] = self.directory
+    try:
+      self.assertEqual(os.path.join(self.directory, 'devices'),
+                       common.get_cache_directory('devices'))
+    finally:
+      if cache_dir is None:
+        del os.environ['FPLUTIL_CACHE_DIR']
+      else:
+        os.environ['FPLUTIL_CACHE_DIR'] = cache_dir
+
+  def test_set_get(self):
+    self.create_cache(boot_id='1').set('key', {'a': 'b'})
+    self.assertEqual({'a': 'b'}, self.create_cache(boot_id='1').get('key'))
+    self.assertIsNone(self.create_cache(boot_id='1').get('missing'))
+
+  def test_expired(self):
+    self.create_cache(boot_id='1').set('key', 'value')
+    self.clock.now += 61
+    self.assertIsNone(self.create_cache(boot_id='1').get('key'))
+
+  def test_disabled(self):
+    cache = self.create_cache(ttl=0, boot_id='1')
+    cache.set('key', 'value')
+    self.assertIsNone(cache.get('key'))
+    self.assertFalse(os.path.exists(cache.path))
+
+  def test_reboot_boot_id(self):
+    self.create_cache(boot_id='1').set('key', 'value')
+    self.assertIsNone(self.create_cache(boot_id='2').get('key'))
+
+  def test_reboot_boot_time(self):
+    self.create_cache(boot_time=500.0).set('key', 'value')
+    self.assertEqual('value', self.create_cache(boot_time=502.0).get('key'))
+    self.assertIsNone(self.create_cache(boot_time=700.0).get('key'))
+
+  def test_verified_boot_identity(self):
+    cache = self.create_cache()
+    self.assertFalse(cache.is_boot_verified())
+    cache.set('key', 'value')
+    self.assertIsNone(cache.get('key'))
+    cache.set_boot_identity('1', 900.0)
+    cache.set('key', 'value')
+    # The boot identity is trusted until it's boot_identity_ttl old.
+    self.clock.now += device_cache.BOOT_IDENTITY_TTL
+    cache = self.create_cache()
+    self.assertTrue(cache.is_boot_verified())
+    self.assertEqual('1', cache.boot_id)
+    self.assertEqual('value', cache.get('key'))
+    self.clock.now += 1
+    cache = self.create_cache()
+    self.assertFalse(cache.is_boot_verified())
+    self.assertIsNone(cache.get('key'))
+    # Verifying the same boot keeps the entries.
+    cache.set_boot_identity('1', 900.0)
+    self.assertEqual('value', cache.get('key'))
+
+  def test_set_boot_identity_reboot(self):
+    cache = self.create_cache()
+    cache.set_boot_identity('1', 900.0)
+    cache.set('key', 'value')
+    cache = self.create_cache()
+    cache.set_boot_identity('2', 950.0)
+    self.assertIsNone(cache.get('key'))
+    self.assertIsNone(self.create_cache().get('key'))
+
+  def test_corrupt_cache(self):
+    cache = self.create_cache(boot_id='1')
+    with open(cache.path, 'w') as f:
+      f.write('{')
+    self.assertIsNone(cache.get('key'))
+    cache.set('key', 'value')
+    self.assertEqual('value', self.create_cache(boot_id='1').get('key'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,1180 @@
+#!/usr/bin/python
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""@file buildutil/fake_adb.py Simulates adb and Android devices on the host.
+
+This module implements an executable which accepts the same command line
+as the subset of adb used by fplutil's tools, serving responses from
+simulated devices backed by a local directory.  This makes it possible to test
+and benchmark the tools on machines without Android devices.
+
+The state of the simulated devices is stored in the directory specified by the
+FAKE_ADB_STATE_DIR environment variable.  FakeAdbState is used to create the
+state directory and a launcher script which can be used in place of adb:
+
+    state = fake_adb.FakeAdbState('/tmp/fake_adb')
+    state.add_device('0123456789', model='Nexus 5', name='hammerhead')
+    state.add_package('0123456789', 'com.example.app', '.MainActivity')
+    state.add_response(r'shell screenrecord', stderr='not supported',
+                       returncode=1)
+    state.save()
+    adb_path = state.create_launcher()
+    # adb_path is $FAKE_ADB_STATE_DIR/platform-tools/adb so the state
+    # directory can be used as the Android SDK directory for buildutil.
+
+Device shell commands are executed using bash on the host with the
+working directory set to the device's root filesystem directory.  Absolute
+paths under the Android data, system, sysfs and procfs directories are
+rewritten to reference the device's root filesystem directory and getprop,
+ps, am, pm, run-as, logcat, input and screencap are replaced with commands
+which operate on the simulated device.  Commands which reference any other
+absolute path (e.g /tmp) fail rather than operating on the host's
+filesystem, with the exception of /dev/null and /proc/uptime which are
+read from the host.  Paths are checked by inspecting the command line so
+paths constructed by the command when it runs are not detected, simulated
+devices should only be used to run trusted commands.  Binaries pushed to
+the device that can't execute on the host (e.g perf) are replaced with
+simulated versions.
+
+Optional environment variables:
+
+@li FAKE_ADB_STATE_DIR = Directory containing the state of simulated devices.
+@li FAKE_ADB_LATENCY = Time in seconds to delay each adb command to
+simulate the latency of communicating with a device.
+
+Each invocation is appended to commands.log in the state directory as a
+JSON object per line, which can be used to count the commands issued by a
+tool.
+
+@package fplutil.buildutil.fake_adb Simulates adb and Android devices.
+"""
+
+import json
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import time
+import uuid
+import xml.etree.ElementTree
+import zipfile
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.common as common
+
+## Environment variable which specifies the state directory.
+STATE_DIR_ENV_VAR = 'FAKE_ADB_STATE_DIR'
+
+## Environment variable which specifies the latency of each command.
+LATENCY_ENV_VAR = 'FAKE_ADB_LATENCY'
+
+## @cond FPLUTIL_INTERNAL
+# Environment variable used to pass the serial of the device to commands run
+# in a device shell.
+_SERIAL_ENV_VAR = 'FAKE_ADB_SERIAL'
+# Environment variable used to pass the user running commands in a device
+# shell.
+_USER_ENV_VAR = 'FAKE_ADB_USER'
+# Environment variable which names a simulated binary in "ps" output.
+_COMMAND_NAME_ENV_VAR = 'FAKE_ADB_COMMAND_NAME'
+# Name of the file which stores the global configuration.
+_CONFIG_FILE = 'config.json'
+# Name of the file each device's state is stored in.
+_DEVICE_STATE_FILE = 'state.json'
+# Name of the file each device's log is stored in.
+_LOGCAT_FILE = 'logcat.txt'
+# Name of the command log file.
+_COMMAND_LOG_FILE = 'commands.log'
+# Commands which are replaced with simulated versions in a device shell.
+_DEVICE_COMMANDS = ('getprop', 'ps', 'am', 'pm', 'run-as', 'logcat',
+                    'input', 'screencap')
+# Binaries which are replaced with simulated versions when pushed.
+_EMULATED_BINARIES = ('perf',)
+# Top level directories of the device filesystem mapped to the device's root
+# filesystem directory.
+_DEVICE_DIRECTORIES = ('data', 'sdcard', 'system', 'sys', 'proc', 'mnt',
+                       'storage', 'cache', 'vendor')
+# Device paths which reference the host.  /proc/uptime is read from the host
+# so that the uptime advances while commands run, reboots are detected
+# using the simulated boot ID.
+_HOST_PATHS = ('/dev/null', '/proc/uptime')
+# Device path of the file which contains the kernel's boot ID.
+_BOOT_ID_PATH = '/proc/sys/kernel/random/boot_id'
+# Matches absolute paths in a shell command.
+_MATCH_ABSOLUTE_PATH = re.compile(
+    r'(^|[\s\'"=(:;|&<>])(/[^\s\'"=:;|&()<>*]*)')
+# Default properties of a simulated device.
+_DEFAULT_PROPERTIES = {
+    'ro.build.version.release': '4.4.4',
+    'ro.build.version.sdk': '19',
+    'ro.product.cpu.abi': 'armeabi-v7a',
+    'ro.product.cpu.abi2': 'armeabi',
+    'ro.sf.lcd_density': '320',
+}
+# First API level which logs the time taken to display activities using the
+# ActivityTaskManager tag rather than ActivityManager.
+_ACTIVITY_TASK_MANAGER_API_LEVEL = 29
+# Matches the time, if present, and tag of a line of the log in the "time" or
+# "brief" format.
+_MATCH_LOGCAT_TAG = re.compile(
+    r'^(?:(\d\d-\d\d \d\d:\d\d:\d\d\.\d+)\s+)?[VDIWEF]/([^(]*)\(')
+# Format of the time of each line of the log in the "time" format.
+_LOGCAT_TIME_FORMAT = '%m-%d %H:%M:%S'
+# logcat options which are followed by a value.
+_LOGCAT_VALUE_OPTIONS = ('-b', '-f', '-n', '-r', '-t', '-T', '-v')
+# First user ID assigned to installed packages.
+_FIRST_APPLICATION_UID = 10000
+## @endcond FPLUTIL_INTERNAL
+
+
+def _read_json(path, default):
+  """Read a JSON file.
+
+  Args:
+    path: File to read.
+    default: Value to return if the file doesn't exist or can't be parsed.
+
+  Returns:
+    Object read from the file or default.
+  """
+  try:
+    with open(path) as f:
+      return json.load(f)
+  except (IOError, OSError, ValueError):
+    return default
+
+
+class FakeAdbState(object):
+  """State of the simulated devices.
+
+  Attributes:
+    directory: State directory.
+    config: Global configuration dictionary which contains the latency of
+      each command, scripted responses and the list of devices.
+  """
+
+  def __init__(self, directory):
+    """Initialize the instance, reading the configuration if it exists.
+
+    Args:
+      directory: State directory.
+    """
+    self.directory = os.path.abspath(directory)
+    self.config = _read_json(os.path.join(self.directory, _CONFIG_FILE), {})
+    self.config.setdefault('latency', 0.0)
+    self.config.setdefault('responses', [])
+    self.config.setdefault('devices', [])
+
+  def save(self):
+    """Write the configuration to the state directory."""
+    common.write_json_atomically(os.path.join(self.directory, _CONFIG_FILE),
+                                 self.config, indent=2, sort_keys=True)
+
+  def get_device_directory(self, serial):
+    """Get the directory which stores the state of a device.
+
+    Args:
+      serial: Serial number of the device.
+
+    Returns:
+      Path of the device's state directory.
+    """
+    return os.path.join(self.directory, 'devices', serial)
+
+  def get_device_root(self, serial):
+    """Get the directory which contains the root filesystem of a device.
+
+    Args:
+      serial: Serial number of the device.
+
+    Returns:
+      Path of the device's root filesystem directory.
+    """
+    return os.path.join(self.get_device_directory(serial), 'fs')
+
+  def get_device_path(self, serial, device_path):
+    """Get the host path of a file on a device.
+
+    Args:
+      serial: Serial number of the device.
+      device_path: Absolute path of the file on the device.
+
+    Returns:
+      Host path of the file.
+    """
+    return os.path.join(self.get_device_root(serial),
+                        device_path.lstrip('/'))
+
+  def read_device_state(self, serial):
+    """Read the state of a device.
+
+    Args:
+      serial: Serial number of the device.
+
+    Returns:
+      Dictionary containing the state of the device.
+    """
+    return _read_json(os.path.join(self.get_device_directory(serial),
+                                   _DEVICE_STATE_FILE), {})
+
+  def write_device_state(self, serial, device_state):
+    """Write the state of a device.
+
+    Args:
+      serial: Serial number of the device.
+      device_state: Dictionary containing the state of the device.
+    """
+    common.write_json_atomically(
+        os.path.join(self.get_device_directory(serial), _DEVICE_STATE_FILE),
+        device_state, indent=2, sort_keys=True)
+
+  def add_device(self, serial, model='Nexus 5', name='hammerhead',
+                 properties=None, root=False, cpus=4,
+                 cpu_frequencies=(300000, 1200000, 2265600)):
+    """Add a simulated device.
+
+    Args:
+      serial: Serial number of the device.
+      model: Model name reported in ro.product.model.
+      name: Product name reported in ro.product.name.
+      properties: Dictionary of additional properties.
+      root: Whether the device shell runs as root.
+      cpus: Number of CPUs in the device's sysfs.
+      cpu_frequencies: Frequencies (in KHz) reported in each CPU's
+        cpufreq/stats/time_in_state file.
+    """
+    device_properties = dict(_DEFAULT_PROPERTIES)
+    device_properties['ro.product.model'] = model
+    device_properties['ro.product.name'] = name
+    device_properties['ro.product.device'] = name
+    device_properties['ro.serialno'] = serial
+    device_properties.update(properties or {})
+    if serial not in self.config['devices']:
+      self.config['devices'].append(serial)
+    device_state = self.read_device_state(serial)
+    device_state.update({'properties': device_properties, 'root': root,
+                         'transport_id': len(self.config['devices']),
+                         'cpus': cpus,
+                         'cpu_frequencies': list(cpu_frequencies),
+                         'boot_time': time.time()})
+    device_state.setdefault('packages', {})
+    device_state.setdefault('processes', {})
+    device_state.setdefault('next_pid', 1000)
+    self.write_device_state(serial, device_state)
+    self.write_file(serial, _BOOT_ID_PATH, str(uuid.uuid4()) + '\n')
+    self.update_cpufreq_stats(serial)
+    for directory in ('/data/local/tmp', '/sdcard', '/system/lib'):
+      path = self.get_device_path(serial, directory)
+      if not os.path.exists(path):
+        os.makedirs(path)
+
+  def update_cpufreq_stats(self, serial):
+    """Update the CPU frequency statistics of a device.
+
+    The time each CPU of the device spends at each frequency increases with
+    the time since the device was added, where the time spent at each
+    frequency is weighted by the index of the frequency.
+
+    Args:
+      serial: Serial number of the device.
+    """
+    device_state = self.read_device_state(serial)
+    frequencies = device_state.get('cpu_frequencies', [])
+    # time_in_state is reported in units of 10ms.
+    elapsed = int((time.time() - device_state.get('boot_time', 0)) * 100)
+    total_weight = sum(range(1, len(frequencies) + 1))
+    for cpu in range(device_state.get('cpus', 0)):
+      self.write_file(
+          serial, '/sys/devices/system/cpu/cpu%d/cpufreq/stats/'
+          'time_in_state' % cpu,
+          ''.join(['%d %d\n' % (f, elapsed * (i + 1) / total_weight)
+                   for i, f in enumerate(frequencies)]))
+
+  def reboot_device(self, serial):
+    """Simulate a reboot of a device.
+
+    Stops all running processes, assigns a new boot ID and transport ID to
+    the device.
+
+    Args:
+      serial: Serial number of the device.
+    """
+    device_state = self.read_device_state(serial)
+    device_state['processes'] = {}
+    device_state['boot_time'] = time.time()
+    device_state['transport_id'] = (max(
+        [self.read_device_state(s).get('transport_id', 0)
+         for s in self.config['devices']]) + 1)
+    self.write_device_state(serial, device_state)
+    self.write_file(serial, _BOOT_ID_PATH, str(uuid.uuid4()) + '\n')
+
+  def add_package(self, serial, package_name, activity_name='.MainActivity',
+                  launch_time_ms=250):
+    """Install a package on a device.
+
+    Args:
+      serial: Serial number of the device.
+      package_name: Name of the package.
+      activity_name: Main activity of the package.
+      launch_time_ms: Time reported for the package's activity to be
+        displayed when started.
+    """
+    device_state = self.read_device_state(serial)
+    packages = device_state.setdefault('packages', {})
+    uid = _FIRST_APPLICATION_UID + len(packages)
+    if package_name in packages:
+      uid = packages[package_name]['uid']
+    packages[package_name] = {'uid': uid, 'activity': activity_name,
+                              'launch_time_ms': launch_time_ms}
+    self.write_device_state(serial, device_state)
+    data_directory = self.get_device_path(serial, '/data/data/' + package_name)
+    if not os.path.exists(data_directory):
+      os.makedirs(data_directory)
+
+  def add_response(self, pattern, stdout='', stderr='', returncode=0,
+                   serial=None):
+    """Add a scripted response to an adb command.
+
+    Args:
+      pattern: Regular expression which is searched for in the adb command
+        line (excluding the executable and device selection arguments).
+      stdout: String written to the standard output stream.
+      stderr: String written to the standard error stream.
+      returncode: Exit status of the command.
+      serial: Serial number of the device the response applies to, None
+        applies the response to all devices.
+    """
+    self.config['responses'].append({
+        'pattern': pattern, 'stdout': stdout, 'stderr': stderr,
+        'returncode': returncode, 'serial': serial})
+
+  def set_latency(self, latency):
+    """Set the time each command is delayed.
+
+    Args:
+      latency: Time in seconds.
+    """
+    self.config['latency'] = latency
+
+  def write_file(self, serial, device_path, contents):
+    """Write a file to a device's filesystem.
+
+    Args:
+      serial: Serial number of the device.
+      device_path: Absolute path of the file on the device.
+      contents: String to write to the file.
+    """
+    path = self.get_device_path(serial, device_path)
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+      os.makedirs(directory)
+    with open(path, 'wb') as f:
+      f.write(contents)
+
+  def get_logcat(self, serial):
+    """Get the log of a device.
+
+    Args:
+      serial: Serial number of the device.
+
+    Returns:
+      String containing the device's log.
+    """
+    try:
+      with open(os.path.join(self.get_device_directory(serial),
+                             _LOGCAT_FILE)) as f:
+        return f.read()
+    except IOError:
+      return ''
+
+  def get_command_log(self):
+    """Get the list of commands issued to the simulated adb.
+
+    Returns:
+      List of dictionaries, one per command, containing the serial of the
+      device ('serial'), the arguments ('args'), the start time ('time') and
+      duration ('duration') of each command.
+    """
+    commands = []
+    try:
+      with open(os.path.join(self.directory, _COMMAND_LOG_FILE)) as f:
+        for line in f:
+          try:
+            commands.append(json.loads(line))
+          except ValueError:
+            pass
+    except IOError:
+      pass
+    return commands
+
+  def get_environment(self):
+    """Get environment variables required to run the simulated adb.
+
+    Returns:
+      Dictionary of environment variables.
+    """
+    return {STATE_DIR_ENV_VAR: self.directory}
+
+  def create_launcher(self, directory=None):
+    """Create a script which runs the simulated adb with this state.
+
+    Args:
+      directory: Directory to create the platform-tools/adb script in.
+        Defaults to the state directory.
+
+    Returns:
+      Path of the launcher script.
+    """
+    launcher = os.path.join(directory or self.directory, 'platform-tools',
+                            'adb')
+    if not os.path.exists(os.path.dirname(launcher)):
+      os.makedirs(os.path.dirname(launcher))
+    with open(launcher, 'w') as f:
+      f.write('#!/bin/sh\n'
+              '%s="${%s:-%s}" exec "%s" "%s" "$@"\n' % (
+                  STATE_DIR_ENV_VAR, STATE_DIR_ENV_VAR, self.directory,
+                  sys.executable, os.path.abspath(__file__).replace(
+                      '.pyc', '.py')))
+    os.chmod(launcher, 0755)
+    return launcher
+
+
+class FakeAdb(object):
+  """Implements adb commands against simulated devices.
+
+  Attributes:
+    state: FakeAdbState instance.
+    stdout: Stream the standard output of commands is written to.
+    stderr: Stream the standard error output of commands is written to.
+  """
+
+  class Error(Exception):
+    """Thrown when a command fails."""
+    pass
+
+  def __init__(self, state, stdout=sys.stdout, stderr=sys.stderr):
+    """Initialize the instance.
+
+    Args:
+      state: FakeAdbState instance.
+      stdout: Stream the standard output of commands is written to.
+      stderr: Stream the standard error output of commands is written to.
+    """
+    self.state = state
+    self.stdout = stdout
+    self.stderr = stderr
+
+  def select_device(self, serial):
+    """Select the device a command operates on.
+
+    Args:
+      serial: Serial number passed using -s or None.
+
+    Returns:
+      Serial number of the selected device.
+
+    Raises:
+      FakeAdb.Error: If the device isn't found or a device isn't specified
+        and multiple devices are connected.
+    """
+    devices = self.state.config['devices']
+    if serial:
+      if serial not in devices:
+        raise FakeAdb.Error("error: device '%s' not found" % serial)
+      return serial
+    if not devices:
+      raise FakeAdb.Error('error: no devices/emulators found')
+    if len(devices) > 1:
+      raise FakeAdb.Error('error: more than one device/emulator')
+    return devices[0]
+
+  def find_response(self, serial, args):
+    """Find a scripted response for a command.
+
+    Args:
+      serial: Serial number of the device or None.
+      args: Command line arguments excluding the device selection arguments.
+
+    Returns:
+      Response dictionary or None if a scripted response isn't found.
+    """
+    command_line = ' '.join(args)
+    for response in self.state.config['responses']:
+      if response.get('serial') and response['serial'] != serial:
+        continue
+      if re.search(response['pattern'], command_line):
+        return response
+    return None
+
+  def run(self, argv):
+    """Run an adb command.
+
+    Args:
+      argv: Command line arguments excluding the executable.
+
+    Returns:
+      Exit status of the command.
+    """
+    start_time = time.time()
+    latency = float(os.getenv(LATENCY_ENV_VAR) or
+                    self.state.config.get('latency', 0))
+    if latency:
+      time.sleep(latency)
+    args = list(argv)
+    serial = None
+    while args and args[0] in ('-s', '-d', '-e'):
+      if args[0] == '-s' and len(args) > 1:
+        serial = args[1]
+        args = args[2:]
+      else:
+        args = args[1:]
+    try:
+      response = self.find_response(serial, args)
+      if response:
+        self.stdout.write(response.get('stdout', ''))
+        self.stderr.write(response.get('stderr', ''))
+        return response.get('returncode', 0)
+      command = args[0] if args else 'help'
+      handler = getattr(self, '_command_' + command.replace('-', '_'), None)
+      if not handler:
+        raise FakeAdb.Error('error: unknown command %s' % command)
+      if command in ('devices', 'version', 'start-server', 'kill-server'):
+        return handler(None, args[1:])
+      return handler(self.select_device(serial), args[1:])
+    except FakeAdb.Error as e:
+      self.stderr.write(str(e) + '\n')
+      return 1
+    finally:
+      self._log_command(serial, argv, start_time)
+
+  def _log_command(self, serial, argv, start_time):
+    """Append a command to the command log.
+
+    Args:
+      serial: Serial number passed using -s or None.
+      argv: Command line arguments.
+      start_time: Time the command started.
+    """
+    try:
+      with open(os.path.join(self.state.directory, _COMMAND_LOG_FILE),
+                'a') as f:
+        f.write(json.dumps({'serial': serial, 'args': argv,
+                            'time': start_time,
+                            'duration': time.time() - start_time}) + '\n')
+    except IOError:
+      pass
+
+  def _command_version(self, unused_serial, unused_args):
+    """Display the version of adb."""
+    self.stdout.write('Android Debug Bridge version 1.0.32 (simulated)\n')
+    return 0
+
+  def _command_start_server(self, unused_serial, unused_args):
+    """Start the adb server, this is a no-op."""
+    return 0
+
+  _command_kill_server = _command_start_server
+
+  def _command_wait_for_device(self, unused_serial, unused_args):
+    """Wait for a device, this is a no-op."""
+    return 0
+
+  def _command_get_state(self, unused_serial, unused_args):
+    """Display the state of a device."""
+    self.stdout.write('device\n')
+    return 0
+
+  def _command_devices(self, unused_serial, args):
+    """List the simulated devices."""
+    lines = ['List of devices attached']
+    for serial in self.state.config['devices']:
+      if '-l' in args:
+        device_state = self.state.read_device_state(serial)
+        properties = device_state.get('properties', {})
+        lines.append(
+            '%s               device usb:1-%d product:%s model:%s device:%s '
+            'transport_id:%s' % (
+                serial, len(lines), properties.get('ro.product.name', ''),
+                properties.get('ro.product.model', '').replace(' ', '_'),
+                properties.get('ro.product.device', ''),
+                device_state.get('transport_id', 1)))
+      else:
+        lines.append('%s\tdevice' % serial)
+    self.stdout.write('\n'.join(lines) + '\n\n')
+    return 0
+
+  def _command_shell(self, serial, args):
+    """Run a command in the device shell."""
+    if not args:
+      raise FakeAdb.Error('error: interactive shells are not supported')
+    device_state = self.state.read_device_state(serial)
+    # adb shell reports both output streams using the standard output stream.
+    return self.device_shell(serial, ' '.join(args),
+                             'root' if device_state.get('root') else 'shell',
+                             self.state.get_device_root(serial),
+                             merge_stderr=True)
+
+  def _command_exec_out(self, serial, args):
+    """Run a command in the device shell without modifying the output."""
+    if not args:
+      raise FakeAdb.Error('error: exec-out requires a command')
+    device_state = self.state.read_device_state(serial)
+    return self.device_shell(serial, ' '.join(args),
+                             'root' if device_state.get('root') else 'shell',
+                             self.state.get_device_root(serial))
+
+  def _command_push(self, serial, args):
+    """Copy a file from the host to a device."""
+    if len(args) != 2:
+      raise FakeAdb.Error('error: push requires a source and destination')
+    source, destination = args
+    if not os.path.exists(source):
+      raise FakeAdb.Error("error: cannot stat '%s': No such file or "
+                          "directory" % source)
+    target = self.state.get_device_path(serial, destination)
+    if os.path.isdir(target):
+      target = os.path.join(target, os.path.basename(source))
+      destination = '/'.join((destination.rstrip('/'),
+                              os.path.basename(source)))
+    directory = os.path.dirname(target)
+    if not os.path.exists(directory):
+      os.makedirs(directory)
+    if os.path.basename(source) in _EMULATED_BINARIES:
+      # Replace binaries that can't run on the host with a simulated version.
+      # The process is named using the host path since command lines in the
+      # device shell reference host paths.
+      self._write_device_command(target, os.path.basename(source), target)
+    else:
+      shutil.copy(source, target)
+    self.stderr.write('%d KB/s (%d bytes in 0.001s)\n' % (
+        os.path.getsize(source), os.path.getsize(source)))
+    return 0
+
+  def _command_pull(self, serial, args):
+    """Copy a file from a device to the host."""
+    if len(args) != 2:
+      raise FakeAdb.Error('error: pull requires a source and destination')
+    source, destination = args
+    path = self.state.get_device_path(serial, source)
+    if not os.path.isfile(path):
+      raise FakeAdb.Error("remote object '%s' does not exist" % source)
+    if os.path.isdir(destination):
+      destination = os.path.join(destination, os.path.basename(source))
+    shutil.copy(path, destination)
+    self.stderr.write('%d KB/s (%d bytes in 0.001s)\n' % (
+        os.path.getsize(path), os.path.getsize(path)))
+    return 0
+
+  @staticmethod
+  def _get_apk_package(apk):
+    """Get the package and main activity name of an APK.
+
+    The manifest is read from the project directory containing the APK
+    (e.g project/bin/project.apk) since the manifest in the APK is stored in
+    a binary format.
+
+    Args:
+      apk: Path of the APK.
+
+    Returns:
+      (package_name, activity_name) tuple.
+
+    Raises:
+      FakeAdb.Error: If the package name can't be determined.
+    """
+    android_schema = '{http://schemas.android.com/apk/res/android}'
+    for manifest in (
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(apk))),
+                     'AndroidManifest.xml'),
+        os.path.join(os.path.dirname(os.path.abspath(apk)),
+                     'AndroidManifest.xml')):
+      if not os.path.exists(manifest):
+        continue
+      try:
+        root = xml.etree.ElementTree.parse(manifest).getroot()
+      except xml.etree.ElementTree.ParseError:
+        continue
+      activity = root.find('application/activity')
+      activity_name = (activity.get(android_schema + 'name') if
+                       activity is not None else '') or '.MainActivity'
+      return (root.get('package'), activity_name)
+    raise FakeAdb.Error('Failure [INSTALL_FAILED_INVALID_APK]')
+
+  def _command_install(self, serial, args):
+    """Install an APK on a device."""
+    apks = [a for a in args if not a.startswith('-')]
+    if not apks or not os.path.exists(apks[-1]):
+      raise FakeAdb.Error('Failure [INSTALL_FAILED_INVALID_URI]')
+    apk = apks[-1]
+    if not zipfile.is_zipfile(apk):
+      raise FakeAdb.Error('Failure [INSTALL_FAILED_INVALID_APK]')
+    package_name, activity_name = FakeAdb._get_apk_package(apk)
+    self.state.add_package(serial, package_name, activity_name)
+    target = self.state.get_device_path(serial,
+                                        '/data/app/%s-1.apk' % package_name)
+    if not os.path.exists(os.path.dirname(target)):
+      os.makedirs(os.path.dirname(target))
+    shutil.copy(apk, target)
+    self.stdout.write('Success\n')
+    return 0
+
+  def _command_uninstall(self, serial, args):
+    """Remove a package from a device."""
+    packages = [a for a in args if not a.startswith('-')]
+    device_state = self.state.read_device_state(serial)
+    if not packages or packages[0] not in device_state.get('packages', {}):
+      self.stdout.write('Failure\n')
+      return 0
+    del device_state['packages'][packages[0]]
+    device_state.get('processes', {}).pop(packages[0], None)
+    self.state.write_device_state(serial, device_state)
+    apk = self.state.get_device_path(serial, '/data/app/%s-1.apk' % (
+        packages[0]))
+    if os.path.exists(apk):
+      os.remove(apk)
+    self.stdout.write('Success\n')
+    return 0
+
+  @staticmethod
+  def _filter_logcat(log, tags, start_time=None, show_time=False):
+    """Filter lines of the log by tag and time.
+
+    Args:
+      log: String containing lines of the log in the "time" format.
+      tags: Tags of lines to display or None to display all lines.
+      start_time: Time ("MM-DD hh:mm:ss.mmm") of the first line to display
+        or None to display all lines.
+      show_time: Whether to display lines in the "time" format rather than
+        the "brief" format.
+
+    Returns:
+      Filtered log string.
+    """
+    lines = []
+    for line in log.splitlines(True):
+      m = _MATCH_LOGCAT_TAG.match(line)
+      if not m:
+        continue
+      line_time, tag = m.groups()
+      if tags is not None and tag.strip() not in tags:
+        continue
+      if start_time and line_time and line_time < start_time:
+        continue
+      if line_time and not show_time:
+        line = line[m.start(2) - 2:]
+      lines.append(line)
+    return ''.join(lines)
+
+  def _command_logcat(self, serial, args):
+    """Display or clear the log of a device."""
+    logcat_file = os.path.join(self.state.get_device_directory(serial),
+                               _LOGCAT_FILE)
+    if '-c' in args:
+      if os.path.exists(logcat_file):
+        os.remove(logcat_file)
+      return 0
+    options = {}
+    filter_specs = []
+    index = 0
+    while index < len(args):
+      if args[index] in _LOGCAT_VALUE_OPTIONS and index + 1 < len(args):
+        options[args[index]] = args[index + 1]
+        index += 1
+      elif not args[index].startswith('-'):
+        filter_specs.append(args[index])
+      index += 1
+    # "-s" silences all tags other than those in the filter specifications
+    # that follow the options, priorities are ignored.
+    tags = None
+    if '-s' in args:
+      tags = [spec.split(':', 1)[0] for spec in filter_specs]
+    start_time = options.get('-T')
+    if start_time and start_time.isdigit():
+      start_time = None
+    show_time = options.get('-v') == 'time'
+    self.stdout.write(FakeAdb._filter_logcat(
+        self.state.get_logcat(serial), tags, start_time=start_time,
+        show_time=show_time))
+    self.stdout.flush()
+    if '-d' in args:
+      return 0
+    # Follow the log until this process is killed.
+    offset = len(self.state.get_logcat(serial))
+    try:
+      while True:
+        time.sleep(0.05)
+        log = self.state.get_logcat(serial)
+        if len(log) > offset:
+          self.stdout.write(FakeAdb._filter_logcat(log[offset:], tags,
+                                                   show_time=show_time))
+          self.stdout.flush()
+        offset = len(log)
+    except KeyboardInterrupt:
+      return 0
+
+  def _write_device_command(self, path, command, display_name=None):
+    """Write a script which runs a simulated device command.
+
+    Args:
+      path: Path of the script to write.
+      command: Name of the command to simulate.
+      display_name: Name of the command reported by "ps".
+    """
+    with open(path, 'w') as f:
+      f.write('#!/bin/sh\n'
+              '%s="%s" %s="%s" exec "%s" "%s" --device-command %s "$@"\n' % (
+                  STATE_DIR_ENV_VAR, self.state.directory,
+                  _COMMAND_NAME_ENV_VAR, display_name or command,
+                  sys.executable,
+                  os.path.abspath(__file__).replace('.pyc', '.py'), command))
+    os.chmod(path, 0755)
+
+  def _get_shell_path(self):
+    """Create the directory of simulated device commands.
+
+    Returns:
+      Directory containing simulated device commands.
+    """
+    directory = os.path.join(self.state.directory, 'commands')
+    if not os.path.exists(os.path.join(directory, 'sh')):
+      if not os.path.exists(directory):
+        os.makedirs(directory)
+      for command in _DEVICE_COMMANDS:
+        self._write_device_command(os.path.join(directory, command), command)
+      # Device shell scripts use mksh extensions (e.g arrays) so use bash.
+      with open(os.path.join(directory, 'sh'), 'w') as f:
+        f.write('#!/bin/sh\nexec bash "$@"\n')
+      os.chmod(os.path.join(directory, 'sh'), 0755)
+    return directory
+
+  def map_device_paths(self, serial, command):
+    """Rewrite the absolute device paths in a shell command to host paths.
+
+    Args:
+      serial: Serial number of the device.
+      command: Shell command to rewrite.
+
+    Returns:
+      Shell command which references the device's root filesystem directory.
+
+    Raises:
+      FakeAdb.Error: If the command references a path which isn't simulated.
+    """
+    root = self.state.get_device_root(serial)
+
+    def map_path(match):
+      """Map an absolute path to the device's root filesystem directory."""
+      prefix, path = match.groups()
+      # Paths which have already been mapped (e.g commands run using
+      # run-as) and paths read from the host are not modified.
+      if (path in _HOST_PATHS or path == root or
+          path.startswith(root + '/')):
+        return match.group(0)
+      if path.lstrip('/').split('/', 1)[0] not in _DEVICE_DIRECTORIES:
+        raise FakeAdb.Error('%s: path is not simulated' % path)
+      return prefix + root + path
+
+    return _MATCH_ABSOLUTE_PATH.sub(map_path, command)
+
+  def device_shell(self, serial, command, user, cwd, merge_stderr=False):
+    """Run a command in the shell of a simulated device.
+
+    Args:
+      serial: Serial number of the device.
+      command: Shell command to run.
+      user: Name of the user running the command.
+      cwd: Host directory to run the command in.
+      merge_stderr: Whether to write the standard error stream of the command
+        to the standard output stream.
+
+    Returns:
+      Exit status of the command.
+
+    Raises:
+      FakeAdb.Error: If the command references a path which isn't simulated.
+    """
+    root = self.state.get_device_root(serial)
+    command = self.map_device_paths(serial, command)
+    if not os.path.exists(cwd):
+      os.makedirs(cwd)
+    self.state.update_cpufreq_stats(serial)
+    env = dict(os.environ)
+    env['PATH'] = os.pathsep.join((self._get_shell_path(),
+                                   os.getenv('PATH', '')))
+    env[STATE_DIR_ENV_VAR] = self.state.directory
+    env[_SERIAL_ENV_VAR] = serial
+    env[_USER_ENV_VAR] = user
+    env['USER'] = user
+    env.pop(_COMMAND_NAME_ENV_VAR, None)
+    process = subprocess.Popen(
+        ['bash', '-c', command],
+        cwd=cwd, env=env, stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE)
+    try:
+      out, err = process.communicate()
+    except KeyboardInterrupt:
+      out, err = process.communicate()
+    # Report paths relative to the device's filesystem.
+    self.stdout.write(out.replace(root, ''))
+    if err:
+      self.stderr.write(err.replace(root, ''))
+    return process.returncode
+
+
+class DeviceCommands(object):
+  """Simulated commands run in the shell of a simulated device.
+
+  Attributes:
+    state: FakeAdbState instance.
+    serial: Serial number of the device.
+    user: Name of the user running the command.
+    fake_adb: FakeAdb instance used to run shell commands.
+  """
+
+  def __init__(self, state, serial, user):
+    """Initialize the instance.
+
+    Args:
+      state: FakeAdbState instance.
+      serial: Serial number of the device.
+      user: Name of the user running the command.
+    """
+    self.state = state
+    self.serial = serial
+    self.user = user
+    self.fake_adb = FakeAdb(state)
+
+  def run(self, command, args):
+    """Run a simulated command.
+
+    Args:
+      command: Name of the command.
+      args: Arguments of the command.
+
+    Returns:
+      Exit status of the command.
+    """
+    handler = getattr(self, '_command_' + command.replace('-', '_'), None)
+    if not handler:
+      sys.stderr.write('%s: not found\n' % command)
+      return 127
+    return handler(args)
+
+  def _command_getprop(self, args):
+    """Display device properties."""
+    properties = self.state.read_device_state(self.serial).get(
+        'properties', {})
+    if args:
+      print properties.get(args[0], args[1] if len(args) > 1 else '')
+    else:
+      for key in sorted(properties):
+        print '[%s]: [%s]' % (key, properties[key])
+    return 0
+
+  def _get_package_user(self, package_name):
+    """Get the name of the user a package runs as.
+
+    Args:
+      package_name: Name of the package.
+
+    Returns:
+      User name string.
+    """
+    package = self.state.read_device_state(self.serial).get(
+        'packages', {}).get(package_name, {})
+    return 'u0_a%d' % (package.get('uid', _FIRST_APPLICATION_UID) -
+                       _FIRST_APPLICATION_UID)
+
+  def _get_simulated_processes(self):
+    """Get host processes running simulated device binaries.
+
+    Returns:
+      List of (user, pid, ppid, name) tuples.
+    """
+    processes = []
+    if not os.path.isdir('/proc'):
+      return processes
+    for pid in [p for p in os.listdir('/proc') if p.isdigit()]:
+      try:
+        with open(os.path.join('/proc', pid, 'environ')) as f:
+          environ = dict([v.split('=', 1) for v in f.read().split('\0')
+                          if '=' in v])
+        if (environ.get(_SERIAL_ENV_VAR) != self.serial or
+            not environ.get(_COMMAND_NAME_ENV_VAR)):
+          continue
+        with open(os.path.join('/proc', pid, 'stat')) as f:
+          ppid = f.read().rsplit(')', 1)[1].split()[1]
+        processes.append((environ.get(_USER_ENV_VAR, 'shell'), int(pid),
+                          int(ppid), environ[_COMMAND_NAME_ENV_VAR]))
+      except (IOError, OSError, IndexError):
+        pass
+    return processes
+
+  def _command_ps(self, unused_args):
+    """List running processes."""
+    device_state = self.state.read_device_state(self.serial)
+    print 'USER     PID   PPID  VSIZE  RSS     WCHAN    PC         NAME'
+    print 'root      1     0     680    540   ffffffff 00000000 S /init'
+    row = '%-9s %-5d %-5d 1000   100   ffffffff 00000000 S %s'
+    for package_name, pid in sorted(device_state.get('processes', {}).items()):
+      print row % (self._get_package_user(package_name), pid, 1, package_name)
+    for user, pid, ppid, name in self._get_simulated_processes():
+      if pid != os.getpid():
+        print row % (user, pid, ppid, name)
+    return 0
+
+  def _command_am(self, args):
+    """Start and stop activities."""
+    device_state = self.state.read_device_state(self.serial)
+    packages = device_state.get('packages', {})
+    processes = device_state.setdefault('processes', {})
+    if args and args[0] == 'start':
+      components = [a for a in args[1:] if '/' in a]
+      if not components:
+        sys.stderr.write('Error: Intent does not match any activities\n')
+        return 1
+      component = components[0]
+      package_name, activity_name = component.split('/', 1)
+      print 'Starting: Intent { cmp=%s }' % component
+      package = packages.get(package_name)
+      if not package:
+        print ('Error type 3\nError: Activity class {%s} does not exist.' %
+               component)
+        return 0
+      if '-S' in args:
+        processes.pop(package_name, None)
+      launch_time = package.get('launch_time_ms', 0)
+      if package_name not in processes:
+        processes[package_name] = device_state.get('next_pid', 1000)
+        device_state['next_pid'] = processes[package_name] + 1
+      self.state.write_device_state(self.serial, device_state)
+      with open(os.path.join(self.state.get_device_directory(self.serial),
+                             _LOGCAT_FILE), 'a') as f:
+        api_level = int(device_state.get('properties', {}).get(
+            'ro.build.version.sdk', 0))
+        now = time.time()
+        f.write('%s.%03d I/%s(  500): Displayed %s: +%dms\n' % (
+            time.strftime(_LOGCAT_TIME_FORMAT, time.localtime(now)),
+            int(now * 1000) % 1000,
+            'ActivityTaskManager'
+            if api_level >= _ACTIVITY_TASK_MANAGER_API_LEVEL else
+            'ActivityManager', component, launch_time))
+      if '-W' in args:
+        print os.linesep.join((
+            'Status: ok', 'Activity: %s' % component,
+            'ThisTime: %d' % launch_time, 'TotalTime: %d' % launch_time,
+            'WaitTime: %d' % (launch_time + 5), 'Complete'))
+    elif args and args[0] == 'force-stop' and len(args) > 1:
+      processes.pop(args[1], None)
+      self.state.write_device_state(self.serial, device_state)
+    return 0
+
+  def _command_pm(self, args):
+    """Query installed packages."""
+    packages = self.state.read_device_state(self.serial).get('packages', {})
+    if args[:2] == ['list', 'packages']:
+      for package_name in sorted(packages):
+        print 'package:%s' % package_name
+    elif args[:1] == ['path'] and len(args) > 1:
+      if args[1] not in packages:
+        return 1
+      print 'package:/data/app/%s-1.apk' % args[1]
+    return 0
+
+  def _command_run_as(self, args):
+    """Run a command as a package's user."""
+    if not args:
+      sys.stderr.write('run-as: usage: run-as <package-name> <command>\n')
+      return 1
+    package_name = args[0]
+    if package_name not in self.state.read_device_state(self.serial).get(
+        'packages', {}):
+      sys.stderr.write("run-as: Package '%s' is unknown\n" % package_name)
+      return 1
+    data_directory = self.state.get_device_path(
+        self.serial, '/data/data/' + package_name)
+    command = ' '.join(["'%s'" % a.replace("'", "'\\''") if ' ' in a else a
+                        for a in args[1:]]) or 'sh'
+    try:
+      return self.fake_adb.device_shell(self.serial, command,
+                                        self._get_package_user(package_name),
+                                        data_directory)
+    except FakeAdb.Error as e:
+      sys.stderr.write(str(e) + '\n')
+      return 1
+
+  def _command_logcat(self, args):
+    """Display or clear the log of the device."""
+    return self.fake_adb._command_logcat(self.serial, args)
+
+  def _command_input(self, unused_args):
+    """Simulate input events, this is a no-op."""
+    return 0
+
+  def _command_screencap(self, args):
+    """Write a placeholder screenshot."""
+    filenames = [a for a in args if not a.startswith('-')]
+    if filenames:
+      with open(filenames[0], 'wb') as f:
+        f.write('\x89PNG\r\n\x1a\n')
+    return 0
+
+  def _command_perf(self, args):
+    """Simulate perf, writing a placeholder trace when recording."""
+    if args[:1] != ['record']:
+      return 0
+    output_filename = 'perf.data'
+    for i, arg in enumerate(args[:-1]):
+      if arg == '-o':
+        output_filename = args[i + 1]
+    stopped = []
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+      signal.signal(signal_number,
+                    lambda unused_signal, unused_frame: stopped.append(True))
+    record_time = 0
+    if '--' in args and args[args.index('--') + 1:][:1] == ['sleep']:
+      record_time = float(args[args.index('--') + 2])
+    end_time = time.time() + record_time
+    while not stopped and (not record_time or time.time() < end_time):
+      time.sleep(0.05)
+    with open(output_filename, 'wb') as f:
+      f.write('PERFILE2')
+    sys.stderr.write('[ perf record: Captured and wrote 0.001 MB %s ]\n' %
+                     output_filename)
+    return 0
+
+
+def main():
+  """Run the simulated adb.
+
+  Returns:
+    Exit status of the command.
+  """
+  state_directory = os.getenv(STATE_DIR_ENV_VAR)
+  if not state_directory:
+    print >> sys.stderr, '%s must be set.' % STATE_DIR_ENV_VAR
+    return 1
+  state = FakeAdbState(state_directory)
+  if sys.argv[1:2] == ['--device-command']:
+    return DeviceCommands(
+        state, os.getenv(_SERIAL_ENV_VAR),
+        os.getenv(_USER_ENV_VAR, 'shell')).run(sys.argv[2], sys.argv[3:])
+  return FakeAdb(state).run(sys.argv[1:])
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.android as android
+import buildutil.fake_adb as fake_adb
+
+
+class FakeAdbTest(unittest.TestCase):
+  """Simulated adb unit tests."""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.state = fake_adb.FakeAdbState(self.directory)
+    self.state.add_device('123456', model='Nexus 7', name='razor')
+    self.state.add_package('123456', 'com.example.app', '.Main',
+                           launch_time_ms=100)
+    self.state.save()
+    self.adb = self.state.create_launcher()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def run_adb(self, *args):
+    """Run the simulated adb.
+
+    Args:
+      *args: Arguments passed to adb.
+
+    Returns:
+      (stdout, stderr, returncode) tuple.
+    """
+    process = subprocess.Popen([self.adb] + list(args),
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    return (out, err, process.returncode)
+
+  def test_devices(self):
+    out, _, returncode = self.run_adb('devices', '-l')
+    self.assertEqual(0, returncode)
+    self.assertIn('123456', out)
+    self.assertIn('model:Nexus_7', out)
+    self.assertIn('transport_id:1', out)
+
+  def test_multiple_devices(self):
+    self.state.add_device('654321')
+    self.state.save()
+    _, err, returncode = self.run_adb('shell', 'getprop')
+    self.assertEqual(1, returncode)
+    self.assertIn('more than one device', err)
+    out, _, returncode = self.run_adb('-s', '654321', 'shell', 'getprop',
+                                      'ro.serialno')
+    self.assertEqual(0, returncode)
+    self.assertEqual('654321', out.strip())
+
+  def test_shell_status(self):
+    out, _, _ = self.run_adb('shell', 'getprop ro.product.model; echo $? >&2')
+    self.assertEqual(['Nexus 7', '0'], out.splitlines())
+    out, _, _ = self.run_adb('shell', 'run-as com.unknown ls; echo $? >&2')
+    self.assertEqual('1', out.splitlines()[-1])
+
+  def test_start_activity(self):
+    out, _, _ = self.run_adb(
+        'shell', 'am start -S -n com.example.app/.Main && '
+        'fields=( $(ps | grep -F com.example.app) ) && echo ${fields[1]}')
+    self.assertEqual('1000', out.splitlines()[-1])
+    out, _, _ = self.run_adb('logcat', '-d')
+    self.assertIn('Displayed com.example.app/.Main: +100ms', out)
+    self.assertTrue(out.startswith('I/'))
+    out, _, _ = self.run_adb('logcat', '-d', '-v', 'time', '-s',
+                             'ActivityManager:I')
+    self.assertRegexpMatches(out, r'^\d\d-\d\d \d\d:\d\d:\d\d\.\d{3} I/')
+    # Lines logged before the time passed to -T are omitted.
+    out, _, _ = self.run_adb('logcat', '-d', '-T', '12-31 23:59:59.999')
+    self.assertEqual('', out)
+
+  def test_push_pull(self):
+    local_file = os.path.join(self.directory, 'local.txt')
+    with open(local_file, 'w') as f:
+      f.write('hello')
+    self.assertEqual(0, self.run_adb('push', local_file,
+                                     '/data/local/tmp/remote.txt')[2])
+    self.assertTrue(os.path.exists(self.state.get_device_path(
+        '123456', '/data/local/tmp/remote.txt')))
+    out, _, _ = self.run_adb('shell', 'cat /data/local/tmp/remote.txt')
+    self.assertEqual('hello', out)
+    pulled_file = os.path.join(self.directory, 'pulled.txt')
+    self.assertEqual(0, self.run_adb('pull', '/data/local/tmp/remote.txt',
+                                     pulled_file)[2])
+    with open(pulled_file) as f:
+      self.assertEqual('hello', f.read())
+    self.assertEqual(1, self.run_adb('pull', '/data/missing', pulled_file)[2])
+
+  def test_unsimulated_paths(self):
+    host_file = os.path.join(self.directory, 'host.txt')
+    with open(host_file, 'w') as f:
+      f.write('host')
+    for command in ('rm -f %s' % host_file, 'cd / && rm -f host.txt',
+                    'run-as com.example.app rm -f %s' % host_file):
+      out, err, returncode = self.run_adb('shell', command)
+      self.assertEqual(1, returncode)
+      self.assertIn('path is not simulated', out + err)
+    self.assertTrue(os.path.exists(host_file))
+    out, _, returncode = self.run_adb('shell', 'cat /proc/uptime 2>/dev/null')
+    self.assertEqual(0, returncode)
+    self.assertEqual(2, len(out.split()))
+
+  def test_reboot(self):
+    boot_id = self.run_adb('shell', 'cat /proc/sys/kernel/random/boot_id')[0]
+    self.assertEqual(boot_id, self.run_adb(
+        'shell', 'cat /proc/sys/kernel/random/boot_id')[0])
+    self.state.reboot_device('123456')
+    self.state.save()
+    self.assertNotEqual(boot_id, self.run_adb(
+        'shell', 'cat /proc/sys/kernel/random/boot_id')[0])
+
+  def test_cpufreq_stats(self):
+    out, _, _ = self.run_adb(
+        'shell', 'cat /sys/devices/system/cpu/cpu0/cpufreq/stats/'
+        'time_in_state')
+    self.assertEqual(['300000', '1200000', '2265600'],
+                     [l.split()[0] for l in out.splitlines()])
+
+  def test_scripted_response(self):
+    self.state.add_response(r'^shell screenrecord', stdout='unsupported\n',
+                            returncode=2)
+    self.state.save()
+    self.assertEqual(('unsupported\n', '', 2),
+                     self.run_adb('shell', 'screenrecord', '/sdcard/a.mp4'))
+
+  def test_command_log(self):
+    self.run_adb('devices')
+    self.run_adb('-s', '123456', 'shell', 'getprop')
+    commands = self.state.get_command_log()
+    self.assertEqual([None, '123456'], [c['serial'] for c in commands])
+    self.assertEqual(['shell', 'getprop'], commands[1]['args'][2:])
+
+  def test_buildutil_get_device_dpi(self):
+    defaults = android.BuildEnvironment.build_defaults()
+    defaults['sdk_home'] = self.directory
+    defaults['ndk_home'] = self.directory
+    build_environment = android.BuildEnvironment(defaults)
+    self.assertEqual(320, build_environment.get_device_dpi())
+    self.assertEqual(['com.example.app'],
+                     build_environment.list_installed_packages())
+
+
+if __name__ == '__main__':
+  unittest.main()
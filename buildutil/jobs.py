@@ -0,0 +1,219 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""@file buildutil/jobs.py Dependency aware job scheduler.
+
+run_jobs() runs a set of jobs on a pool of threads.  A job only starts when
+all jobs it depends upon have completed successfully, jobs that depend upon
+a failed job are skipped.  Jobs which share a resource (e.g a directory they
+write to) are not run concurrently.
+
+@package fplutil.buildutil.jobs Dependency aware job scheduler.
+"""
+
+import os
+import Queue
+import sys
+import threading
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.common as common
+
+## @cond FPLUTIL_INTERNAL
+# Time in seconds to wait for a job to complete before checking for
+# interrupts.
+_POLL_INTERVAL = 0.1
+## @endcond FPLUTIL_INTERNAL
+
+
+class DependencyError(common.Error):
+
+  """Raised if the dependencies between jobs can't be satisfied."""
+
+  CODE = 3
+
+  def __init__(self, jobs):
+    """Initializes exception with the jobs that could not be started.
+
+    Args:
+      jobs: List of jobs which have cyclic dependencies.
+    """
+    super(DependencyError, self).__init__()
+    self._error_message = 'Cyclic dependencies between %s' % (
+        ', '.join([str(j) for j in jobs]))
+    self._error_code = DependencyError.CODE
+
+
+class JobResults(object):
+
+  """Results of a set of jobs.
+
+  Attributes:
+    completed: List of jobs that completed successfully in the order they
+      completed.
+    failures: List of (job, exception) tuples for each job that failed in
+      the order they failed.
+    skipped: List of jobs that were not started due to a failure.
+  """
+
+  def __init__(self):
+    """Initialize the instance."""
+    self.completed = []
+    self.failures = []
+    self.skipped = []
+
+  @property
+  def succeeded(self):
+    """Whether all jobs completed successfully."""
+    return not self.failures and not self.skipped
+
+  def summary(self):
+    """Get a human readable summary of the results.
+
+    Returns:
+      List of strings, one line for each job.
+    """
+    lines = ['%d succeeded, %d failed, %d skipped' % (
+        len(self.completed), len(self.failures), len(self.skipped))]
+    lines.extend(['FAILED %s: %s' % (job, error)
+                  for job, error in self.failures])
+    lines.extend(['SKIPPED %s' % job for job in self.skipped])
+    return lines
+
+
+class _JobThread(threading.Thread):
+
+  """Runs a job posting the result to a queue.
+
+  Attributes:
+    job: Job passed to the function.
+    function: Function called with the job.
+    completions: Queue.Queue which receives a (job, exception) tuple when the
+      function returns where exception is None if the job succeeded.
+  """
+
+  def __init__(self, job, function, completions):
+    """Initialize the instance.
+
+    Args:
+      job: Job passed to the function.
+      function: Function called with the job.
+      completions: Queue.Queue which receives the result of the job.
+    """
+    super(_JobThread, self).__init__()
+    self.daemon = True
+    self.job = job
+    self.function = function
+    self.completions = completions
+
+  def run(self):
+    """Run the job."""
+    error = None
+    try:
+      self.function(self.job)
+    except Exception as e:  # pylint: disable=broad-except
+      error = e
+    self.completions.put((self.job, error))
+
+
+def run_jobs(jobs, function, max_jobs, dependencies=None, fail_fast=True,
+             resources=None):
+  """Run jobs concurrently honoring the dependencies between them.
+
+  Args:
+    jobs: List of jobs, jobs that are ready to run are started in this order.
+    function: Function which is called with each job from a worker thread.
+      The job fails if the function raises an exception.
+    max_jobs: Maximum number of jobs to run concurrently.
+    dependencies: Dictionary which maps each job to the list of jobs that must
+      complete before it's started.  Dependencies which are not in the jobs
+      list are ignored.
+    fail_fast: Whether to stop starting jobs after the first failure.  Jobs
+      that are running when a failure occurs are allowed to complete.
+    resources: Dictionary which maps each job to the list of resources it
+      uses exclusively.  Jobs that share a resource are run one at a time in
+      the order they're listed in jobs, unlike dependencies the failure of
+      one doesn't cause the others to be skipped.
+
+  Returns:
+    JobResults instance.
+
+  Raises:
+    DependencyError: If jobs have cyclic dependencies.
+  """
+  dependencies = dependencies or {}
+  resources = resources or {}
+  job_set = set(jobs)
+  pending = list(jobs)
+  required = dict([(job, set([d for d in dependencies.get(job, [])
+                              if d in job_set and d != job]))
+                   for job in jobs])
+  completed = set()
+  running = set()
+  resources_in_use = set()
+  results = JobResults()
+  completions = Queue.Queue()
+  max_jobs = max(1, max_jobs)
+
+  while pending or running:
+    if not (fail_fast and results.failures):
+      # Resources of ready jobs waiting on a resource are reserved so that
+      # jobs sharing a resource start in order.
+      reserved = set(resources_in_use)
+      for job in list(pending):
+        if len(running) >= max_jobs:
+          break
+        if required[job] <= completed:
+          job_resources = set(resources.get(job, []))
+          if not job_resources & reserved:
+            pending.remove(job)
+            running.add(job)
+            resources_in_use.update(job_resources)
+            _JobThread(job, function, completions).start()
+          reserved.update(job_resources)
+    if not running:
+      if not results.failures:
+        raise DependencyError(pending)
+      break
+    while True:
+      try:
+        job, error = completions.get(True, _POLL_INTERVAL)
+        break
+      except Queue.Empty:
+        pass
+    running.remove(job)
+    resources_in_use.difference_update(resources.get(job, []))
+    if error:
+      results.failures.append((job, error))
+    else:
+      completed.add(job)
+      results.completed.append(job)
+
+  results.skipped = pending
+  return results
+
+
+def split_cpu_count(cpu_count, max_jobs, number_of_jobs):
+  """Split a CPU budget between concurrently running jobs.
+
+  Args:
+    cpu_count: Total number of CPUs available.
+    max_jobs: Maximum number of jobs that will run concurrently.
+    number_of_jobs: Total number of jobs.
+
+  Returns:
+    Number of CPUs each job should use.
+  """
+  concurrent_jobs = max(1, min(max_jobs, number_of_jobs))
+  return max(1, int(cpu_count) / concurrent_jobs)
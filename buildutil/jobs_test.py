@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import sys
+import threading
+import time
+import unittest
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.jobs as jobs
+
+
+class JobRecorder(object):
+  """Records the order jobs run and the maximum number of concurrent jobs.
+
+  Attributes:
+    started: List of jobs in the order they started.
+    running: Number of jobs currently running.
+    max_running: Maximum number of jobs that ran concurrently.
+    fail: Set of jobs which raise an exception.
+    lock: Lock held while updating this instance.
+  """
+
+  def __init__(self, fail=None):
+    """Initialize the instance.
+
+    Args:
+      fail: Set of jobs which raise an exception.
+    """
+    self.started = []
+    self.running = 0
+    self.max_running = 0
+    self.fail = fail or set()
+    self.lock = threading.Lock()
+
+  def __call__(self, job):
+    """Run a job."""
+    with self.lock:
+      self.started.append(job)
+      self.running += 1
+      self.max_running = max(self.max_running, self.running)
+    time.sleep(0.05)
+    with self.lock:
+      self.running -= 1
+    if job in self.fail:
+      raise ValueError(job)
+
+
+class JobsTest(unittest.TestCase):
+  """Job scheduler unit tests."""
+
+  def test_concurrency(self):
+    recorder = JobRecorder()
+    results = jobs.run_jobs(range(6), recorder, 3)
+    self.assertTrue(results.succeeded)
+    self.assertEqual(range(6), sorted(results.completed))
+    self.assertEqual(3, recorder.max_running)
+
+  def test_dependencies(self):
+    recorder = JobRecorder()
+    results = jobs.run_jobs(['c', 'b', 'a'], recorder, 3,
+                            dependencies={'c': ['b'], 'b': ['a', 'z']})
+    self.assertTrue(results.succeeded)
+    self.assertEqual(['a', 'b', 'c'], recorder.started)
+    self.assertEqual(1, recorder.max_running)
+
+  def test_fail_fast(self):
+    recorder = JobRecorder(fail=set(['a']))
+    results = jobs.run_jobs(['a', 'b', 'c'], recorder, 1,
+                            dependencies={'b': ['a']})
+    self.assertEqual(['a'], [job for job, _ in results.failures])
+    self.assertEqual(['b', 'c'], results.skipped)
+    self.assertEqual('0 succeeded, 1 failed, 2 skipped', results.summary()[0])
+
+  def test_continue_after_failure(self):
+    recorder = JobRecorder(fail=set(['a']))
+    results = jobs.run_jobs(['a', 'b', 'c'], recorder, 1,
+                            dependencies={'b': ['a']}, fail_fast=False)
+    self.assertEqual(['c'], results.completed)
+    self.assertEqual(['b'], results.skipped)
+
+  def test_resources(self):
+    recorder = JobRecorder(fail=set(['a']))
+    results = jobs.run_jobs(['a', 'b', 'c', 'd'], recorder, 4,
+                            fail_fast=False,
+                            resources={'a': ['lib'], 'c': ['lib', 'other'],
+                                       'd': ['other']})
+    # Jobs sharing a resource run in order after the failure of a previous
+    # job using the resource.
+    self.assertEqual(['a', 'b'], recorder.started[:2])
+    self.assertEqual(['b', 'c', 'd'], sorted(results.completed))
+    self.assertLess(recorder.started.index('c'), recorder.started.index('d'))
+    self.assertEqual([], results.skipped)
+    self.assertEqual(2, recorder.max_running)
+
+  def test_cycle(self):
+    with self.assertRaises(jobs.DependencyError):
+      jobs.run_jobs(['a', 'b'], JobRecorder(), 2,
+                    dependencies={'a': ['b'], 'b': ['a']})
+
+  def test_split_cpu_count(self):
+    self.assertEqual(4, jobs.split_cpu_count('8', 2, 10))
+    self.assertEqual(8, jobs.split_cpu_count(8, 4, 1))
+    self.assertEqual(1, jobs.split_cpu_count(2, 4, 4))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -29,12 +29,19 @@ import os
 import shlex
 import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.artifact_cache as artifact_cache
 import buildutil.common as common
+import buildutil.trace as trace
 
 _CMAKE_PATH_ENV_VAR = 'CMAKE_PATH'
 _CMAKE_FLAGS_ENV_VAR = 'CMAKE_FLAGS'
 _CMAKE_PATH = 'cmake_path'
 _CMAKE_FLAGS = 'cmake_flags'
+# Files and directories generated in the project directory by CMake which
+# are not inputs of the build.
+_CMAKE_GENERATED_FILES = ('CMakeCache.txt', 'CMakeFiles', 'cmake_install.cmake',
+                          'CTestTestfile.cmake', 'Makefile',
+                          'install_manifest.txt')
 
 
 class BuildEnvironment(common.BuildEnvironment):
@@ -136,13 +143,15 @@ class BuildEnvironment(common.BuildEnvironment):
     search_dict = {BuildEnvironment.CMAKE: [self.cmake_path]}
     if additional_paths:
       search_dict.update(additional_paths)
-    return BuildEnvironment._check_binary(binary, search_dict[binary])
+    return common.BuildEnvironment._find_binary(self, binary, search_dict)
 
+  @trace.traced()
   def run_cmake(self, gen='Unix Makefiles'):
     """Run cmake based on the specified build environment.
 
     This will execute cmake using the configured environment, passing it the
-    flags specified in the cmake_flags property.
+    flags specified in the cmake_flags property.  If ccache is enabled it's
+    used to launch the C and C++ compilers.
 
     Args:
       gen: Optional argument to specify CMake project generator (defaults to
@@ -156,8 +165,80 @@ class BuildEnvironment(common.BuildEnvironment):
     cmake_path = self._find_binary(BuildEnvironment.CMAKE)
 
     args = [cmake_path, '-G', gen]
+    ccache = self.get_ccache()
+    if ccache:
+      args += ['-DCMAKE_C_COMPILER_LAUNCHER=%s' % ccache,
+               '-DCMAKE_CXX_COMPILER_LAUNCHER=%s' % ccache]
     if self.cmake_flags:
       args += shlex.split(self.cmake_flags, posix=self._posix)
     args.append(self.project_directory)
 
     self.run_subprocess(args, cwd=self.project_directory)
+
+  def get_artifact_key_builder(self):
+    """Create a KeyBuilder which identifies outputs of this environment.
+
+    Returns:
+      buildutil.artifact_cache.KeyBuilder instance.
+    """
+    key = super(BuildEnvironment, self).get_artifact_key_builder()
+    key.add_value(self.cmake_flags)
+    return key
+
+  def _get_cmake_artifact_key(self, gen, outputs):
+    """Derive the artifact cache key of the project.
+
+    Args:
+      gen: CMake project generator.
+      outputs: List of output directories relative to the project directory.
+
+    Returns:
+      Key string or None if the inputs of the project can't be read.
+    """
+    key = self.get_artifact_key_builder()
+    key.add_value(gen)
+    exclude = artifact_cache.DEFAULT_EXCLUDE + _CMAKE_GENERATED_FILES
+    try:
+      cmake_path = self._find_binary(BuildEnvironment.CMAKE)
+      key.add_value(os.path.abspath(cmake_path))
+      key.add_value(artifact_cache.hash_file(cmake_path))
+      key.add_tree(self.project_directory, exclude=exclude,
+                   exclude_paths=outputs)
+    except (IOError, OSError):
+      return None
+    return key.hexdigest()
+
+  def build_cmake_project(self, outputs, gen='Unix Makefiles'):
+    """Run cmake then make unless the outputs can be restored from the cache.
+
+    If the artifact cache is enabled, the output directories are restored
+    from the cache when the project's sources, the CMake and make flags and
+    the version of CMake are unchanged.  Otherwise the project is built using
+    run_cmake() and run_make() and the output directories are added to the
+    cache.
+
+    Args:
+      outputs: List of directories, relative to the project directory,
+        written by the build.
+      gen: Optional argument to specify CMake project generator (defaults to
+        Unix Makefiles)
+
+    Returns:
+      True if the outputs were restored from the cache, False otherwise.
+
+    Raises:
+      SubCommandError: CMake or make invocation failed or returned an error.
+      ToolPathError: CMake or make not found in configured build environment
+        or $PATH.
+    """
+
+    def build():
+      """Run cmake and make."""
+      self.run_cmake(gen=gen)
+      self.run_make()
+
+    key = None
+    if self.artifact_cache and not self.clean:
+      key = self._get_cmake_artifact_key(gen, outputs)
+    with self.ccache_report():
+      return self.run_cached(build, key, outputs)
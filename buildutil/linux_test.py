@@ -17,10 +17,13 @@
 import argparse
 import distutils.spawn
 import os
+import shutil
 import sys
+import tempfile
 import unittest
 sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
 import buildutil.android as android
+import buildutil.artifact_cache as artifact_cache
 import buildutil.common as common
 import buildutil.common_test as common_test
 import buildutil.linux as linux
@@ -96,5 +99,50 @@ class LinuxBuildUtilTest(unittest.TestCase):
     b.project_directory = 'e'
     b.run_cmake(gen='b')
 
+  def test_run_cmake_ccache(self):
+    d = linux.BuildEnvironment.build_defaults()
+    b = linux.BuildEnvironment(d)
+    b.ccache = True
+    b.ccache_path = None
+    b._ccache_configured = True
+    ccache = os.path.join('a', 'b', 'ccache')
+    b.run_subprocess = CMakeMock(
+        self, ['-G', 'b', '-DCMAKE_C_COMPILER_LAUNCHER=' + ccache,
+               '-DCMAKE_CXX_COMPILER_LAUNCHER=' + ccache, 'e'], 'e')
+    b.project_directory = 'e'
+    b.run_cmake(gen='b')
+
+  def test_build_cmake_project(self):
+    d = linux.BuildEnvironment.build_defaults()
+    b = linux.BuildEnvironment(d)
+    directory = tempfile.mkdtemp()
+    b.project_directory = os.path.join(directory, 'project')
+    b.cmake_path = sys.executable
+    b.artifact_cache = artifact_cache.ArtifactCache(
+        os.path.join(directory, 'cache'), 1024 * 1024)
+    built = []
+
+    def run_make():
+      built.append(b.project_directory)
+      os.makedirs(os.path.join(b.project_directory, 'out'))
+      open(os.path.join(b.project_directory, 'Makefile'), 'w').close()
+
+    b.run_cmake = lambda gen: None
+    b.run_make = run_make
+    try:
+      os.makedirs(b.project_directory)
+      with open(os.path.join(b.project_directory, 'CMakeLists.txt'),
+                'w') as f:
+        f.write('project(a)')
+      shutil.copytree(b.project_directory, os.path.join(directory, 'copy'))
+      self.assertFalse(b.build_cmake_project(['out']))
+      # Build another checkout of the same project.
+      b.project_directory = os.path.join(directory, 'copy')
+      self.assertTrue(b.build_cmake_project(['out']))
+      self.assertEqual(1, len(built))
+      self.assertTrue(os.path.isdir(os.path.join(b.project_directory, 'out')))
+    finally:
+      shutil.rmtree(directory)
+
 if __name__ == '__main__':
   unittest.main()
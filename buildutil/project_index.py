@@ -0,0 +1,124 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""@file buildutil/project_index.py On-disk index of discovered projects.
+
+Searching a large directory tree for projects is slow, especially on network
+file systems.  ProjectIndex stores the projects found in a tree along with
+the modification time of each directory that was searched in the
+"projects" subdirectory of common.get_cache_directory().  Adding, removing
+or renaming a file or directory changes the modification time of the
+directory containing it, so the index is valid while the modification times
+of all searched directories are unchanged which is much cheaper to check
+than searching the tree again.
+
+@package fplutil.buildutil.project_index On-disk index of discovered projects.
+"""
+
+import hashlib
+import json
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.common as common
+
+## @cond FPLUTIL_INTERNAL
+# Subdirectory of the cache directory which contains project indices.
+_PROJECT_INDEX_SUBDIR = 'projects'
+## @endcond FPLUTIL_INTERNAL
+
+
+def get_directory_mtimes(directories):
+  """Get the modification time of a set of directories.
+
+  Args:
+    directories: Iterable of directory paths.
+
+  Returns:
+    Dictionary of modification times indexed by directory or None if any
+    of the directories can't be read.
+  """
+  mtimes = {}
+  try:
+    for directory in directories:
+      mtimes[directory] = os.stat(directory).st_mtime
+  except OSError:
+    return None
+  return mtimes
+
+
+class ProjectIndex(object):
+
+  """Projects found by searching a directory tree.
+
+  Attributes:
+    root: Directory that was searched.
+    exclude: Sorted list of directory names excluded from the search.
+    path: File the index is stored in.
+  """
+
+  def __init__(self, root, exclude, directory=None):
+    """Initialize the instance.
+
+    Args:
+      root: Directory that is searched.
+      exclude: Iterable of directory names excluded from the search.
+      directory: Directory used to store the index, defaults to the
+        "projects" subdirectory of common.get_cache_directory().
+    """
+    self.root = os.path.abspath(root)
+    self.exclude = sorted(set(exclude))
+    key = hashlib.sha1(json.dumps([self.root, self.exclude])).hexdigest()
+    self.path = os.path.join(
+        directory or common.get_cache_directory(_PROJECT_INDEX_SUBDIR),
+        key + '.json')
+
+  def load(self):
+    """Read the index if it's still valid.
+
+    Returns:
+      (apk_dirs, lib_dirs) tuple of the projects in the index or None if the
+      index doesn't exist or a directory changed since it was written.
+    """
+    try:
+      with open(self.path) as f:
+        data = json.load(f)
+    except (IOError, OSError, ValueError):
+      return None
+    if data.get('root') != self.root or data.get('exclude') != self.exclude:
+      return None
+    directory_mtimes = data.get('directories', {})
+    if get_directory_mtimes(directory_mtimes.iterkeys()) != directory_mtimes:
+      return None
+    return (data.get('apk_dirs', []), data.get('lib_dirs', []))
+
+  def save(self, apk_dirs, lib_dirs, directory_mtimes):
+    """Write the index.
+
+    Args:
+      apk_dirs: List of directories which contain APK projects.
+      lib_dirs: List of directories which contain library projects.
+      directory_mtimes: Dictionary of the modification times of all
+        directories that were searched, indexed by directory.
+    """
+    try:
+      common.write_json_atomically(
+          self.path, {'root': self.root, 'exclude': self.exclude,
+                      'apk_dirs': apk_dirs, 'lib_dirs': lib_dirs,
+                      'directories': directory_mtimes})
+    except (IOError, OSError):
+      # Failing to write the index is not fatal, the tree will be searched
+      # again next time.
+      pass
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.project_index as project_index
+
+
+class ProjectIndexTest(unittest.TestCase):
+  """On-disk project index unit tests."""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.root = os.path.join(self.directory, 'root')
+    self.app = os.path.join(self.root, 'app')
+    os.makedirs(self.app)
+    self.index_directory = os.path.join(self.directory, 'index')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def create_index(self, exclude=('bin',)):
+    """Create a ProjectIndex for the test tree."""
+    return project_index.ProjectIndex(self.root, exclude,
+                                      directory=self.index_directory)
+
+  def save(self):
+    """Save an index of the test tree."""
+    self.create_index().save(
+        [self.app], [], project_index.get_directory_mtimes([self.root,
+                                                            self.app]))
+
+  def test_load_missing(self):
+    self.assertIsNone(self.create_index().load())
+
+  def test_save_load(self):
+    self.save()
+    self.assertEqual(([self.app], []), self.create_index().load())
+    self.assertEqual(([self.app], []),
+                     self.create_index(exclude=['bin', 'bin']).load())
+    self.assertIsNone(self.create_index(exclude=['obj']).load())
+
+  def test_directory_changed(self):
+    self.save()
+    os.makedirs(os.path.join(self.app, 'jni'))
+    self.assertIsNone(self.create_index().load())
+
+  def test_directory_removed(self):
+    self.save()
+    shutil.rmtree(self.app)
+    self.assertIsNone(self.create_index().load())
+
+  def test_get_directory_mtimes(self):
+    self.assertEqual([self.root], project_index.get_directory_mtimes(
+        [self.root]).keys())
+    self.assertIsNone(project_index.get_directory_mtimes(
+        [os.path.join(self.root, 'missing')]))
+
+
+if __name__ == '__main__':
+  unittest.main()
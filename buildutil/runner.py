@@ -0,0 +1,333 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""@file buildutil/runner.py Streaming subprocess runner.
+
+run() executes a subprocess reading the standard output and error streams
+line by line as they're written.  Each line can be passed to a callback,
+written to a log file and retained in memory, either in full or as a bounded
+tail of the most recent lines which is sufficient to report errors without
+accumulating the entire output of long running commands.
+
+Commands can be terminated after a timeout, in which case the command and
+all processes it started (the command's process group) are killed.  The
+wall time and resource usage of each command is recorded in the returned
+Result and reported to observers registered with add_observer().
+
+@package fplutil.buildutil.runner Streaming subprocess runner.
+"""
+
+import collections
+import errno
+import os
+import signal
+import subprocess
+import threading
+import time
+
+## Default number of lines retained in Result.stdout_tail and
+## Result.stderr_tail.
+DEFAULT_TAIL_LINES = 100
+
+## @cond FPLUTIL_INTERNAL
+# Functions called with (args, result) after each command completes.
+_OBSERVERS = []
+# Time in seconds between terminating and killing a timed out process group.
+_KILL_GRACE_PERIOD = 2.0
+## @endcond FPLUTIL_INTERNAL
+
+
+class Result(object):
+
+  """Result of running a command.
+
+  Attributes:
+    args: Command that was executed.
+    returncode: Return code of the command.
+    stdout: String containing the standard output stream if it was captured,
+      None otherwise.
+    stderr: String containing the standard error stream if it was captured,
+      None otherwise.
+    stdout_tail: List of the most recent lines written to the standard
+      output stream.
+    stderr_tail: List of the most recent lines written to the standard error
+      stream.
+    wall_time: Time in seconds taken to execute the command.
+    rusage: resource.struct_rusage of the command if it's available on the
+      host operating system, None otherwise.
+    timed_out: Whether the command was killed after a timeout.
+  """
+
+  def __init__(self, args):
+    """Initialize the instance.
+
+    Args:
+      args: Command that was executed.
+    """
+    self.args = args
+    self.returncode = None
+    self.stdout = None
+    self.stderr = None
+    self.stdout_tail = []
+    self.stderr_tail = []
+    self.wall_time = 0.0
+    self.rusage = None
+    self.timed_out = False
+
+  @property
+  def user_time(self):
+    """User CPU time in seconds consumed by the command or 0.0."""
+    return self.rusage.ru_utime if self.rusage else 0.0
+
+  @property
+  def system_time(self):
+    """System CPU time in seconds consumed by the command or 0.0."""
+    return self.rusage.ru_stime if self.rusage else 0.0
+
+  @property
+  def max_rss(self):
+    """Maximum resident set size of the command as reported by the OS."""
+    return self.rusage.ru_maxrss if self.rusage else 0
+
+
+class _StreamReader(threading.Thread):
+
+  """Reads lines from a stream of a subprocess.
+
+  Attributes:
+    stream: File object to read from.
+    callback: Callable which is passed each line or None.
+    log_file: File object each line is written to or None.
+    log_lock: Lock held while writing to log_file.
+    lines: List of lines read if capturing the stream, None otherwise.
+    tail: collections.deque of the most recent lines read.
+  """
+
+  def __init__(self, stream, callback, log_file, log_lock, capture,
+               tail_lines):
+    """Initialize the instance.
+
+    Args:
+      stream: File object to read from.
+      callback: Callable which is passed each line or None.
+      log_file: File object each line is written to or None.
+      log_lock: Lock held while writing to log_file.
+      capture: Whether to retain all lines read from the stream.
+      tail_lines: Number of recent lines to retain.
+    """
+    super(_StreamReader, self).__init__()
+    self.daemon = True
+    self.stream = stream
+    self.callback = callback
+    self.log_file = log_file
+    self.log_lock = log_lock
+    self.lines = [] if capture else None
+    self.tail = collections.deque(maxlen=tail_lines)
+
+  def run(self):
+    """Read lines until the end of the stream."""
+    for line in iter(self.stream.readline, ''):
+      if self.lines is not None:
+        self.lines.append(line)
+      self.tail.append(line)
+      if self.log_file:
+        with self.log_lock:
+          self.log_file.write(line)
+      if self.callback:
+        self.callback(line)
+    self.stream.close()
+
+
+def add_observer(observer):
+  """Register a function which is called after each command completes.
+
+  Args:
+    observer: Callable which takes (args, result) where args is the command
+      and result is the Result of the command.
+  """
+  _OBSERVERS.append(observer)
+
+
+def remove_observer(observer):
+  """Unregister a function registered with add_observer().
+
+  Args:
+    observer: Function to unregister.
+  """
+  if observer in _OBSERVERS:
+    _OBSERVERS.remove(observer)
+
+
+def _kill_process_group(process, new_process_group, result):
+  """Kill a timed out process and the processes it started.
+
+  Args:
+    process: subprocess.Popen instance to kill.
+    new_process_group: Whether the process was started in its own process
+      group.
+    result: Result of the command which is flagged as timed out.
+  """
+  result.timed_out = True
+  for sig in (signal.SIGTERM, getattr(signal, 'SIGKILL', signal.SIGTERM)):
+    if process.returncode is not None:
+      return
+    try:
+      if new_process_group and hasattr(os, 'killpg'):
+        os.killpg(process.pid, sig)
+      elif sig == signal.SIGTERM:
+        process.terminate()
+      else:
+        process.kill()
+    except OSError:
+      return
+    # Wait for the process to exit before escalating to SIGKILL.
+    deadline = time.time() + _KILL_GRACE_PERIOD
+    while process.returncode is None and time.time() < deadline:
+      time.sleep(0.05)
+
+
+def _wait(process):
+  """Wait for a process to exit collecting its resource usage.
+
+  Args:
+    process: subprocess.Popen instance to wait for.
+
+  Returns:
+    resource.struct_rusage of the process or None if it's not available.
+  """
+  if hasattr(os, 'wait4'):
+    while True:
+      try:
+        _, status, rusage = os.wait4(process.pid, 0)
+        break
+      except OSError as e:
+        if e.errno == errno.EINTR:
+          continue
+        # The process was reaped elsewhere.
+        process.wait()
+        return None
+    # pylint: disable=protected-access
+    process._handle_exitstatus(status)
+    return rusage
+  process.wait()
+  return None
+
+
+def run(args, cwd=None, shell=False, env=None, stdin=None, executable=None,
+        capture=True, stdout_callback=None, stderr_callback=None,
+        tail_lines=DEFAULT_TAIL_LINES, log_filename=None, timeout=None,
+        merge_stderr=False):
+  """Run a command streaming its output.
+
+  Args:
+    args: Command to execute, either a list of arguments or a string if
+      shell is True.
+    cwd: Working directory of the command.
+    shell: Whether to execute the command using the shell.
+    env: Dictionary of environment variables for the command or None to
+      inherit the environment of this process.
+    stdin: String written to the standard input stream of the command or
+      None to inherit the standard input stream.
+    executable: Replacement program to execute, see subprocess.Popen().
+    capture: Whether to retain the entire output of the command in
+      Result.stdout and Result.stderr.  If this is False and no callbacks or
+      log file are specified the command writes directly to the standard
+      output and error streams of this process.
+    stdout_callback: Callable which is passed each line written to the
+      standard output stream.
+    stderr_callback: Callable which is passed each line written to the
+      standard error stream.
+    tail_lines: Number of recent lines of each stream to retain in
+      Result.stdout_tail and Result.stderr_tail.
+    log_filename: File to write the output of the command to.
+    timeout: Time in seconds after which the command and all processes it
+      started are killed or None to wait indefinitely.
+    merge_stderr: Whether to redirect the standard error stream to the
+      standard output stream.
+
+  Returns:
+    Result instance.
+
+  Raises:
+    OSError: If the command can't be executed.
+  """
+  result = Result(args)
+  streaming = bool(capture or stdout_callback or stderr_callback or
+                   log_filename)
+  # Killing a command's children on timeout requires a new process group.
+  # Commands without a timeout stay in this process' group so that they
+  # receive signals (e.g SIGINT) sent from the terminal.
+  new_process_group = bool(timeout) and hasattr(os, 'setsid')
+  start_time = time.time()
+  process = subprocess.Popen(
+      args, cwd=cwd, shell=shell, env=env, executable=executable,
+      stdin=subprocess.PIPE if stdin is not None else None,
+      stdout=subprocess.PIPE if streaming else None,
+      stderr=(subprocess.STDOUT if merge_stderr else
+              subprocess.PIPE if streaming else None),
+      preexec_fn=os.setsid if new_process_group else None)
+
+  log_file = open(log_filename, 'a') if log_filename else None
+  log_lock = threading.Lock()
+  readers = []
+  if streaming:
+    readers.append(_StreamReader(process.stdout, stdout_callback, log_file,
+                                 log_lock, capture, tail_lines))
+    if not merge_stderr:
+      readers.append(_StreamReader(process.stderr, stderr_callback, log_file,
+                                   log_lock, capture, tail_lines))
+  for reader in readers:
+    reader.start()
+
+  timer = None
+  if timeout:
+    timer = threading.Timer(timeout, _kill_process_group,
+                            (process, new_process_group, result))
+    timer.daemon = True
+    timer.start()
+  try:
+    if stdin is not None:
+      try:
+        process.stdin.write(stdin)
+      except IOError:
+        # The command exited without reading its input.
+        pass
+      process.stdin.close()
+    for reader in readers:
+      # Join with a timeout so that this thread remains interruptible.
+      while reader.is_alive():
+        reader.join(0.1)
+    result.rusage = _wait(process)
+  finally:
+    if timer:
+      timer.cancel()
+    if log_file:
+      log_file.close()
+
+  result.returncode = process.returncode
+  result.wall_time = time.time() - start_time
+  if readers:
+    result.stdout_tail = list(readers[0].tail)
+    if capture:
+      result.stdout = ''.join(readers[0].lines)
+  if len(readers) > 1:
+    result.stderr_tail = list(readers[1].tail)
+    if capture:
+      result.stderr = ''.join(readers[1].lines)
+  elif merge_stderr and capture:
+    result.stderr = ''
+  for observer in list(_OBSERVERS):
+    observer(args, result)
+  return result
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.runner as runner
+
+
+class RunnerTest(unittest.TestCase):
+  """Streaming subprocess runner unit tests."""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_capture(self):
+    result = runner.run([sys.executable, '-c',
+                         'import sys; print "out"; print >> sys.stderr, "err"'])
+    self.assertEqual(0, result.returncode)
+    self.assertEqual('out\n', result.stdout)
+    self.assertEqual('err\n', result.stderr)
+    self.assertFalse(result.timed_out)
+    self.assertGreater(result.wall_time, 0.0)
+
+  def test_returncode_and_stdin(self):
+    result = runner.run('read line; echo ${line}; exit 3', shell=True,
+                        stdin='hello\n')
+    self.assertEqual(3, result.returncode)
+    self.assertEqual('hello\n', result.stdout)
+
+  def test_callbacks_tail_and_log(self):
+    lines = []
+    log_filename = os.path.join(self.directory, 'log.txt')
+    result = runner.run('for i in 1 2 3 4 5; do echo ${i}; done', shell=True,
+                        capture=False, stdout_callback=lines.append,
+                        tail_lines=2, log_filename=log_filename)
+    self.assertEqual(['1\n', '2\n', '3\n', '4\n', '5\n'], lines)
+    self.assertEqual(['4\n', '5\n'], result.stdout_tail)
+    self.assertIsNone(result.stdout)
+    with open(log_filename) as f:
+      self.assertEqual('1\n2\n3\n4\n5\n', f.read())
+
+  def test_merge_stderr(self):
+    result = runner.run('echo out; echo err >&2', shell=True,
+                        merge_stderr=True)
+    self.assertEqual('out\nerr\n', result.stdout)
+
+  def test_timeout(self):
+    start_time = time.time()
+    result = runner.run('sleep 30 & sleep 30; echo done', shell=True,
+                        timeout=0.5)
+    self.assertTrue(result.timed_out)
+    self.assertNotEqual(0, result.returncode)
+    self.assertLess(time.time() - start_time, 10)
+
+  def test_observer(self):
+    results = []
+    observer = lambda args, result: results.append((args, result.returncode))
+    runner.add_observer(observer)
+    try:
+      runner.run(['true'])
+    finally:
+      runner.remove_observer(observer)
+    runner.run(['true'])
+    self.assertEqual([(['true'], 0)], results)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,297 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""@file buildutil/trace.py Build timeline tracing.
+
+Tracer records spans covering the steps of a build.  Each span records its
+wall time along with the CPU time and peak resident set size of the
+subprocesses executed using buildutil.runner while the span is open.  Each
+subprocess is also recorded as a span nested within the span that started it.
+Spans are tracked per thread, work run on worker threads is attributed to the
+spans of the thread that started it using Tracer.bind().
+
+Spans are written in the Chrome trace event format which can be viewed by
+loading the file in chrome://tracing.
+
+@package fplutil.buildutil.trace Build timeline tracing.
+"""
+
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.runner as runner
+
+## Category of spans which record the execution of subprocesses.
+SUBPROCESS_CATEGORY = 'subprocess'
+
+## Default category of spans.
+BUILD_CATEGORY = 'build'
+
+
+class Span(object):
+
+  """A timed step of a build.
+
+  Attributes:
+    name: Name of the span.
+    category: Category of the span.
+    args: Dictionary of additional information about the span.
+    thread_id: Identifier of the thread that opened the span.
+    start_time: Time in seconds since the epoch the span started.
+    end_time: Time in seconds since the epoch the span ended or None if the
+      span is still open.
+    child_user_time: User CPU time in seconds of subprocesses executed
+      within the span.
+    child_system_time: System CPU time in seconds of subprocesses executed
+      within the span.
+    max_rss: Peak resident set size of the subprocesses executed within the
+      span as reported by the OS.
+  """
+
+  def __init__(self, name, category, args, thread_id, start_time,
+               end_time=None):
+    """Initialize the instance.
+
+    Args:
+      name: Name of the span.
+      category: Category of the span.
+      args: Dictionary of additional information about the span.
+      thread_id: Identifier of the thread that opened the span.
+      start_time: Time in seconds since the epoch the span started.
+      end_time: Time in seconds since the epoch the span ended.
+    """
+    self.name = name
+    self.category = category
+    self.args = args
+    self.thread_id = thread_id
+    self.start_time = start_time
+    self.end_time = end_time
+    self.child_user_time = 0.0
+    self.child_system_time = 0.0
+    self.max_rss = 0
+
+  @property
+  def wall_time(self):
+    """Time in seconds between the start and end of the span."""
+    return (self.end_time or time.time()) - self.start_time
+
+  def add_command(self, result):
+    """Accumulate the resource usage of a subprocess.
+
+    Args:
+      result: buildutil.runner.Result of the subprocess.
+    """
+    self.child_user_time += result.user_time
+    self.child_system_time += result.system_time
+    self.max_rss = max(self.max_rss, result.max_rss)
+
+  def to_event(self, pid, origin):
+    """Convert to a complete event in the Chrome trace event format.
+
+    Args:
+      pid: Process ID to associate with the event.
+      origin: Time in seconds since the epoch of the start of the trace.
+
+    Returns:
+      Dictionary which describes the event.
+    """
+    args = dict(self.args)
+    args.update({'wall_time': self.wall_time,
+                 'child_user_time': self.child_user_time,
+                 'child_system_time': self.child_system_time,
+                 'max_rss': self.max_rss})
+    return {'name': self.name, 'cat': self.category, 'ph': 'X',
+            'ts': int((self.start_time - origin) * 1000000),
+            'dur': int(self.wall_time * 1000000),
+            'pid': pid, 'tid': self.thread_id, 'args': args}
+
+
+class Tracer(object):
+
+  """Records spans covering the steps of a build.
+
+  Attributes:
+    spans: List of Span instances in the order they were opened.
+    start_time: Time in seconds since the epoch the tracer was created.
+  """
+
+  def __init__(self):
+    """Initialize the instance and start observing subprocesses."""
+    self.spans = []
+    self.start_time = time.time()
+    self._lock = threading.Lock()
+    self._local = threading.local()
+    runner.add_observer(self._command_completed)
+
+  def close(self):
+    """Stop observing subprocesses."""
+    runner.remove_observer(self._command_completed)
+
+  def _get_open_spans(self):
+    """Get the stack of spans opened by the calling thread.
+
+    Returns:
+      List of Span instances, innermost last.
+    """
+    if not hasattr(self._local, 'stack'):
+      self._local.stack = []
+    return self._local.stack
+
+  def _add_span(self, span):
+    """Add a span to the trace.
+
+    Args:
+      span: Span to add.
+    """
+    with self._lock:
+      self.spans.append(span)
+
+  @contextlib.contextmanager
+  def span(self, name, category=BUILD_CATEGORY, **args):
+    """Open a span for the duration of a with statement.
+
+    Args:
+      name: Name of the span.
+      category: Category of the span.
+      **args: Additional information stored with the span.
+
+    Yields:
+      Span instance.
+    """
+    thread_id = threading.current_thread().ident
+    stack = self._get_open_spans()
+    if stack and stack[-1].thread_id != thread_id:
+      # Identify the span of the thread that started this one, see bind().
+      args = dict(args, parent=stack[-1].name)
+    span = Span(name, category, args, thread_id, time.time())
+    self._add_span(span)
+    stack.append(span)
+    try:
+      yield span
+    finally:
+      span.end_time = time.time()
+      stack.pop()
+
+  def bind(self, function):
+    """Attribute the work of a function called on another thread to spans.
+
+    The spans open on the calling thread are the parents of the spans opened
+    and subprocesses executed by the returned function on any thread.
+
+    Args:
+      function: Function to wrap.
+
+    Returns:
+      Wrapped function.
+    """
+    parents = list(self._get_open_spans())
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+      """Call function with the parent spans open."""
+      stack = self._get_open_spans()
+      self._local.stack = parents + stack
+      try:
+        return function(*args, **kwargs)
+      finally:
+        self._local.stack = stack
+    return wrapper
+
+  def _command_completed(self, args, result):
+    """Record a subprocess executed within an open span.
+
+    Args:
+      args: Command that was executed.
+      result: buildutil.runner.Result of the command.
+    """
+    stack = self._get_open_spans()
+    if not stack:
+      return
+    end_time = time.time()
+    command = args if isinstance(args, basestring) else ' '.join(args)
+    span = Span(os.path.basename(command.split(' ')[0]),
+                SUBPROCESS_CATEGORY,
+                {'command': command, 'returncode': result.returncode},
+                threading.current_thread().ident,
+                end_time - result.wall_time, end_time)
+    span.add_command(result)
+    self._add_span(span)
+    # Spans bound to worker threads are updated by each thread.
+    with self._lock:
+      for open_span in stack:
+        open_span.add_command(result)
+
+  def to_chrome_trace(self):
+    """Convert the recorded spans to the Chrome trace event format.
+
+    Returns:
+      Dictionary which can be serialized as JSON.
+    """
+    pid = os.getpid()
+    with self._lock:
+      events = [span.to_event(pid, self.start_time) for span in self.spans]
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+  def write(self, filename):
+    """Write the recorded spans to a file in the Chrome trace event format.
+
+    Args:
+      filename: Name of the file to write.
+    """
+    with open(filename, 'w') as f:
+      json.dump(self.to_chrome_trace(), f, indent=2, sort_keys=True)
+
+
+def traced(name=None, category=BUILD_CATEGORY):
+  """Decorate a method so that each call is recorded in a span.
+
+  The span is recorded by the Tracer referenced by the "tracer" attribute of
+  the instance the method is called on.  If the attribute is None the method
+  is called without recording a span.
+
+  Args:
+    name: Name of the span, defaults to the name of the method.
+    category: Category of the span.
+
+  Returns:
+    Decorator function.
+  """
+
+  def decorator(method):
+    """Wrap method in a span.
+
+    Args:
+      method: Method to wrap.
+
+    Returns:
+      Wrapped method.
+    """
+    span_name = name or method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+      """Call method within a span if tracing is enabled."""
+      tracer = getattr(self, 'tracer', None)
+      if not tracer:
+        return method(self, *args, **kwargs)
+      with tracer.span(span_name, category):
+        return method(self, *args, **kwargs)
+    return wrapper
+  return decorator
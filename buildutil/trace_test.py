@@ -0,0 +1,146 @@
+#!/usr/bin/python
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import buildutil.common as common
+import buildutil.runner as runner
+import buildutil.trace as trace
+
+
+class TracedObject(object):
+  """Object with a traced method.
+
+  Attributes:
+    tracer: Tracer used to record spans or None.
+  """
+
+  def __init__(self, tracer):
+    """Initialize the instance.
+
+    Args:
+      tracer: Tracer used to record spans or None.
+    """
+    self.tracer = tracer
+
+  @trace.traced()
+  def step(self, value):
+    """Run a subprocess and return value."""
+    runner.run([sys.executable, '-c', 'pass'])
+    return value
+
+
+class TraceTest(unittest.TestCase):
+  """Build timeline tracing unit tests."""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.tracer = trace.Tracer()
+
+  def tearDown(self):
+    self.tracer.close()
+    shutil.rmtree(self.directory)
+
+  def test_nested_spans(self):
+    with self.tracer.span('build', path='a'):
+      with self.tracer.span('compile'):
+        runner.run([sys.executable, '-c', 'pass'])
+    self.assertEqual(['build', 'compile', os.path.basename(sys.executable)],
+                     [s.name for s in self.tracer.spans])
+    build, compile_span, command = self.tracer.spans
+    self.assertEqual(trace.SUBPROCESS_CATEGORY, command.category)
+    self.assertLessEqual(build.start_time, compile_span.start_time)
+    self.assertGreaterEqual(build.end_time, compile_span.end_time)
+    self.assertGreater(command.max_rss, 0)
+    self.assertEqual(command.max_rss, build.max_rss)
+    self.assertEqual(command.child_user_time, build.child_user_time)
+
+  def test_commands_outside_spans_ignored(self):
+    runner.run([sys.executable, '-c', 'pass'])
+    self.assertEqual([], self.tracer.spans)
+
+  def test_traced(self):
+    self.assertEqual(1, TracedObject(None).step(1))
+    self.assertEqual([], self.tracer.spans)
+    self.assertEqual(2, TracedObject(self.tracer).step(2))
+    self.assertEqual(['step', os.path.basename(sys.executable)],
+                     [s.name for s in self.tracer.spans])
+
+  def test_bind(self):
+    with self.tracer.span('build') as build:
+      step = self.tracer.bind(TracedObject(self.tracer).step)
+    threads = [threading.Thread(target=step, args=(i,)) for i in range(2)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    steps = [s for s in self.tracer.spans if s.name == 'step']
+    commands = [s for s in self.tracer.spans
+                if s.category == trace.SUBPROCESS_CATEGORY]
+    self.assertEqual(2, len(steps))
+    self.assertEqual(['build', 'build'], [s.args['parent'] for s in steps])
+    self.assertEqual(2, len(commands))
+    self.assertAlmostEqual(sum([c.child_user_time for c in commands]),
+                           build.child_user_time)
+    self.assertEqual(max([c.max_rss for c in commands]), build.max_rss)
+    # The binding doesn't leak into the calling thread.
+    step(3)
+    self.assertEqual([], self.tracer._get_open_spans())
+
+  def test_close(self):
+    self.tracer.close()
+    with self.tracer.span('build'):
+      runner.run([sys.executable, '-c', 'pass'])
+    self.assertEqual(['build'], [s.name for s in self.tracer.spans])
+
+  def test_write(self):
+    with self.tracer.span('build', path='a'):
+      pass
+    trace_file = os.path.join(self.directory, 'trace.json')
+    self.tracer.write(trace_file)
+    with open(trace_file) as f:
+      events = json.load(f)['traceEvents']
+    self.assertEqual(1, len(events))
+    self.assertEqual('build', events[0]['name'])
+    self.assertEqual('X', events[0]['ph'])
+    self.assertEqual('a', events[0]['args']['path'])
+    self.assertGreaterEqual(events[0]['ts'], 0)
+
+  def test_build_environment_trace(self):
+    self.tracer.close()
+    args = common.BuildEnvironment.build_defaults()
+    args['trace_out'] = os.path.join(self.directory, 'trace.json')
+    env = common.BuildEnvironment(args)
+    self.tracer = env.tracer
+    env.run_subprocess([sys.executable, '-c', 'pass'])
+    with env.tracer.span('build'):
+      env.run_subprocess([sys.executable, '-c', 'pass'])
+    env.write_trace()
+    with open(args['trace_out']) as f:
+      self.assertEqual(2, len(json.load(f)['traceEvents']))
+    # Writing the trace stops observing subprocesses.
+    self.assertIsNone(env.tracer)
+    self.assertNotIn(self.tracer._command_completed, runner._OBSERVERS)
+
+
+if __name__ == '__main__':
+  unittest.main()
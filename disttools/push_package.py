@@ -26,6 +26,7 @@ import tempfile
 sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__),
                                               os.path.pardir)))
 from docs import generate_docs  # pylint: disable=g-import-not-at-top
+import buildutil.runner as runner  # pylint: disable=g-import-not-at-top
 
 ## The directory containing this file.
 THIS_DIR = os.path.realpath(os.path.dirname(__file__))
@@ -97,7 +98,7 @@ class Subprocess(object):
 
     Args:
       args: Command to execute.
-      **argv: Additional arguments for subprocess.Popen().
+      **argv: Additional arguments for runner.run().
 
     Raises:
       subprocess.CalledProcessError:
@@ -107,18 +108,17 @@ class Subprocess(object):
     if not run:
       return
 
-    try:
-      subprocess.check_call(args, **argv)
-    except subprocess.CalledProcessError as e:
-      logging.error(e.output)
-      raise e
+    result = runner.run(args, capture=False, **argv)
+    logging.debug('%s took %.2fs', str(args), result.wall_time)
+    if result.returncode:
+      raise subprocess.CalledProcessError(result.returncode, str(args))
 
   def get_output(self, args, **argv):
     """Run command and get standard output.
 
     Args:
       args: Command to execute.
-      **argv: Additional arguments for subprocess.Popen().
+      **argv: Additional arguments for runner.run().
 
     Returns:
       Output string if successful.
@@ -130,12 +130,14 @@ class Subprocess(object):
     run, argv = self.display_command(args, **argv)
     if not run:
       return ''
-    p = subprocess.Popen(args, stdout=subprocess.PIPE, **argv)
-    stdout, _ = p.communicate()
-    if p.returncode:
+    result = runner.run(args, stderr_callback=sys.stderr.write, **argv)
+    logging.debug('%s took %.2fs', str(args), result.wall_time)
+    if result.returncode:
+      logging.error(''.join(result.stderr_tail))
       raise subprocess.CalledProcessError(
-          p.returncode, '%s returned %d' % (str(args), p.returncode), stdout)
-    return stdout
+          result.returncode, '%s returned %d' % (str(args), result.returncode),
+          result.stdout)
+    return result.stdout
 
 
 class Package(object):
@@ -23,7 +23,6 @@ import os
 import platform
 import re
 import shutil
-import subprocess
 import sys
 import urllib2
 import xml.etree.ElementTree
@@ -31,6 +30,9 @@ import xml.etree.ElementTree
 ## This script's directory.
 SCRIPT_DIRECTORY = os.path.abspath(os.path.dirname(__file__))
 
+sys.path.append(os.path.join(SCRIPT_DIRECTORY, os.pardir, os.pardir))
+import buildutil.runner as runner  # pylint: disable=g-import-not-at-top
+
 ## Page which contains the mapping between Android API levels and source tags.
 BUILD_NUMBERS_URL = 'http://source.android.com/source/build-numbers.html'
 
@@ -168,9 +170,12 @@ def run_command(command, error_string, cwd=None, verbose=False):
     print >> sys.stderr, command, cwd
   # If this is Linux or OSX force the use of the bash shell.
   shell = '/bin/bash' if platform.system() in ('Darwin', 'Linux') else None
-  process = subprocess.Popen(command, shell=True, cwd=cwd, executable=shell)
-  if process.wait() != 0:
-    raise CommandError(error_string, command, process.returncode)
+  result = runner.run(command, shell=True, cwd=cwd, executable=shell,
+                      capture=False)
+  if verbose:
+    print >> sys.stderr, '%s took %.2fs' % (command, result.wall_time)
+  if result.returncode != 0:
+    raise CommandError(error_string, command, result.returncode)
 
 
 def run_command_get_output(command, error_string, cwd=None, verbose=False,
@@ -193,13 +198,13 @@ def run_command_get_output(command, error_string, cwd=None, verbose=False,
   """
   if verbose:
     print >> sys.stderr, command, cwd if cwd else ''
-  process = subprocess.Popen(command, shell=True, cwd=cwd,
-                             stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-  stdout, stderr = process.communicate(input=stdin if stdin else '')
-  if process.returncode != 0:
-    raise CommandError(error_string, command, process.returncode,
-                       stdout=stdout, stderr=stderr)
-  return stdout
+  result = runner.run(command, shell=True, cwd=cwd,
+                      stdin=stdin if stdin else '',
+                      stderr_callback=sys.stderr.write)
+  if result.returncode != 0:
+    raise CommandError(error_string, command, result.returncode,
+                       stdout=result.stdout, stderr=result.stderr)
+  return result.stdout
 
 
 def format_build_command(command):